@@ -1,3 +1,4 @@
+import datetime
 import shutil
 import tempfile
 import mock
@@ -157,6 +158,24 @@ class JobRunAdapterTestCase(TestCase):
         assert_equal(self.adapter.get_runs(), None)
 
 
+class ArchivedJobRunAdapterTestCase(TestCase):
+
+    @setup
+    def setup_adapter(self):
+        action_run = mock.Mock(job_run_id='MASTER.job.3', action_name='one',
+            start_time=None, end_time=None)
+        self.job_run = mock.Mock(action_runs=[action_run],
+            start_time=None, end_time=None)
+        self.adapter = adapter.ArchivedJobRunAdapter(self.job_run)
+
+    def test_get_repr(self):
+        result = self.adapter.get_repr()
+        assert_equal(result['state'], self.job_run.state)
+        action_run = result['runs'][0]
+        assert_equal(action_run['job_name'], 'MASTER.job')
+        assert_equal(action_run['run_num'], '3')
+
+
 class ServiceAdapterTestCase(TestCase):
 
     @setup
@@ -234,6 +253,21 @@ class JobIndexAdapterTestCase(TestCase):
         result = self.adapter.get_actions()
         assert_equal(result, [])
 
+class GetStartDensityTestCase(TestCase):
+
+    def test_get_start_density(self):
+        run_times = [
+            datetime.datetime(2012, 3, 14, 2, 5, 30),
+            datetime.datetime(2012, 3, 14, 2, 1),
+            datetime.datetime(2012, 3, 14, 2, 5, 0),
+        ]
+        expected = [
+            {'minute': datetime.datetime(2012, 3, 14, 2, 1), 'count': 1},
+            {'minute': datetime.datetime(2012, 3, 14, 2, 5), 'count': 2},
+        ]
+        assert_equal(adapter.get_start_density(run_times), expected)
+
+
 class SchedulerAdapterTestCase(TestCase):
 
     @setup
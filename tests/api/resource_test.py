@@ -1,6 +1,8 @@
 """
 Test cases for the web services interface to tron
 """
+import datetime
+
 import mock
 import twisted.web.resource
 import twisted.web.http
@@ -12,11 +14,12 @@ from testify import setup_teardown
 from tests import mocks
 from twisted.web import http
 from tests.assertions import assert_call
-from tron import event, node
+from tron import dispatch, event, eventloop, node
 from tron import mcp
 from tron.api import resource as www, controller
 from tests.testingutils import Turtle, autospec_method
 from tron.core import service, serviceinstance, job, jobrun
+from tron.serialize.runstate import statemanager
 
 
 REQUEST = twisted.web.server.Request(mock.Mock(), None)
@@ -107,7 +110,9 @@ class ApiRootResourceTestCase(WWWTestCase):
         self.resource = www.ApiRootResource(self.mcp)
 
     def test__init__(self):
-        expected_children = ['jobs', 'services', 'config', 'status', 'events', '']
+        expected_children = ['jobs', 'services', 'config', 'status',
+                             'schedule', 'persistence', 'dispatch', 'events',
+                             '']
         assert_equal(set(expected_children), set(self.resource.children))
 
     def test_render_GET(self):
@@ -142,11 +147,50 @@ class ActionRunHistoryResourceTestCase(WWWTestCase):
     @setup
     def setup_resource(self):
         self.action_runs = [mock.MagicMock(), mock.MagicMock()]
-        self.resource = www.ActionRunHistoryResource(self.action_runs)
+        self.archived_runs = mock.Mock(return_value=[mock.MagicMock()])
+        self.resource = www.ActionRunHistoryResource(
+            self.action_runs, self.archived_runs)
 
     def test_render_GET(self):
         response = self.resource.render_GET(self.request)
         assert_equal(len(response), len(self.action_runs))
+        assert not self.archived_runs.mock_calls
+
+    def test_render_GET_archived(self):
+        request = build_request(archived='1', limit='5')
+        response = self.resource.render_GET(request)
+        assert_equal(len(response), 3)
+        self.archived_runs.assert_called_with(5, None, None)
+
+    def test_render_GET_archived_page(self):
+        request = build_request(archived='1', before='20')
+        response = self.resource.render_GET(request)
+        assert_equal(len(response), 1)
+        self.archived_runs.assert_called_with(
+            www.DEFAULT_ARCHIVE_LIMIT, 20, None)
+
+
+class JobRunArchiveResourceTestCase(WWWTestCase):
+
+    @setup
+    def setup_resource(self):
+        self.run_archive = mock.Mock()
+        self.runs = [mock.MagicMock(run_num=4), mock.MagicMock(run_num=3)]
+        self.run_archive.get_runs.return_value = self.runs
+        self.resource = www.JobRunArchiveResource(self.run_archive, 'job')
+
+    def test_render_GET(self):
+        request = build_request(limit='2', before_time='1000')
+        response = self.resource.render_GET(request)
+        self.run_archive.get_runs.assert_called_with('job', 2, None, 1000)
+        assert_equal(len(response['runs']), 2)
+        assert_equal(response['before'], 3)
+
+    def test_render_GET_last_page(self):
+        response = self.resource.render_GET(self.request)
+        self.run_archive.get_runs.assert_called_with(
+            'job', www.DEFAULT_ARCHIVE_LIMIT, None, None)
+        assert_equal(response['before'], None)
 
 
 class JobCollectionResourceTestCase(WWWTestCase):
@@ -186,7 +230,8 @@ class JobResourceTestCase(WWWTestCase):
     @setup
     def setup_resource(self):
         self.job_scheduler = mock.create_autospec(job.JobScheduler)
-        self.job_runs = mock.create_autospec(jobrun.JobRunCollection)
+        self.job_runs = mock.create_autospec(jobrun.JobRunCollection,
+            archive=None)
         self.job = mock.create_autospec(job.Job,
             runs=self.job_runs,
             all_nodes=False,
@@ -228,9 +273,19 @@ class JobResourceTestCase(WWWTestCase):
     def test_getChild(self):
         autospec_method(self.resource.get_run_from_identifier)
         identifier = 'identifier'
-        resource = self.resource.getChild(identifier, None)
+        self.request.method = 'GET'
+        resource = self.resource.getChild(identifier, self.request)
         assert_equal(resource.job_run,
             self.resource.get_run_from_identifier.return_value)
+        assert not self.job.thaw_run.mock_calls
+
+    def test_getChild_POST_thaws_run(self):
+        autospec_method(self.resource.get_run_from_identifier)
+        self.request.method = 'POST'
+        resource = self.resource.getChild('identifier', self.request)
+        self.job.thaw_run.assert_called_with(
+            self.resource.get_run_from_identifier.return_value)
+        assert_equal(resource.job_run, self.job.thaw_run.return_value)
 
     def test_getChild_action_run_history(self):
         autospec_method(self.resource.get_run_from_identifier, return_value=None)
@@ -241,6 +296,23 @@ class JobResourceTestCase(WWWTestCase):
         resource = self.resource.getChild(action_name, None)
         assert_equal(resource.__class__, www.ActionRunHistoryResource)
         assert_equal(resource.action_runs, action_runs)
+        assert_equal(resource.archived_runs, None)
+
+    def test_getChild_action_run_history_archived(self):
+        autospec_method(self.resource.get_run_from_identifier, return_value=None)
+        self.job_runs.archive = mock.Mock()
+        self.job.action_graph.names = ['action_name']
+        resource = self.resource.getChild('action_name', None)
+        resource.archived_runs(5, None, None)
+        self.job_runs.archive.get_action_runs.assert_called_with(
+            self.job_scheduler.get_name.return_value, 'action_name',
+            5, None, None)
+
+    def test_getChild_archive(self):
+        self.job_runs.archive = mock.Mock()
+        resource = self.resource.getChild('_archive', None)
+        assert_equal(resource.__class__, www.JobRunArchiveResource)
+        assert_equal(resource.run_archive, self.job_runs.archive)
 
 
 class ServiceResourceTestCase(WWWTestCase):
@@ -323,6 +395,74 @@ class EventResourceTestCase(WWWTestCase):
         assert_equal(names, [critical_message, ok_message])
 
 
+class StatusResourceTestCase(WWWTestCase):
+
+    @setup
+    def setup_resource(self):
+        self.resource = www.StatusResource(mock.Mock())
+
+    def test_render_GET(self):
+        response = self.resource.render_GET(self.request())
+        assert_equal(response['timers'], eventloop.get_timer_stats())
+
+
+class ScheduleResourceTestCase(WWWTestCase):
+
+    @setup
+    def setup_resource(self):
+        self.job_collection = mock.create_autospec(job.JobCollection)
+        self.resource = www.ScheduleResource(self.job_collection)
+
+    def test_render_GET(self):
+        run_time = datetime.datetime(2012, 3, 14, 2, 5, 30)
+        a_job = mock.Mock(config=mock.Mock(namespace='ns'))
+        a_job.get_name.return_value = 'a_job'
+        a_job.node_pool = mock.create_autospec(node.NodePool)
+        a_job.node_pool.get_name.return_value = 'pool'
+        self.job_collection.get_upcoming_runs.return_value = [(run_time, a_job)]
+        request = build_request(namespace='ns', start='2012-03-14 02:00:00',
+            hours='1')
+        response = self.resource.render_GET(request)
+
+        start = datetime.datetime(2012, 3, 14, 2)
+        self.job_collection.get_upcoming_runs.assert_called_with(
+            start, start + datetime.timedelta(hours=1),
+            namespace='ns', node_pool=None)
+        expected_run = {
+            'run_time': run_time, 'job': 'a_job',
+            'namespace': 'ns', 'node_pool': 'pool'}
+        assert_equal(response['runs'], [expected_run])
+        assert_equal(response['density'],
+            [{'minute': datetime.datetime(2012, 3, 14, 2, 5), 'count': 1}])
+
+
+class PersistenceResourceTestCase(WWWTestCase):
+
+    @setup
+    def setup_resource(self):
+        self.state_watcher = mock.create_autospec(
+            statemanager.StateChangeWatcher)
+        self.state_watcher.get_stats.return_value = {'slow_saves': 2}
+        self.resource = www.PersistenceResource(self.state_watcher)
+
+    def test_render_GET(self):
+        response = self.resource.render_GET(self.request())
+        assert_equal(response, {'slow_saves': 2})
+
+
+class DispatchResourceTestCase(WWWTestCase):
+
+    @setup
+    def setup_resource(self):
+        self.dispatcher = mock.create_autospec(dispatch.Dispatcher)
+        self.dispatcher.get_stats.return_value = {'waited': 3}
+        self.resource = www.DispatchResource(self.dispatcher)
+
+    def test_render_GET(self):
+        response = self.resource.render_GET(self.request())
+        assert_equal(response, {'waited': 3})
+
+
 class ConfigResourceTestCase(TestCase):
 
     @setup_teardown
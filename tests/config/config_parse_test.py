@@ -182,6 +182,8 @@ services:
                 'nodePool': schema.ConfigNodePool(nodes=('node0', 'node1'),
                                                 name='nodePool')
             }),
+            dispatch=config_parse.DEFAULT_DISPATCH,
+            catch_up=config_parse.DEFAULT_CATCH_UP,
             jobs=FrozenDict({
                 'MASTER.test_job0': schema.ConfigJob(
                     name='MASTER.test_job0',
@@ -205,6 +207,9 @@ services:
                         node=None),
                     enabled=True,
                     max_runtime=None,
+                    priority=0,
+                    catch_up=None,
+                    backfill_limit=None,
                     allow_overlap=False),
                 'MASTER.test_job1': schema.ConfigJob(
                     name='MASTER.test_job1',
@@ -234,6 +239,9 @@ services:
                     all_nodes=False,
                     cleanup_action=None,
                     max_runtime=None,
+                    priority=0,
+                    catch_up=None,
+                    backfill_limit=None,
                     allow_overlap=True),
                 'MASTER.test_job2': schema.ConfigJob(
                     name='MASTER.test_job2',
@@ -258,6 +266,9 @@ services:
                     all_nodes=False,
                     cleanup_action=None,
                     max_runtime=None,
+                    priority=0,
+                    catch_up=None,
+                    backfill_limit=None,
                     allow_overlap=False),
                 'MASTER.test_job3': schema.ConfigJob(
                     name='MASTER.test_job3',
@@ -287,6 +298,9 @@ services:
                     all_nodes=False,
                     cleanup_action=None,
                     max_runtime=None,
+                    priority=0,
+                    catch_up=None,
+                    backfill_limit=None,
                     allow_overlap=False),
                 'MASTER.test_job4': schema.ConfigJob(
                     name='MASTER.test_job4',
@@ -310,6 +324,9 @@ services:
                     cleanup_action=None,
                     enabled=False,
                     max_runtime=None,
+                    priority=0,
+                    catch_up=None,
+                    backfill_limit=None,
                     allow_overlap=False)
                 }),
                 services=FrozenDict({
@@ -449,6 +466,9 @@ services:
                         node=None),
                     enabled=True,
                     max_runtime=None,
+                    priority=0,
+                    catch_up=None,
+                    backfill_limit=None,
                     allow_overlap=False),
                 'test_job1': schema.ConfigJob(
                     name='test_job1',
@@ -480,6 +500,9 @@ services:
                     all_nodes=False,
                     cleanup_action=None,
                     max_runtime=None,
+                    priority=0,
+                    catch_up=None,
+                    backfill_limit=None,
                     allow_overlap=True),
                 'test_job2': schema.ConfigJob(
                     name='test_job2',
@@ -506,6 +529,9 @@ services:
                     all_nodes=False,
                     cleanup_action=None,
                     max_runtime=None,
+                    priority=0,
+                    catch_up=None,
+                    backfill_limit=None,
                     allow_overlap=False),
                 'test_job3': schema.ConfigJob(
                     name='test_job3',
@@ -535,6 +561,9 @@ services:
                     all_nodes=False,
                     cleanup_action=None,
                     max_runtime=None,
+                    priority=0,
+                    catch_up=None,
+                    backfill_limit=None,
                     allow_overlap=False),
                 'test_job4': schema.ConfigJob(
                     name='test_job4',
@@ -558,6 +587,9 @@ services:
                     cleanup_action=None,
                     enabled=False,
                     max_runtime=None,
+                    priority=0,
+                    catch_up=None,
+                    backfill_limit=None,
                     allow_overlap=False)
                 }),
                 services=FrozenDict({
@@ -931,7 +963,10 @@ class ValidateJobsAndServicesTestCase(TestCase):
                      node=None),
                 enabled=True,
                 allow_overlap=False,
-                max_runtime=None)
+                max_runtime=None,
+                priority=0,
+                catch_up=None,
+                backfill_limit=None)
             }
 
         expected_services = {'MASTER.test_service0':
@@ -1121,6 +1156,188 @@ class ValidateSSHOptionsTestCase(TestCase):
         assert_equal(config.agent, True)
 
 
+class ValidateStatePersistenceTestCase(TestCase):
+
+    @setup
+    def setup_context(self):
+        self.context = config_utils.NullConfigContext
+        self.config = {'name': 'tron_state', 'store_type': 'shelve'}
+
+    def test_defaults(self):
+        config = config_parse.valid_state_persistence.validate(
+            self.config, self.context)
+        assert_equal(config.buffer_size, 1)
+        assert_equal(config.threaded_writer, False)
+        assert_equal(config.writer_queue_size, 10000)
+
+    def test_invalid_writer_queue_size(self):
+        self.config['writer_queue_size'] = 0
+        assert_raises(ConfigError, config_parse.valid_state_persistence.validate,
+            self.config, self.context)
+
+    def test_invalid_min_save_interval(self):
+        self.config['max_buffer_age'] = 2
+        self.config['min_save_interval'] = 30
+        assert_raises(ConfigError, config_parse.valid_state_persistence.validate,
+            self.config, self.context)
+
+    def test_codec(self):
+        self.config['codec'] = 'zlib+json'
+        config = config_parse.valid_state_persistence.validate(
+            self.config, self.context)
+        assert_equal(config.codec, 'zlib+json')
+
+    def test_invalid_codec(self):
+        self.config['codec'] = 'bson'
+        assert_raises(ConfigError, config_parse.valid_state_persistence.validate,
+            self.config, self.context)
+
+    def test_journal_sync(self):
+        self.config.update(store_type='journal',
+            connection_details='sync=segment')
+        config = config_parse.valid_state_persistence.validate(
+            self.config, self.context)
+        assert_equal(config.connection_details, 'sync=segment')
+
+    def test_invalid_journal_sync(self):
+        self.config.update(store_type='journal', connection_details='sync=off')
+        assert_raises(ConfigError, config_parse.valid_state_persistence.validate,
+            self.config, self.context)
+
+    def test_invalid_slow_save_threshold(self):
+        self.config['slow_save_threshold'] = 0
+        assert_raises(ConfigError, config_parse.valid_state_persistence.validate,
+            self.config, self.context)
+
+
+class ValidateDispatchTestCase(TestCase):
+
+    @setup
+    def setup_context(self):
+        self.context = config_utils.NullConfigContext
+
+    def test_defaults(self):
+        config = config_parse.valid_dispatch.validate({}, self.context)
+        assert_equal(config, config_parse.DEFAULT_DISPATCH)
+
+    def test_limits(self):
+        config = config_parse.valid_dispatch.validate(
+            {'max_per_node': 10, 'namespaces': {'batch': 50}}, self.context)
+        assert_equal(config.max_per_node, 10)
+        assert_equal(config.namespaces, FrozenDict(batch=50))
+
+    def test_invalid_limit(self):
+        assert_raises(ConfigError, config_parse.valid_dispatch.validate,
+            {'max_concurrent': 0}, self.context)
+
+    def test_invalid_limits(self):
+        assert_raises(ConfigError, config_parse.valid_dispatch.validate,
+            {'nodes': {'node0': 0}}, self.context)
+
+    def test_unknown_node_pool(self):
+        test_config = BASE_CONFIG + dedent("""
+            dispatch:
+                node_pools:
+                    unknown: 10
+            """)
+        exception = assert_raises(
+            ConfigError, valid_config_from_yaml, test_config)
+        assert_in("Dispatch limits for unknown node_pools: unknown",
+            str(exception))
+
+    def test_known_node(self):
+        test_config = BASE_CONFIG + dedent("""
+            dispatch:
+                nodes:
+                    node0: 5
+            """)
+        config = valid_config_from_yaml(test_config)
+        assert_equal(config.dispatch.nodes, FrozenDict(node0=5))
+
+
+class ValidateCatchUpTestCase(TestCase):
+
+    @setup
+    def setup_context(self):
+        self.context = config_utils.NullConfigContext
+
+    def test_defaults(self):
+        config = config_parse.valid_catch_up.validate({}, self.context)
+        assert_equal(config, config_parse.DEFAULT_CATCH_UP)
+
+    def test_valid(self):
+        config = config_parse.valid_catch_up.validate(
+            {'policy': 'backfill', 'backfill_limit': 3, 'ramp_window': '5m'},
+            self.context)
+        assert_equal(config.policy, schema.CatchUpPolicies.backfill)
+        assert_equal(config.backfill_limit, 3)
+        assert_equal(config.ramp_window, datetime.timedelta(minutes=5))
+
+    def test_invalid_policy(self):
+        assert_raises(ConfigError, config_parse.valid_catch_up.validate,
+            {'policy': 'all'}, self.context)
+
+    def test_negative_backfill_limit(self):
+        assert_raises(ConfigError, config_parse.valid_catch_up.validate,
+            {'policy': 'backfill', 'backfill_limit': -1}, self.context)
+
+    def test_zero_backfill_limit(self):
+        config = config_parse.valid_catch_up.validate(
+            {'backfill_limit': 0}, self.context)
+        assert_equal(config.backfill_limit, 0)
+
+    def test_job_catch_up(self):
+        test_config = BASE_CONFIG + dedent("""
+            jobs:
+                -
+                    name: "test_job0"
+                    node: node0
+                    schedule: "interval 20s"
+                    catch_up: skip
+                    actions:
+                        -
+                            name: "action0_0"
+                            command: "test_command0.0"
+            """)
+        config = valid_config_from_yaml(test_config)
+        job_config = config.jobs['MASTER.test_job0']
+        assert_equal(job_config.catch_up, schema.CatchUpPolicies.skip)
+        assert_equal(job_config.backfill_limit, None)
+
+    def test_job_invalid_catch_up(self):
+        test_config = BASE_CONFIG + dedent("""
+            jobs:
+                -
+                    name: "test_job0"
+                    node: node0
+                    schedule: "interval 20s"
+                    catch_up: always
+                    actions:
+                        -
+                            name: "action0_0"
+                            command: "test_command0.0"
+            """)
+        assert_raises(ConfigError, valid_config_from_yaml, test_config)
+
+    def test_job_negative_backfill_limit(self):
+        test_config = BASE_CONFIG + dedent("""
+            jobs:
+                -
+                    name: "test_job0"
+                    node: node0
+                    schedule: "interval 20s"
+                    catch_up: backfill
+                    backfill_limit: -1
+                    actions:
+                        -
+                            name: "action0_0"
+                            command: "test_command0.0"
+            """)
+        exception = assert_raises(
+            ConfigError, valid_config_from_yaml, test_config)
+        assert_in("backfill_limit", str(exception))
+
+
 class ValidateIdentityFileTestCase(TestCase):
 
     @setup
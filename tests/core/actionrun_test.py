@@ -13,7 +13,9 @@ from tron import node, actioncommand
 from tron.core import jobrun, actiongraph
 from tron.core.actionrun import ActionCommand, ActionRun
 from tron.core.actionrun import ActionRunCollection, ActionRunFactory
+from tron.core import actionrun
 from tron.serialize import filehandler
+from tron.utils import collections
 
 
 class ActionRunFactoryTestCase(TestCase):
@@ -21,7 +23,9 @@ class ActionRunFactoryTestCase(TestCase):
     @setup
     def setup_action_runs(self):
         self.run_time = datetime.datetime(2012, 3, 14, 15, 9 ,26)
-        actions = [Turtle(name='act1'), Turtle(name='act2')]
+        actions = [
+            Turtle(name='act1', required_actions=[]),
+            Turtle(name='act2', required_actions=[])]
         self.action_graph = actiongraph.ActionGraph(
                 actions, dict((a.name, a) for a in actions))
 
@@ -152,6 +156,61 @@ class ActionRunTestCase(TestCase):
         assert_equal(self.action_run.exit_status, -2)
         assert self.action_run.is_failed
 
+    @mock.patch('tron.core.actionrun.dispatch.Dispatcher', autospec=True)
+    def test_start_dispatched(self, mock_dispatcher):
+        dispatcher = mock_dispatcher.get_instance.return_value
+        self.action_run.machine.transition('ready')
+        assert_equal(self.action_run.start(), dispatcher.submit.return_value)
+        dispatcher.submit.assert_called_with(
+            self.action_run, self.action_run.action_command)
+        assert not self.action_run.node.submit_command.mock_calls
+        assert self.action_run.dispatch_waiting
+        assert self.action_run.state_data['dispatch_waiting']
+
+    def test_submit_command(self):
+        command = mock.Mock()
+        self.action_run.dispatch_waiting = True
+        deferred = self.action_run.submit_command(command)
+        assert_equal(deferred, self.action_run.node.submit_command.return_value)
+        self.action_run.node.submit_command.assert_called_with(command)
+        assert not self.action_run.dispatch_waiting
+
+    @mock.patch('tron.core.actionrun.dispatch.Dispatcher', autospec=True)
+    def test_requeue(self, mock_dispatcher):
+        dispatcher = mock_dispatcher.get_instance.return_value
+        self.action_run.machine.transition('start')
+        self.action_run.dispatch_waiting = True
+        assert_equal(self.action_run.requeue(), dispatcher.submit.return_value)
+        dispatcher.submit.assert_called_with(
+            self.action_run, self.action_run.action_command)
+
+    @mock.patch('tron.core.actionrun.dispatch.Dispatcher', autospec=True)
+    def test_requeue_not_waiting(self, mock_dispatcher):
+        self.action_run.machine.transition('start')
+        assert not self.action_run.requeue()
+        assert not mock_dispatcher.get_instance.mock_calls
+
+    @mock.patch('tron.core.actionrun.dispatch.Dispatcher', autospec=True)
+    def test_stop_waiting(self, mock_dispatcher):
+        dispatcher = mock_dispatcher.get_instance.return_value
+        dispatcher.cancel.return_value = True
+        self.action_run.machine.transition('start')
+        self.action_run.stop()
+        dispatcher.cancel.assert_called_with(self.action_run)
+        assert self.action_run.is_failed
+        assert not self.action_run.dispatch_waiting
+        assert not self.action_run.node.submit_command.mock_calls
+
+    @mock.patch('tron.core.actionrun.dispatch.Dispatcher', autospec=True)
+    def test_kill_running(self, mock_dispatcher):
+        dispatcher = mock_dispatcher.get_instance.return_value
+        dispatcher.cancel.return_value = False
+        self.action_run.kill()
+        self.action_runner.build_stop_action_command.assert_called_with(
+            self.action_run.id, 'kill')
+        self.action_run.node.submit_command.assert_called_with(
+            self.action_runner.build_stop_action_command.return_value)
+
     @mock.patch('tron.core.actionrun.filehandler', autospec=True)
     def test_build_action_command(self, mock_filehandler):
         autospec_method(self.action_run.watch)
@@ -265,6 +324,38 @@ class ActionRunTestCase(TestCase):
         assert_equal(state_data['command'], command)
         assert_equal(state_data['rendered_command'], command)
 
+    def test_compact_state_data(self):
+        self.action_run.node.get_name.return_value = 'node'
+        command = self.action_run.command
+        self.action_run.start_time = datetime.datetime(2012, 3, 14, 15, 9, 26, 53)
+        strings = collections.StringTable()
+        state_data = self.action_run.compact_state_data(strings)
+        expected = {
+            'a':    'action_name',
+            's':    actionrun.STATE_CODES['scheduled'],
+            't0':   actionrun.encode_time(self.action_run.start_time),
+            'c':    0,
+            'r':    0,
+            'n':    1,
+        }
+        assert_equal(state_data, expected)
+        assert_equal(strings.strings, [command, 'node'])
+
+    def test_compact_state_data_dispatch_waiting(self):
+        self.action_run.dispatch_waiting = True
+        state_data = self.action_run.compact_state_data(
+            collections.StringTable())
+        assert_equal(state_data['w'], True)
+
+    def test_compact_state_data_expanded(self):
+        self.action_run.node.get_name.return_value = 'node'
+        self.action_run.end_time = datetime.datetime(2012, 3, 14, 15, 9, 26, 53)
+        strings = collections.StringTable()
+        state_data = actionrun.expand_compact_state(
+            self.action_run.compact_state_data(strings), 'id', strings)
+        expected = dict(self.action_run.state_data, node_name='node')
+        assert_equal(state_data, expected)
+
     def test_render_command(self):
         self.action_run.context = {'stars': 'bright'}
         self.action_run.bare_command = "%(stars)s"
@@ -298,7 +389,7 @@ class ActionRunTestCase(TestCase):
         self.action_run.machine.state = ActionRun.STATE_QUEUED
         assert not self.action_run.is_broken
 
-    def test__getattr__(self):
+    def test_state_attributes(self):
         assert not self.action_run.is_succeeded
         assert not self.action_run.is_failed
         assert not self.action_run.is_queued
@@ -306,9 +397,9 @@ class ActionRunTestCase(TestCase):
         assert self.action_run.cancel()
         assert self.action_run.is_cancelled
 
-    def test__getattr__missing_attribute(self):
+    def test_state_attributes_missing_attribute(self):
         assert_raises(AttributeError,
-            self.action_run.__getattr__, 'is_not_a_real_state')
+            getattr, self.action_run, 'is_not_a_real_state')
 
 
 class ActionRunStateRestoreTestCase(testingutils.MockTimeTestCase):
@@ -352,6 +443,20 @@ class ActionRunStateRestoreTestCase(testingutils.MockTimeTestCase):
         assert_equal(action_run.exit_status, 0)
         assert_equal(action_run.end_time, self.now)
 
+    def test_from_state_starting(self):
+        self.state_data['state'] = 'starting'
+        action_run = ActionRun.from_state(self.state_data, self.parent_context,
+                self.output_path, self.run_node)
+        assert action_run.is_failed
+        assert not action_run.dispatch_waiting
+
+    def test_from_state_dispatch_waiting(self):
+        self.state_data.update(state='starting', dispatch_waiting=True)
+        action_run = ActionRun.from_state(self.state_data, self.parent_context,
+                self.output_path, self.run_node)
+        assert action_run.is_starting
+        assert action_run.dispatch_waiting
+
     def test_from_state_queued(self):
         self.state_data['state'] = 'queued'
         action_run = ActionRun.from_state(self.state_data, self.parent_context,
@@ -371,6 +476,28 @@ class ActionRunStateRestoreTestCase(testingutils.MockTimeTestCase):
         mock_store.get_instance().get_node.assert_called_with(
             self.state_data['node_name'], self.run_node)
 
+    def test_from_state_compact(self):
+        strings = collections.StringTable(['do things', 'anode'])
+        start_time = datetime.datetime(2012, 3, 14, 15, 9, 26, 53)
+        state_data = {
+            'a':    'theaction',
+            's':    actionrun.STATE_CODES['failed'],
+            't0':   actionrun.encode_time(start_time),
+            'c':    0,
+            'n':    1,
+            'x':    2,
+        }
+        action_run = ActionRun.from_state(state_data, self.parent_context,
+                self.output_path, self.run_node, job_run_id='theid',
+                strings=strings)
+        assert_equal(action_run.id, 'theid.theaction')
+        assert action_run.is_failed
+        assert_equal(action_run.start_time, start_time)
+        assert_equal(action_run.end_time, None)
+        assert_equal(action_run.bare_command, 'do things')
+        assert_equal(action_run.rendered_command, None)
+        assert_equal(action_run.exit_status, 2)
+
     def test_from_state_before_rendered_command(self):
         self.state_data['command'] = 'do things %(actionname)s'
         self.state_data['rendered_command'] = None
@@ -395,6 +522,14 @@ class ActionRunStateRestoreTestCase(testingutils.MockTimeTestCase):
         assert_equal(action_run.rendered_command, self.state_data['command'])
 
 
+def set_state(action_run, state):
+    """Set the state of action_run without a transition, and notify the
+    observers of the change.
+    """
+    action_run.machine.state = state
+    action_run.machine.notify(state)
+
+
 class ActionRunCollectionTestCase(TestCase):
 
     def _build_run(self, name):
@@ -461,7 +596,8 @@ class ActionRunCollectionTestCase(TestCase):
         assert_equal(set(action_runs), set(self.action_runs[:2]))
 
     def test_get_startable_action_runs_none(self):
-        self.collection.run_map.clear()
+        for action_run in self.action_runs:
+            set_state(action_run, ActionRun.STATE_CANCELLED)
         action_runs = self.collection.get_startable_action_runs()
         assert_equal(set(action_runs), set())
 
@@ -469,7 +605,8 @@ class ActionRunCollectionTestCase(TestCase):
         assert self.collection.has_startable_action_runs
 
     def test_has_startable_action_runs_false(self):
-        self.collection.run_map.clear()
+        for action_run in self.action_runs:
+            set_state(action_run, ActionRun.STATE_RUNNING)
         assert not self.collection.has_startable_action_runs
 
     def test_is_complete_false(self):
@@ -477,7 +614,7 @@ class ActionRunCollectionTestCase(TestCase):
 
     def test_is_complete_true(self):
         for action_run in self.collection.action_runs_with_cleanup:
-            action_run.machine.state = ActionRun.STATE_SKIPPED
+            set_state(action_run, ActionRun.STATE_SKIPPED)
         assert self.collection.is_complete
 
     def test_is_done_false(self):
@@ -485,35 +622,26 @@ class ActionRunCollectionTestCase(TestCase):
 
     def test_is_done_false_because_of_running(self):
         action_run = self.collection.run_map['action_name']
-        action_run.machine.state = ActionRun.STATE_RUNNING
+        set_state(action_run, ActionRun.STATE_RUNNING)
         assert not self.collection.is_done
 
-    def test_is_done_true_because_blocked(self):
-        self.run_map['action_name'].machine.state = ActionRun.STATE_FAILED
-        self.run_map['second_name'].machine.state = ActionRun.STATE_QUEUED
-        autospec_method(self.collection._is_run_blocked)
-        blocked_second_action_run = lambda ar: ar == self.run_map['second_name']
-        self.collection._is_run_blocked.side_effect = blocked_second_action_run
-        assert self.collection.is_done
-        assert self.collection.is_failed
-
     def test_is_done_true(self):
         for action_run in self.collection.action_runs_with_cleanup:
-            action_run.machine.state = ActionRun.STATE_FAILED
+            set_state(action_run, ActionRun.STATE_FAILED)
         assert self.collection.is_done
 
     def test_is_failed_false_not_done(self):
-        self.run_map['action_name'].machine.state = ActionRun.STATE_FAILED
+        set_state(self.run_map['action_name'], ActionRun.STATE_FAILED)
         assert not self.collection.is_failed
 
     def test_is_failed_false_no_failed(self):
         for action_run in self.collection.action_runs_with_cleanup:
-            action_run.machine.state = ActionRun.STATE_SUCCEEDED
+            set_state(action_run, ActionRun.STATE_SUCCEEDED)
         assert not self.collection.is_failed
 
     def test_is_failed_true(self):
         for action_run in self.collection.action_runs_with_cleanup:
-            action_run.machine.state = ActionRun.STATE_FAILED
+            set_state(action_run, ActionRun.STATE_FAILED)
         assert self.collection.is_failed
 
     def test__getattr__(self):
@@ -522,6 +650,13 @@ class ActionRunCollectionTestCase(TestCase):
         assert not self.collection.is_running
         assert self.collection.ready()
 
+    def test_cleanup(self):
+        self.collection.cleanup()
+        assert self.collection.is_cancelled
+        assert not self.collection.is_scheduled
+        assert not self.collection.has_startable_action_runs
+        assert self.collection.is_done
+
     def test__str__(self):
         self.collection._is_run_blocked = lambda r: r.action_name != 'cleanup'
         expected = [
@@ -535,22 +670,29 @@ class ActionRunCollectionTestCase(TestCase):
 
     def test_end_time(self):
         max_end_time = datetime.datetime(2013, 6, 15)
-        self.run_map['action_name'].machine.state = ActionRun.STATE_FAILED
+        set_state(self.run_map['action_name'], ActionRun.STATE_FAILED)
         self.run_map['action_name'].end_time = datetime.datetime(2013, 5, 12)
-        self.run_map['second_name'].machine.state = ActionRun.STATE_SUCCEEDED
+        set_state(self.run_map['second_name'], ActionRun.STATE_SUCCEEDED)
         self.run_map['second_name'].end_time = max_end_time
         assert_equal(self.collection.end_time, max_end_time)
 
     def test_end_time_not_done(self):
         self.run_map['action_name'].end_time = datetime.datetime(2013, 5, 12)
-        self.run_map['action_name'].machine.state = ActionRun.STATE_FAILED
+        set_state(self.run_map['action_name'], ActionRun.STATE_FAILED)
         self.run_map['second_name'].end_time = None
-        self.run_map['second_name'].machine.state = ActionRun.STATE_RUNNING
+        set_state(self.run_map['second_name'], ActionRun.STATE_RUNNING)
         assert_equal(self.collection.end_time, None)
 
     def test_end_time_not_started(self):
         assert_equal(self.collection.end_time, None)
 
+    def test_is_finished(self):
+        for action_run in self.action_runs[:2]:
+            set_state(action_run, ActionRun.STATE_SUCCEEDED)
+        assert not self.collection.is_finished
+        set_state(self.run_map['cleanup'], ActionRun.STATE_FAILED)
+        assert self.collection.is_finished
+
 
 class ActionRunCollectionIsRunBlockedTestCase(TestCase):
 
@@ -584,18 +726,48 @@ class ActionRunCollectionIsRunBlockedTestCase(TestCase):
     def teardown_action_run(self):
         shutil.rmtree(self.output_path.base, ignore_errors=True)
 
+    def test_get_startable_action_runs(self):
+        action_runs = self.collection.get_startable_action_runs()
+        assert_equal(action_runs, [self.run_map['action_name']])
+
+    def test_get_startable_action_runs_required_complete(self):
+        set_state(self.run_map['action_name'], ActionRun.STATE_SUCCEEDED)
+        action_runs = self.collection.get_startable_action_runs()
+        assert_equal(action_runs, [self.run_map['second_name']])
+        assert_equal(self.collection.blocking_counts['second_name'], 0)
+
+    def test_get_startable_action_runs_required_failed(self):
+        set_state(self.run_map['action_name'], ActionRun.STATE_FAILED)
+        assert not self.collection.has_startable_action_runs
+        assert_equal(self.collection.blocking_counts['second_name'], 1)
+
+    def test_is_done_true_because_blocked(self):
+        set_state(self.run_map['action_name'], ActionRun.STATE_FAILED)
+        set_state(self.run_map['second_name'], ActionRun.STATE_QUEUED)
+        assert self.collection.is_done
+        assert self.collection.is_failed
+
+    def test_is_done_false_required_running(self):
+        set_state(self.run_map['action_name'], ActionRun.STATE_RUNNING)
+        assert not self.collection.is_done
+        set_state(self.run_map['action_name'], ActionRun.STATE_SUCCEEDED)
+        assert not self.collection.is_done
+        set_state(self.run_map['second_name'], ActionRun.STATE_SUCCEEDED)
+        assert self.collection.is_done
+        assert not self.collection.is_failed
+
     def test_is_run_blocked_no_required_actions(self):
         assert not self.collection._is_run_blocked(self.run_map['action_name'])
 
     def test_is_run_blocked_completed_run(self):
-        self.run_map['second_name'].machine.state = ActionRun.STATE_FAILED
+        set_state(self.run_map['second_name'], ActionRun.STATE_FAILED)
         assert not self.collection._is_run_blocked(self.run_map['second_name'])
 
-        self.run_map['second_name'].machine.state = ActionRun.STATE_RUNNING
+        set_state(self.run_map['second_name'], ActionRun.STATE_RUNNING)
         assert not self.collection._is_run_blocked(self.run_map['second_name'])
 
     def test_is_run_blocked_required_actions_completed(self):
-        self.run_map['action_name'].machine.state = ActionRun.STATE_SKIPPED
+        set_state(self.run_map['action_name'], ActionRun.STATE_SKIPPED)
         assert not self.collection._is_run_blocked(self.run_map['second_name'])
 
     def test_is_run_blocked_required_actions_blocked(self):
@@ -603,25 +775,80 @@ class ActionRunCollectionIsRunBlockedTestCase(TestCase):
         self.action_graph.action_map['third_act'] = third_act
         self.run_map['third_act'] = self._build_run('third_act')
 
-        self.run_map['action_name'].machine.state = ActionRun.STATE_FAILED
+        set_state(self.run_map['action_name'], ActionRun.STATE_FAILED)
         assert self.collection._is_run_blocked(self.run_map['third_act'])
 
     def test_is_run_blocked_required_actions_scheduled(self):
-        self.run_map['action_name'].machine.state = ActionRun.STATE_SCHEDULED
+        set_state(self.run_map['action_name'], ActionRun.STATE_SCHEDULED)
         assert self.collection._is_run_blocked(self.run_map['second_name'])
 
     def test_is_run_blocked_required_actions_starting(self):
-        self.run_map['action_name'].machine.state = ActionRun.STATE_STARTING
+        set_state(self.run_map['action_name'], ActionRun.STATE_STARTING)
         assert self.collection._is_run_blocked(self.run_map['second_name'])
 
     def test_is_run_blocked_required_actions_queued(self):
-        self.run_map['action_name'].machine.state = ActionRun.STATE_QUEUED
+        set_state(self.run_map['action_name'], ActionRun.STATE_QUEUED)
         assert self.collection._is_run_blocked(self.run_map['second_name'])
 
     def test_is_run_blocked_required_actions_failed(self):
-        self.run_map['action_name'].machine.state = ActionRun.STATE_FAILED
+        set_state(self.run_map['action_name'], ActionRun.STATE_FAILED)
         assert self.collection._is_run_blocked(self.run_map['second_name'])
 
 
+class CompletedActionRunTestCase(TestCase):
+
+    @setup
+    def setup_collection(self):
+        actions = [mock.Mock(name=name, required_actions=[])
+                   for name in ['action_name', 'cleanup']]
+        self.action_graph = actiongraph.ActionGraph(
+            actions, dict((a.name, a) for a in actions))
+        mock_node = mock.create_autospec(node.Node)
+        mock_node.get_name.return_value = 'anode'
+        self.action_runs = [
+            ActionRun("job.3", name, mock_node, "do %s" % name,
+                run_state=ActionRun.STATE_FAILED, exit_status=1,
+                cleanup=name == 'cleanup')
+            for name in ['action_name', 'cleanup']]
+        self.run_map = dict((a.action_name, a) for a in self.action_runs)
+        self.collection = ActionRunCollection(self.action_graph, self.run_map)
+        self.completed = actionrun.CompletedActionRunCollection.from_collection(
+            self.collection)
+
+    def test_from_action_run(self):
+        action_run = actionrun.CompletedActionRun.from_action_run(
+            self.action_runs[0])
+        assert_equal(action_run.id, 'job.3.action_name')
+        assert_equal(action_run.state, ActionRun.STATE_FAILED)
+        assert_equal(action_run.exit_status, 1)
+        assert action_run.is_failed
+        assert action_run.is_done
+        assert action_run.is_broken
+        assert not action_run.is_running
+        assert not hasattr(action_run, 'skip')
+
+    def test_state_data(self):
+        action_run = self.completed['action_name']
+        assert_equal(action_run.state_data, self.action_runs[0].state_data)
+        strings = collections.StringTable()
+        assert_equal(action_run.compact_state_data(strings),
+            self.action_runs[0].compact_state_data(collections.StringTable()))
+
+    def test_collection_state_data(self):
+        assert_equal(self.completed.state_data, self.collection.state_data)
+        assert_equal(self.completed.cleanup_action_state_data,
+            self.collection.cleanup_action_state_data)
+
+    def test_collection_lookups(self):
+        assert 'action_name' in self.completed
+        assert 'other' not in self.completed
+        assert_equal(self.completed.get('other'), None)
+        assert_raises(KeyError, lambda: self.completed['other'])
+        assert_equal(self.completed.cleanup_action_run.action_name, 'cleanup')
+        assert_equal([run.action_name for run in self.completed.action_runs],
+            ['action_name'])
+        assert_equal(self.completed.action_graph, self.action_graph)
+
+
 if __name__ == "__main__":
     run()
@@ -8,7 +8,8 @@ from tests import mocks
 from tests.assertions import assert_length, assert_call, assert_mock_calls
 from tests.testingutils import Turtle, autospec_method
 from tests import testingutils
-from tron import node, event, actioncommand
+from tron import node, event, actioncommand, scheduler
+from tron.config import schema
 from tron.core import job, jobrun
 from tron.core.actionrun import ActionRun
 
@@ -95,10 +96,16 @@ class JobTestCase(TestCase):
         assert_equal(state_data['runs'], self.job.runs.state_data)
         assert state_data['enabled']
 
+    def test_run_index_state_data(self):
+        state_data = self.job.run_index_state_data
+        assert_equal(state_data['run_nums'], self.job.runs.run_nums)
+        assert state_data['enabled']
+
     def test_restore_state(self):
         run_data = ['one', 'two']
         job_runs = [Turtle(), Turtle()]
         self.job.runs.restore_state = lambda r, a, o, c, n: job_runs
+        self.job.runs.freeze = mock.Mock(return_value=None)
         state_data = {'enabled': False, 'runs': run_data}
 
         self.job.restore_state(state_data)
@@ -108,6 +115,16 @@ class JobTestCase(TestCase):
         self.job.watch.assert_has_calls(calls)
         self.job.event.ok.assert_called_with('restored')
 
+    def test_restore_state_freezes_finished_runs(self):
+        job_runs = [Turtle(), Turtle()]
+        self.job.runs.restore_state = lambda r, a, o, c, n: job_runs
+        self.job.runs.freeze = mock.Mock(side_effect=[None, mock.Mock()])
+
+        self.job.restore_state({'enabled': True, 'runs': []})
+        assert_equal(self.job.runs.freeze.mock_calls,
+            [mock.call(job_run) for job_run in job_runs])
+        self.job.watch.assert_called_once_with(job_runs[0])
+
     def test_build_new_runs(self):
         run_time = datetime.datetime(2012, 3, 14, 15, 9, 26)
         runs = list(self.job.build_new_runs(run_time))
@@ -146,11 +163,38 @@ class JobTestCase(TestCase):
         self.job.watch.assert_called_with(runs[0])
 
     def test_handler(self):
-        self.job.handler(None, jobrun.JobRun.NOTIFY_STATE_CHANGED)
+        job_run = mock.Mock()
+        self.job.handler(job_run, jobrun.JobRun.NOTIFY_STATE_CHANGED)
         self.job.notify.assert_called_with(self.job.NOTIFY_STATE_CHANGE)
+        assert_call(self.job.runs.mark_changed, 0, job_run)
 
-        self.job.handler(None, jobrun.JobRun.NOTIFY_DONE)
+        self.job.runs.freeze = mock.Mock(return_value=None)
+        self.job.handler(job_run, jobrun.JobRun.NOTIFY_DONE)
         self.job.notify.assert_called_with(self.job.NOTIFY_RUN_DONE)
+        self.job.runs.freeze.assert_called_with(job_run)
+
+    def test_handler_done_freezes_run(self):
+        job_run = mock.Mock()
+        self.job.runs.freeze = mock.Mock()
+        autospec_method(self.job.stop_watching)
+        self.job.handler(job_run, jobrun.JobRun.NOTIFY_DONE)
+        self.job.runs.freeze.assert_called_with(job_run)
+        self.job.stop_watching.assert_called_with(job_run)
+
+    def test_thaw_run_not_frozen(self):
+        job_run = mock.Mock(frozen=False)
+        assert_equal(self.job.thaw_run(job_run), job_run)
+        assert not self.job.watch.mock_calls
+
+    def test_thaw_run(self):
+        completed_run = mock.Mock(frozen=True)
+        self.job.runs.thaw = mock.Mock()
+        job_run = self.job.thaw_run(completed_run)
+        assert_equal(job_run, self.job.runs.thaw.return_value)
+        self.job.runs.thaw.assert_called_with(completed_run,
+            self.job.action_graph, self.job.output_path.clone(),
+            self.job.context)
+        self.job.watch.assert_called_with(job_run)
 
     def test__eq__(self):
         other_job = job.Job("jobname", 'scheduler')
@@ -351,6 +395,186 @@ class JobSchedulerGetRunsToScheduleTestCase(TestCase):
         self.scheduler.next_run_time.assert_called_once_with(None)
 
 
+class JobSchedulerCatchUpTestCase(testingutils.MockTimeTestCase):
+
+    now = datetime.datetime(2012, 3, 14, 15)
+
+    @setup
+    def setup_job(self):
+        self.scheduler = scheduler.IntervalScheduler(
+            datetime.timedelta(minutes=10), None)
+        self.job = job.Job("jobname", self.scheduler,
+            run_collection=mock.Mock(), node_pool=mock.Mock())
+        self.job_scheduler = job.JobScheduler(self.job)
+        self.catch_up = mock.create_autospec(job.RestartCatchUp)
+        self.catch_up.get_allowed_runs.return_value = 1
+
+    def minutes_ago(self, minutes):
+        return self.now - datetime.timedelta(minutes=minutes)
+
+    def test_catch_up_missed_runs_none_missed(self):
+        scheduled = [mock.Mock(run_time=self.now + datetime.timedelta(1))]
+        result = self.job_scheduler.catch_up_missed_runs(
+            self.catch_up, scheduled)
+        assert_equal(result, scheduled)
+        assert not self.catch_up.delay.mock_calls
+        assert_equal(self.job_scheduler.missed_runs_left, None)
+
+    def test_catch_up_missed_runs_run_once(self):
+        missed_run = mock.Mock(run_time=self.minutes_ago(35))
+        result = self.job_scheduler.catch_up_missed_runs(
+            self.catch_up, [missed_run])
+        assert_equal(result, [])
+        self.catch_up.delay.assert_called_with(
+            self.job_scheduler, [missed_run])
+        self.catch_up.skip.assert_called_with(self.job, 3)
+        assert_equal(self.job_scheduler.missed_runs_left, 0)
+        assert not missed_run.cancel.mock_calls
+
+    def test_catch_up_missed_runs_skip(self):
+        self.catch_up.get_allowed_runs.return_value = 0
+        missed_run = mock.Mock(run_time=self.minutes_ago(35))
+        result = self.job_scheduler.catch_up_missed_runs(
+            self.catch_up, [missed_run])
+        assert_equal(result, [])
+        missed_run.cancel.assert_called_with()
+        self.catch_up.skip.assert_called_with(self.job, 4)
+        assert not self.catch_up.delay.mock_calls
+        assert_equal(self.job_scheduler.missed_runs_left, 0)
+
+    def test_catch_up_missed_runs_backfill_from_last_run(self):
+        self.catch_up.get_allowed_runs.return_value = 5
+        self.job.runs.get_newest.return_value.run_time = self.minutes_ago(45)
+        autospec_method(self.job.build_new_runs)
+        result = self.job_scheduler.catch_up_missed_runs(self.catch_up, [])
+        assert_equal(result, [])
+        self.job.build_new_runs.assert_called_with(self.minutes_ago(35))
+        self.catch_up.delay.assert_called_with(
+            self.job_scheduler, self.job.build_new_runs.return_value)
+        self.catch_up.skip.assert_called_with(self.job, -1)
+        assert_equal(self.job_scheduler.missed_runs_left, 4)
+
+    def test_catch_up_missed_runs_last_run_not_missed(self):
+        self.job.runs.get_newest.return_value.run_time = self.minutes_ago(5)
+        result = self.job_scheduler.catch_up_missed_runs(self.catch_up, [])
+        assert_equal(result, [])
+        assert not self.catch_up.get_allowed_runs.mock_calls
+        assert_equal(self.job_scheduler.missed_runs_left, None)
+
+    def test_get_catch_up_run_time_not_catching_up(self):
+        run_time = self.minutes_ago(30)
+        assert_equal(self.job_scheduler.get_catch_up_run_time(run_time),
+            run_time)
+
+    def test_get_catch_up_run_time_not_missed(self):
+        self.job_scheduler.missed_runs_left = 2
+        run_time = self.now + datetime.timedelta(minutes=5)
+        assert_equal(self.job_scheduler.get_catch_up_run_time(run_time),
+            run_time)
+        assert_equal(self.job_scheduler.missed_runs_left, None)
+
+    def test_get_catch_up_run_time_backfill(self):
+        self.job_scheduler.missed_runs_left = 2
+        run_time = self.minutes_ago(30)
+        assert_equal(self.job_scheduler.get_catch_up_run_time(run_time),
+            run_time)
+        assert_equal(self.job_scheduler.missed_runs_left, 1)
+
+    def test_get_catch_up_run_time_skip_to_next(self):
+        self.job_scheduler.missed_runs_left = 0
+        run_time = self.job_scheduler.get_catch_up_run_time(
+            self.minutes_ago(30))
+        assert_equal(run_time, self.now + datetime.timedelta(minutes=10))
+        assert_equal(self.job_scheduler.missed_runs_left, None)
+
+    def test_restore_state_disabled_job(self):
+        missed_run = mock.Mock(run_time=self.minutes_ago(35))
+        self.job.runs.get_scheduled.return_value = [missed_run]
+        autospec_method(self.job.restore_state)
+        autospec_method(self.job_scheduler._set_callback)
+        autospec_method(self.job_scheduler.schedule)
+        self.job.enabled = False
+        self.job_scheduler.restore_state('state_data', self.catch_up)
+        self.job_scheduler._set_callback.assert_called_with(missed_run)
+        assert not self.catch_up.delay.mock_calls
+
+
+class RestartCatchUpTestCase(testingutils.MockTimeTestCase):
+
+    now = datetime.datetime(2012, 3, 14, 15)
+
+    @setup
+    def setup_catch_up(self):
+        self.config = schema.ConfigCatchUp(
+            policy=schema.CatchUpPolicies.run_once,
+            backfill_limit=5,
+            ramp_window=datetime.timedelta(minutes=1))
+        self.catch_up = job.RestartCatchUp(self.config)
+
+    def build_job(self, catch_up=None, backfill_limit=None):
+        return mock.Mock(config=mock.Mock(
+            catch_up=catch_up, backfill_limit=backfill_limit))
+
+    def test_get_allowed_runs_default(self):
+        assert_equal(self.catch_up.get_allowed_runs(self.build_job()), 1)
+
+    def test_get_allowed_runs_job_skip(self):
+        job_ = self.build_job(catch_up=schema.CatchUpPolicies.skip)
+        assert_equal(self.catch_up.get_allowed_runs(job_), 0)
+
+    def test_get_allowed_runs_backfill(self):
+        job_ = self.build_job(catch_up=schema.CatchUpPolicies.backfill)
+        assert_equal(self.catch_up.get_allowed_runs(job_), 5)
+        job_ = self.build_job(
+            catch_up=schema.CatchUpPolicies.backfill, backfill_limit=2)
+        assert_equal(self.catch_up.get_allowed_runs(job_), 2)
+
+    def test_skip(self):
+        job_ = mock.Mock()
+        self.catch_up.skip(job_, 0)
+        assert_equal(self.catch_up.skipped, {})
+        self.catch_up.skip(job_, 3)
+        assert_equal(self.catch_up.skipped, {job_.get_name.return_value: 3})
+
+    def test_get_delays(self):
+        job_runs = [
+            mock.Mock(run_time=self.now - datetime.timedelta(minutes=m), id=m)
+            for m in [5, 30, 10]]
+        job_scheduler = mock.Mock()
+        self.catch_up.delay(job_scheduler, job_runs)
+        delays = self.catch_up.get_delays()
+        assert_equal(delays, [
+            (0.0, job_scheduler, job_runs[1]),
+            (20.0, job_scheduler, job_runs[2]),
+            (40.0, job_scheduler, job_runs[0])])
+
+    def test_get_delays_no_ramp_window(self):
+        self.catch_up.config = self.config._replace(ramp_window=None)
+        job_runs = [mock.Mock(run_time=self.now, id=i) for i in range(2)]
+        self.catch_up.delay(mock.Mock(), job_runs)
+        assert_equal([d[0] for d in self.catch_up.get_delays()], [0, 0])
+
+    @mock.patch('tron.core.job.event', autospec=True)
+    @mock.patch('tron.core.job.eventloop', autospec=True)
+    def test_start(self, mock_eventloop, mock_event):
+        job_runs = [mock.Mock(run_time=self.now, id=i) for i in range(2)]
+        job_scheduler = mock.Mock()
+        self.catch_up.delay(job_scheduler, job_runs)
+        self.catch_up.skip(mock.Mock(get_name=lambda: 'a_job'), 4)
+        self.catch_up.start()
+        assert_equal(mock_eventloop.call_later.mock_calls, [
+            mock.call(0.0, job_scheduler.run_job, job_runs[0]),
+            mock.call(30.0, job_scheduler.run_job, job_runs[1])])
+        mock_event.get_recorder.return_value.notice.assert_called_with(
+            'catch_up', delayed=[0, 1], skipped={'a_job': 4},
+            ramp_seconds=30.0)
+
+    @mock.patch('tron.core.job.event', autospec=True)
+    def test_start_nothing_missed(self, mock_event):
+        self.catch_up.start()
+        assert not mock_event.get_recorder.mock_calls
+
+
 class JobSchedulerManualStartTestCase(testingutils.MockTimeTestCase):
 
     now = datetime.datetime.now()
@@ -481,20 +705,24 @@ class JobSchedulerFactoryTestCase(TestCase):
         self.time_zone = mock.Mock()
         self.action_runner = mock.create_autospec(
             actioncommand.SubprocessActionRunnerFactory)
+        self.run_archive = mock.Mock()
         self.factory = job.JobSchedulerFactory(
-            self.context, self.output_stream_dir, self.time_zone, self.action_runner)
+            self.context, self.output_stream_dir, self.time_zone,
+            self.action_runner, self.run_archive)
 
     def test_build(self):
         config = mock.Mock()
         with mock.patch('tron.core.job.Job', autospec=True) as mock_job:
             job_scheduler = self.factory.build(config)
             args, _ = mock_job.from_config.call_args
-            job_config, scheduler, context, output_path, action_runner = args
+            (job_config, scheduler, context, output_path, action_runner,
+                run_archive) = args
             assert_equal(job_config, config)
             assert_equal(job_scheduler.get_job(), mock_job.from_config.return_value)
             assert_equal(context, self.context)
             assert_equal(output_path.base, self.output_stream_dir)
             assert_equal(action_runner, self.action_runner)
+            assert_equal(run_archive, self.run_archive)
 
 
 class JobCollectionTestCase(TestCase):
@@ -530,6 +758,23 @@ class JobCollectionTestCase(TestCase):
             mock_scheduler.get_job.return_value)
         existing_scheduler.schedule_reconfigured.assert_called_with()
 
+    def test_restore_state(self):
+        job_scheduler = mock.create_autospec(job.JobScheduler)
+        self.collection.jobs['a_job'] = job_scheduler
+        self.collection.restore_state({'a_job': 'state'})
+        job_scheduler.restore_state.assert_called_with('state', None)
+
+    @mock.patch('tron.core.job.RestartCatchUp', autospec=True)
+    def test_restore_state_catch_up(self, mock_catch_up):
+        job_scheduler = mock.create_autospec(job.JobScheduler)
+        self.collection.jobs['a_job'] = job_scheduler
+        self.collection.update_catch_up('catch_up_config')
+        self.collection.restore_state({'a_job': 'state'})
+        mock_catch_up.assert_called_with('catch_up_config')
+        job_scheduler.restore_state.assert_called_with(
+            'state', mock_catch_up.return_value)
+        mock_catch_up.return_value.start.assert_called_with()
+
     def test_get_jobs_from_namespace(self):
         fake_job_uno = job.Job(mock.MagicMock(), mock.Mock())
         fake_job_dos = job.Job(mock.MagicMock(), mock.Mock())
@@ -543,6 +788,76 @@ class JobCollectionTestCase(TestCase):
             assert_equal(self.collection.get_jobs_by_namespace('dos'),
                 [fake_job_dos])
 
+    def test_update_invalidates_schedule_index(self):
+        mock_scheduler = mock.create_autospec(job.JobScheduler)
+        autospec_method(self.collection.get_by_name)
+        self.collection.schedule_index.entries[
+            self.collection.get_by_name.return_value.get_name()] = 'entry'
+        self.collection.update(mock_scheduler)
+        assert_equal(self.collection.schedule_index.entries, {})
+
+    def test_get_upcoming_runs(self):
+        jobs = [mock.Mock(config=mock.Mock(namespace=namespace))
+                for namespace in ['uno', 'uno', 'dos']]
+        jobs[0].node_pool.get_name.return_value = 'pool'
+        autospec_method(self.collection.get_jobs, return_value=jobs)
+        autospec_method(self.collection.schedule_index.get_runs)
+        runs = self.collection.get_upcoming_runs(
+            'start', 'end', namespace='uno', node_pool='pool')
+        assert_equal(runs, self.collection.schedule_index.get_runs.return_value)
+        self.collection.schedule_index.get_runs.assert_called_with(
+            [jobs[0]], 'start', 'end')
+
+
+class ScheduleIndexTestCase(testingutils.MockTimeTestCase):
+
+    now = datetime.datetime(2012, 3, 14, 15)
+
+    @setup
+    def setup_index(self):
+        self.index = job.ScheduleIndex(datetime.timedelta(hours=2))
+        self.interval = datetime.timedelta(minutes=30)
+        self.scheduled_run = mock.Mock(
+            run_time=self.now + datetime.timedelta(minutes=10))
+        self.job = mock.Mock(enabled=True,
+            scheduler=scheduler.IntervalScheduler(self.interval, None))
+        self.job.get_name.return_value = 'a_job'
+        self.job.runs.get_scheduled.return_value = [self.scheduled_run]
+
+    def run_times(self, *minutes):
+        return [self.now + datetime.timedelta(minutes=m) for m in minutes]
+
+    def test_get_runs(self):
+        runs = self.index.get_runs([self.job])
+        expected = self.run_times(10, 40, 70, 100)
+        assert_equal(runs, [(run_time, self.job) for run_time in expected])
+
+    def test_get_runs_time_range(self):
+        start, end = self.run_times(30, 80)
+        runs = self.index.get_runs([self.job], start, end)
+        assert_equal([run_time for run_time, _ in runs],
+            self.run_times(40, 70))
+
+    def test_get_runs_disabled(self):
+        self.job.enabled = False
+        assert_equal(self.index.get_runs([self.job]), [])
+
+    def test_get_run_times_cached(self):
+        run_times = self.index.get_run_times(self.job, self.now)
+        assert self.index.get_run_times(self.job, self.now) is run_times
+
+    def test_get_run_times_scheduled_run_changed(self):
+        self.index.get_run_times(self.job, self.now)
+        self.scheduled_run.run_time = self.now + datetime.timedelta(minutes=20)
+        assert_equal(self.index.get_run_times(self.job, self.now),
+            self.run_times(20, 50, 80, 110))
+
+    def test_get_run_times_past_window(self):
+        self.index.get_run_times(self.job, self.now)
+        later = self.now + datetime.timedelta(hours=1)
+        assert_equal(self.index.get_run_times(self.job, later),
+            self.run_times(10, 40, 70, 100, 130, 160))
+
 
 if __name__ == '__main__':
     run()
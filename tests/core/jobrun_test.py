@@ -5,7 +5,7 @@ from testify import TestCase, setup, assert_equal
 from testify.assertions import assert_in
 from tests.assertions import assert_length, assert_raises, assert_call
 from tron import node, event, actioncommand
-from tron.core import jobrun, actionrun, actiongraph, job
+from tron.core import jobrun, actionrun, actiongraph, job, action
 from tests.testingutils import Turtle, autospec_method
 from tron.serialize import filehandler
 
@@ -324,6 +324,53 @@ class JobRunFromStateTestCase(TestCase):
         assert run.context.next
         assert run.action_graph
 
+    def test_from_state_compact(self):
+        self.state_data.update(
+            state_format=jobrun.COMPACT_STATE_FORMAT,
+            strings=['doit'],
+            runs=[{'a': 'blingaction', 's': 4, 'c': 0}],
+            cleanup_run={'a': 'cleanup', 's': 5, 'c': 0})
+        run = jobrun.JobRun.from_state(self.state_data, self.action_graph,
+            self.output_path, self.context, self.node_pool)
+        action_run = run.action_runs['blingaction']
+        assert_equal(action_run.id, 'thejobname.22.blingaction')
+        assert_equal(action_run.bare_command, 'doit')
+        assert action_run.is_succeeded
+        assert run.action_runs.cleanup_action_run.is_failed
+
+    @mock.patch('tron.core.actionrun.filehandler', autospec=True)
+    @mock.patch('tron.core.actionrun.dispatch.Dispatcher', autospec=True)
+    def test_from_state_requeues_dispatch_waiting(self, mock_dispatcher, _):
+        dispatcher = mock_dispatcher.get_instance.return_value
+        self.state_data.update(
+            state_format=jobrun.COMPACT_STATE_FORMAT,
+            strings=['doit'],
+            runs=[
+                {'a': 'blingaction', 's': 2, 'c': 0, 'w': True},
+                {'a': 'sentaction', 's': 2, 'c': 0}])
+        run = jobrun.JobRun.from_state(self.state_data, self.action_graph,
+            self.output_path, self.context, self.node_pool)
+        waiting_run = run.action_runs['blingaction']
+        assert waiting_run.is_starting
+        assert run.action_runs['sentaction'].is_failed
+        dispatcher.submit.assert_called_once_with(
+            waiting_run, waiting_run.action_command)
+
+    def test_expand_state_data(self):
+        self.state_data.update(
+            state_format=jobrun.COMPACT_STATE_FORMAT,
+            strings=['doit'],
+            runs=[{'a': 'blingaction', 's': 4, 'c': 0}])
+        state_data = jobrun.expand_state_data(self.state_data)
+        assert 'strings' not in state_data
+        action_state = state_data['runs'][0]
+        assert_equal(action_state['job_run_id'], 'thejobname.22')
+        assert_equal(action_state['command'], 'doit')
+        assert_equal(action_state['state'], 'succeeded')
+
+    def test_expand_state_data_original_format(self):
+        assert_equal(jobrun.expand_state_data(self.state_data), self.state_data)
+
     def test_from_state_node_no_longer_exists(self):
         run = jobrun.JobRun.from_state(self.state_data, self.action_graph,
             self.output_path, self.context, self.node_pool)
@@ -337,6 +384,8 @@ class MockJobRun(Turtle):
 
     manual = False
 
+    frozen = False
+
     node = 'anode'
 
     @property
@@ -374,7 +423,7 @@ class JobRunCollectionTestCase(TestCase):
             self._mock_run(state=actionrun.ActionRun.STATE_SUCCEEDED, run_num=i)
             for i in xrange(2,0,-1)
         ]
-        self.run_collection.runs.extend(self.job_runs)
+        self.run_collection.extend(self.job_runs)
         self.mock_node = mock.create_autospec(node.Node)
 
     def test__init__(self):
@@ -382,8 +431,10 @@ class JobRunCollectionTestCase(TestCase):
 
     def test_from_config(self):
         job_config = mock.Mock(run_limit=20)
-        runs = jobrun.JobRunCollection.from_config(job_config)
+        run_archive = mock.Mock()
+        runs = jobrun.JobRunCollection.from_config(job_config, run_archive)
         assert_equal(runs.run_limit, 20)
+        assert_equal(runs.archive, run_archive)
 
     def test_restore_state(self):
         run_collection = jobrun.JobRunCollection(20)
@@ -408,6 +459,8 @@ class JobRunCollectionTestCase(TestCase):
         assert_equal(run_collection.runs[0].run_num, 3)
         assert_equal(run_collection.runs[3].run_num, 0)
         assert_length(restored_runs, 4)
+        changed_runs, _ = run_collection.pop_changes()
+        assert_equal(changed_runs, restored_runs)
 
     def test_restore_state_with_runs(self):
         assert_raises(ValueError,
@@ -423,6 +476,7 @@ class JobRunCollectionTestCase(TestCase):
         self.run_collection.remove_old_runs.assert_called_with()
         assert_equal(job_run.run_num, 5)
         assert_equal(job_run.job_name, mock_job.get_name.return_value)
+        assert_equal(self.run_collection.pop_changes(), ([job_run], []))
 
     def test_build_new_run_manual(self):
         autospec_method(self.run_collection.remove_old_runs)
@@ -452,6 +506,8 @@ class JobRunCollectionTestCase(TestCase):
         assert_length(self.run_collection.runs, 3)
         assert_equal(self.run_collection.runs[0], self.job_runs[1])
         assert_call(self.job_runs[0].cleanup, 0)
+        _, removed_run_ids = self.run_collection.pop_changes()
+        assert_equal(removed_run_ids, [self.job_runs[0].id])
 
     def test_get_run_by_state(self):
         state = actionrun.ActionRun.STATE_SUCCEEDED
@@ -515,7 +571,7 @@ class JobRunCollectionTestCase(TestCase):
         scheduled_run = self._mock_run(
                 run_num=run_num,
                 state=actionrun.ActionRun.STATE_SCHEDULED)
-        self.run_collection.runs.appendleft(scheduled_run)
+        self.run_collection.appendleft(scheduled_run)
         pending = list(self.run_collection.get_pending())
         assert_length(pending, 2)
         assert_equal(pending, [scheduled_run, self.job_runs[0]])
@@ -524,7 +580,7 @@ class JobRunCollectionTestCase(TestCase):
         starting_run = self._mock_run(
             run_num=self.run_collection.next_run_num(),
             state=actionrun.ActionRun.STATE_STARTING)
-        self.run_collection.runs.appendleft(starting_run)
+        self.run_collection.appendleft(starting_run)
         active = list(self.run_collection.get_active())
         assert_length(active, 2)
         assert_equal(active, [starting_run, self.job_runs[1]])
@@ -534,7 +590,7 @@ class JobRunCollectionTestCase(TestCase):
             run_num=self.run_collection.next_run_num(),
             state=actionrun.ActionRun.STATE_STARTING)
         starting_run.node = 'differentnode'
-        self.run_collection.runs.appendleft(starting_run)
+        self.run_collection.appendleft(starting_run)
         active = list(self.run_collection.get_active('anode'))
         assert_length(active, 1)
         assert_equal(active, [self.job_runs[1]])
@@ -547,13 +603,14 @@ class JobRunCollectionTestCase(TestCase):
         run_num = self.run_collection.next_run_num()
         second_queued = self._mock_run(
             run_num=run_num, state=actionrun.ActionRun.STATE_QUEUED)
-        self.run_collection.runs.appendleft(second_queued)
+        self.run_collection.appendleft(second_queued)
 
         first_queued = self.run_collection.get_first_queued()
         assert_equal(first_queued, self.job_runs[0])
 
     def test_get_first_queued_no_match(self):
         self.job_runs[0].state = actionrun.ActionRun.STATE_CANCELLED
+        self.run_collection.handler(self.job_runs[0], None)
         first_queued = self.run_collection.get_first_queued()
         assert not first_queued
 
@@ -567,7 +624,7 @@ class JobRunCollectionTestCase(TestCase):
             run_num=self.run_collection.next_run_num(),
             state=actionrun.ActionRun.STATE_SCHEDULED,
             node="nine")
-        self.run_collection.runs.appendleft(scheduled_run)
+        self.run_collection.appendleft(scheduled_run)
 
         next_run = self.run_collection.get_next_to_finish(node="seven")
         assert_equal(next_run, self.job_runs[1])
@@ -587,6 +644,26 @@ class JobRunCollectionTestCase(TestCase):
         run_collection = jobrun.JobRunCollection(5)
         assert_equal(run_collection.next_run_num(), 0)
 
+    def test_get_next_run_num_after_remove(self):
+        self.run_collection.remove_pending()
+        assert_equal(self.run_collection.next_run_num(), 5)
+
+    def test_handler_updates_index(self):
+        job_run = self.job_runs[1]
+        job_run.state = actionrun.ActionRun.STATE_SUCCEEDED
+        self.run_collection.handler(job_run, jobrun.JobRun.NOTIFY_STATE_CHANGED)
+        assert_equal(self.run_collection.last_success, job_run)
+        assert_equal(self.run_collection.get_active(), [])
+        state = actionrun.ActionRun.STATE_RUNNING
+        assert_equal(self.run_collection.get_run_by_state(state), None)
+
+    def test_remove_old_runs_updates_index(self):
+        self.run_collection.run_limit = 2
+        self.run_collection.remove_old_runs()
+        assert_equal(self.run_collection.get_run_by_num(1), None)
+        assert_equal(self.run_collection.last_success, None)
+        assert_equal(self.run_collection.runs_by_num.keys(), [3, 4])
+
     def test_remove_old_runs(self):
         self.run_collection.run_limit = 1
         self.run_collection.remove_old_runs()
@@ -595,6 +672,28 @@ class JobRunCollectionTestCase(TestCase):
         assert_call(self.job_runs[-1].cleanup, 0)
         for job_run in self.run_collection.runs:
             assert_length(job_run.cancel.calls, 0)
+        _, removed_run_ids = self.run_collection.pop_changes()
+        assert_length(removed_run_ids, 3)
+
+    def test_remove_old_runs_archived(self):
+        self.run_collection.archive = mock.Mock()
+        self.job_runs[0].action_runs = mock.Mock(is_done=False)
+        for job_run in self.job_runs[1:]:
+            job_run.action_runs = mock.Mock(is_done=True)
+        self.run_collection.run_limit = 0
+        self.run_collection.remove_old_runs()
+
+        expected = [mock.call(job_run) for job_run in self.job_runs[:0:-1]]
+        assert_equal(self.run_collection.archive.add.mock_calls, expected)
+        assert_length(self.run_collection.runs, 0)
+
+    def test_remove_old_runs_archive_failure(self):
+        self.run_collection.archive = mock.Mock()
+        self.run_collection.archive.add.side_effect = ValueError
+        self.run_collection.run_limit = 3
+        self.run_collection.remove_old_runs()
+        assert_call(self.job_runs[-1].cleanup, 0)
+        assert_length(self.run_collection.runs, 3)
 
     def test_remove_old_runs_none(self):
         self.run_collection.remove_old_runs()
@@ -608,6 +707,18 @@ class JobRunCollectionTestCase(TestCase):
     def test_state_data(self):
         assert_length(self.run_collection.state_data, len(self.job_runs))
 
+    def test_run_nums(self):
+        assert_equal(self.run_collection.run_nums, [4, 3, 2, 1])
+
+    def test_pop_changes(self):
+        self.run_collection.mark_changed(self.job_runs[2])
+        self.run_collection.mark_changed(self.job_runs[0])
+        self.run_collection.remove_pending()
+        changed_runs, removed_run_ids = self.run_collection.pop_changes()
+        assert_equal(changed_runs, [self.job_runs[2]])
+        assert_equal(removed_run_ids, [self.job_runs[0].id])
+        assert_equal(self.run_collection.pop_changes(), ([], []))
+
     def test_last_success(self):
         assert_equal(self.run_collection.last_success, self.job_runs[2])
 
@@ -623,3 +734,139 @@ class JobRunCollectionTestCase(TestCase):
         assert_equal(runs, expected)
         for job_run in job_runs:
             job_run.get_action_run.assert_called_with(action_name)
+
+
+def build_finished_job_run(run_num=3, state=actionrun.ActionRun.STATE_SUCCEEDED):
+    actions = [action.Action(name, 'do %s' % name, None)
+               for name in ['first', 'second']]
+    graph = actiongraph.ActionGraph(actions, dict((a.name, a) for a in actions))
+    mock_node = mock.create_autospec(node.Node)
+    mock_node.get_name.return_value = 'anode'
+    job_run = jobrun.JobRun('MASTER.job', run_num,
+        datetime.datetime(2012, 3, 14, 15, 9, 26), mock_node,
+        action_graph=graph)
+    job_run.action_runs = actionrun.ActionRunFactory.build_action_run_collection(
+        job_run, None)
+    for action_run in job_run.action_runs:
+        action_run.machine.state = state
+        action_run.start_time = datetime.datetime(2012, 3, 14, 15, 10)
+        action_run.end_time = datetime.datetime(2012, 3, 14, 15, 11)
+        job_run.action_runs.handler(action_run, None)
+    return job_run
+
+
+class CompletedJobRunTestCase(TestCase):
+
+    @setup
+    def setup_job_run(self):
+        self.job_run = build_finished_job_run()
+        self.completed_run = jobrun.CompletedJobRun.from_job_run(self.job_run)
+
+    def test_from_job_run(self):
+        assert self.completed_run.frozen
+        assert_equal(self.completed_run.id, self.job_run.id)
+        assert_equal(self.completed_run.node, self.job_run.node)
+        assert_equal(self.completed_run.state,
+            actionrun.ActionRun.STATE_SUCCEEDED)
+        assert_equal(self.completed_run.start_time, self.job_run.start_time)
+        assert_equal(self.completed_run.end_time, self.job_run.end_time)
+        assert not self.completed_run.is_running
+        assert not self.completed_run.is_scheduled
+
+    def test_action_runs(self):
+        action_runs = self.completed_run.action_runs
+        assert_equal(sorted(action_runs.names), ['first', 'second'])
+        assert 'first' in action_runs
+        assert_equal(action_runs['first'].id, 'MASTER.job.3.first')
+        assert_equal(self.completed_run.get_action_run('second'),
+            action_runs['second'])
+        assert_raises(KeyError, lambda: action_runs['third'])
+
+    def test_state_data(self):
+        assert_equal(self.completed_run.state_data, self.job_run.state_data)
+
+    def test_cleanup(self):
+        self.completed_run.output_path = mock.create_autospec(
+            filehandler.OutputPath)
+        self.completed_run.cleanup()
+        self.completed_run.output_path.delete.assert_called_with()
+
+
+class JobRunCollectionFreezeTestCase(TestCase):
+
+    @setup
+    def setup_collection(self):
+        self.run_collection = jobrun.JobRunCollection(5)
+        self.job_run = build_finished_job_run(run_num=3)
+        self.newer_run = build_finished_job_run(run_num=4)
+        self.run_collection.extend([self.newer_run, self.job_run])
+        self.run_collection.mark_changed(self.job_run)
+
+    def test_freeze(self):
+        completed_run = self.run_collection.freeze(self.job_run)
+        assert_equal(list(self.run_collection), [self.newer_run, completed_run])
+        assert_equal(self.run_collection.get_run_by_num(3), completed_run)
+        state = actionrun.ActionRun.STATE_SUCCEEDED
+        assert_equal(self.run_collection.runs_by_state[state],
+            set([self.newer_run, completed_run]))
+        assert_equal(self.run_collection.pop_changes(), ([completed_run], []))
+        assert_equal(self.job_run._observers[True], [])
+
+    def test_freeze_unfinished(self):
+        action_run = self.job_run.action_runs['first']
+        action_run.machine.state = actionrun.ActionRun.STATE_SCHEDULED
+        self.job_run.action_runs.handler(action_run, None)
+        assert_equal(self.run_collection.freeze(self.job_run), None)
+        assert_equal(self.run_collection.get_run_by_num(3), self.job_run)
+
+    def test_freeze_failed_with_blocked_action(self):
+        first = action.Action('first', 'do first', None)
+        second = action.Action('second', 'do second', None,
+            required_actions=[first])
+        cleanup = action.Action(action.CLEANUP_ACTION_NAME, 'clean', None)
+        action_map = dict((a.name, a) for a in [first, second, cleanup])
+        graph = actiongraph.ActionGraph([first], action_map)
+        job_run = jobrun.JobRun('MASTER.job', 5,
+            datetime.datetime(2012, 3, 14, 15, 9, 26),
+            mock.create_autospec(node.Node), action_graph=graph)
+        job_run.action_runs = (
+            actionrun.ActionRunFactory.build_action_run_collection(
+                job_run, None))
+        self.run_collection.extend([job_run])
+        states = [
+            ('first',                       actionrun.ActionRun.STATE_FAILED),
+            ('second',                      actionrun.ActionRun.STATE_QUEUED),
+            (action.CLEANUP_ACTION_NAME,    actionrun.ActionRun.STATE_QUEUED),
+        ]
+        for name, state in states:
+            action_run = job_run.action_runs[name]
+            action_run.machine.state = state
+            job_run.action_runs.handler(action_run, None)
+        assert_equal(self.run_collection.freeze(job_run), None)
+
+        cleanup_run = job_run.action_runs.cleanup_action_run
+        cleanup_run.machine.state = actionrun.ActionRun.STATE_SUCCEEDED
+        job_run.action_runs.handler(cleanup_run, None)
+        completed_run = self.run_collection.freeze(job_run)
+        assert_equal(self.run_collection.get_run_by_num(5), completed_run)
+        assert_equal(completed_run.state, actionrun.ActionRun.STATE_FAILED)
+        assert_equal(completed_run.action_runs['second'].state,
+            actionrun.ActionRun.STATE_QUEUED)
+
+    def test_freeze_removed_run(self):
+        self.run_collection.run_limit = 1
+        self.run_collection.remove_old_runs()
+        assert_equal(self.run_collection.freeze(self.job_run), None)
+        assert_equal(list(self.run_collection), [self.newer_run])
+
+    def test_thaw(self):
+        completed_run = self.run_collection.freeze(self.job_run)
+        output_path = filehandler.OutputPath('base')
+        job_run = self.run_collection.thaw(completed_run,
+            self.job_run.action_graph, output_path, None)
+        assert not job_run.frozen
+        assert_equal(list(self.run_collection), [self.newer_run, job_run])
+        assert_equal(self.run_collection.get_run_by_num(3), job_run)
+        assert_equal(job_run.state_data, completed_run.state_data)
+        assert_equal(job_run.node, completed_run.node)
+        assert_equal(job_run._observers[True], [self.run_collection])
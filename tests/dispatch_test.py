@@ -0,0 +1,206 @@
+import mock
+from testify import TestCase, assert_equal, run, setup_teardown
+from twisted.internet import defer, task
+
+from tron import dispatch, eventloop
+from tron.config import config_parse, schema
+from tron.utils.dicts import FrozenDict
+
+
+def build_action_run(job_name, node_name, run_num=1, action_name='act'):
+    action_run = mock.Mock(job_run_id='%s.%s' % (job_name, run_num))
+    action_run.id = '%s.%s' % (action_run.job_run_id, action_name)
+    action_run.node.get_name.return_value = node_name
+    action_run.deferred = defer.Deferred()
+    action_run.submit_command.return_value = action_run.deferred
+    return action_run
+
+
+def build_job_config(namespace='MASTER', priority=0):
+    return mock.Mock(namespace=namespace, priority=priority)
+
+
+class DispatcherTestCase(TestCase):
+
+    @setup_teardown
+    def setup_dispatcher(self):
+        dispatch.Dispatcher._instance = None
+        self.clock = task.Clock()
+        eventloop.set_clock(self.clock)
+        self.dispatcher = dispatch.Dispatcher.get_instance()
+        self.dispatch_config = config_parse.DEFAULT_DISPATCH
+        self.node_pools = {
+            'pool': schema.ConfigNodePool(nodes=('node0', 'node1'),
+                name='pool'),
+        }
+        self.jobs = {
+            'MASTER.low':   build_job_config(),
+            'MASTER.high':  build_job_config(priority=5),
+            'other.job':    build_job_config(namespace='other'),
+        }
+        yield
+        eventloop.set_clock(None)
+        dispatch.Dispatcher._instance = None
+
+    def configure(self, **limits):
+        config = self.dispatch_config._replace(**limits)
+        dispatch.Dispatcher.update_from_config(
+            config, self.node_pools, self.jobs)
+
+    def submit(self, job_name, node_name='node0', run_num=1):
+        action_run = build_action_run(job_name, node_name, run_num)
+        assert self.dispatcher.submit(action_run, mock.Mock())
+        return action_run
+
+    def finish(self, action_run):
+        action_run.deferred.callback(0)
+
+    def test_single_instance(self):
+        assert_equal(self.dispatcher, dispatch.Dispatcher.get_instance())
+
+    def test_submit_without_limits(self):
+        action_runs = [self.submit('MASTER.low', run_num=i) for i in range(5)]
+        for action_run in action_runs:
+            assert_equal(len(action_run.submit_command.mock_calls), 1)
+        assert_equal(self.dispatcher.total_running, 5)
+
+    def test_submit_failed(self):
+        action_run = build_action_run('MASTER.low', 'node0')
+        action_run.submit_command.return_value = None
+        assert not self.dispatcher.submit(action_run, mock.Mock())
+        assert_equal(self.dispatcher.total_running, 0)
+        assert_equal(self.dispatcher.running, {})
+
+    def test_node_limit(self):
+        self.configure(max_per_node=1)
+        first = self.submit('MASTER.low', run_num=1)
+        second = self.submit('MASTER.low', run_num=2)
+        other_node = self.submit('MASTER.low', node_name='node2', run_num=3)
+        assert not second.submit_command.mock_calls
+        assert_equal(len(other_node.submit_command.mock_calls), 1)
+
+        self.clock.advance(10)
+        self.finish(first)
+        assert_equal(len(second.submit_command.mock_calls), 1)
+        stats = self.dispatcher.get_stats()
+        assert_equal(stats['waited'], 1)
+        assert_equal(stats['max_wait_seconds'], 10)
+        assert_equal(stats['max_waiting'], 1)
+
+    def test_node_limit_override(self):
+        self.configure(max_per_node=1, nodes=FrozenDict(node0=2))
+        self.submit('MASTER.low', run_num=1)
+        second = self.submit('MASTER.low', run_num=2)
+        assert_equal(len(second.submit_command.mock_calls), 1)
+
+    def test_node_pool_limit(self):
+        self.configure(node_pools=FrozenDict(pool=1))
+        self.submit('MASTER.low', node_name='node0', run_num=1)
+        second = self.submit('MASTER.low', node_name='node1', run_num=2)
+        outside = self.submit('MASTER.low', node_name='node2', run_num=3)
+        assert not second.submit_command.mock_calls
+        assert_equal(len(outside.submit_command.mock_calls), 1)
+
+    def test_namespace_limit(self):
+        self.configure(namespaces=FrozenDict(MASTER=1))
+        self.submit('MASTER.low', run_num=1)
+        second = self.submit('MASTER.high', run_num=2)
+        other = self.submit('other.job', run_num=3)
+        assert not second.submit_command.mock_calls
+        assert_equal(len(other.submit_command.mock_calls), 1)
+
+    def test_max_concurrent(self):
+        self.configure(max_concurrent=2)
+        self.submit('MASTER.low', node_name='node0', run_num=1)
+        self.submit('other.job', node_name='node1', run_num=2)
+        third = self.submit('MASTER.high', node_name='node2', run_num=3)
+        assert not third.submit_command.mock_calls
+        assert_equal(self.dispatcher.get_stats()['queue'][0]['id'], third.id)
+
+    def test_priority_then_fifo(self):
+        self.configure(max_per_node=1)
+        running = self.submit('MASTER.low', run_num=1)
+        low = self.submit('MASTER.low', run_num=2)
+        high = self.submit('MASTER.high', run_num=3)
+        later_high = self.submit('MASTER.high', run_num=4)
+        ids = [item['id'] for item in self.dispatcher.get_stats()['queue']]
+        assert_equal(ids, [high.id, later_high.id, low.id])
+
+        self.finish(running)
+        assert_equal(len(high.submit_command.mock_calls), 1)
+        assert not later_high.submit_command.mock_calls
+        assert not low.submit_command.mock_calls
+
+    def test_dispatch_skips_blocked(self):
+        self.configure(max_per_node=1)
+        running = self.submit('MASTER.low', node_name='node0', run_num=1)
+        self.submit('MASTER.low', node_name='node1', run_num=2)
+        blocked = self.submit('MASTER.low', node_name='node1', run_num=3)
+        waiting = self.submit('MASTER.low', node_name='node0', run_num=4)
+        self.finish(running)
+        assert not blocked.submit_command.mock_calls
+        assert_equal(len(waiting.submit_command.mock_calls), 1)
+        assert_equal(len(self.dispatcher.waiting), 1)
+
+    def test_failed_command_releases(self):
+        self.configure(max_per_node=1)
+        first = self.submit('MASTER.low', run_num=1)
+        second = self.submit('MASTER.low', run_num=2)
+        first.deferred.addErrback(lambda _: None)
+        first.deferred.errback(Exception())
+        assert_equal(len(second.submit_command.mock_calls), 1)
+        assert_equal(self.dispatcher.total_running, 1)
+
+    def test_cancel(self):
+        self.configure(max_per_node=1)
+        running = self.submit('MASTER.low', run_num=1)
+        waiting = self.submit('MASTER.low', run_num=2)
+        assert self.dispatcher.cancel(waiting)
+        assert not self.dispatcher.cancel(waiting)
+        assert not self.dispatcher.cancel(running)
+        self.finish(running)
+        assert not waiting.submit_command.mock_calls
+
+    def test_update_from_config_starts_waiting(self):
+        self.configure(max_per_node=1)
+        self.submit('MASTER.low', run_num=1)
+        waiting = self.submit('MASTER.low', run_num=2)
+        self.configure(max_per_node=2)
+        assert_equal(len(waiting.submit_command.mock_calls), 1)
+
+    def test_get_keys(self):
+        self.configure()
+        action_run = build_action_run('other.job', 'node1')
+        assert_equal(self.dispatcher.get_keys(action_run), [
+            (dispatch.NODES, 'node1'),
+            (dispatch.NODE_POOLS, 'pool'),
+            (dispatch.NAMESPACES, 'other')])
+
+    def test_get_stats(self):
+        self.configure(max_concurrent=1)
+        self.submit('MASTER.low', run_num=1)
+        self.submit('MASTER.low', run_num=2)
+        self.clock.advance(3)
+        stats = self.dispatcher.get_stats()
+        assert_equal(stats['running'], 1)
+        assert_equal(stats['running_by'][dispatch.NODES], {'node0': 1})
+        assert_equal(stats['running_by'][dispatch.NAMESPACES], {'MASTER': 1})
+        assert_equal(stats['queue'], [{
+            'id': 'MASTER.low.2.act',
+            'node': 'node0',
+            'priority': 0,
+            'wait_seconds': 3,
+        }])
+
+    def test_clear(self):
+        self.configure(max_concurrent=1)
+        self.submit('MASTER.low', run_num=1)
+        self.submit('MASTER.low', run_num=2)
+        self.dispatcher.clear()
+        assert_equal(self.dispatcher.waiting, [])
+        assert_equal(self.dispatcher.total_running, 0)
+        assert_equal(self.dispatcher.stats['dispatched'], 0)
+
+
+if __name__ == '__main__':
+    run()
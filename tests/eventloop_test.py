@@ -1,8 +1,10 @@
 import mock
 from testify import TestCase
-from testify import setup
+from testify import setup, setup_teardown
 from testify.assertions import assert_equal
+from twisted.internet import error, task
 
+from tests.assertions import assert_raises
 from tron import eventloop
 
 
@@ -37,4 +39,146 @@ class UniqueCallTestCase(TestCase):
         self.callback.delayed_call.active.return_value = True
         with mock.patch('tron.eventloop.call_later', autospec=True) as mock_call_later:
             self.callback.start()
-            assert not mock_call_later.call_count
\ No newline at end of file
+            assert not mock_call_later.call_count
+
+    def test_start_with_delay(self):
+        self.callback.delayed_call.active.return_value = False
+        with mock.patch('tron.eventloop.call_later', autospec=True) as mock_call_later:
+            self.callback.start(2)
+            mock_call_later.assert_called_with(2, self.callback.func)
+
+    @mock.patch('tron.eventloop.reactor', autospec=True)
+    def test_start_active_sooner(self, mock_reactor):
+        mock_reactor.seconds.return_value = 100
+        self.callback.delayed_call.active.return_value = True
+        self.callback.delayed_call.getTime.return_value = 105
+        self.callback.start(2)
+        self.callback.delayed_call.reset.assert_called_with(2)
+
+    @mock.patch('tron.eventloop.reactor', autospec=True)
+    def test_start_active_later(self, mock_reactor):
+        mock_reactor.seconds.return_value = 100
+        self.callback.delayed_call.active.return_value = True
+        self.callback.delayed_call.getTime.return_value = 101
+        self.callback.start(2)
+        assert not self.callback.delayed_call.reset.mock_calls
+
+
+class TimerQueueTestCase(TestCase):
+
+    @setup
+    def setup_queue(self):
+        self.clock = task.Clock()
+        self.queue = eventloop.TimerQueue(self.clock)
+        self.calls = []
+
+    def call(self, name):
+        self.calls.append((name, self.clock.seconds()))
+
+    def test_call_later(self):
+        self.queue.call_later(5, self.call, 'b')
+        self.queue.call_later(2, self.call, 'a')
+        assert_equal(len(self.clock.getDelayedCalls()), 1)
+        self.clock.advance(10)
+        assert_equal(self.calls, [('a', 10), ('b', 10)])
+        assert_equal(len(self.queue), 0)
+        assert not self.clock.getDelayedCalls()
+
+    def test_single_reactor_call(self):
+        for i in xrange(100):
+            self.queue.call_later(i + 1, self.call, i)
+        assert_equal(len(self.clock.getDelayedCalls()), 1)
+        self.clock.pump([1] * 100)
+        assert_equal([name for name, _ in self.calls], range(100))
+
+    def test_cancel(self):
+        timer = self.queue.call_later(2, self.call, 'a')
+        self.queue.call_later(3, self.call, 'b')
+        timer.cancel()
+        assert not timer.active()
+        self.clock.advance(3)
+        assert_equal(self.calls, [('b', 3)])
+        assert_raises(error.AlreadyCancelled, timer.cancel)
+
+    def test_cancel_last_timer(self):
+        timer = self.queue.call_later(2, self.call, 'a')
+        timer.cancel()
+        assert not self.clock.getDelayedCalls()
+        assert_equal(len(self.queue), 0)
+
+    def test_cancel_compacts_heap(self):
+        timers = [self.queue.call_later(i + 1, self.call, i)
+                  for i in xrange(10)]
+        for timer in timers[:6]:
+            timer.cancel()
+        assert_equal(len(self.queue.heap), 4)
+        assert_equal(len(self.queue), 4)
+
+    def test_reset(self):
+        timer = self.queue.call_later(5, self.call, 'a')
+        timer.reset(1)
+        assert_equal(timer.getTime(), 1)
+        self.clock.advance(1)
+        assert_equal(self.calls, [('a', 1)])
+        self.clock.advance(5)
+        assert_equal(len(self.calls), 1)
+        assert_raises(error.AlreadyCalled, timer.reset, 1)
+
+    def test_call_later_zero_from_timer(self):
+        def call_again():
+            self.queue.call_later(0, self.call, 'second')
+            self.call('first')
+            # Run by a new reactor call, not the one which is running
+            assert_equal(len(self.clock.getDelayedCalls()), 1)
+        self.queue.call_later(1, call_again)
+        self.clock.advance(1)
+        assert_equal(self.calls, [('first', 1), ('second', 1)])
+
+    def test_failure(self):
+        self.queue.call_later(1, mock.Mock(side_effect=ValueError))
+        self.queue.call_later(1, self.call, 'a')
+        self.clock.advance(1)
+        assert_equal(self.calls, [('a', 1)])
+        assert_equal(self.queue.stats['failures'], 1)
+
+    def test_get_stats(self):
+        self.queue.call_later(1, self.call, 'a')
+        self.queue.call_later(2, self.call, 'b')
+        self.queue.call_later(10, self.call, 'c')
+        self.clock.advance(3)
+        stats = self.queue.get_stats()
+        assert_equal(stats['pending'], 1)
+        assert_equal(stats['fired'], 2)
+        assert_equal(stats['max_lag'], 2)
+        assert_equal(stats['mean_lag'], 1.5)
+
+
+class SetClockTestCase(TestCase):
+
+    @setup_teardown
+    def restore_clock(self):
+        self.clock = task.Clock()
+        eventloop.set_clock(self.clock)
+        yield
+        eventloop.set_clock(None)
+
+    def test_set_clock(self):
+        func = mock.Mock()
+        eventloop.call_later(5, func, 'arg')
+        self.clock.advance(4)
+        assert not func.mock_calls
+        self.clock.advance(1)
+        func.assert_called_once_with('arg')
+
+    def test_set_clock_drops_timers(self):
+        func = mock.Mock()
+        eventloop.call_later(5, func)
+        eventloop.set_clock(task.Clock())
+        self.clock.advance(5)
+        assert not func.mock_calls
+        assert not self.clock.getDelayedCalls()
+        assert_equal(len(eventloop.timer_queue), 0)
+
+    def test_set_clock_none(self):
+        eventloop.set_clock(None)
+        assert eventloop.timer_queue.clock is eventloop.reactor
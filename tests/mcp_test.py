@@ -1,3 +1,4 @@
+import os
 import shutil
 import tempfile
 
@@ -50,24 +51,40 @@ class MasterControlProgramTestCase(TestCase):
         for job_sched in self.mcp.get_job_collection():
             assert job_sched.shutdown_requested
 
+    @mock.patch('tron.mcp.dispatch.Dispatcher', autospec=True)
     @mock.patch('tron.mcp.node.NodePoolRepository', autospec=True)
-    def test_apply_config(self, mock_repo):
+    def test_apply_config(self, mock_repo, mock_dispatcher):
         config_container = mock.create_autospec(config_parse.ConfigContainer)
         master_config = config_container.get_master.return_value
         autospec_method(self.mcp.apply_collection_config)
         autospec_method(self.mcp.apply_notification_options)
         autospec_method(self.mcp.build_job_scheduler_factory)
+        autospec_method(self.mcp.update_run_archive)
         self.mcp.apply_config(config_container)
         self.mcp.state_watcher.update_from_config.assert_called_with(
             master_config.state_persistence)
+        self.mcp.update_run_archive.assert_called_with(
+            master_config.state_persistence)
         assert_equal(self.mcp.context.base, master_config.command_context)
         assert_equal(len(self.mcp.apply_collection_config.mock_calls), 2)
         self.mcp.apply_notification_options.assert_called_with(
             master_config.notification_options)
         mock_repo.update_from_config.assert_called_with(master_config.nodes, 
             master_config.node_pools, master_config.ssh_options)
+        mock_dispatcher.update_from_config.assert_called_with(
+            master_config.dispatch, master_config.node_pools,
+            config_container.get_jobs.return_value)
+        assert_equal(self.mcp.jobs.catch_up_config, master_config.catch_up)
         self.mcp.build_job_scheduler_factory(master_config)
 
+    @mock.patch('tron.mcp.node.NodePoolRepository', autospec=True)
+    def test_update_nodes(self, mock_repo):
+        nodes, node_pools, ssh_options = mock.Mock(), mock.Mock(), mock.Mock()
+        self.mcp.update_nodes(nodes, node_pools, ssh_options)
+        mock_repo.update_from_config.assert_called_with(
+            nodes, node_pools, ssh_options)
+        assert 'node_setup' in self.mcp.startup_timer.durations
+
     def test_update_state_watcher_config_changed(self):
         self.mcp.state_watcher.update_from_config.return_value = True
         self.mcp.jobs = mock.create_autospec(job.JobCollection)
@@ -79,11 +96,30 @@ class MasterControlProgramTestCase(TestCase):
         self.mcp.state_watcher.update_from_config.assert_called_with(state_config)
         assert_equal(
             self.mcp.state_watcher.save_job.mock_calls,
-            [mock.call(j.job) for j in self.mcp.jobs])
+            [mock.call(j.get_job(), all_runs=True) for j in self.mcp.jobs])
         assert_equal(
             self.mcp.state_watcher.save_service.mock_calls,
             [mock.call(s) for s in self.mcp.services])
 
+    def test_update_run_archive(self):
+        job_runs = mock.Mock()
+        self.mcp.jobs = mock.create_autospec(job.JobCollection)
+        self.mcp.jobs.get_job_run_collections.return_value = [job_runs]
+        state_config = mock.Mock(run_archive='archive.sqlite')
+        self.mcp.update_run_archive(state_config)
+        run_archive = self.mcp.run_archive
+        assert_equal(run_archive.filename,
+            os.path.join(self.working_dir, 'archive.sqlite'))
+        assert_equal(job_runs.archive, run_archive)
+
+        self.mcp.update_run_archive(state_config)
+        assert_equal(self.mcp.run_archive, run_archive)
+
+    def test_update_run_archive_disabled(self):
+        self.mcp.update_run_archive(mock.Mock(run_archive='archive.sqlite'))
+        self.mcp.update_run_archive(mock.Mock(run_archive=None))
+        assert_equal(self.mcp.run_archive, None)
+
     def test_update_state_watcher_config_no_change(self):
         self.mcp.state_watcher.update_from_config.return_value = False
         self.mcp.jobs = {'a': mock.Mock(), 'b': mock.Mock()}
@@ -115,8 +151,23 @@ class MasterControlProgramRestoreStateTestCase(TestCase):
         job_state_data = {'1': 'things', '2': 'things'}
         self.mcp.state_watcher.restore.return_value = job_state_data, service_state_data
         self.mcp.restore_state()
+        self.mcp.state_watcher.restore.assert_called_with(
+            self.mcp.jobs.get_names.return_value,
+            self.mcp.services.get_names.return_value,
+            timer=self.mcp.startup_timer)
         self.mcp.jobs.restore_state.assert_called_with(job_state_data)
         self.mcp.services.restore_state.assert_called_with(service_state_data)
+        assert 'apply' in self.mcp.startup_timer.durations
+
+    def test_initial_setup(self):
+        autospec_method(self.mcp._load_config)
+        autospec_method(self.mcp.restore_state)
+        self.mcp.jobs = mock.Mock()
+        self.mcp.initial_setup()
+        self.mcp._load_config.assert_called_with()
+        self.mcp.restore_state.assert_called_with()
+        self.mcp.jobs.schedule.assert_called_with()
+        assert_equal(self.mcp.startup_timer.durations.keys(), ['first_schedule'])
 
 
 if __name__ == '__main__':
@@ -62,6 +62,18 @@ class NodePoolRepositoryTestCase(TestCase):
         assert_equal(set(self.repo.pools), set(node_names + [node_pool_config['c'].name]))
         assert_equal(set(self.repo.nodes), set(node_names + mock_nodes.keys()))
 
+    def test_update_from_config_node_factory(self):
+        self.repo.node_factory = node_factory = mock.Mock()
+        node_config = {'a': mock.Mock()}
+        ssh_options = mock.Mock(identities=[], known_hosts_file=None)
+        try:
+            node.NodePoolRepository.update_from_config(
+                node_config, {}, ssh_options)
+        finally:
+            self.repo.node_factory = node.Node.from_config
+        node_factory.assert_called_with(
+            node_config['a'], mock.ANY, mock.ANY, ssh_options)
+
     def test_nodes_by_name(self):
         mock_nodes = {'a': mock.Mock(), 'b': mock.Mock()}
         self.repo.nodes.update(mock_nodes)
@@ -89,6 +89,33 @@ class GeneralSchedulerTestCase(testingutils.MockTimeTestCase):
         next_run_time = self.scheduler.next_run_time(None)
         assert_equal(next_run_time, expected)
 
+    def test_get_match_caches_next_matches(self):
+        start = datetime.datetime(2012, 3, 14, 15)
+        first = self.scheduler.get_match(start)
+        assert_equal(len(self.scheduler.next_matches),
+            self.scheduler.cache_size)
+
+        with mock.patch.object(self.scheduler.time_spec, 'get_match',
+                autospec=True) as mock_get_match:
+            assert_equal(self.scheduler.get_match(start), first)
+            second = self.scheduler.get_match(first)
+        assert not mock_get_match.mock_calls
+        assert_equal(second, datetime.datetime(2012, 3, 16, 14, 30))
+
+    def test_get_match_cache_miss(self):
+        self.scheduler.get_match(datetime.datetime(2012, 3, 14, 15))
+        next_run = self.scheduler.get_match(datetime.datetime(2012, 5, 1))
+        assert_equal(next_run, datetime.datetime(2012, 5, 1, 14, 30))
+        assert_equal(len(self.scheduler.next_matches),
+            self.scheduler.cache_size)
+
+    def test_next_run_times(self):
+        start = datetime.datetime(2012, 3, 14, 15)
+        end = datetime.datetime(2012, 3, 16, 14, 30)
+        next_run_times = list(self.scheduler.next_run_times(start, end))
+        assert_equal(next_run_times, [datetime.datetime(2012, 3, 15, 14, 30)])
+        assert_equal(self.scheduler.next_matches, {})
+
     def test__str__(self):
         assert_equal(str(self.scheduler), "daily ")
 
@@ -365,6 +392,12 @@ class IntervalSchedulerTestCase(TestCase):
         run_time = self.scheduler.next_run_time(None)
         assert_equal(self.now + self.interval, run_time)
 
+    def test_next_run_times(self):
+        end = self.now + datetime.timedelta(seconds=21)
+        next_run_times = list(self.scheduler.next_run_times(self.now, end))
+        assert_equal(next_run_times,
+            [self.now + self.interval, self.now + self.interval * 2])
+
     @mock.patch('tron.scheduler.random', autospec=True)
     def test_next_run_time_with_jitter(self, mock_random):
         jitter = datetime.timedelta(seconds=234)
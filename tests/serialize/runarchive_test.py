@@ -0,0 +1,145 @@
+import datetime
+import os
+import shutil
+import tempfile
+
+import mock
+from testify import TestCase, run, setup, teardown, assert_equal
+from tests.assertions import assert_length
+from tron.serialize import runarchive
+
+
+def build_action_run_state(job_run_id, action_name, start_time):
+    return {
+        'job_run_id':       job_run_id,
+        'action_name':      action_name,
+        'state':            'succeeded',
+        'start_time':       start_time,
+        'end_time':         start_time + datetime.timedelta(seconds=30),
+        'command':          'do %s' % action_name,
+        'node_name':        'batch1',
+        'exit_status':      0,
+    }
+
+
+def build_job_run(run_num, cleanup=False):
+    run_time = datetime.datetime(2013, 4, 1, 10, 30) + datetime.timedelta(
+        days=run_num)
+    job_run_id = 'MASTER.job.%s' % run_num
+    state_data = {
+        'job_name':     'MASTER.job',
+        'run_num':      run_num,
+        'run_time':     run_time,
+        'node_name':    'batch1',
+        'runs':         [build_action_run_state(job_run_id, 'one', run_time)],
+        'cleanup_run':  None,
+        'manual':       False,
+    }
+    if cleanup:
+        state_data['cleanup_run'] = build_action_run_state(
+            job_run_id, 'cleanup', run_time)
+
+    return mock.Mock(
+        job_name='MASTER.job',
+        run_num=run_num,
+        run_time=run_time,
+        start_time=run_time,
+        end_time=run_time + datetime.timedelta(seconds=30),
+        state='succeeded',
+        state_data=state_data)
+
+
+class RunArchiveTestCase(TestCase):
+
+    @setup
+    def setup_archive(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'archive.sqlite')
+        self.archive = runarchive.RunArchive(self.filename)
+        self.job_runs = [build_job_run(run_num) for run_num in xrange(5)]
+        for job_run in self.job_runs:
+            self.archive.add(job_run)
+        self.archive.flush()
+
+    @teardown
+    def teardown_archive(self):
+        self.archive.cleanup()
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_runs(self):
+        runs = self.archive.get_runs('MASTER.job', 2)
+        assert_equal([run.run_num for run in runs], [4, 3])
+        job_run = runs[0]
+        assert_equal(job_run.id, 'MASTER.job.4')
+        assert_equal(job_run.state, 'succeeded')
+        assert_equal(job_run.run_time, self.job_runs[4].run_time)
+        assert_equal(job_run.start_time, self.job_runs[4].start_time)
+        assert_equal(job_run.end_time, self.job_runs[4].end_time)
+        assert_equal(job_run.action_runs[0].id, 'MASTER.job.4.one')
+
+    def test_get_runs_before_run_num(self):
+        runs = self.archive.get_runs('MASTER.job', 2, before_run_num=3)
+        assert_equal([run.run_num for run in runs], [2, 1])
+
+    def test_get_runs_before_time(self):
+        before_time = runarchive.to_timestamp(self.job_runs[2].run_time)
+        runs = self.archive.get_runs('MASTER.job', 10, before_time=before_time)
+        assert_equal([run.run_num for run in runs], [1, 0])
+
+    def test_get_runs_other_job(self):
+        assert_equal(self.archive.get_runs('MASTER.other', 10), [])
+
+    def test_add_is_written_by_writer(self):
+        job_run = build_job_run(5)
+        with mock.patch.object(self.archive.writer, 'save') as mock_save:
+            self.archive.add(job_run)
+        (key, row), = mock_save.call_args[0][0]
+        assert_equal(key, ('MASTER.job', 5))
+        assert_equal(row[:2], ('MASTER.job', 5))
+        assert_equal(self.archive.count('MASTER.job'), 5)
+
+    def test_add_replaces(self):
+        self.archive.add(self.job_runs[0])
+        self.archive.flush()
+        assert_equal(self.archive.count('MASTER.job'), 5)
+
+    def test_get_action_runs(self):
+        self.archive.add(build_job_run(5, cleanup=True))
+        self.archive.flush()
+        action_runs = self.archive.get_action_runs('MASTER.job', 'cleanup', 3)
+        assert_length(action_runs, 1)
+        assert_equal(action_runs[0].id, 'MASTER.job.5.cleanup')
+
+    def test_reopen(self):
+        self.archive.add(build_job_run(5))
+        self.archive.cleanup()
+        self.archive = runarchive.RunArchive(self.filename)
+        assert_equal(self.archive.count('MASTER.job'), 6)
+
+
+class RunArchiveStoreTestCase(TestCase):
+
+    @setup
+    def setup_store(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'archive.sqlite')
+        self.archive = runarchive.RunArchive(self.filename)
+        self.store = runarchive.RunArchiveStore(self.filename)
+
+    @teardown
+    def teardown_store(self):
+        self.store.cleanup()
+        self.archive.cleanup()
+        shutil.rmtree(self.tmpdir)
+
+    def test_save_batch(self):
+        rows = [
+            (self.store.build_key('MASTER.job', run_num),
+             ('MASTER.job', run_num, None, None, None, 'succeeded', ''))
+            for run_num in xrange(3)]
+        self.store.save(rows)
+        assert_equal(self.archive.count('MASTER.job'), 3)
+
+
+if __name__ == "__main__":
+    run()
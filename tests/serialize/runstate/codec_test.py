@@ -0,0 +1,146 @@
+import cPickle as pickle
+import datetime
+
+import yaml
+from testify import TestCase, run, setup, assert_equal
+from tests.assertions import assert_raises
+from tron import actioncommand
+from tron.core import action, actiongraph, jobrun
+from tron.core.actionrun import ActionRunFactory
+from tron.serialize.runstate import codec
+from tron.serialize.runstate import metrics
+
+
+class GetCodecTestCase(TestCase):
+
+    def test_get_codec(self):
+        assert isinstance(codec.get_codec('json'), codec.JSONCodec)
+
+    def test_get_codec_wrapped(self):
+        state_codec = codec.get_codec('base64+zlib+pickle')
+        assert_equal(state_codec.name, 'base64+zlib+pickle')
+        assert isinstance(state_codec, codec.Base64Codec)
+        assert isinstance(state_codec.codec, codec.ZlibCodec)
+        assert isinstance(state_codec.codec.codec, codec.PickleCodec)
+
+    def test_get_codec_unknown(self):
+        for name in ['bson', 'zlib+zlib', 'json+zlib', 'gzip+json']:
+            assert_raises(codec.UnknownCodecError, codec.get_codec, name)
+
+    def test_text_codec(self):
+        assert_equal(codec.text_codec(codec.get_codec('json')).name, 'json')
+        assert_equal(codec.text_codec(codec.get_codec('pickle')).name,
+            'base64+pickle')
+
+
+class CodecTestCase(TestCase):
+
+    state_data = {
+        'job_name':     'MASTER.job',
+        'run_num':      3,
+        'run_time':     datetime.datetime(2012, 3, 4, 5, 6, 7, 8),
+        'manual':       False,
+        'cleanup_run':  None,
+        'runs': [{
+            'state':        'succeeded',
+            'end_time':     datetime.datetime(2012, 3, 4, 5, 6, 7),
+        }],
+    }
+
+    def test_round_trip(self):
+        names = ['json', 'pickle', 'yaml', 'zlib+json', 'base64+zlib+pickle',
+                 'zlib+yaml']
+        for name in names:
+            state_codec = codec.get_codec(name)
+            data = state_codec.encode(self.state_data)
+            assert_equal(state_codec.decode(data), self.state_data)
+
+    def test_json_datetime(self):
+        state_codec = codec.JSONCodec()
+        data = state_codec.encode({'a': datetime.datetime(2012, 3, 4)})
+        assert_equal(data,
+            '{"a":{"__datetime__":"2012-03-04T00:00:00.000000"}}')
+
+
+    def test_json_round_trip_types(self):
+        state_codec = codec.JSONCodec()
+        state_data = {1: 'x', 'a': (1, 'b'), (2, 3): [u'\xe9', None]}
+        decoded = state_codec.decode(state_codec.encode(state_data))
+        assert_equal(decoded, state_data)
+        assert_equal(type(decoded[1]), str)
+        assert_equal(type(decoded['a']), tuple)
+
+    def test_json_rejects_unknown_types(self):
+        assert_raises(TypeError, codec.JSONCodec().encode, {'a': set()})
+
+    def test_round_trip_job_run_state_data(self):
+        action_runner = actioncommand.NoActionRunnerFactory
+        first = action.Action('first', 'true', None)
+        second = action.Action('second', 'true', None,
+            required_actions=[first])
+        graph = actiongraph.ActionGraph(
+            [first], {'first': first, 'second': second})
+        job_run = jobrun.JobRun('MASTER.job', 3,
+            datetime.datetime(2012, 3, 4, 5, 6, 7, 8), None,
+            action_graph=graph)
+        job_run.action_runs = ActionRunFactory.build_action_run_collection(
+            job_run, action_runner)
+        job_run.action_runs.run_map['first'].machine.transition('start')
+        state_data = job_run.state_data
+
+        for name in ['json', 'pickle', 'yaml']:
+            state_codec = codec.get_codec(name)
+            data = state_codec.encode(state_data)
+            assert_equal(state_codec.decode(data), state_data)
+
+
+class YamlCodecTestCase(TestCase):
+
+    def test_decode_legacy_python_tags(self):
+        data = yaml.dump({'a': u'x\xe9', 's': 'str', 't': (1, 2)})
+        assert_equal(codec.YamlCodec().decode(data),
+            {'a': u'x\xe9', 's': 'str', 't': (1, 2)})
+
+    def test_decode_unsafe(self):
+        data = "!!python/object/apply:os.system ['true']"
+        assert_raises(yaml.YAMLError, codec.YamlCodec().decode, data)
+
+
+class StateCodecTestCase(TestCase):
+
+    @setup
+    def setup_codec(self):
+        self.legacy_decoder = lambda data: ('legacy', data)
+        self.codec = codec.StateCodec(codec.JSONCodec(), self.legacy_decoder)
+
+    def test_encode(self):
+        assert_equal(self.codec.encode([1]), '#tron-codec:json\n[1]')
+
+    def test_decode(self):
+        assert_equal(self.codec.decode(self.codec.encode({'a': 1})), {'a': 1})
+
+    def test_decode_other_codec(self):
+        other = codec.StateCodec(codec.get_codec('zlib+pickle'), None)
+        assert_equal(self.codec.decode(other.encode({'a': 1})), {'a': 1})
+
+    def test_decode_legacy(self):
+        assert_equal(self.codec.decode('{a: 1}'), ('legacy', '{a: 1}'))
+
+    def test_metrics(self):
+        self.codec.metrics = metrics.PersistenceMetrics()
+        data = self.codec.encode([1])
+        self.codec.decode(data)
+        assert_equal(self.codec.metrics.encoded_bytes, len(data))
+        assert_equal(set(self.codec.metrics.codec_timer.durations),
+            set(['encode', 'decode']))
+
+    def test_pickle_without_metrics(self):
+        self.codec = codec.StateCodec(codec.JSONCodec(), None)
+        self.codec.metrics = metrics.PersistenceMetrics()
+        restored = pickle.loads(pickle.dumps(self.codec))
+        assert_equal(restored.metrics, None)
+        assert_equal(restored.decode(self.codec.encode([1])), [1])
+
+
+if __name__ == "__main__":
+    run()
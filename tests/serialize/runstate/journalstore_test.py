@@ -0,0 +1,212 @@
+import os
+import shutil
+import tempfile
+
+import mock
+from testify import TestCase, run, setup, assert_equal, teardown
+from testify import assert_raises
+from tron.serialize import runstate
+from tron.serialize.runstate import codec
+from tron.serialize.runstate import journalstore
+from tron.serialize.runstate.journalstore import JournalStateStore, JournalKey
+
+
+class ReadRecordsTestCase(TestCase):
+
+    @setup
+    def setup_file(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'records')
+
+    @teardown
+    def teardown_file(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _read(self, data):
+        with open(self.filename, 'wb') as fh:
+            fh.write(data)
+        with open(self.filename, 'rb') as fh:
+            return list(journalstore.read_records(fh))
+
+    def test_read_records(self):
+        data = journalstore.encode_record('a') + journalstore.encode_record('b')
+        assert_equal(self._read(data), ['a', 'b'])
+
+    def test_read_records_incomplete(self):
+        data = journalstore.encode_record('abcd')
+        for length in [3, len(data) - 1]:
+            assert_raises(journalstore.CorruptRecordError,
+                self._read, data[:length])
+
+    def test_read_records_checksum_mismatch(self):
+        data = journalstore.encode_record('abcd')
+        assert_raises(journalstore.CorruptRecordError,
+            self._read, data[:-1] + 'x')
+
+
+class ParseConnectionDetailsTestCase(TestCase):
+
+    def test_default(self):
+        assert_equal(journalstore.parse_connection_details(None),
+            journalstore.SYNC_ALWAYS)
+
+    def test_sync(self):
+        assert_equal(journalstore.parse_connection_details('sync=none'),
+            journalstore.SYNC_NONE)
+
+    def test_unknown_sync(self):
+        assert_raises(ValueError,
+            journalstore.parse_connection_details, 'sync=never')
+
+    def test_unknown_option(self):
+        assert_raises(ValueError,
+            journalstore.parse_connection_details, 'fsync=always')
+
+
+class JournalStateStoreTestCase(TestCase):
+
+    @setup
+    def setup_store(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'state')
+        self.store = JournalStateStore(self.path)
+
+    @teardown
+    def teardown_store(self):
+        self.store.cleanup()
+        shutil.rmtree(self.tmpdir)
+
+    def _reopen(self):
+        self.store.cleanup()
+        self.store = JournalStateStore(self.path)
+
+    def _files(self):
+        return sorted(os.listdir(self.path))
+
+    def test__init__no_state(self):
+        assert not os.path.exists(self.path)
+        assert_equal(self.store.state, {})
+
+    def test_build_key(self):
+        key = self.store.build_key(runstate.JOB_STATE, 'blah')
+        assert_equal(key, JournalKey(runstate.JOB_STATE, 'blah'))
+
+    def test_save_and_restore(self):
+        keys = [JournalKey(runstate.JOB_STATE, 'one'),
+                JournalKey(runstate.JOB_RUN_STATE, 'one.1')]
+        self.store.save([(keys[0], {'a': 1}), (keys[1], {'b': 2})])
+        self.store.save([(keys[0], {'a': 3})])
+        self._reopen()
+
+        missing = JournalKey(runstate.JOB_STATE, 'two')
+        state = self.store.restore(keys + [missing])
+        assert_equal(state, {keys[0]: {'a': 3}, keys[1]: {'b': 2}})
+
+    def test_restore_returns_copies(self):
+        key = JournalKey(runstate.JOB_STATE, 'one')
+        self.store.save([(key, {'run_nums': [1, 2]})])
+        state_data = self.store.restore([key])[key]
+        state_data['runs'] = []
+        state_data['run_nums'].append(3)
+        del state_data['run_nums']
+        assert_equal(self.store.restore([key]), {key: {'run_nums': [1, 2]}})
+
+    def test_save_delete(self):
+        key = JournalKey(runstate.JOB_RUN_STATE, 'one.1')
+        self.store.save([(key, {'a': 1})])
+        self.store.save([(key, None)])
+        self._reopen()
+        assert_equal(self.store.restore([key]), {})
+
+    def test_save_new_segment(self):
+        self.store.segment_size = 1
+        key = JournalKey(runstate.JOB_STATE, 'one')
+        self.store.save([(key, {'a': 1})])
+        self.store.save([(key, {'a': 2})])
+        assert_equal(self._files(), ['journal.00000001', 'journal.00000002',
+            'journal.00000003'])
+
+        self._reopen()
+        assert_equal(self.store.restore([key]), {key: {'a': 2}})
+
+    def test_save_starts_compaction(self):
+        self.store.segment_size = 1
+        self.store.compact_segments = 2
+        key = JournalKey(runstate.JOB_STATE, 'one')
+        for i in xrange(3):
+            self.store.save([(key, {'a': i})])
+        self.store.compact_thread.join()
+
+        assert_equal(self._files(), ['journal.00000003', 'journal.00000004',
+            'snapshot'])
+        self._reopen()
+        assert_equal(self.store.restore([key]), {key: {'a': 2}})
+
+    def test_compact(self):
+        keys = [JournalKey(runstate.JOB_STATE, 'one'),
+                JournalKey(runstate.JOB_STATE, 'two')]
+        self.store.save([(keys[0], {'a': 1}), (keys[1], {'b': 1})])
+        self.store.compact()
+        self.store.save([(keys[1], None)])
+        assert_equal(self._files(), ['journal.00000002', 'snapshot'])
+
+        self._reopen()
+        assert_equal(self.store.restore(keys), {keys[0]: {'a': 1}})
+
+    def test_restore_corrupt_tail(self):
+        key = JournalKey(runstate.JOB_STATE, 'one')
+        self.store.save([(key, {'a': 1})])
+        self.store.save([(key, {'a': 2})])
+        self.store.cleanup()
+
+        filename = os.path.join(self.path, 'journal.00000001')
+        with open(filename, 'rb+') as fh:
+            fh.truncate(os.path.getsize(filename) - 1)
+
+        self.store = JournalStateStore(self.path)
+        assert_equal(self.store.restore([key]), {key: {'a': 1}})
+        self.store.save([(key, {'a': 3})])
+        assert_equal(self._files(), ['journal.00000001', 'journal.00000002'])
+
+    def test_save_with_codec(self):
+        key = JournalKey(runstate.JOB_STATE, 'one')
+        self.store.save([(key, {'a': 1})])
+        self.store.cleanup()
+        self.store = JournalStateStore(self.path, codec.get_codec('zlib+json'))
+        self.store.save([(key, {'a': 2})])
+        self.store.compact()
+        self._reopen()
+        assert_equal(self.store.restore([key]), {key: {'a': 2}})
+
+    def _fsync_count(self, sync, saves):
+        self.store.cleanup()
+        self.store = JournalStateStore(self.path, None, 'sync=%s' % sync)
+        key = JournalKey(runstate.JOB_STATE, 'one')
+        with mock.patch.object(journalstore.os, 'fsync',
+                autospec=True) as mock_fsync:
+            for i in xrange(saves):
+                self.store.save([(key, {'a': i})])
+            self.store.cleanup()
+            return len(mock_fsync.mock_calls)
+
+    def test_sync_always(self):
+        # Each save, the new directory entry, and the segment on cleanup
+        assert_equal(self._fsync_count('always', 3), 5)
+
+    def test_sync_segment(self):
+        assert_equal(self._fsync_count('segment', 3), 1)
+
+    def test_sync_none(self):
+        assert_equal(self._fsync_count('none', 3), 0)
+
+    def test_restore_does_not_write(self):
+        self.store.save([(JournalKey(runstate.JOB_STATE, 'one'), {'a': 1})])
+        files = self._files()
+        reader = JournalStateStore(self.path)
+        reader.restore([JournalKey(runstate.JOB_STATE, 'one')])
+        reader.cleanup()
+        assert_equal(self._files(), files)
+
+
+if __name__ == "__main__":
+    run()
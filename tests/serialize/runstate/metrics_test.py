@@ -0,0 +1,69 @@
+from testify import TestCase, run, setup, assert_equal
+
+from tron.serialize import runstate
+from tron.serialize.runstate import metrics
+
+
+class HistogramTestCase(TestCase):
+
+    @setup
+    def setup_histogram(self):
+        self.histogram = metrics.Histogram([1, 10])
+
+    def test_add(self):
+        for value in [0.5, 1, 5, 20]:
+            self.histogram.add(value)
+        assert_equal(self.histogram.counts, [2, 1, 1])
+        assert_equal(self.histogram.max, 20)
+
+    def test_get_stats(self):
+        self.histogram.add(2)
+        self.histogram.add(4)
+        stats = self.histogram.get_stats()
+        assert_equal(stats['buckets'], [
+            {'le': 1, 'count': 0},
+            {'le': 10, 'count': 2},
+            {'le': None, 'count': 0}])
+        assert_equal(stats['mean'], 3.0)
+
+    def test_get_stats_empty(self):
+        assert_equal(self.histogram.get_stats()['mean'], 0)
+
+
+class PersistenceMetricsTestCase(TestCase):
+
+    @setup
+    def setup_metrics(self):
+        self.metrics = metrics.PersistenceMetrics()
+
+    def test_record_flush(self):
+        self.metrics.record_flush('count', 3, 0.2)
+        self.metrics.record_flush('timer', 5, 0.4)
+        assert_equal(self.metrics.save_latency.count, 2)
+        assert_equal(self.metrics.flush_keys.total, 8)
+        assert_equal(self.metrics.last_flush['reason'], 'timer')
+
+    def test_record_restore(self):
+        self.metrics.record_restore(runstate.JOB_STATE, 4, 0.5)
+        self.metrics.record_restore(runstate.JOB_STATE, 2, 0.25)
+        stats = self.metrics.get_stats()
+        assert_equal(stats['restore'],
+            {runstate.JOB_STATE: {'duration': 0.75, 'keys': 6}})
+
+    def test_get_stats_store_io_time(self):
+        self.metrics.record_flush('count', 2, 0.5)
+        self.metrics.record_encode(0.125, 100)
+        stats = self.metrics.get_stats()
+        assert_equal(stats['encode_time'], 0.125)
+        assert_equal(stats['store_io_time'], 0.375)
+        assert_equal(stats['bytes_per_flush'], 100.0)
+
+    def test_get_stats_with_write_time(self):
+        self.metrics.record_flush('count', 2, 0.001)
+        self.metrics.record_encode(0.25, 100)
+        stats = self.metrics.get_stats(write_time=1.0)
+        assert_equal(stats['store_io_time'], 0.75)
+
+
+if __name__ == "__main__":
+    run()
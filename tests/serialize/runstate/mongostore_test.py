@@ -1,13 +1,15 @@
+import mock
 from testify import TestCase, run, setup, assert_equal, teardown
-from tests import testingutils
 from tron.serialize import runstate
 mongostore = None # pyflakes
 
 
 class MongoStateStoreTestCase(TestCase):
-    _suites = ['mongodb']
+    """Run against mongomock, an in-process stand-in for MongoDB."""
 
     store = None
+    patcher = None
+    use_mongomock = True
 
     @setup
     def setup_store(self):
@@ -15,30 +17,55 @@ class MongoStateStoreTestCase(TestCase):
         from tron.serialize.runstate import mongostore
         global mongostore
         self.db_name = 'test_base'
+        if self.use_mongomock:
+            import mongomock
+            self.patcher = mock.patch(
+                'pymongo.MongoClient', mongomock.MongoClient)
+            self.patcher.start()
         self.store = mongostore.MongoStateStore(self.db_name, None)
 
     @teardown
     def teardown_store(self):
+        if self.patcher:
+            self.patcher.stop()
         if self.store:
-            # Clear out records
             self.store.connection.drop_database(self.db_name)
             self.store.cleanup()
 
     def _create_doc(self, key, doc):
-        import pymongo
-        db = pymongo.Connection()[self.db_name]
-        doc['_id'] = key.key
-        db[key.collection].save(doc)
-        db.connection.disconnect()
+        doc = dict(doc, _id=key.key)
+        self.store.db[key.collection].insert_one(doc)
+
+    def _find_all(self, collection):
+        return list(self.store.db[collection].find())
 
     def test__init__(self):
         assert_equal(self.store.db_name, self.db_name)
 
     def test_connect(self):
         assert self.store.connection
-        assert_equal(self.store.connection.host, 'localhost')
         assert_equal(self.store.db.name, self.db_name)
 
+    def test_connect_options(self):
+        params = {
+            'hostname':         'mongoserver',
+            'port':             '55555',
+            'w':                'majority',
+            'journal':          'true',
+            'max_pool_size':    '20',
+            'username':         'ted',
+            'password':         'sam',
+        }
+        with mock.patch('pymongo.MongoClient') as mock_client:
+            self.store._connect(self.db_name, params)
+        mock_client.assert_called_with('mongoserver', 55555, w='majority',
+            journal=True, maxPoolSize=20, username='ted', password='sam',
+            authSource=self.db_name)
+
+    def test_parse_write_concern(self):
+        assert_equal(mongostore.parse_write_concern('2'), 2)
+        assert_equal(mongostore.parse_write_concern('majority'), 'majority')
+
     def test_parse_connection_details(self):
         details = "hostname=mongoserver&port=55555"
         params = self.store._parse_connection_details(details)
@@ -68,26 +95,43 @@ class MongoStateStoreTestCase(TestCase):
         assert_equal(key.key, 'stars')
 
     def test_save(self):
-        import pymongo
         doc0, doc1 = {'a':"Hey there"}, {'a': "Howsit"}
         key_value_pairs = [
             (mongostore.MongoStateKey(self.store.JOB_COLLECTION, "1"), doc0),
             (mongostore.MongoStateKey(self.store.SERVICE_COLLECTION, "2"), doc1)
         ]
         self.store.save(key_value_pairs)
-        self.store.cleanup()
-
-        @testingutils.retry()
-        def verify():
-            db = pymongo.Connection()[self.db_name]
-            assert_equal(db[self.store.JOB_COLLECTION].find()[0], doc0)
-            assert_equal(db[self.store.SERVICE_COLLECTION].find()[0], doc1)
-        verify()
+        assert_equal(self._find_all(self.store.JOB_COLLECTION),
+            [dict(doc0, _id="1")])
+        assert_equal(self._find_all(self.store.SERVICE_COLLECTION),
+            [dict(doc1, _id="2")])
+        assert '_id' not in doc0
+
+    def test_save_update_and_delete(self):
+        keys = [mongostore.MongoStateKey(self.store.JOB_COLLECTION, str(i))
+                for i in xrange(2)]
+        self.store.save([(keys[0], {'a': 1}), (keys[1], {'a': 2})])
+        self.store.save([(keys[0], {'a': 3}), (keys[1], None)])
+        assert_equal(self._find_all(self.store.JOB_COLLECTION),
+            [{'_id': '0', 'a': 3}])
+
+    def test_save_bulk_write_per_collection(self):
+        self.store.db = mock.MagicMock()
+        key_value_pairs = [
+            (mongostore.MongoStateKey(self.store.JOB_RUN_COLLECTION, str(i)),
+                {'a': i})
+            for i in xrange(10)]
+        self.store.save(key_value_pairs)
+        collection = self.store.db[self.store.JOB_RUN_COLLECTION]
+        assert_equal(collection.bulk_write.call_count, 1)
+        requests = collection.bulk_write.call_args[0][0]
+        assert_equal(len(requests), 10)
+        assert_equal(collection.bulk_write.call_args[1], {'ordered': False})
 
     def test_restore(self):
         keys = [
-            mongostore.MongoStateKey(runstate.JOB_STATE, "1"),
-            mongostore.MongoStateKey(runstate.SERVICE_STATE, "2")
+            mongostore.MongoStateKey(self.store.JOB_COLLECTION, "1"),
+            mongostore.MongoStateKey(self.store.SERVICE_COLLECTION, "2")
         ]
         docs = [
             {'ahh': 'first doc'},
@@ -96,37 +140,43 @@ class MongoStateStoreTestCase(TestCase):
         for i in xrange(2):
             self._create_doc(keys[i], docs[i])
 
-        @testingutils.retry()
-        def verify():
-            restored_data = self.store.restore(keys)
-            assert_equal(restored_data[keys[0]], docs[0])
-            assert_equal(restored_data[keys[1]], docs[1])
-        verify()
+        restored_data = self.store.restore(keys)
+        assert_equal(restored_data, dict(zip(keys, docs)))
+
+    def test_restore_find_per_collection(self):
+        self.store.db = mock.MagicMock()
+        self.store.chunk_size = 4
+        keys = [mongostore.MongoStateKey(self.store.JOB_RUN_COLLECTION, str(i))
+                for i in xrange(10)]
+        self.store.restore(keys)
+        collection = self.store.db[self.store.JOB_RUN_COLLECTION]
+        assert_equal(collection.find.call_count, 3)
+        query = collection.find.call_args_list[0][0][0]
+        assert_equal(len(query['_id']['$in']), 4)
 
     def test_restore_not_found(self):
-        keys = [mongostore.MongoStateKey(runstate.JOB_STATE, "1")]
+        keys = [mongostore.MongoStateKey(self.store.JOB_COLLECTION, "1")]
         restored_data = self.store.restore(keys)
         assert_equal(restored_data, {})
 
     def test_restore_partial(self):
         keys = [
-            mongostore.MongoStateKey(runstate.JOB_STATE, "1"),
-            mongostore.MongoStateKey(runstate.SERVICE_STATE, "2")
+            mongostore.MongoStateKey(self.store.JOB_COLLECTION, "1"),
+            mongostore.MongoStateKey(self.store.SERVICE_COLLECTION, "2")
         ]
         docs = [{'ahh': 'first doc'}]
         self._create_doc(keys[0], docs[0])
 
-        @testingutils.retry()
-        def verify():
-            restored_data = self.store.restore(keys)
-            assert_equal(restored_data[keys[0]], docs[0])
-        verify()
+        restored_data = self.store.restore(keys)
+        assert_equal(restored_data, {keys[0]: docs[0]})
+
+
+class MongoStateStoreServerTestCase(MongoStateStoreTestCase):
+    """Run the same tests against a MongoDB server on localhost."""
+    _suites = ['mongodb']
 
-    def test_cleanup(self):
-        self.store.cleanup()
-        assert not self.store.connection.host
-        assert not self.store.connection.port
+    use_mongomock = False
 
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    run()
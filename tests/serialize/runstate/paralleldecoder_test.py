@@ -0,0 +1,35 @@
+from testify import TestCase, run, setup, assert_equal
+
+from tron.serialize.runstate import codec
+from tron.serialize.runstate.paralleldecoder import ParallelDecoder
+
+
+class ParallelDecoderTestCase(TestCase):
+
+    @setup
+    def setup_decoder(self):
+        self.codec = codec.get_codec('json')
+        self.decoder = ParallelDecoder(2)
+        self.decoder.chunk_size = 3
+
+    def _raw_items(self, count):
+        return dict(('key%d' % i, self.codec.encode({'num': i}))
+                    for i in xrange(count))
+
+    def test_decode(self):
+        state = self.decoder.decode(self.codec, self._raw_items(10))
+        expected = dict(('key%d' % i, {'num': i}) for i in xrange(10))
+        assert_equal(state, expected)
+
+    def test_decode_in_process(self):
+        self.decoder.processes = 1
+        state = self.decoder.decode(self.codec, self._raw_items(4))
+        assert_equal(len(state), 4)
+        assert_equal(state['key3'], {'num': 3})
+
+    def test_decode_empty(self):
+        assert_equal(self.decoder.decode(self.codec, {}), {})
+
+
+if __name__ == "__main__":
+    run()
@@ -1,6 +1,10 @@
+import mock
+import yaml
 from testify import TestCase, run, setup, assert_equal, teardown
+from testify import assert_raises
 from tests.assertions import assert_length
 from tron.serialize import runstate
+from tron.serialize.runstate import codec
 sqlalchemystore = None # pyflakes
 
 
@@ -40,7 +44,70 @@ class SQLAlchmeyStateStoreTestCase(TestCase):
         self.store.save(items)
 
         rows = self.store.engine.execute(self.store.job_table.select())
-        assert_equal(rows.fetchone(), ('stars', "{docs: blocks}\n"))
+        id, state_data = rows.fetchone()
+        assert_equal(id, 'stars')
+        assert state_data.startswith('#tron-codec:yaml\n')
+        assert_equal(self.store.decoder(state_data), doc)
+
+    def test_save_with_codec(self):
+        self.store.cleanup()
+        self.store = sqlalchemystore.SQLAlchemyStateStore('name',
+            'sqlite:///:memory:', codec.get_codec('zlib+json'))
+        key = sqlalchemystore.SQLStateKey(self.store.job_table, 'stars')
+        self.store.save([(key, {'docs': 'blocks'})])
+
+        rows = self.store.engine.execute(self.store.job_table.select())
+        _, state_data = rows.fetchone()
+        assert state_data.startswith('#tron-codec:base64+zlib+json\n')
+        assert_equal(self.store.restore([key]), {key: {'docs': 'blocks'}})
+
+    def test_restore_legacy(self):
+        key = sqlalchemystore.SQLStateKey(self.store.job_table, 'stars')
+        doc = {'docs': 'blocks', 'version': (0, 6, 1)}
+        insert = self.store.job_table.insert()
+        self.store.engine.execute(insert.values(id='stars',
+            state_data=yaml.dump(doc)))
+        assert_equal(self.store.restore([key]), {key: doc})
+
+    def test_save_delete(self):
+        key = sqlalchemystore.SQLStateKey(self.store.job_run_table, 'stars.1')
+        self.store.save([(key, {'docs': 'blocks'})])
+        self.store.save([(key, None)])
+
+        rows = self.store.engine.execute(self.store.job_run_table.select())
+        assert_equal(rows.fetchall(), [])
+
+    def test_save_update(self):
+        key = sqlalchemystore.SQLStateKey(self.store.job_table, 'stars')
+        self.store.save([(key, {'docs': 'blocks'})])
+        self.store.save([(key, {'docs': 'builder'})])
+        assert_equal(self.store.restore([key]), {key: {'docs': 'builder'}})
+
+    def test_save_is_one_transaction(self):
+        keys = [sqlalchemystore.SQLStateKey(self.store.job_table, 'stars'),
+                sqlalchemystore.SQLStateKey(self.store.job_table, 'foo')]
+        self.store.save([(keys[0], {'docs': 'blocks'})])
+        self.store.encoder = mock.Mock(side_effect=ValueError)
+        items = [(keys[0], None), (keys[1], {'docs': 'builder'})]
+        assert_raises(ValueError, self.store.save, items)
+
+        rows = self.store.engine.execute(self.store.job_table.select())
+        assert_equal([row[0] for row in rows], ['stars'])
+
+    def test_execute_reconnects(self):
+        error = sqlalchemystore.sqlalchemy.exc.DBAPIError(
+            'select', {}, Exception("gone away"), connection_invalidated=True)
+        func = mock.Mock(side_effect=[error, 'result'])
+        assert_equal(self.store._execute(func), 'result')
+        assert_equal(func.call_count, 2)
+
+    def test_execute_other_failure(self):
+        error = sqlalchemystore.sqlalchemy.exc.DBAPIError(
+            'select', {}, Exception("bad sql"))
+        func = mock.Mock(side_effect=error)
+        assert_raises(
+            sqlalchemystore.sqlalchemy.exc.DBAPIError, self.store._execute, func)
+        assert_equal(func.call_count, 1)
 
     def test_restore_missing(self):
         key = sqlalchemystore.SQLStateKey(self.store.job_table, 'stars')
@@ -74,6 +141,22 @@ class SQLAlchmeyStateStoreTestCase(TestCase):
         assert_length(docs, 1)
         assert_equal(docs[keys[0]], item)
 
+    def test_restore_raw(self):
+        key = sqlalchemystore.SQLStateKey(self.store.job_table, 'stars')
+        self.store.save([(key, {'docs': 'blocks'})])
+        raw = self.store.restore_raw([key])
+        assert raw[key].startswith('#tron-codec:yaml\n')
+        assert_equal(self.store.codec.decode(raw[key]), {'docs': 'blocks'})
+
+    def test_restore_chunked(self):
+        self.store.chunk_size = 2
+        keys = [sqlalchemystore.SQLStateKey(self.store.job_run_table, 'job.%d' % i)
+                for i in xrange(5)]
+        items = [(key, {'run_num': i}) for i, key in enumerate(keys)]
+        self.store.save(items)
+
+        assert_equal(self.store.restore(keys), dict(items))
+
 
 if __name__ == "__main__":
     run()
\ No newline at end of file
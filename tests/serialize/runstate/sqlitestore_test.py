@@ -0,0 +1,87 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from testify import TestCase, run, setup, assert_equal, teardown
+from tests.assertions import assert_length
+from tron.serialize import runstate
+from tron.serialize.runstate.sqlitestore import SQLiteStateStore, SQLiteStateKey
+
+
+class SQLiteStateStoreTestCase(TestCase):
+
+    @setup
+    def setup_store(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'state.sqlite')
+        self.store = SQLiteStateStore(self.filename)
+
+    @teardown
+    def teardown_store(self):
+        self.store.cleanup()
+        shutil.rmtree(self.tmpdir)
+
+    def _rows(self):
+        connection = sqlite3.connect(self.filename)
+        rows = connection.execute("SELECT type, key FROM state").fetchall()
+        connection.close()
+        return sorted(rows)
+
+    def test__init__(self):
+        journal_mode = self.store.connection.execute(
+            "PRAGMA journal_mode").fetchone()[0]
+        assert_equal(journal_mode, 'wal')
+
+    def test_build_key(self):
+        key = self.store.build_key(runstate.JOB_STATE, 'blah')
+        assert_equal(key, SQLiteStateKey(runstate.JOB_STATE, 'blah'))
+
+    def test_save(self):
+        keys = [SQLiteStateKey(runstate.JOB_STATE, 'one'),
+                SQLiteStateKey(runstate.SERVICE_STATE, 'two')]
+        self.store.save(zip(keys, [{'a': 1}, {'b': 2}]))
+        self.store.save([(keys[0], {'a': 3})])
+        assert_equal(self._rows(), [tuple(key) for key in keys])
+        assert_equal(self.store.restore(keys[:1]), {keys[0]: {'a': 3}})
+
+    def test_save_delete(self):
+        key = SQLiteStateKey(runstate.JOB_RUN_STATE, 'one.1')
+        self.store.save([(key, {'a': 1})])
+        self.store.save([(key, None)])
+        assert_equal(self._rows(), [])
+
+    def test_restore_many(self):
+        self.store.restore_chunk_size = 2
+        keys = [SQLiteStateKey(runstate.JOB_STATE, 'job%s' % i)
+                for i in xrange(5)]
+        keys.append(SQLiteStateKey(runstate.SERVICE_STATE, 'service'))
+        items = [(key, {'iden': key.iden}) for key in keys]
+        self.store.save(items)
+
+        assert_equal(self.store.restore(keys), dict(items))
+
+    def test_restore_raw(self):
+        key = SQLiteStateKey(runstate.JOB_STATE, 'one')
+        self.store.save([(key, {'a': 1})])
+        raw = self.store.restore_raw([key])
+        assert_equal(self.store.codec.decode(raw[key]), {'a': 1})
+
+    def test_restore_partial(self):
+        keys = [SQLiteStateKey(runstate.JOB_STATE, 'one'),
+                SQLiteStateKey(runstate.JOB_STATE, 'two')]
+        self.store.save([(keys[0], {'a': 1})])
+        state = self.store.restore(keys)
+        assert_length(state, 1)
+        assert_equal(state[keys[0]], {'a': 1})
+
+    def test_restore_after_reopen(self):
+        key = SQLiteStateKey(runstate.JOB_STATE, 'one')
+        self.store.save([(key, {'a': 1})])
+        self.store.cleanup()
+        self.store = SQLiteStateStore(self.filename)
+        assert_equal(self.store.restore([key]), {key: {'a': 1}})
+
+
+if __name__ == "__main__":
+    run()
@@ -1,32 +1,103 @@
 import os
+import shutil
+import tempfile
 import mock
-from testify import TestCase, assert_equal, setup, run
+from testify import TestCase, assert_equal, setup, run, setup_teardown
 
 from tests.assertions import assert_raises
 from tests.testingutils import autospec_method
-from tron.config import schema
+from tron.config import config_parse
+from tron.core import job, service
 from tron.serialize import runstate
+from tron.serialize.runstate import codec
+from tron.serialize.runstate.paralleldecoder import ParallelDecoder
 from tron.serialize.runstate.shelvestore import ShelveStateStore
+from tron.serialize.runstate.threadedwriter import ThreadedStateWriter
 from tron.serialize.runstate.statemanager import PersistentStateManager, StateChangeWatcher
 from tron.serialize.runstate.statemanager import StateSaveBuffer
+from tron.serialize.runstate.statemanager import estimate_size
 from tron.serialize.runstate.statemanager import StateMetadata
 from tron.serialize.runstate.statemanager import PersistenceStoreError
 from tron.serialize.runstate.statemanager import VersionMismatchError
 from tron.serialize.runstate.statemanager import PersistenceManagerFactory
+from tron.utils import timeutils
 
 
 class PersistenceManagerFactoryTestCase(TestCase):
 
+    @setup_teardown
+    def setup_tmpdir(self):
+        self.tmpdir = tempfile.mkdtemp()
+        yield
+        shutil.rmtree(self.tmpdir)
+
     def test_from_config_shelve(self):
-        thefilename = 'thefilename'
-        config = schema.ConfigState(
-            store_type='shelve', name=thefilename, buffer_size=0,
-            connection_details=None)
+        thefilename = os.path.join(self.tmpdir, 'thefilename')
+        config = config_parse.DEFAULT_STATE_PERSISTENCE._replace(
+            name=thefilename)
         manager = PersistenceManagerFactory.from_config(config)
         store = manager._impl
         assert_equal(store.filename, config.name)
         assert isinstance(store, ShelveStateStore)
-        os.unlink(thefilename)
+        store.cleanup()
+
+    @mock.patch('tron.serialize.runstate.statemanager.JournalStateStore',
+        autospec=True)
+    def test_from_config_journal(self, mock_store):
+        config = config_parse.DEFAULT_STATE_PERSISTENCE._replace(
+            store_type='journal', name='state_dir')
+        manager = PersistenceManagerFactory.from_config(config)
+        assert_equal(manager._impl, mock_store.return_value)
+        mock_store.assert_called_with('state_dir', None, None)
+
+    @mock.patch('tron.serialize.runstate.statemanager.ShelveStateStore',
+        autospec=True)
+    def test_store_from_config(self, mock_store):
+        config = config_parse.DEFAULT_STATE_PERSISTENCE._replace(
+            threaded_writer=True)
+        store = PersistenceManagerFactory.store_from_config(config)
+        assert_equal(store, mock_store.return_value)
+        mock_store.assert_called_with(config.name)
+
+    @mock.patch('tron.serialize.runstate.statemanager.ShelveStateStore',
+        autospec=True)
+    def test_from_config_threaded_writer(self, mock_store):
+        config = config_parse.DEFAULT_STATE_PERSISTENCE._replace(
+            threaded_writer=True, writer_queue_size=5)
+        manager = PersistenceManagerFactory.from_config(config)
+        writer = manager._impl
+        assert isinstance(writer, ThreadedStateWriter)
+        assert_equal(writer.store, mock_store.return_value)
+        assert_equal(writer.queue_size, 5)
+        writer.cleanup()
+
+    @mock.patch('tron.serialize.runstate.statemanager.ShelveStateStore',
+        autospec=True)
+    def test_from_config_buffer(self, _mock_store):
+        config = config_parse.DEFAULT_STATE_PERSISTENCE._replace(
+            buffer_size=10, max_buffer_age=30, min_save_interval=2,
+            max_buffer_bytes=1024)
+        buffer = PersistenceManagerFactory.from_config(config)._buffer
+        assert_equal(buffer.buffer_size, 10)
+        assert_equal(buffer.max_age, 30)
+        assert_equal(buffer.min_interval, 2)
+        assert_equal(buffer.max_bytes, 1024)
+
+    @mock.patch('tron.serialize.runstate.statemanager.ShelveStateStore',
+        autospec=True)
+    def test_from_config_restore_processes(self, _mock_store):
+        config = config_parse.DEFAULT_STATE_PERSISTENCE._replace(
+            restore_processes=4)
+        decoder = PersistenceManagerFactory.from_config(config)._decoder
+        assert_equal(decoder.processes, 4)
+
+    @mock.patch('tron.serialize.runstate.statemanager.ShelveStateStore',
+        autospec=True)
+    def test_from_config_slow_save_threshold(self, _mock_store):
+        config = config_parse.DEFAULT_STATE_PERSISTENCE._replace(
+            slow_save_threshold=2.5)
+        manager = PersistenceManagerFactory.from_config(config)
+        assert_equal(manager.slow_save_threshold, 2.5)
 
 
 class StateMetadataTestCase(TestCase):
@@ -44,23 +115,95 @@ class StateMetadataTestCase(TestCase):
         assert_raises(
                 VersionMismatchError, StateMetadata.validate_metadata, metadata)
 
+    def test_validate_metadata_version_list(self):
+        metadata = {'version': [0, 5, 2], 'codec': 'zlib+json'}
+        StateMetadata.validate_metadata(metadata)
+
+    def test_validate_metadata_unknown_codec(self):
+        metadata = {'version': (0, 5, 2), 'codec': 'bson'}
+        assert_raises(
+                PersistenceStoreError, StateMetadata.validate_metadata, metadata)
+
+    def test_state_data_codec(self):
+        assert_equal(StateMetadata('json').state_data['codec'], 'json')
+
+
+class EstimateSizeTestCase(TestCase):
+
+    def test_estimate_size(self):
+        state_data = {'name': 'abcd', 'runs': [None, ('ab', 3)]}
+        assert_equal(estimate_size(state_data), 4 + 4 + 4 + 8 + 2 + 8)
+
 
 class StateSaveBufferTestCase(TestCase):
 
-    @setup
+    @setup_teardown
     def setup_buffer(self):
         self.buffer_size = 5
         self.buffer = StateSaveBuffer(self.buffer_size)
+        self.now = 1000
+        with mock.patch('tron.serialize.runstate.statemanager.time',
+                autospec=True) as self.mock_time:
+            self.mock_time.time.side_effect = lambda: self.now
+            yield
 
     def test_save(self):
-        assert self.buffer.save(1, 2)
         assert not self.buffer.save(1, 3)
         assert not self.buffer.save(1, 4)
         assert not self.buffer.save(1, 5)
         assert not self.buffer.save(1, 6)
-        assert self.buffer.save(1, 7)
+        assert_equal(self.buffer.save(1, 7), 'count')
         assert_equal(self.buffer.buffer[1], 7)
 
+    def test_save_all(self):
+        assert not self.buffer.save_all([(1, 2), (2, 3)])
+        assert not self.buffer.save_all([(1, 4)])
+        assert_equal(self.buffer.buffer, {1: 4, 2: 3})
+
+    def test_save_max_bytes(self):
+        self.buffer.max_bytes = 10
+        assert not self.buffer.save(1, 'abcde')
+        assert not self.buffer.save(1, 'abcdefgh')
+        assert_equal(self.buffer.save(2, 'ab'), 'bytes')
+
+    def test_save_max_age(self):
+        self.buffer.max_age = 30
+        assert not self.buffer.save(1, 2)
+        assert_equal(self.buffer.flush_delay(), 30)
+        self.now += 30
+        assert_equal(self.buffer.save(2, 3), 'age')
+
+    def test_save_min_interval(self):
+        self.buffer.buffer_size = 1
+        self.buffer.min_interval = 2
+        self.buffer.flush('count')
+        self.now += 1
+        assert not self.buffer.save(1, 2)
+        assert_equal(self.buffer.flush_delay(), 1)
+        self.now += 1
+        assert_equal(self.buffer.save(1, 3), 'count')
+
+    def test_flush_delay_empty(self):
+        self.buffer.max_age = 30
+        assert_equal(self.buffer.flush_delay(), None)
+
+    def test_flush_delay_no_limits(self):
+        self.buffer.save(1, 2)
+        assert_equal(self.buffer.flush_delay(), None)
+
+    def test_flush(self):
+        self.buffer.save_all([(1, 2), (2, 3)])
+        self.buffer.save(1, 4)
+        self.now += 3
+        assert_equal(sorted(self.buffer.flush('count')), [(1, 4), (2, 3)])
+        assert not self.buffer.buffer
+        stats = self.buffer.get_stats()
+        assert_equal(stats['flushes'], 1)
+        assert_equal(stats['keys_written'], 2)
+        assert_equal(stats['last_staleness'], 3)
+        assert_equal(stats['flush_reasons'], {'count': 1})
+        assert_equal(stats['write_amplification'], 1.0)
+
     def test__iter__(self):
         self.buffer.save(1, 2)
         self.buffer.save(2, 3)
@@ -100,12 +243,87 @@ class PersistentStateManagerTestCase(TestCase):
             names[1]: {'state': '2data'}}
         assert_equal(expected, state_data)
 
+    def test_restore_keys(self):
+        timer = timeutils.StepTimer()
+        state = self.manager._restore_keys(['a'], timer)
+        assert_equal(state, self.store.restore.return_value)
+        self.store.restore.assert_called_with(['a'])
+        assert_equal(timer.durations.keys(), ['state_fetch'])
+
+    def test_restore_keys_with_decoder(self):
+        self.manager._decoder = decoder = mock.create_autospec(ParallelDecoder)
+        timer = timeutils.StepTimer()
+        state = self.manager._restore_keys(['a'], timer)
+        assert_equal(state, decoder.decode.return_value)
+        self.store.restore_raw.assert_called_with(['a'])
+        decoder.decode.assert_called_with(
+            self.store.codec, self.store.restore_raw.return_value)
+        assert_equal(timer.durations.keys(), ['state_fetch', 'decode'])
+
     def test_save(self):
         name, state_data = 'name', mock.Mock()
         self.manager.save(runstate.JOB_STATE, name, state_data)
         key = '%s%s' % (runstate.JOB_STATE, name)
         self.store.save.assert_called_with([(key, state_data)])
 
+    def test_save_all(self):
+        items = [
+            (runstate.JOB_RUN_STATE, 'name.1', mock.Mock()),
+            (runstate.JOB_RUN_STATE, 'name.0', None),
+            (runstate.JOB_STATE, 'name', mock.Mock())]
+        self.manager.save_all(items)
+        expected = [('%s%s' % (t, n), s) for t, n, s in items]
+        call_args = self.store.save.call_args[0][0]
+        assert_equal(sorted(call_args), sorted(expected))
+
+    def test_restore_job_runs(self):
+        job_states = {
+            'one': {'enabled': True, 'run_nums': [3, 2]},
+            'two': {'enabled': False, 'runs': ['full']}}
+        self.store.restore.return_value = {
+            '%sone.3' % runstate.JOB_RUN_STATE: 'three',
+            '%sone.2' % runstate.JOB_RUN_STATE: 'two'}
+        restored = self.manager._restore_job_runs(job_states)
+        expected = {
+            'one': {'enabled': True, 'runs': ['three', 'two']},
+            'two': {'enabled': False, 'runs': ['full']}}
+        assert_equal(restored, expected)
+
+    def test_restore_job_runs_missing_run(self):
+        job_states = {'one': {'enabled': True, 'run_nums': [3, 2]}}
+        self.store.restore.return_value = {
+            '%sone.3' % runstate.JOB_RUN_STATE: 'three'}
+        restored = self.manager._restore_job_runs(job_states)
+        assert_equal(restored, {'one': {'enabled': True, 'runs': ['three']}})
+
+    def test_restore_job_runs_not_indexed(self):
+        job_states = {'two': {'enabled': False, 'runs': []}}
+        restored = self.manager._restore_job_runs(job_states)
+        assert_equal(restored, job_states)
+        assert not self.store.restore.mock_calls
+
+    @mock.patch('tron.serialize.runstate.statemanager.time', autospec=True)
+    def test_save_schedules_flush(self, mock_time):
+        mock_time.time.return_value = 1000
+        self.manager._buffer = StateSaveBuffer(5, max_age=30)
+        autospec_method(self.manager._flush_callback.start)
+        self.manager.save(runstate.JOB_STATE, 'name', mock.Mock())
+        assert not self.store.save.mock_calls
+        self.manager._flush_callback.start.assert_called_with(30)
+
+    def test_save_from_timer(self):
+        self.manager._buffer = StateSaveBuffer(5)
+        self.manager._buffer.save('key', 'state')
+        self.manager._save_from_timer()
+        self.store.save.assert_called_with([('key', 'state')])
+        assert_equal(self.manager._buffer.stats['flush_reasons'], {'timer': 1})
+
+    def test_save_from_timer_disabled(self):
+        self.manager._buffer.save('key', 'state')
+        with self.manager.disabled():
+            self.manager._save_from_timer()
+        assert not self.store.save.mock_calls
+
     def test_save_failed(self):
         self.store.save.side_effect = PersistenceStoreError("blah")
         assert_raises(PersistenceStoreError, self.manager.save, None, None, None)
@@ -137,6 +355,46 @@ class PersistentStateManagerTestCase(TestCase):
             pass
         assert not self.manager.enabled
 
+    def test_attach_codec_metrics(self):
+        store = mock.Mock(spec=['build_key', 'codec'],
+            codec=codec.StateCodec(codec.JSONCodec(), None))
+        manager = PersistentStateManager(store, self.buffer)
+        assert_equal(store.codec.metrics, manager.metrics)
+
+    def test_restore_dicts_records_metrics(self):
+        self.store.restore.return_value = {}
+        self.manager._restore_dicts(runstate.JOB_STATE, ['one', 'two'])
+        assert_equal(self.manager.metrics.restore_keys,
+            {runstate.JOB_STATE: 2})
+
+    def test_save_records_flush(self):
+        self.manager.save(runstate.JOB_STATE, 'name', {})
+        assert_equal(self.manager.metrics.last_flush['reason'], 'count')
+        assert_equal(self.manager.metrics.flush_keys.total, 1)
+
+    @mock.patch('tron.serialize.runstate.statemanager.time', autospec=True)
+    @mock.patch('tron.serialize.runstate.statemanager.event', autospec=True)
+    def test_save_slow(self, mock_event, mock_time):
+        mock_time.time.side_effect = iter([10, 10, 10, 13])
+        self.manager.slow_save_threshold = 2
+        self.manager.save(runstate.JOB_STATE, 'name', {})
+        assert_equal(self.manager.metrics.slow_saves, 1)
+        mock_event.get_recorder.return_value.notice.assert_called_with(
+            'slow_state_save', reason='count', keys=1, duration=3)
+
+    @mock.patch('tron.serialize.runstate.statemanager.event', autospec=True)
+    def test_save_not_slow(self, mock_event):
+        self.manager.slow_save_threshold = 60
+        self.manager.save(runstate.JOB_STATE, 'name', {})
+        assert not mock_event.get_recorder.mock_calls
+
+    def test_get_stats(self):
+        self.store.get_stats.return_value = {'total_save_duration': 2}
+        stats = self.manager.get_stats()
+        assert_equal(stats['store_stats'], {'total_save_duration': 2})
+        assert_equal(stats['store_io_time'], 2)
+        assert_equal(stats['buffer'], self.buffer.get_stats())
+
 
 class StateChangeWatcherTestCase(TestCase):
 
@@ -165,11 +423,77 @@ class StateChangeWatcherTestCase(TestCase):
             mock_factory.from_config.return_value)
         mock_factory.from_config.assert_called_with(state_config)
 
+    def test_handler_marks_dirty(self):
+        autospec_method(self.watcher._save_callback.start)
+        mock_job = mock.create_autospec(job.Job)
+        mock_job.name = 'job'
+        mock_service = mock.create_autospec(service.Service)
+        mock_service.name = 'service'
+        for _ in xrange(3):
+            self.watcher.handler(mock_job, job.Job.NOTIFY_STATE_CHANGE)
+        self.watcher.handler(mock_service, service.Service.NOTIFY_STATE_CHANGE)
+
+        assert_equal(self.watcher.dirty_jobs, {mock_job.name: mock_job})
+        assert_equal(self.watcher.dirty_services,
+            {mock_service.name: mock_service})
+        assert not self.state_manager.save.mock_calls
+        assert_equal(self.watcher._save_callback.start.mock_calls,
+            [mock.call(0)] * 4)
+
+    def test_handler_other_observable(self):
+        autospec_method(self.watcher._save_callback.start)
+        self.watcher.handler(mock.Mock(), 'event')
+        assert not self.watcher._save_callback.start.mock_calls
+
+    def test_save_dirty(self):
+        autospec_method(self.watcher.save_job)
+        autospec_method(self.watcher.save_service)
+        mock_job, mock_service = mock.Mock(), mock.Mock()
+        self.watcher.dirty_jobs = {'job': mock_job}
+        self.watcher.dirty_services = {'service': mock_service}
+        self.watcher.save_dirty()
+        self.watcher.save_job.assert_called_with(mock_job)
+        self.watcher.save_service.assert_called_with(mock_service)
+
+    def test_save_job_clears_dirty(self):
+        mock_job = mock.Mock()
+        mock_job.runs.pop_changes.return_value = [], []
+        self.watcher.dirty_jobs = {mock_job.name: mock_job}
+        self.watcher.save_job(mock_job)
+        assert_equal(self.watcher.dirty_jobs, {})
+
     def test_save_job(self):
         mock_job = mock.Mock()
+        mock_job.runs.pop_changes.return_value = [], []
         self.watcher.save_job(mock_job)
         self.watcher.state_manager.save.assert_called_with(
             runstate.JOB_STATE, mock_job.name, mock_job.state_data)
+        mock_job.runs.pop_changes.assert_called_with()
+
+    def test_save_job_incremental(self):
+        self.watcher.config = mock.Mock(incremental=True)
+        mock_job = mock.Mock()
+        changed_run = mock.Mock()
+        mock_job.runs.pop_changes.return_value = [changed_run], ['job.1']
+        self.watcher.save_job(mock_job)
+        self.watcher.state_manager.save_all.assert_called_with([
+            (runstate.JOB_RUN_STATE, changed_run.id, changed_run.state_data),
+            (runstate.JOB_RUN_STATE, 'job.1', None),
+            (runstate.JOB_STATE, mock_job.name,
+                mock_job.run_index_state_data)])
+
+    def test_save_job_incremental_all_runs(self):
+        self.watcher.config = mock.Mock(incremental=True)
+        mock_job = mock.MagicMock()
+        runs = [mock.Mock(), mock.Mock()]
+        mock_job.runs.pop_changes.return_value = [], []
+        mock_job.runs.__iter__.return_value = iter(runs)
+        self.watcher.save_job(mock_job, all_runs=True)
+        self.watcher.state_manager.save_all.assert_called_with([
+            (runstate.JOB_RUN_STATE, runs[0].id, runs[0].state_data),
+            (runstate.JOB_RUN_STATE, runs[1].id, runs[1].state_data),
+            (runstate.JOB_STATE, mock_job.name,
+                mock_job.run_index_state_data)])
 
     def test_save_service(self):
         mock_service = mock.Mock()
@@ -181,12 +505,17 @@ class StateChangeWatcherTestCase(TestCase):
         patcher = mock.patch('tron.serialize.runstate.statemanager.StateMetadata')
         with patcher as mock_state_metadata:
             self.watcher.save_metadata()
+            mock_state_metadata.assert_called_with(None)
             meta_data = mock_state_metadata.return_value
             self.watcher.state_manager.save.assert_called_with(
                 runstate.MCP_STATE, meta_data.name, meta_data.state_data)
 
     def test_shutdown(self):
+        mock_service = mock.Mock()
+        self.watcher.dirty_services = {mock_service.name: mock_service}
         self.watcher.shutdown()
+        self.watcher.state_manager.save.assert_called_with(
+            runstate.SERVICE_STATE, mock_service.name, mock_service.state_data)
         assert not self.watcher.state_manager.enabled
         self.watcher.state_manager.cleanup.assert_called_with()
 
@@ -197,8 +526,15 @@ class StateChangeWatcherTestCase(TestCase):
     def test_restore(self):
         jobs, services = mock.Mock(), mock.Mock()
         self.watcher.restore(jobs, services)
-        self.watcher.state_manager.restore.assert_called_with(jobs, services)
-
+        self.watcher.state_manager.restore.assert_called_with(
+            jobs, services, timer=None)
+
+    def test_get_stats(self):
+        self.state_manager.get_stats.return_value = {'slow_saves': 0}
+        self.watcher.dirty_jobs = {'job': mock.Mock()}
+        stats = self.watcher.get_stats()
+        assert_equal(stats,
+            {'slow_saves': 0, 'dirty_jobs': 1, 'dirty_services': 0})
 
 
 if __name__ == "__main__":
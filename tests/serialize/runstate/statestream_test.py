@@ -0,0 +1,100 @@
+import mock
+from testify import TestCase, run, setup, assert_equal
+
+from tron.serialize import runstate
+from tron.serialize.runstate import statestream
+from tron.serialize.runstate.statestream import StateItem
+
+
+class FakeStore(object):
+    """A StateStore which keeps state in a dict."""
+
+    def __init__(self, state=None):
+        self.state = state or {}
+        self.restore_calls = []
+        self.save_calls = []
+
+    def build_key(self, type, iden):
+        return type, iden
+
+    def restore(self, keys):
+        self.restore_calls.append(keys)
+        return dict((key, self.state[key]) for key in keys if key in self.state)
+
+    def save(self, key_value_pairs):
+        self.save_calls.append(key_value_pairs)
+        self.state.update(key_value_pairs)
+
+
+class ChunksTestCase(TestCase):
+
+    def test_chunks(self):
+        chunks = list(statestream.chunks(xrange(5), 2))
+        assert_equal(chunks, [[0, 1], [2, 3], [4]])
+
+    def test_chunks_empty(self):
+        assert_equal(list(statestream.chunks([], 2)), [])
+
+
+class StateStreamTestCase(TestCase):
+
+    @setup
+    def setup_stream(self):
+        self.store = FakeStore({
+            (runstate.JOB_STATE, 'one'):        {'runs': [], 'enabled': True},
+            (runstate.JOB_STATE, 'two'):        {'run_nums': [2, 1]},
+            (runstate.JOB_RUN_STATE, 'two.2'):  {'run_num': 2},
+            (runstate.JOB_RUN_STATE, 'two.1'):  {'run_num': 1},
+            (runstate.SERVICE_STATE, 'serv'):   {'enabled': True},
+        })
+        self.stream = statestream.StateStream(
+            self.store, ['one', 'two', 'missing'], ['serv'], chunk_size=2)
+
+    def test__iter__(self):
+        items = list(self.stream)
+        expected = [
+            StateItem(runstate.JOB_STATE, 'one', {'runs': [], 'enabled': True}),
+            StateItem(runstate.JOB_STATE, 'two', {'run_nums': [2, 1]}),
+            StateItem(runstate.JOB_RUN_STATE, 'two.2', {'run_num': 2}),
+            StateItem(runstate.JOB_RUN_STATE, 'two.1', {'run_num': 1}),
+            StateItem(runstate.SERVICE_STATE, 'serv', {'enabled': True}),
+        ]
+        assert_equal(items, expected)
+
+    def test__iter__chunks(self):
+        list(self.stream)
+        assert_equal([len(keys) for keys in self.store.restore_calls],
+            [2, 2, 1, 1])
+
+
+class StateCopierTestCase(TestCase):
+
+    @setup
+    def setup_copier(self):
+        self.store = FakeStore()
+        self.progress = mock.Mock()
+        self.copier = statestream.StateCopier(self.store, 2, self.progress)
+        self.items = [StateItem(runstate.JOB_STATE, 'job%d' % i, {'i': i})
+                      for i in xrange(5)]
+
+    def test_copy(self):
+        assert_equal(self.copier.copy(self.items), 5)
+        assert_equal([len(pairs) for pairs in self.store.save_calls], [2, 2, 1])
+        assert_equal(self.store.state[(runstate.JOB_STATE, 'job4')], {'i': 4})
+        assert_equal(self.progress.mock_calls,
+            [mock.call(2), mock.call(4), mock.call(5)])
+
+    def test_copy_stream(self):
+        source = FakeStore({(runstate.SERVICE_STATE, 'serv'): {'a': 1}})
+        stream = statestream.StateStream(source, [], ['serv'])
+        assert_equal(self.copier.copy(stream), 1)
+        assert_equal(self.store.state, source.state)
+
+    def test_flush_empty(self):
+        self.copier.flush()
+        assert not self.store.save_calls
+        assert not self.progress.mock_calls
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,146 @@
+import threading
+
+import mock
+from testify import TestCase, run, setup, teardown, assert_equal
+
+from tron.serialize.runstate.threadedwriter import ThreadedStateWriter
+
+
+class ThreadedStateWriterTestCase(TestCase):
+
+    @setup
+    def setup_writer(self):
+        self.store = mock.Mock()
+        self.writer = ThreadedStateWriter(self.store, 10)
+        self.writer.retry_delay = 0.01
+        self.writer.wait_interval = 0.01
+
+    @teardown
+    def teardown_writer(self):
+        self.writer.cleanup()
+
+    def _block_store_save(self):
+        """Block the first save until the returned event is set."""
+        started, blocker = threading.Event(), threading.Event()
+        def save(_):
+            started.set()
+            blocker.wait()
+        self.store.save.side_effect = save
+        return started, blocker
+
+    def _saved_items(self):
+        return [item
+            for call in self.store.save.mock_calls
+            for item in call[1][0]]
+
+    def test_build_key(self):
+        key = self.writer.build_key('type', 'name')
+        assert_equal(key, self.store.build_key.return_value)
+        self.store.build_key.assert_called_with('type', 'name')
+
+    def test_save(self):
+        items = [('one', {'a': 1}), ('two', {'b': 2})]
+        self.writer.save(items)
+        self.writer.flush()
+        assert_equal(sorted(self._saved_items()), items)
+        stats = self.writer.get_stats()
+        assert_equal(stats['keys_written'], 2)
+        assert_equal(stats['queue_depth'], 0)
+
+    def test_save_coalesces_by_key(self):
+        started, blocker = self._block_store_save()
+        self.writer.save([('one', 1)])
+        started.wait()
+        self.writer.save([('two', 1), ('two', 2)])
+        self.writer.save([('two', 3)])
+        blocker.set()
+        self.writer.flush()
+
+        assert_equal(self._saved_items(), [('one', 1), ('two', 3)])
+        assert_equal(self.writer.get_stats()['coalesced'], 2)
+
+    def test_save_does_not_block_when_queue_is_full(self):
+        self.writer.queue_size = 2
+        started, blocker = self._block_store_save()
+        self.writer.save([('one', 1)])
+        started.wait()
+        self.writer.save([('two', 2)])
+        self.writer.save([('three', 3)])
+        self.writer.save([('four', 4)])
+        stats = self.writer.get_stats()
+        blocker.set()
+        self.writer.flush()
+
+        assert_equal(stats['queue_depth'], 3)
+        assert_equal(stats['over_capacity'], 1)
+        assert_equal(sorted(self._saved_items()),
+            [('four', 4), ('one', 1), ('three', 3), ('two', 2)])
+
+    def test_save_failure_is_retried(self):
+        self.store.save.side_effect = [Exception("failed"), None]
+        self.writer.save([('one', 1)])
+        self.writer.flush()
+        self.writer.flush()
+        assert_equal(self._saved_items(), [('one', 1), ('one', 1)])
+        stats = self.writer.get_stats()
+        assert_equal(stats['failures'], 1)
+        assert_equal(stats['retries'], 1)
+        assert_equal(stats['consecutive_failures'], 0)
+        assert_equal(stats['retry_delay'], 0)
+
+    def test_save_failure_backs_off(self):
+        self.writer.max_retry_delay = 0.04
+        started, blocker = threading.Event(), threading.Event()
+        def save(_):
+            if self.store.save.call_count == 5:
+                started.set()
+                blocker.wait()
+            raise Exception("failed")
+        self.store.save.side_effect = save
+        self.writer.save([('one', 1)])
+        started.wait()
+        self.writer.save([('one', 2)])
+        stats = self.writer.get_stats()
+        blocker.set()
+
+        assert_equal(stats['consecutive_failures'], 4)
+        assert_equal(stats['retry_delay'], 0.04)
+        assert_equal(stats['queue_depth'], 1)
+
+    def test_record_failure(self):
+        self.writer.retry_delay, self.writer.max_retry_delay = 1, 5
+        delays = []
+        for _ in range(5):
+            self.writer._record_failure()
+            delays.append(self.writer.stats['retry_delay'])
+        assert_equal(delays, [1, 2, 4, 5, 5])
+
+    def test_restore(self):
+        self.writer.save([('one', 1)])
+        state = self.writer.restore(['one'])
+        assert_equal(state, self.store.restore.return_value)
+        self.store.restore.assert_called_with(['one'])
+        assert_equal(self._saved_items(), [('one', 1)])
+
+    def test_restore_raw(self):
+        self.writer.save([('one', 1)])
+        state = self.writer.restore_raw(['one'])
+        assert_equal(state, self.store.restore_raw.return_value)
+        assert_equal(self.writer.codec, self.store.codec)
+        assert_equal(self._saved_items(), [('one', 1)])
+
+    def test_restore_raw_not_supported(self):
+        writer = ThreadedStateWriter(mock.Mock(spec=['save', 'restore', 'cleanup']), 10)
+        assert not hasattr(writer, 'restore_raw')
+        writer.cleanup()
+
+    def test_cleanup(self):
+        self.writer.save([('one', 1)])
+        self.writer.cleanup()
+        assert not self.writer.thread.is_alive()
+        assert_equal(self._saved_items(), [('one', 1)])
+        self.store.cleanup.assert_called_with()
+
+
+if __name__ == "__main__":
+    run()
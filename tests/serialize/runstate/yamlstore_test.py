@@ -1,16 +1,20 @@
 import os
+import shutil
 import tempfile
 
+import mock
 from testify import TestCase, run, setup, assert_equal, teardown
 import yaml
-from tron.serialize.runstate import yamlstore
+from tests.assertions import assert_raises
+from tron.serialize.runstate import codec, yamlstore
 
 class YamlStateStoreTestCase(TestCase):
 
     @setup
     def setup_store(self):
-        self.filename = os.path.join(tempfile.gettempdir(), 'yaml_state')
-        self.store = yamlstore.YamlStateStore(self.filename)
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'yaml_state')
+        self.store = yamlstore.YamlStateStore(self.path)
         self.test_data = {
             'one': {'a': 1},
             'two': {'b': 2},
@@ -19,38 +23,55 @@ class YamlStateStoreTestCase(TestCase):
 
     @teardown
     def teardown_store(self):
-        try:
-            os.unlink(self.filename)
-        except OSError:
-            pass
+        shutil.rmtree(self.tmpdir)
 
-    def test_restore(self):
-        with open(self.filename, 'w') as fh:
+    def _write_legacy_file(self):
+        with open(self.path, 'w') as fh:
             yaml.dump(self.test_data, fh)
 
+    def _read_shard(self, type, iden):
+        with open(os.path.join(self.path, type, iden + '.yaml')) as fh:
+            return yaml.load(fh)
+
+    def test_restore(self):
         keys = [yamlstore.YamlKey('one', 'a'), yamlstore.YamlKey('three', 'c')]
+        self.store.save(zip(keys, [1, 3]))
         state_data = self.store.restore(keys)
-        assert_equal(self.store.buffer, self.test_data)
 
         expected = {keys[0]: 1, keys[1]: 3}
         assert_equal(expected, state_data)
 
-    def test_restore_missing_type_key(self):
-        with open(self.filename, 'w') as fh:
-            yaml.dump(self.test_data, fh)
-
-        keys = [yamlstore.YamlKey('seven', 'a')]
-        state_data = self.store.restore(keys)
-        assert_equal(self.store.buffer, self.test_data)
+    def test_restore_only_requested_keys(self):
+        keys = [yamlstore.YamlKey('one', 'a'), yamlstore.YamlKey('two', 'b')]
+        self.store.save(zip(keys, [1, 2]))
+        with mock.patch.object(codec.yaml, 'load') as mock_load:
+            state_data = self.store.restore(keys[:1])
+        assert_equal(state_data, {keys[0]: mock_load.return_value})
+        assert_equal(mock_load.call_count, 1)
+
+    def test_restore_missing(self):
+        self.store.save([(yamlstore.YamlKey('one', 'a'), 1)])
+        state_data = self.store.restore([yamlstore.YamlKey('seven', 'a')])
         assert_equal({}, state_data)
 
-    def test_restore_file_missing(self):
-        state_data = self.store.restore(['some', 'keys'])
+    def test_restore_path_missing(self):
+        state_data = self.store.restore([yamlstore.YamlKey('some', 'keys')])
         assert_equal(state_data, {})
 
-    def test_save(self):
-        expected = {'one': {'five': 'dataz'}, 'two': {'seven': 'stars'}}
+    def test_restore_raw(self):
+        key = yamlstore.YamlKey('one', 'a')
+        self.store.save([(key, {'b': 1})])
+        raw = self.store.restore_raw([key])
+        assert_equal(yaml.load(raw[key]), {'b': 1})
+        assert_equal(self.store.codec.decode(raw[key]), {'b': 1})
 
+    def test_restore_legacy_file(self):
+        self._write_legacy_file()
+        keys = [yamlstore.YamlKey('one', 'a'), yamlstore.YamlKey('three', 'c')]
+        state_data = self.store.restore(keys)
+        assert_equal(state_data, {keys[0]: 1, keys[1]: 3})
+
+    def test_save(self):
         key_value_pairs = [
             (yamlstore.YamlKey('one', 'five'), 'barz')
         ]
@@ -64,15 +85,79 @@ class YamlStateStoreTestCase(TestCase):
         ]
         self.store.save(key_value_pairs)
 
-        assert_equal(self.store.buffer, expected)
-        with open(self.filename, 'r') as fh:
-            actual = yaml.load(fh)
-        assert_equal(actual, expected)
-
-
-
-
+        assert_equal(sorted(os.listdir(self.path)), ['one', 'two'])
+        assert_equal(self._read_shard('one', 'five'), 'dataz')
+        assert_equal(self._read_shard('two', 'seven'), 'stars')
+
+    def test_save_quotes_iden(self):
+        key = yamlstore.YamlKey('one', '../five')
+        self.store.save([(key, 'barz')])
+        assert_equal(os.listdir(os.path.join(self.path, 'one')),
+            ['..%2Ffive.yaml'])
+        assert_equal(self.store.restore([key]), {key: 'barz'})
+
+    def test_save_failure_keeps_shard(self):
+        key = yamlstore.YamlKey('one', 'five')
+        self.store.save([(key, 'barz')])
+        with mock.patch.object(codec.yaml, 'dump', side_effect=IOError):
+            assert_raises(IOError, self.store.save, [(key, 'dataz')])
+
+        assert_equal(os.listdir(os.path.join(self.path, 'one')), ['five.yaml'])
+        assert_equal(self.store.restore([key]), {key: 'barz'})
+
+    def test_save_delete(self):
+        key = yamlstore.YamlKey('one', 'five')
+        self.store.save([(key, 'barz')])
+        self.store.save([(key, None)])
+        assert_equal(os.listdir(os.path.join(self.path, 'one')), [])
+        assert_equal(self.store.restore([key]), {})
+
+    def test_save_converts_legacy_file(self):
+        self._write_legacy_file()
+        self.store.save([(yamlstore.YamlKey('two', 'b'), 5)])
+
+        assert os.path.isfile(self.path + '.old')
+        assert_equal(self._read_shard('one', 'a'), 1)
+        assert_equal(self._read_shard('two', 'b'), 5)
+        assert_equal(self._read_shard('three', 'c'), 3)
+        assert not os.path.exists(self.path + '.converting')
+
+    def test_save_convert_legacy_file_failure(self):
+        self._write_legacy_file()
+        key = yamlstore.YamlKey('two', 'b')
+        with mock.patch.object(codec.yaml, 'dump', side_effect=IOError):
+            assert_raises(IOError, self.store.save, [(key, 5)])
+
+        assert self.store.is_legacy_file
+        assert not os.path.exists(self.path + '.old')
+        assert_equal(self.store.restore([key]), {key: 2})
+
+        self.store.save([(key, 5)])
+        assert_equal(self.store.restore([key]), {key: 5})
+        assert_equal(self._read_shard('one', 'a'), 1)
+
+    def test_restore_finishes_conversion(self):
+        self._write_legacy_file()
+        converting_path = self.path + '.converting'
+        self.store._write_shard(
+            yamlstore.YamlKey('one', 'a'), 1, converting_path)
+        os.rename(self.path, self.path + '.old')
+
+        key = yamlstore.YamlKey('one', 'a')
+        assert_equal(self.store.restore([key]), {key: 1})
+        assert not os.path.exists(converting_path)
+
+    def test_restore_raw_finishes_conversion(self):
+        self._write_legacy_file()
+        converting_path = self.path + '.converting'
+        key = yamlstore.YamlKey('one', 'a')
+        self.store._write_shard(key, 1, converting_path)
+        os.rename(self.path, self.path + '.old')
+
+        raw = self.store.restore_raw([key])
+        assert_equal(self.store.codec.decode(raw[key]), 1)
+        assert not os.path.exists(converting_path)
 
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    run()
@@ -0,0 +1,230 @@
+import datetime
+import os
+import random
+import shutil
+import tempfile
+
+import mock
+from testify import TestCase, assert_equal, run, setup, teardown
+from testify import setup_teardown
+from twisted.internet import task
+
+from tests.assertions import assert_raises
+from tron import actioncommand, eventloop, event, node, simulation
+from tron.config import config_parse, manager, schema
+from tron.utils import timeutils
+
+
+class DistributionTestCase(TestCase):
+
+    def test_from_string(self):
+        distribution = simulation.Distribution.from_string('uniform:10,300')
+        assert_equal(distribution.name, 'uniform')
+        assert_equal(distribution.params, [10, 300])
+
+    def test_from_string_number(self):
+        distribution = simulation.Distribution.from_string(30)
+        assert_equal(distribution.name, 'constant')
+        assert_equal(distribution.sample(random.Random()), 30)
+
+    def test_from_string_unknown(self):
+        assert_raises(simulation.Error,
+            simulation.Distribution.from_string, 'bogus:3')
+
+    def test_from_string_invalid(self):
+        assert_raises(simulation.Error,
+            simulation.Distribution.from_string, 'uniform:a,b')
+
+    def test_sample_not_negative(self):
+        distribution = simulation.Distribution('normal', [-100, 1])
+        assert_equal(distribution.sample(random.Random(1)), 0)
+
+    def test_sample_wrong_params(self):
+        distribution = simulation.Distribution('uniform', [1])
+        assert_raises(simulation.Error, distribution.sample, random.Random())
+
+
+class GetActionNameTestCase(TestCase):
+
+    def test_get_action_name(self):
+        name = simulation.get_action_name('MASTER.job_name.23.action_name')
+        assert_equal(name, 'MASTER.job_name.action_name')
+
+
+class CommandModelTestCase(TestCase):
+
+    @setup
+    def setup_model(self):
+        config = {
+            'default':      'constant:60',
+            'failure_rate': 0.5,
+            'actions': {
+                'MASTER.*.load':        'constant:10',
+                'MASTER.nightly.load':  'constant:20',
+            },
+        }
+        self.model = simulation.CommandModel.from_config(config, seed=1)
+        self.command = mock.Mock(id='MASTER.nightly.3.load')
+
+    def test_get_distribution_longest_pattern(self):
+        distribution = self.model.get_distribution(self.command.id)
+        assert_equal(distribution.params, [20])
+
+    def test_get_distribution_default(self):
+        distribution = self.model.get_distribution('MASTER.other.3.copy')
+        assert_equal(distribution, self.model.default)
+
+    def test_start_and_exited(self):
+        results = [self.model.start(self.command) for _ in xrange(20)]
+        assert_equal(set(duration for duration, _ in results), set([20]))
+        assert_equal(set(status for _, status in results), set([0, 1]))
+        for _, exit_status in results:
+            self.model.exited(exit_status)
+
+        stats = self.model.get_stats()
+        assert_equal(stats['started'], 20)
+        assert_equal(stats['max_running'], 20)
+        assert_equal(stats['running'], 0)
+        assert_equal(stats['succeeded'] + stats['failed'], 20)
+
+    def test_seed(self):
+        other = simulation.CommandModel.from_config({'failure_rate': 0.5}, 1)
+        self.model.failure_rate = 0.5
+        results = [self.model.start(self.command)[1] for _ in xrange(10)]
+        assert_equal([other.start(self.command)[1] for _ in xrange(10)],
+            results)
+
+
+class SimulatedNodeTestCase(TestCase):
+
+    @setup_teardown
+    def setup_clock(self):
+        self.clock = task.Clock()
+        eventloop.set_clock(self.clock)
+        yield
+        eventloop.set_clock(None)
+
+    @setup
+    def setup_node(self):
+        self.model = simulation.CommandModel(
+            simulation.Distribution('constant', [30]))
+        node_settings = mock.Mock(jitter_load_factor=1, jitter_min_load=4,
+            jitter_max_delay=20)
+        self.node = simulation.SimulatedNode(self.model,
+            mock.Mock(), mock.Mock(), None, node_settings)
+        self.command = actioncommand.ActionCommand('MASTER.job.1.act', 'do')
+
+    def test_run(self):
+        deferred = self.node.run(self.command)
+        callback = mock.Mock()
+        deferred.addCallback(callback)
+        assert_equal(self.command.state, actioncommand.ActionCommand.RUNNING)
+
+        self.clock.advance(30)
+        assert self.command.is_complete
+        callback.assert_called_with(0)
+        assert_equal(self.node.run_states, {})
+        assert_equal(self.model.get_stats()['succeeded'], 1)
+
+    def test_run_already_running(self):
+        self.node.run(self.command)
+        assert_raises(node.Error, self.node.run, self.command)
+
+    def test_stop(self):
+        self.node.submit_command(self.command)
+        self.node.stop(self.command)
+        assert self.command.is_done
+        assert_equal(self.command.exit_status, None)
+        assert_equal(self.node.exit_timers, {})
+        assert_equal(self.model.get_stats()['stopped'], 1)
+        self.clock.advance(30)
+        assert_equal(self.model.get_stats()['succeeded'], 0)
+
+
+class SimulatedMasterControlProgramTestCase(TestCase):
+
+    @setup
+    def setup_mcp(self):
+        self.mcp = simulation.SimulatedMasterControlProgram(
+            tempfile.mkdtemp(), tempfile.mkdtemp())
+
+    @teardown
+    def teardown_mcp(self):
+        event.EventManager.reset()
+        shutil.rmtree(self.mcp.working_dir)
+        shutil.rmtree(self.mcp.config.config_path)
+
+    def test_update_state_watcher_config_remote_store(self):
+        state_config = schema.ConfigState('state', 'mongo',
+            *[None] * len(schema.ConfigState.optional_keys))
+        with mock.patch.object(self.mcp.state_watcher, 'update_from_config',
+                autospec=True) as mock_update:
+            mock_update.return_value = False
+            self.mcp.update_state_watcher_config(state_config)
+        expected = state_config._replace(store_type='sqlite')
+        mock_update.assert_called_with(expected)
+
+
+class SimulationTestCase(TestCase):
+
+    config = """
+ssh_options:
+    agent: true
+nodes:
+    - name: node0
+      hostname: localhost
+jobs:
+    - name: hourly
+      node: node0
+      schedule: "cron 0 * * * *"
+      actions:
+        - name: first
+          command: "do something"
+        - name: second
+          command: "do something else"
+          requires: [first]
+"""
+
+    @setup_teardown
+    def setup_simulation(self):
+        self.config_dir = tempfile.mkdtemp()
+        self.config_path = os.path.join(self.config_dir, 'config')
+        manager.create_new_config(self.config_path, self.config)
+        model = simulation.CommandModel(
+            simulation.Distribution('constant', [600]))
+        start_time = datetime.datetime(2013, 3, 14, 0, 30)
+        self.simulation = simulation.Simulation(
+            self.config_path, model, start_time, seed=1)
+        environ = dict(os.environ)
+        environ.pop('SSH_AUTH_SOCK', None)
+        with mock.patch.object(node.KnownHosts, 'from_path', autospec=True):
+            with mock.patch.dict(os.environ, environ, clear=True):
+                self.simulation.setup()
+        yield
+        self.simulation.cleanup()
+        node.NodePoolRepository.get_instance().clear()
+        event.EventManager.reset()
+        shutil.rmtree(self.config_dir)
+
+    def test_run(self):
+        self.simulation.run(3 * 3600)
+        report = self.simulation.get_report()
+        assert_equal(report['simulated_seconds'], 3 * 3600)
+        assert_equal(report['end_time'], datetime.datetime(2013, 3, 14, 3, 30))
+        # Runs at 1:00, 2:00 and 3:00, with both actions done by 3:20
+        assert_equal(report['commands']['started'], 6)
+        assert_equal(report['commands']['succeeded'], 6)
+        assert_equal(report['queue_depth']['max'], 0)
+
+    def test_cleanup(self):
+        working_dir = self.simulation.working_dir
+        self.simulation.cleanup()
+        self.simulation.mcp = None
+        assert not os.path.exists(working_dir)
+        assert eventloop.timer_queue.clock is eventloop.reactor
+        assert_equal(timeutils.clock, None)
+        assert config_parse.valid_ssh_options.require_agent
+
+
+if __name__ == '__main__':
+    run()
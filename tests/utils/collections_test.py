@@ -74,6 +74,37 @@ class MappingCollectionsTestCase(TestCase):
         self.collection.add.assert_called_with(item, self.collection.remove_item)
 
 
+class UpdateMembershipTestCase(TestCase):
+
+    def test_update_membership(self):
+        items = set(['one'])
+        collections.update_membership(items, 'two', True)
+        collections.update_membership(items, 'one', False)
+        collections.update_membership(items, 'three', False)
+        assert_equal(items, set(['two']))
+
+
+class StringTableTestCase(TestCase):
+
+    @setup
+    def setup_table(self):
+        self.table = collections.StringTable(['one'])
+
+    def test_add(self):
+        assert_equal(self.table.add('two'), 1)
+        assert_equal(self.table.add('one'), 0)
+        assert_equal(self.table.add('two'), 1)
+        assert_equal(self.table.strings, ['one', 'two'])
+
+    def test_add_none(self):
+        assert_equal(self.table.add(None), None)
+        assert_equal(len(self.table), 1)
+
+    def test_get(self):
+        assert_equal(self.table.get(0), 'one')
+        assert_equal(self.table.get(None), None)
+
+
 class EnumTestCase(TestCase):
 
     @setup
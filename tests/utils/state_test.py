@@ -123,3 +123,56 @@ class NamedEventByNameTestCase(TestCase):
 
     def test_miss(self):
         assert_raises(ValueError, state.named_event_by_name, self.start, 'x')
+
+
+class StateTableTestCase(TestCase):
+
+    @setup
+    def build_table(self):
+        self.state_green = NamedEventState('green')
+        self.state_yellow = NamedEventState('yellow', stop=self.state_green)
+        self.state_red = NamedEventState('red', go=self.state_yellow,
+            stop=self.state_green)
+        self.table = state.StateTable(self.state_red)
+
+    def test__init__(self):
+        assert_equal(self.table.transitions, frozenset(['go', 'stop']))
+        assert_equal(set(self.table.state_by_name),
+            set(['red', 'yellow', 'green']))
+        assert_equal(len(self.table.states), 3)
+
+    def test_get_state(self):
+        assert_equal(self.table.get_state('yellow'), self.state_yellow)
+        assert_raises(ValueError, self.table.get_state, 'blue')
+
+    def test_machine_transitions(self):
+        machine = state.StateMachine(self.state_red, table=self.table)
+        assert_equal(machine.transitions, self.table.transitions)
+
+    def test_add_attributes(self):
+        class Light(object):
+            def __init__(self, machine):
+                self.machine = machine
+
+            def stop(self):
+                return 'stopped'
+
+        self.table.add_attributes(Light, lambda light: light.machine)
+        light = Light(state.StateMachine(self.state_red))
+        assert light.is_red
+        assert not light.is_yellow
+        assert light.go()
+        assert light.is_yellow
+        assert_equal(light.stop(), 'stopped')
+
+    def test_add_attributes_without_transitions(self):
+        class LightRecord(object):
+            def __init__(self, state):
+                self.state = state
+
+        self.table.add_attributes(LightRecord, lambda light: light,
+            include_transitions=False)
+        light = LightRecord(self.state_yellow)
+        assert light.is_yellow
+        assert not light.is_red
+        assert not hasattr(light, 'go')
@@ -1,5 +1,6 @@
 import datetime
-from testify import TestCase, assert_equal, setup
+import mock
+from testify import TestCase, assert_equal, setup, teardown
 from tests import testingutils
 
 from tron.utils import timeutils
@@ -205,4 +206,37 @@ class DateArithmeticTestCase(testingutils.MockTimeTestCase):
         assert_equal(DateArithmetic.parse('daynumber-1'), daynum)
 
     def test_bad_date_format(self):
-        assert DateArithmetic.parse('~~') is None
\ No newline at end of file
+        assert DateArithmetic.parse('~~') is None
+
+class SetClockTestCase(TestCase):
+
+    @teardown
+    def restore_clock(self):
+        timeutils.set_clock(None)
+
+    def test_current_time_from_clock(self):
+        clock = mock.Mock()
+        clock.seconds.return_value = 1331730000
+        timeutils.set_clock(clock)
+        assert_equal(timeutils.current_time(),
+            datetime.datetime.fromtimestamp(1331730000))
+
+
+class StepTimerTestCase(TestCase):
+
+    @setup
+    def setup_timer(self):
+        self.timer = timeutils.StepTimer()
+
+    def test_time(self):
+        with mock.patch('tron.utils.timeutils.time.time', side_effect=[1, 3]):
+            with self.timer.time('load'):
+                pass
+        assert_equal(self.timer.durations, {'load': 2})
+
+    def test_add(self):
+        self.timer.add('load', 2)
+        self.timer.add('apply', 1.5)
+        self.timer.add('load', 1)
+        assert_equal(self.timer.durations.items(), [('load', 3), ('apply', 1.5)])
+        assert_equal(str(self.timer), "load=3.000s, apply=1.500s")
@@ -1,6 +1,8 @@
 import datetime
+import random
 
-from testify import run, assert_equal, TestCase
+import pytz
+from testify import run, assert_equal, setup, TestCase
 from tron.utils import trontimespec
 
 
@@ -120,5 +122,149 @@ class TimeSpecificationTestCase(TestCase):
         assert_equal(time, datetime.time(1, 20, 4))
 
 
+class NextBitTestCase(TestCase):
+
+    def test_next_bit(self):
+        mask = trontimespec.to_mask([3, 10, 20])
+        assert_equal(trontimespec.next_bit(mask, 0), 3)
+        assert_equal(trontimespec.next_bit(mask, 3), 3)
+        assert_equal(trontimespec.next_bit(mask, 11), 20)
+        assert_equal(trontimespec.next_bit(mask, 21), None)
+
+
+class CompiledTimeSpecificationTestCase(TestCase):
+
+    def test_day_mask_last(self):
+        time_spec = trontimespec.CompiledTimeSpecification(
+            monthdays=[5, 'LAST'])
+        assert_equal(time_spec.day_mask(2012, 2),
+            trontimespec.to_mask([5, 29]))
+
+    def test_next_time(self):
+        time_spec = trontimespec.CompiledTimeSpecification(
+            minutes=[20, 30], hours=[1, 5], seconds=[4, 5])
+        start_date = datetime.datetime(2012, 3, 14, 1, 30, 4, 10)
+        assert_equal(time_spec.next_time(start_date, True),
+            datetime.time(1, 30, 5))
+        start_date = datetime.datetime(2012, 3, 14, 5, 30, 6)
+        assert time_spec.next_time(start_date, True) is None
+        assert_equal(time_spec.next_time(start_date, False),
+            datetime.time(1, 20, 4))
+
+    def test_get_match_no_match(self):
+        time_spec = trontimespec.CompiledTimeSpecification(
+            months=[2], monthdays=[30])
+        time_spec.max_months = 24
+        assert_equal(time_spec.get_match(datetime.datetime(2012, 1, 1)), None)
+
+
+def get_match_or_error(time_spec, start):
+    """Return the match, or the type of error raised by get_match(). Both
+    implementations share handle_timezone(), which can raise for times which
+    do not exist because of DST.
+    """
+    try:
+        return time_spec.get_match(start)
+    except ValueError, e:
+        return type(e)
+
+
+class TimeSpecificationEquivalenceTestCase(TestCase):
+    """Compare CompiledTimeSpecification to TimeSpecification for random
+    cron, groc and daily specifications and start times, including start
+    times around DST transitions.
+    """
+
+    timezones = [None, 'US/Pacific', 'Europe/London', 'Australia/Sydney']
+    dst_transitions = [
+        datetime.datetime(2012, 3, 11, 2, 30),
+        datetime.datetime(2012, 11, 4, 1, 30),
+        datetime.datetime(2013, 3, 31, 1, 30),
+        datetime.datetime(2013, 10, 27, 1, 30),
+        datetime.datetime(2013, 4, 7, 2, 30),
+        datetime.datetime(2013, 10, 6, 2, 30),
+    ]
+
+    @setup
+    def setup_random(self):
+        self.random = random.Random(4321)
+
+    def sample(self, values, max_count):
+        return self.random.sample(values, self.random.randint(1, max_count))
+
+    def build_cron_spec(self):
+        spec = {
+            'minutes':      self.sample(range(60), 4),
+            'hours':        self.sample(range(24), 4),
+            'seconds':      [0],
+        }
+        if self.random.random() < 0.5:
+            spec['monthdays'] = self.sample(range(1, 29) + ['LAST'], 3)
+        else:
+            spec['weekdays'] = self.sample(range(7), 3)
+        if self.random.random() < 0.5:
+            spec['months'] = self.sample(range(1, 13), 4)
+        return spec
+
+    def build_groc_spec(self):
+        spec = {'timestr': '%02d:%02d' % (
+            self.random.randint(0, 23), self.random.randint(0, 59))}
+        choice = self.random.random()
+        if choice < 0.4:
+            spec['weekdays'] = self.sample(range(7), 3)
+            spec['ordinals'] = self.sample(range(1, 6), 3)
+        elif choice < 0.8:
+            spec['monthdays'] = self.sample(range(1, 29), 3)
+        if self.random.random() < 0.5:
+            spec['months'] = self.sample(range(1, 13), 4)
+        return spec
+
+    def build_daily_spec(self):
+        spec = {
+            'hours':        [self.random.randint(0, 23)],
+            'minutes':      [self.random.randint(0, 59)],
+            'seconds':      [self.random.randint(0, 59)],
+        }
+        if self.random.random() < 0.5:
+            spec['weekdays'] = self.sample(range(7), 4)
+        return spec
+
+    def build_start_time(self, timezone):
+        if self.random.random() < 0.5:
+            start = self.random.choice(self.dst_transitions)
+            start += datetime.timedelta(
+                minutes=self.random.randint(-180, 180))
+        else:
+            start = datetime.datetime(2012, 1, 1) + datetime.timedelta(
+                seconds=self.random.randint(0, 3 * 365 * 24 * 3600))
+        if timezone and self.random.random() < 0.5:
+            start = pytz.utc.localize(start)
+        return start
+
+    def assert_equivalent(self, build_spec):
+        for _ in xrange(200):
+            timezone = self.random.choice(self.timezones)
+            spec = dict(build_spec(), timezone=timezone)
+            reference = trontimespec.TimeSpecification(**spec)
+            compiled = trontimespec.CompiledTimeSpecification(**spec)
+            start = self.build_start_time(timezone)
+            for _ in xrange(3):
+                expected = get_match_or_error(reference, start)
+                assert_equal(get_match_or_error(compiled, start), expected,
+                    message="%s from %s" % (spec, start))
+                if not isinstance(expected, datetime.datetime):
+                    break
+                start = expected
+
+    def test_cron(self):
+        self.assert_equivalent(self.build_cron_spec)
+
+    def test_groc(self):
+        self.assert_equivalent(self.build_groc_spec)
+
+    def test_daily(self):
+        self.assert_equivalent(self.build_daily_spec)
+
+
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    run()
@@ -0,0 +1,41 @@
+import mock
+from testify import TestCase, run, setup, teardown, assert_equal
+from twisted.internet import defer, task
+
+from tron import eventloop
+from tron.utils import twistedutils
+
+
+class DeferTimeoutTestCase(TestCase):
+
+    @setup
+    def setup_queue(self):
+        self.clock = task.Clock()
+        self.patcher = mock.patch('tron.eventloop.timer_queue',
+            eventloop.TimerQueue(self.clock))
+        self.patcher.start()
+        self.deferred = defer.Deferred()
+        self.errback = mock.Mock()
+        self.deferred.addErrback(self.errback)
+
+    @teardown
+    def teardown_queue(self):
+        self.patcher.stop()
+
+    def test_timeout(self):
+        timer = twistedutils.defer_timeout(self.deferred, 20)
+        self.clock.advance(20)
+        assert not timer.active()
+        assert_equal(self.errback.call_count, 1)
+
+    def test_cancelled_on_success(self):
+        timer = twistedutils.defer_timeout(self.deferred, 20)
+        self.deferred.callback('ok')
+        assert not timer.active()
+        assert not self.clock.getDelayedCalls()
+        self.clock.advance(20)
+        assert not self.errback.mock_calls
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,115 @@
+"""
+ Benchmark running every action of a job run with wide and deep action
+ graphs. After each action succeeds the startable actions are found and the
+ collection is checked to see if it is done, like
+ JobRun.handle_action_run_state_change. The indexed ActionRunCollection is
+ compared with checking the requirements of every run after each change.
+
+Usage:
+
+python tools/benchmark/action_dag.py --actions 100 --actions 500
+"""
+import optparse
+import time
+
+from tron.core import action, actiongraph
+from tron.core.actionrun import ActionRun, ActionRunCollection
+
+
+def parse_options():
+    parser = optparse.OptionParser()
+    parser.add_option("--actions", action="append", type="int",
+        help="Number of actions in each graph. May be given more than once.")
+    opts, _ = parser.parse_args()
+    opts.actions = opts.actions or [50, 200, 500]
+    return opts
+
+
+def build_wide_graph(num_actions):
+    """One action, which is required by num_actions - 2 actions, which are
+    all required by the last action.
+    """
+    first = action.Action('first', 'true', None)
+    middle = [
+        action.Action('middle%d' % i, 'true', None, required_actions=[first])
+        for i in xrange(num_actions - 2)]
+    last = action.Action('last', 'true', None, required_actions=middle)
+    return [first] + middle + [last]
+
+
+def build_deep_graph(num_actions):
+    """A chain of num_actions actions, which each require the previous one."""
+    actions = [action.Action('action0', 'true', None)]
+    for i in xrange(1, num_actions):
+        actions.append(action.Action('action%d' % i, 'true', None,
+            required_actions=[actions[-1]]))
+    return actions
+
+
+def build_collection(actions):
+    action_map = dict((a.name, a) for a in actions)
+    graph = actiongraph.ActionGraph(
+        [a for a in actions if not a.required_actions], action_map)
+    run_map = dict(
+        (a.name, ActionRun('MASTER.job.1', a.name, None, a.command))
+        for a in actions)
+    return ActionRunCollection(graph, run_map)
+
+
+def scan_startable(collection):
+    return [run for run in collection.action_runs
+            if run.check_state('start') and not collection._is_run_blocked(run)]
+
+
+def scan_is_done(collection):
+    if any(run.is_running for run in collection.action_runs_with_cleanup):
+        return False
+    return all(run.is_done or collection._is_run_blocked(run)
+               for run in collection.action_runs)
+
+
+def indexed_startable(collection):
+    return collection.get_startable_action_runs()
+
+
+def indexed_is_done(collection):
+    return collection.is_done
+
+
+def start_runs(action_runs):
+    for action_run in action_runs:
+        action_run.machine.transition('start')
+        action_run.machine.transition('started')
+    return list(action_runs)
+
+
+def timed_run(collection, get_startable, is_done):
+    """Run every action, and return the time in milliseconds."""
+    start_time = time.time()
+    running = start_runs(get_startable(collection))
+    while running:
+        running.pop().machine.transition('success')
+        running.extend(start_runs(get_startable(collection)))
+        is_done(collection)
+    assert is_done(collection)
+    return (time.time() - start_time) * 1000
+
+
+def main():
+    opts = parse_options()
+    print "milliseconds to run every action of a job run"
+    print "%-8s %8s %10s %10s" % ("graph", "actions", "scan", "indexed")
+
+    for name, build_graph in [
+            ('wide', build_wide_graph), ('deep', build_deep_graph)]:
+        for num_actions in opts.actions:
+            actions = build_graph(num_actions)
+            print "%-8s %8d %10.1f %10.1f" % (name, num_actions,
+                timed_run(build_collection(actions),
+                    scan_startable, scan_is_done),
+                timed_run(build_collection(actions),
+                    indexed_startable, indexed_is_done))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+ Benchmark the memory used by finished job runs which are kept in a
+ JobRunCollection, as full JobRuns and as frozen CompletedJobRuns. Memory is
+ measured as the number of objects tracked by the garbage collector.
+
+Usage:
+
+python tools/benchmark/completed_runs.py --runs 50 --actions 20
+"""
+import datetime
+import gc
+import optparse
+import time
+
+from tron.core import action, actiongraph
+from tron.core.actionrun import ActionRun, ActionRunFactory
+from tron.core.jobrun import JobRun, CompletedJobRun
+
+
+def parse_options():
+    parser = optparse.OptionParser()
+    parser.add_option("--runs", type="int", default=50,
+        help="Number of finished runs to keep.")
+    parser.add_option("--actions", type="int", default=20,
+        help="Number of actions in each run.")
+    opts, _ = parser.parse_args()
+    return opts
+
+
+def build_graph(num_actions):
+    actions = [action.Action('action%d' % i, 'true', None)
+               for i in xrange(num_actions)]
+    return actiongraph.ActionGraph(actions, dict((a.name, a) for a in actions))
+
+
+def build_finished_run(graph, run_num):
+    job_run = JobRun('MASTER.job', run_num, datetime.datetime.now(), None,
+        action_graph=graph)
+    job_run.action_runs = ActionRunFactory.build_action_run_collection(
+        job_run, None)
+    for action_run in job_run.action_runs:
+        action_run.machine.state = ActionRun.STATE_SUCCEEDED
+        job_run.action_runs.handler(action_run, None)
+    return job_run
+
+
+def measure(build_runs):
+    """Return the number of objects and the time in milliseconds to build
+    the runs.
+    """
+    gc.collect()
+    count = len(gc.get_objects())
+    start_time = time.time()
+    runs = build_runs()
+    elapsed = (time.time() - start_time) * 1000
+    gc.collect()
+    return len(gc.get_objects()) - count, elapsed, runs
+
+
+def main():
+    opts = parse_options()
+    graph = build_graph(opts.actions)
+
+    def build_job_runs():
+        return [build_finished_run(graph, i) for i in xrange(opts.runs)]
+
+    full_objects, full_time, job_runs = measure(build_job_runs)
+
+    def freeze_job_runs():
+        return [CompletedJobRun.from_job_run(r) for r in job_runs]
+
+    frozen_objects, freeze_time, _ = measure(freeze_job_runs)
+
+    print "%d runs with %d actions" % (opts.runs, opts.actions)
+    print "%-16s %12s %12s" % ("", "objects", "ms")
+    print "%-16s %12d %12.1f" % ("JobRun", full_objects, full_time)
+    print "%-16s %12d %12.1f" % ("CompletedJobRun", frozen_objects, freeze_time)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+ Benchmark encoding and decoding JobRunCollection.state_data with each
+ state codec, and the legacy yaml.dump/yaml.load encoding.
+
+Usage:
+
+python tools/benchmark/state_codec.py --runs 50 --iterations 20
+"""
+import datetime
+import optparse
+import time
+
+import yaml
+
+from tron.serialize.runstate import codec
+
+
+CODEC_NAMES = [
+    'json', 'pickle', 'yaml', 'zlib+json', 'zlib+pickle', 'base64+zlib+pickle']
+
+
+def parse_options():
+    parser = optparse.OptionParser()
+    parser.add_option("--runs", type="int", default=50,
+        help="Number of job runs in the collection.")
+    parser.add_option("--actions", type="int", default=5,
+        help="Number of actions in each job run.")
+    parser.add_option("--iterations", type="int", default=20,
+        help="Number of times to encode and decode the state.")
+    opts, _ = parser.parse_args()
+    return opts
+
+
+def build_action_run_state(job_run_id, action_name, now):
+    command = 'run_batch --date %s %s' % (now.date(), action_name)
+    return {
+        'job_run_id':       job_run_id,
+        'action_name':      action_name,
+        'state':            'succeeded',
+        'start_time':       now,
+        'end_time':         now + datetime.timedelta(seconds=30),
+        'command':          command,
+        'rendered_command': command,
+        'node_name':        'batch1',
+        'exit_status':      0,
+    }
+
+
+def build_job_run_collection_state(num_runs, num_actions):
+    """Return state_data shaped like JobRunCollection.state_data."""
+    now = datetime.datetime.now()
+    def build_run(run_num):
+        job_run_id = 'MASTER.job_name.%s' % run_num
+        run_time = now - datetime.timedelta(days=run_num)
+        return {
+            'job_name':     'MASTER.job_name',
+            'run_num':      run_num,
+            'run_time':     run_time,
+            'node_name':    'batch1',
+            'runs':         [
+                build_action_run_state(job_run_id, 'action%d' % i, run_time)
+                for i in xrange(num_actions)],
+            'cleanup_run':  build_action_run_state(
+                                job_run_id, 'cleanup', run_time),
+            'manual':       False,
+        }
+    return [build_run(run_num) for run_num in xrange(num_runs, 0, -1)]
+
+
+class LegacyYamlCodec(object):
+    name = 'legacy yaml'
+
+    def encode(self, state_data):
+        return yaml.dump(state_data)
+
+    def decode(self, data):
+        return yaml.load(data, Loader=yaml.Loader)
+
+
+def timed(func, arg, iterations):
+    start_time = time.time()
+    for _ in xrange(iterations):
+        result = func(arg)
+    return (time.time() - start_time) / iterations * 1000, result
+
+
+def run_benchmark(state_codec, state_data, iterations):
+    encode_time, data = timed(state_codec.encode, state_data, iterations)
+    decode_time, _ = timed(state_codec.decode, data, iterations)
+    print "%-20s %10.2f %10.2f %10d" % (
+        state_codec.name, encode_time, decode_time, len(data))
+
+
+def main():
+    opts = parse_options()
+    state_data = build_job_run_collection_state(opts.runs, opts.actions)
+    print "%d runs with %d actions, %d iterations" % (
+        opts.runs, opts.actions, opts.iterations)
+    print "%-20s %10s %10s %10s" % ("codec", "encode ms", "decode ms", "bytes")
+
+    run_benchmark(LegacyYamlCodec(), state_data, opts.iterations)
+    for name in CODEC_NAMES:
+        run_benchmark(codec.get_codec(name), state_data, opts.iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+ Benchmark ActionRun state checks and transitions, and JobRun.state, which
+ checks the state of every ActionRun in the JobRun.
+
+Usage:
+
+python tools/benchmark/state_machine.py --actions 20 --repeat 10000
+"""
+import datetime
+import optparse
+import time
+
+from tron.core import action, actiongraph
+from tron.core.actionrun import ActionRunFactory
+from tron.core.jobrun import JobRun
+
+
+def parse_options():
+    parser = optparse.OptionParser()
+    parser.add_option("--actions", type="int", default=20,
+        help="Number of actions in the JobRun.")
+    parser.add_option("--repeat", type="int", default=10000,
+        help="Number of times to repeat each measurement.")
+    opts, _ = parser.parse_args()
+    return opts
+
+
+def build_job_run(num_actions):
+    actions = [action.Action('action%d' % i, 'true', None)
+               for i in xrange(num_actions)]
+    graph = actiongraph.ActionGraph(actions, dict((a.name, a) for a in actions))
+    job_run = JobRun('MASTER.job', 1, datetime.datetime.now(), None,
+        action_graph=graph)
+    job_run.action_runs = ActionRunFactory.build_action_run_collection(
+        job_run, None)
+    return job_run
+
+
+def timed(func, count):
+    """Return the time in microseconds to call func."""
+    start_time = time.time()
+    for _ in xrange(count):
+        func()
+    return (time.time() - start_time) / count * 1000000
+
+
+def timed_transitions(num_actions, count):
+    """Return the time in microseconds for each transition of an ActionRun
+    in a JobRun, which notifies the ActionRunCollection and the JobRun.
+    """
+    elapsed, transitions = 0, 0
+    for _ in xrange(max(count / num_actions, 1)):
+        job_run = build_job_run(num_actions)
+        job_run.handler = lambda action_run, event: None
+        start_time = time.time()
+        for action_run in job_run.action_runs.action_runs:
+            for name in ['ready', 'start', 'started', 'success']:
+                action_run.machine.transition(name)
+                transitions += 1
+        elapsed += time.time() - start_time
+    return elapsed / transitions * 1000000
+
+
+def main():
+    opts = parse_options()
+    job_run = build_job_run(opts.actions)
+    action_run = job_run.action_runs.run_map['action0']
+
+    print "microseconds per call, %d actions" % opts.actions
+    results = [
+        ("ActionRun.is_running",
+            timed(lambda: action_run.is_running, opts.repeat)),
+        ("ActionRun.is_done",
+            timed(lambda: action_run.is_done, opts.repeat)),
+        ("ActionRun transition",
+            timed_transitions(opts.actions, opts.repeat)),
+        ("JobRun.state",
+            timed(lambda: job_run.state, opts.repeat / 10)),
+        ("JobRun.is_scheduled",
+            timed(lambda: job_run.is_scheduled, opts.repeat)),
+    ]
+    for name, result in results:
+        print "%-24s %10.2f" % (name, result)
+
+
+if __name__ == "__main__":
+    main()
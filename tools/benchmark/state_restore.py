@@ -0,0 +1,92 @@
+"""
+ Benchmark saving and restoring job state with a state store.
+
+Usage:
+
+python tools/benchmark/state_restore.py --jobs 1000 --jobs 10000 \
+    --connection-details sqlite:////tmp/tron_bench.db
+"""
+import datetime
+import optparse
+import os
+import tempfile
+import time
+
+from tron.serialize import runstate
+from tron.serialize.runstate.sqlalchemystore import SQLAlchemyStateStore
+
+
+def parse_options():
+    parser = optparse.OptionParser()
+    parser.add_option("--jobs", action="append", type="int",
+        help="Number of jobs to restore. May be given more than once.")
+    parser.add_option("--runs", type="int", default=5,
+        help="Number of runs in the state of each job.")
+    parser.add_option("--connection-details",
+        help="SQLAlchemy database URL. Defaults to a temporary sqlite file.")
+    opts, _ = parser.parse_args()
+    opts.jobs = opts.jobs or [1000, 10000]
+    return opts
+
+
+def build_job_state(num_runs=5):
+    now = datetime.datetime.now()
+    return {
+        'enabled': True,
+        'runs': [{
+            'job_name':     'MASTER.job',
+            'run_num':      run_num,
+            'run_time':     now,
+            'node_name':    'node0',
+            'manual':       False,
+            'runs': [{
+                'action_name':  'action%d' % i,
+                'state':        'succeeded',
+                'start_time':   now,
+                'end_time':     now,
+                'command':      'echo %d' % i,
+                'node_name':    'node0',
+                'exit_status':  0,
+            } for i in xrange(3)],
+            'cleanup_run':  None,
+        } for run_num in xrange(num_runs)],
+    }
+
+
+def timed(func, *args):
+    start_time = time.time()
+    func(*args)
+    return time.time() - start_time
+
+
+def run_benchmark(connection_details, num_jobs, num_runs):
+    store = SQLAlchemyStateStore('benchmark', connection_details)
+    try:
+        keys = [store.build_key(runstate.JOB_STATE, 'MASTER.job%d' % i)
+                for i in xrange(num_jobs)]
+        state_data = build_job_state(num_runs)
+        save_time = timed(store.save, [(key, state_data) for key in keys])
+        restore_time = timed(store.restore, keys)
+    finally:
+        store.cleanup()
+    print "%6d jobs: save %.3fs restore %.3fs" % (
+        num_jobs, save_time, restore_time)
+
+
+def main():
+    opts = parse_options()
+    for num_jobs in opts.jobs:
+        if opts.connection_details:
+            run_benchmark(opts.connection_details, num_jobs, opts.runs)
+            continue
+
+        fd, filename = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        try:
+            run_benchmark('sqlite:///%s' % filename, num_jobs, opts.runs)
+        finally:
+            os.unlink(filename)
+
+
+if __name__ == "__main__":
+    main()
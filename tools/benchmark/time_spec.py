@@ -0,0 +1,90 @@
+"""
+ Benchmark finding the next matches of cron, groc and daily schedules with
+ TimeSpecification and CompiledTimeSpecification, and finding the same
+ match repeatedly with a GeneralScheduler, which caches the next matches.
+
+Usage:
+
+python tools/benchmark/time_spec.py --matches 1000
+"""
+import datetime
+import optparse
+import time
+
+import pytz
+
+from tron import scheduler
+from tron.utils import trontimespec
+
+
+SPECS = [
+    ('cron */5 * * * *',        dict(minutes=range(0, 60, 5), seconds=[0])),
+    ('cron 30 2 * * 1-5',       dict(minutes=[30], hours=[2], seconds=[0],
+                                     weekdays=range(1, 6))),
+    ('cron 0 0 1,LAST * *',     dict(minutes=[0], hours=[0], seconds=[0],
+                                     monthdays=[1, 'LAST'])),
+    ('groc 2nd mon of month',   dict(timestr='04:00', weekdays=[1],
+                                     ordinals=[2])),
+    ('groc every day',          dict(timestr='14:30',
+                                     timezone='US/Pacific')),
+    ('daily 10:00:00 MWF',      dict(hours=[10], minutes=[0], seconds=[0],
+                                     weekdays=[1, 3, 5])),
+]
+
+
+def parse_options():
+    parser = optparse.OptionParser()
+    parser.add_option("--matches", type="int", default=1000,
+        help="Number of consecutive matches to find for each spec.")
+    opts, _ = parser.parse_args()
+    return opts
+
+
+def timed_matches(get_match, start, count):
+    """Find count consecutive matches, each from the previous match, like a
+    job scheduling each run from the run_time of the previous run.
+    """
+    start_time = time.time()
+    for _ in xrange(count):
+        start = get_match(start)
+    return (time.time() - start_time) / count * 1000000
+
+
+def timed_repeat(get_match, start, count):
+    """Find the match after start count times, like a job which is scheduled
+    again before its next run, or a status request for the next run.
+    """
+    start_time = time.time()
+    for _ in xrange(count):
+        get_match(start)
+    return (time.time() - start_time) / count * 1000000
+
+
+def build_scheduler(spec):
+    spec = dict(spec)
+    timezone = spec.pop('timezone', None)
+    if timezone:
+        spec['time_zone'] = pytz.timezone(timezone)
+    return scheduler.GeneralScheduler(**spec)
+
+
+def main():
+    opts = parse_options()
+    start = datetime.datetime(2013, 1, 1)
+    print "%d matches for each spec, microseconds per match" % opts.matches
+    print "%-24s %10s %10s %10s %10s" % (
+        "spec", "original", "compiled", "repeat", "cached")
+
+    for name, spec in SPECS:
+        original = trontimespec.TimeSpecification(**spec)
+        compiled = trontimespec.CompiledTimeSpecification(**spec)
+        sched = build_scheduler(spec)
+        print "%-24s %10.1f %10.1f %10.1f %10.1f" % (name,
+            timed_matches(original.get_match, start, opts.matches),
+            timed_matches(compiled.get_match, start, opts.matches),
+            timed_repeat(compiled.get_match, start, opts.matches),
+            timed_repeat(sched.get_match, start, opts.matches))
+
+
+if __name__ == "__main__":
+    main()
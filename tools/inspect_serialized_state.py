@@ -8,10 +8,14 @@ Count of services
 Table of Jobs with start date of last run
 Table of Services with state and instance count
 
+State is read from the store in chunks of --chunk-size keys, in a single pass.
 """
 import optparse
 from tron.config import manager
+from tron.core import jobrun
+from tron.serialize import runstate
 from tron.serialize.runstate import statemanager
+from tron.serialize.runstate.statestream import StateStream
 from tron.utils import tool_utils
 
 
@@ -20,6 +24,8 @@ def parse_options():
     parser.add_option("-c", "--config-path", help="Path to the configuration.")
     parser.add_option("-w", "--working-dir", default=".",
         help="Working directory to resolve relative paths.")
+    parser.add_option("--chunk-size", type="int", default=500,
+        help="Number of keys to read from the store at a time.")
     opts, _ = parser.parse_args()
 
     if not opts.config_path:
@@ -32,59 +38,94 @@ def get_container(config_path):
     return config_manager.load()
 
 
-def get_state(container):
+def get_stream(container, chunk_size):
     config          = container.get_master().state_persistence
-    state_manager   = statemanager.PersistenceManagerFactory.from_config(config)
-    names           = container.get_job_and_service_names()
-    return state_manager.restore(*names)
+    factory         = statemanager.PersistenceManagerFactory
+    store           = factory.store_from_config(config)
+    job_names, service_names = container.get_job_and_service_names()
+    return StateStream(store, job_names, service_names, chunk_size)
 
 
 def format_date(date_string):
     return date_string.strftime("%Y-%m-%d %H:%M:%S") if date_string else None
 
 
-def format_jobs(job_states):
-    format = "%-30s %-8s %-5s %s\n"
-    header = format % ("Name", "Enabled", "Runs", "Last Update")
-
-    def max_run(item):
-        start_time = filter(None, (run['start_time'] for run in item))
-        return max(start_time) if start_time else None
-
-    def build(name, job):
-        start_times = (max_run(job_run['runs']) for job_run in job['runs'])
-        start_times = filter(None, start_times)
-        last_run = format_date(max(start_times)) if start_times else None
-        return format % (name, job['enabled'], len(job['runs']), last_run)
-    seq = sorted(build(*item) for item in job_states.iteritems())
-    return header + "".join(seq)
-
-
-def format_service(service_states):
-    format = "%-30s %-8s %s\n"
-    header = format % ("Name", "Enabled", "Instances")
-    def build(name, service):
-        return format % (name, service.get('enabled'), len(service['instances']))
-    seq = sorted(build(*item) for item in service_states.iteritems())
-    return header + "".join(seq)
-
-
-def display_report(state_config, job_states, service_states):
+def last_start_time(job_run_state):
+    job_run_state = jobrun.expand_state_data(job_run_state)
+    start_times = filter(None,
+        (run['start_time'] for run in job_run_state['runs']))
+    return max(start_times) if start_times else None
+
+
+class StateReport(object):
+    """Summarize the state of jobs and services from a single pass over a
+    StateStream. Only the summary of each item is kept.
+    """
+
+    def __init__(self):
+        self.jobs       = {}
+        self.services   = {}
+
+    def add(self, item):
+        if item.type == runstate.JOB_STATE:
+            self.add_job(item.name, item.state_data)
+        if item.type == runstate.JOB_RUN_STATE:
+            job_name = item.name.rsplit('.', 1)[0]
+            self.add_job_run(self.jobs[job_name], item.state_data)
+        if item.type == runstate.SERVICE_STATE:
+            self.services[item.name] = (
+                item.state_data.get('enabled'),
+                len(item.state_data['instances']))
+
+    def add_job(self, name, state_data):
+        runs = state_data.get('runs', [])
+        num_runs = len(state_data.get('run_nums', runs))
+        job = self.jobs[name] = [state_data['enabled'], num_runs, None]
+        for run_state in runs:
+            self.add_job_run(job, run_state)
+
+    def add_job_run(self, job, run_state):
+        start_time = last_start_time(run_state)
+        if start_time and (not job[2] or start_time > job[2]):
+            job[2] = start_time
+
+    def format_jobs(self):
+        format = "%-30s %-8s %-5s %s\n"
+        header = format % ("Name", "Enabled", "Runs", "Last Update")
+        seq = sorted(
+            format % (name, enabled, num_runs, format_date(last_run))
+            for name, (enabled, num_runs, last_run) in self.jobs.iteritems())
+        return header + "".join(seq)
+
+    def format_services(self):
+        format = "%-30s %-8s %s\n"
+        header = format % ("Name", "Enabled", "Instances")
+        seq = sorted(format % (name, enabled, instances)
+            for name, (enabled, instances) in self.services.iteritems())
+        return header + "".join(seq)
+
+
+def display_report(state_config, report):
     print "State Config: %s" % str(state_config)
-    print "Total Jobs: %s" % len(job_states)
-    print "Total Services: %s" % len(service_states)
+    print "Total Jobs: %s" % len(report.jobs)
+    print "Total Services: %s" % len(report.services)
 
-    print "\n%s" % format_jobs(job_states)
-    print "\n%s" % format_service(service_states)
+    print "\n%s" % report.format_jobs()
+    print "\n%s" % report.format_services()
 
 
-def main(config_path, working_dir):
+def main(config_path, working_dir, chunk_size):
     container = get_container(config_path)
     config    = container.get_master().state_persistence
+    report    = StateReport()
     with tool_utils.working_dir(working_dir):
-        display_report(config, *get_state(container))
+        stream = get_stream(container, chunk_size)
+        for item in stream:
+            report.add(item)
+        stream.store.cleanup()
+    display_report(config, report)
 
 
 if __name__ == "__main__":
     opts = parse_options()
-    main(opts.config_path, opts.working_dir)
\ No newline at end of file
+    main(opts.config_path, opts.working_dir, opts.chunk_size)
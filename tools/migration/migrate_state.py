@@ -13,11 +13,19 @@
 
  Pre 0.5 state files can be read by the YamlStateStore. See the configuration
  documentation for more details on how to create state_persistence sections.
+
+ State is streamed from the source store in chunks of --chunk-size keys, and
+ saved to the destination store in batches of --batch-size keys, so the
+ state is never held in memory all at once.
 """
+import collections
 import optparse
+import sys
+import time
 from tron.config import manager, schema
-from tron.serialize import runstate
 from tron.serialize.runstate.statemanager import PersistenceManagerFactory
+from tron.serialize.runstate.statestream import StateItem
+from tron.serialize.runstate.statestream import StateStream, StateCopier
 from tron.utils import tool_utils
 
 
@@ -35,6 +43,10 @@ def parse_options():
         help="The working directory for dest dir to resolve relative paths.")
     parser.add_option('--namespace', action='store_true',
         help="Move jobs/services which are missing a namespace to the MASTER")
+    parser.add_option('--chunk-size', type='int', default=500,
+        help="Number of keys to read from the source at a time.")
+    parser.add_option('--batch-size', type='int', default=500,
+        help="Number of keys to save to the destination in each write.")
 
     opts, args = parser.parse_args()
 
@@ -46,14 +58,13 @@ def parse_options():
     return opts, args
 
 
-def get_state_manager_from_config(config_path, working_dir):
-    """Return a state manager from the configuration.
-    """
+def get_store_from_config(config_path, working_dir):
+    """Return the StateStore from the configuration."""
     config_manager = manager.ConfigManager(config_path)
     config_container = config_manager.load()
     state_config = config_container.get_master().state_persistence
     with tool_utils.working_dir(working_dir):
-        return PersistenceManagerFactory.from_config(state_config)
+        return PersistenceManagerFactory.store_from_config(state_config)
 
 
 def get_current_config(config_path):
@@ -61,44 +72,58 @@ def get_current_config(config_path):
     return config_manager.load()
 
 
-def add_namespaces(state_data):
-    return dict(('%s.%s' % (schema.MASTER_NAMESPACE, name), data)
-                for (name, data) in state_data.iteritems())
+def add_namespace(item):
+    name = '%s.%s' % (schema.MASTER_NAMESPACE, item.name)
+    return StateItem(item.type, name, item.state_data)
+
 
 def strip_namespace(names):
     return [name.split('.', 1)[1] for name in names]
 
 
+class Progress(object):
+    """Report the number of keys copied, and the rate they are copied."""
+
+    def __init__(self):
+        self.start_time = time.time()
+
+    def __call__(self, count):
+        elapsed = time.time() - self.start_time
+        rate = count / elapsed if elapsed else 0
+        sys.stderr.write("\rCopied %d keys (%.0f keys/s)" % (count, rate))
+        sys.stderr.flush()
+
+
 def convert_state(opts):
-    source_manager  = get_state_manager_from_config(opts.source, opts.source_working_dir)
-    dest_manager    = get_state_manager_from_config(opts.dest, opts.dest_working_dir)
+    source_store    = get_store_from_config(opts.source, opts.source_working_dir)
+    dest_store      = get_store_from_config(opts.dest, opts.dest_working_dir)
     container       = get_current_config(opts.source)
 
     msg = "Migrating state from %s to %s"
-    print msg % (source_manager._impl, dest_manager._impl)
+    print msg % (source_store, dest_store)
 
     job_names, service_names = container.get_job_and_service_names()
     if opts.namespace:
         job_names       = strip_namespace(job_names)
         service_names   = strip_namespace(service_names)
 
-    job_states, service_states = source_manager.restore(
-        job_names, service_names, skip_validation=True)
-    source_manager.cleanup()
-
-    if opts.namespace:
-        job_states      = add_namespaces(job_states)
-        service_states  = add_namespaces(service_states)
-
-    for name, job in job_states.iteritems():
-        dest_manager.save(runstate.JOB_STATE, name, job)
-    print "Migrated %s jobs." % len(job_states)
-
-    for name, service in service_states.iteritems():
-        dest_manager.save(runstate.SERVICE_STATE, name, service)
-    print "Migrated %s services." % len(service_states)
-
-    dest_manager.cleanup()
+    counts = collections.defaultdict(int)
+    def count(item):
+        counts[item.type] += 1
+        return add_namespace(item) if opts.namespace else item
+
+    stream = StateStream(
+        source_store, job_names, service_names, opts.chunk_size)
+    copier = StateCopier(dest_store, opts.batch_size, Progress())
+    try:
+        copier.copy(count(item) for item in stream)
+    finally:
+        source_store.cleanup()
+        dest_store.cleanup()
+
+    print
+    for state_type, type_count in sorted(counts.iteritems()):
+        print "Migrated %s %s." % (type_count, state_type)
 
 
 if __name__ == "__main__":
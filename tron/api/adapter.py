@@ -215,6 +215,56 @@ class JobRunAdapter(RunAdapter):
     def get_action_graph(self):
         return ActionRunGraphAdapter(self._obj.action_runs).get_repr()
 
+
+class ArchivedActionRunAdapter(RunAdapter):
+    """Adapt an ArchivedActionRun from a RunArchive."""
+
+    field_names = [
+        'id',
+        'action_name',
+        'state',
+        'start_time',
+        'end_time',
+        'exit_status',
+        'command',
+        'node_name',
+    ]
+    translated_field_names = [
+        'duration',
+        'job_name',
+        'run_num',
+    ]
+
+    def get_job_name(self):
+        return self._obj.job_run_id.rsplit('.', 1)[-2]
+
+    def get_run_num(self):
+        return self._obj.job_run_id.split('.')[-1]
+
+
+class ArchivedJobRunAdapter(RunAdapter):
+    """Adapt an ArchivedJobRun from a RunArchive."""
+
+    field_names = [
+        'id',
+        'run_num',
+        'run_time',
+        'start_time',
+        'end_time',
+        'manual',
+        'job_name',
+        'state',
+        'node_name',
+    ]
+    translated_field_names = [
+        'duration',
+        'runs',
+    ]
+
+    def get_runs(self):
+        return adapt_many(ArchivedActionRunAdapter, self._obj.action_runs)
+
+
 class JobAdapter(ReprAdapter):
 
     field_names = ['status', 'all_nodes', 'allow_overlap', 'queueing']
@@ -295,6 +345,41 @@ class JobIndexAdapter(ReprAdapter):
         return [adapt_run(action_run) for action_run in job_run.action_runs]
 
 
+class UpcomingRunAdapter(ReprAdapter):
+    """Adapt a (run_time, job) pair from JobCollection.get_upcoming_runs()."""
+
+    translated_field_names = ['run_time', 'job', 'namespace', 'node_pool']
+
+    def __init__(self, upcoming_run):
+        run_time, job = upcoming_run
+        super(UpcomingRunAdapter, self).__init__(job)
+        self.run_time = run_time
+
+    def get_run_time(self):
+        return self.run_time
+
+    def get_job(self):
+        return self._obj.get_name()
+
+    def get_namespace(self):
+        return self._obj.config.namespace
+
+    def get_node_pool(self):
+        return self._obj.node_pool.get_name() if self._obj.node_pool else None
+
+
+def get_start_density(run_times):
+    """Return a list of the number of runs which start in each minute, for
+    each minute which has a run, in order.
+    """
+    counts = {}
+    for run_time in run_times:
+        minute = run_time.replace(second=0, microsecond=0)
+        counts[minute] = counts.get(minute, 0) + 1
+    return [dict(minute=minute, count=counts[minute])
+            for minute in sorted(counts)]
+
+
 class SchedulerAdapter(ReprAdapter):
 
     translated_field_names = ['value', 'type', 'jitter']
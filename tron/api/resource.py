@@ -4,6 +4,7 @@ view current state, event history and send commands to trond.
 """
 
 import datetime
+import functools
 import logging
 
 try:
@@ -15,8 +16,10 @@ except ImportError:
 from twisted.web import http, resource, static, server
 
 from tron import event
+from tron import eventloop
 from tron.api import adapter, controller
 from tron.api import requestargs
+from tron.utils import timeutils
 
 
 log = logging.getLogger(__name__)
@@ -142,20 +145,31 @@ class JobResource(resource.Resource):
             return job_runs.get_run_by_index(int(run_id))
         return job_runs.get_run_by_state_short_name(run_id)
 
-    def getChild(self, run_id, _):
+    def getChild(self, run_id, request):
         if not run_id:
             return self
         if run_id == '_events':
             return EventResource(self.job_scheduler.get_name())
+        run_archive = self.job_scheduler.get_job_runs().archive
+        if run_id == '_archive' and run_archive:
+            return JobRunArchiveResource(
+                run_archive, self.job_scheduler.get_name())
 
+        job = self.job_scheduler.get_job()
         run = self.get_run_from_identifier(run_id)
         if run:
+            # Finished runs are frozen, and must be restored to be changed
+            if request.method == 'POST':
+                run = job.thaw_run(run)
             return JobRunResource(run, self.job_scheduler)
 
-        job = self.job_scheduler.get_job()
         if run_id in job.action_graph.names:
             action_runs = job.runs.get_action_runs(run_id)
-            return ActionRunHistoryResource(action_runs)
+            archived_runs = None
+            if run_archive:
+                archived_runs = functools.partial(run_archive.get_action_runs,
+                    self.job_scheduler.get_name(), run_id)
+            return ActionRunHistoryResource(action_runs, archived_runs)
         msg = "Cannot find job run %s for %s"
         return resource.NoResource(msg % (run_id, job))
 
@@ -180,17 +194,65 @@ class JobResource(resource.Resource):
             run_time=run_time)
 
 
+DEFAULT_ARCHIVE_LIMIT = 20
+
+
+def get_archive_paging(request):
+    """Return the limit, before and before_time request args used to page
+    through a RunArchive.
+    """
+    limit = requestargs.get_integer(request, 'limit') or DEFAULT_ARCHIVE_LIMIT
+    before = requestargs.get_integer(request, 'before')
+    before_time = requestargs.get_integer(request, 'before_time')
+    return limit, before, before_time
+
+
 class ActionRunHistoryResource(resource.Resource):
+    """The runs of an action. If archived_runs is set, it is a function
+    which returns a page of archived runs of the action, which are included
+    when requested.
+    """
 
     isLeaf = True
 
-    def __init__(self, action_runs):
+    def __init__(self, action_runs, archived_runs=None):
         resource.Resource.__init__(self)
         self.action_runs = action_runs
+        self.archived_runs = archived_runs
 
     def render_GET(self, request):
-        return respond(request,
-            adapter.adapt_many(adapter.ActionRunAdapter, self.action_runs))
+        include_archived = requestargs.get_bool(request, 'archived')
+        limit, before, before_time = get_archive_paging(request)
+
+        runs = []
+        if before is None and before_time is None:
+            runs = adapter.adapt_many(adapter.ActionRunAdapter, self.action_runs)
+        if include_archived and self.archived_runs:
+            archived = self.archived_runs(limit, before, before_time)
+            runs.extend(
+                adapter.adapt_many(adapter.ArchivedActionRunAdapter, archived))
+        return respond(request, runs)
+
+
+class JobRunArchiveResource(resource.Resource):
+    """Page through the archived runs of a job, newest first."""
+
+    isLeaf = True
+
+    def __init__(self, run_archive, job_name):
+        resource.Resource.__init__(self)
+        self.run_archive = run_archive
+        self.job_name = job_name
+
+    def render_GET(self, request):
+        limit, before, before_time = get_archive_paging(request)
+        runs = self.run_archive.get_runs(
+            self.job_name, limit, before, before_time)
+        response = {
+            'runs':     adapter.adapt_many(adapter.ArchivedJobRunAdapter, runs),
+            'before':   runs[-1].run_num if len(runs) == limit else None,
+        }
+        return respond(request, response)
 
 
 class JobCollectionResource(resource.Resource):
@@ -230,6 +292,40 @@ class JobCollectionResource(resource.Resource):
         return handle_command(request, self.controller, self.job_collection)
 
 
+class ScheduleResource(resource.Resource):
+    """Upcoming runs of enabled jobs and the number of runs which start in
+    each minute. Runs can be limited to a namespace or node_pool, and to the
+    next `hours` hours or the times between `start` and `end`.
+    """
+
+    isLeaf = True
+
+    def __init__(self, job_collection):
+        self.job_collection = job_collection
+        resource.Resource.__init__(self)
+
+    def get_time_range(self, request):
+        start = requestargs.get_datetime(request, 'start') or None
+        end = requestargs.get_datetime(request, 'end') or None
+        hours = requestargs.get_integer(request, 'hours')
+        if hours and not end:
+            start = start or timeutils.current_time()
+            end = start + datetime.timedelta(hours=hours)
+        return start, end
+
+    def render_GET(self, request):
+        start, end = self.get_time_range(request)
+        runs = self.job_collection.get_upcoming_runs(start, end,
+            namespace=requestargs.get_string(request, 'namespace'),
+            node_pool=requestargs.get_string(request, 'node_pool'))
+        response = {
+            'runs':     adapter.adapt_many(adapter.UpcomingRunAdapter, runs),
+            'density':  adapter.get_start_density(
+                            run_time for run_time, _ in runs),
+        }
+        return respond(request, response)
+
+
 class ServiceInstanceResource(resource.Resource):
 
     isLeaf = True
@@ -343,7 +439,37 @@ class StatusResource(resource.Resource):
         resource.Resource.__init__(self)
 
     def render_GET(self, request):
-        return respond(request, {'status': "I'm alive."})
+        response = {
+            'status':   "I'm alive.",
+            'timers':   eventloop.get_timer_stats(),
+        }
+        return respond(request, response)
+
+
+class PersistenceResource(resource.Resource):
+    """Metrics about saving and restoring state."""
+
+    isLeaf = True
+
+    def __init__(self, state_watcher):
+        self.state_watcher = state_watcher
+        resource.Resource.__init__(self)
+
+    def render_GET(self, request):
+        return respond(request, self.state_watcher.get_stats())
+
+
+class DispatchResource(resource.Resource):
+    """Commands waiting for their concurrency limits, and wait times."""
+
+    isLeaf = True
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        resource.Resource.__init__(self)
+
+    def render_GET(self, request):
+        return respond(request, self.dispatcher.get_stats())
 
 
 class EventResource(resource.Resource):
@@ -373,6 +499,12 @@ class ApiRootResource(resource.Resource):
             ServiceCollectionResource(mcp.get_service_collection()))
         self.putChild('config',   ConfigResource(mcp))
         self.putChild('status',   StatusResource(mcp))
+        self.putChild('schedule',
+            ScheduleResource(mcp.get_job_collection()))
+        self.putChild('persistence',
+            PersistenceResource(mcp.get_state_watcher()))
+        self.putChild('dispatch',
+            DispatchResource(mcp.get_dispatcher()))
         self.putChild('events',   EventResource(''))
         self.putChild('', self)
 
@@ -26,6 +26,7 @@ from tron.config.schema import ConfigState
 from tron.config.schema import ConfigJob, ConfigAction, ConfigCleanupAction
 from tron.config.schema import ConfigService
 from tron.config.schema import MASTER_NAMESPACE
+from tron.serialize.runstate import codec, journalstore
 from tron.utils.dicts import FrozenDict
 
 
@@ -152,8 +153,12 @@ class ValidateSSHOptions(Validator):
         'jitter_load_factor':       config_utils.valid_int,
     }
 
+    # Unset by a simulation, which replaces nodes with ones that never
+    # connect over SSH
+    require_agent =                 True
+
     def post_validation(self, valid_input, config_context):
-        if config_context.partial:
+        if config_context.partial or not self.require_agent:
             return
 
         if valid_input['agent'] and 'SSH_AUTH_SOCK' not in os.environ:
@@ -270,6 +275,17 @@ class ValidateCleanupAction(Validator):
 valid_cleanup_action = ValidateCleanupAction()
 
 
+valid_catch_up_policy = config_utils.build_enum_validator(
+    schema.CatchUpPolicies)
+
+
+def valid_backfill_limit(value, config_context):
+    limit = valid_int(value, config_context)
+    if limit < 0:
+        raise ConfigError("%s must be >= 0." % config_context.path)
+    return limit
+
+
 class ValidateJob(Validator):
     """Validate jobs."""
     config_class =              ConfigJob
@@ -281,6 +297,9 @@ class ValidateJob(Validator):
         'queueing':             True,
         'allow_overlap':        False,
         'max_runtime':          None,
+        'priority':             0,
+        'catch_up':             None,
+        'backfill_limit':       None,
     }
 
     validators = {
@@ -295,6 +314,9 @@ class ValidateJob(Validator):
         'enabled':              valid_bool,
         'allow_overlap':        valid_bool,
         'max_runtime':          config_utils.valid_time_delta,
+        'priority':             valid_int,
+        'catch_up':             valid_catch_up_policy,
+        'backfill_limit':       valid_backfill_limit,
     }
 
     def cast(self, in_dict, config_context):
@@ -387,11 +409,78 @@ class ValidateActionRunner(Validator):
     }
 
 
+def valid_concurrency_limit(value, config_context):
+    limit = valid_int(value, config_context)
+    if limit < 1:
+        raise ConfigError("%s must be >= 1." % config_context.path)
+    return limit
+
+
+def valid_concurrency_limits(value, config_context):
+    """Validate a dict of names to concurrency limits."""
+    limits = valid_dict(value, config_context)
+    for name, limit in limits.iteritems():
+        child_context = config_context.build_child_context(name)
+        valid_identifier(name, child_context)
+        valid_concurrency_limit(limit, child_context)
+    return FrozenDict(limits)
+
+
+class ValidateDispatch(Validator):
+    config_class =              schema.ConfigDispatch
+    optional =                  True
+    defaults = {
+        'max_concurrent':       None,
+        'max_per_node':         None,
+        'nodes':                FrozenDict(),
+        'node_pools':           FrozenDict(),
+        'namespaces':           FrozenDict(),
+    }
+
+    validators = {
+        'max_concurrent':       valid_concurrency_limit,
+        'max_per_node':         valid_concurrency_limit,
+        'nodes':                valid_concurrency_limits,
+        'node_pools':           valid_concurrency_limits,
+        'namespaces':           valid_concurrency_limits,
+    }
+
+valid_dispatch = ValidateDispatch()
+
+
+class ValidateCatchUp(Validator):
+    config_class =              schema.ConfigCatchUp
+    optional =                  True
+    defaults = {
+        'policy':               schema.CatchUpPolicies.run_once,
+        'backfill_limit':       5,
+        'ramp_window':          None,
+    }
+
+    validators = {
+        'policy':               valid_catch_up_policy,
+        'backfill_limit':       valid_backfill_limit,
+        'ramp_window':          config_utils.valid_time_delta,
+    }
+
+valid_catch_up = ValidateCatchUp()
+
+
 class ValidateStatePersistence(Validator):
     config_class                = schema.ConfigState
     defaults = {
         'buffer_size':          1,
         'connection_details':   None,
+        'incremental':          False,
+        'threaded_writer':      False,
+        'writer_queue_size':    10000,
+        'max_buffer_age':       None,
+        'min_save_interval':    None,
+        'max_buffer_bytes':     None,
+        'codec':                None,
+        'restore_processes':    None,
+        'run_archive':          None,
+        'slow_save_threshold':  None,
     }
 
     validators = {
@@ -400,6 +489,16 @@ class ValidateStatePersistence(Validator):
                                     schema.StatePersistenceTypes),
         'connection_details':   valid_string,
         'buffer_size':          valid_int,
+        'incremental':          valid_bool,
+        'threaded_writer':      valid_bool,
+        'writer_queue_size':    valid_int,
+        'max_buffer_age':       valid_float,
+        'min_save_interval':    valid_float,
+        'max_buffer_bytes':     valid_int,
+        'codec':                valid_string,
+        'restore_processes':    valid_int,
+        'run_archive':          valid_string,
+        'slow_save_threshold':  valid_float,
     }
 
     def post_validation(self, config, config_context):
@@ -409,6 +508,41 @@ class ValidateStatePersistence(Validator):
             path = config_context.path
             raise ConfigError("%s buffer_size must be >= 1." % path)
 
+        queue_size = config.get('writer_queue_size')
+        if queue_size is not None and queue_size < 1:
+            path = config_context.path
+            raise ConfigError("%s writer_queue_size must be >= 1." % path)
+
+        max_age, min_interval = (
+            config.get('max_buffer_age'), config.get('min_save_interval'))
+        if max_age and min_interval and min_interval > max_age:
+            path = config_context.path
+            msg = "%s min_save_interval must be <= max_buffer_age."
+            raise ConfigError(msg % path)
+
+        processes = config.get('restore_processes')
+        if processes is not None and processes < 0:
+            path = config_context.path
+            raise ConfigError("%s restore_processes must be >= 0." % path)
+
+        threshold = config.get('slow_save_threshold')
+        if threshold is not None and threshold <= 0:
+            path = config_context.path
+            raise ConfigError("%s slow_save_threshold must be > 0." % path)
+
+        if config.get('codec'):
+            try:
+                codec.get_codec(config['codec'])
+            except codec.UnknownCodecError, e:
+                raise ConfigError("%s %s" % (config_context.path, e))
+
+        if config['store_type'] == schema.StatePersistenceTypes.journal:
+            try:
+                journalstore.parse_connection_details(
+                    config.get('connection_details'))
+            except ValueError, e:
+                raise ConfigError("%s %s" % (config_context.path, e))
+
 valid_state_persistence = ValidateStatePersistence()
 
 
@@ -426,8 +560,24 @@ def validate_jobs_and_services(config, config_context):
     config_utils.unique_names(fmt_string, config['jobs'], config['services'])
 
 
-DEFAULT_STATE_PERSISTENCE = ConfigState('tron_state', 'shelve', None, 1)
+DEFAULT_STATE_PERSISTENCE = ConfigState(
+    name='tron_state',
+    store_type='shelve',
+    connection_details=None,
+    buffer_size=1,
+    incremental=False,
+    threaded_writer=False,
+    writer_queue_size=10000,
+    max_buffer_age=None,
+    min_save_interval=None,
+    max_buffer_bytes=None,
+    codec=None,
+    restore_processes=None,
+    run_archive=None,
+    slow_save_threshold=None)
 DEFAULT_NODE = ValidateNode().do_shortcut('localhost')
+DEFAULT_DISPATCH = schema.ConfigDispatch(**ValidateDispatch.defaults)
+DEFAULT_CATCH_UP = schema.ConfigCatchUp(**ValidateCatchUp.defaults)
 
 
 class ValidateConfig(Validator):
@@ -447,6 +597,8 @@ class ValidateConfig(Validator):
         'state_persistence':    DEFAULT_STATE_PERSISTENCE,
         'nodes':                {'localhost': DEFAULT_NODE},
         'node_pools':           {},
+        'dispatch':             DEFAULT_DISPATCH,
+        'catch_up':             DEFAULT_CATCH_UP,
         'jobs':                 (),
         'services':             (),
     }
@@ -462,6 +614,8 @@ class ValidateConfig(Validator):
         'state_persistence':    valid_state_persistence,
         'nodes':                nodes,
         'node_pools':           node_pools,
+        'dispatch':             valid_dispatch,
+        'catch_up':             valid_catch_up,
     }
     optional = False
 
@@ -476,6 +630,22 @@ class ValidateConfig(Validator):
                 msg = "NodePool %s contains other NodePools: " % node_pool.name
                 raise ConfigError(msg + ",".join(invalid_names))
 
+    def validate_dispatch_names(self, config):
+        """Validate that dispatch limits are for known nodes and node
+        pools.
+        """
+        dispatch = config.get('dispatch')
+        if not dispatch:
+            return
+
+        for name, known_names in [
+                ('nodes', config['nodes']),
+                ('node_pools', config.get('node_pools') or {})]:
+            unknown_names = set(getattr(dispatch, name)) - set(known_names)
+            if unknown_names:
+                msg = "Dispatch limits for unknown %s: " % name
+                raise ConfigError(msg + ",".join(sorted(unknown_names)))
+
     def post_validation(self, config, _):
         """Validate a non-named config."""
         node_names = config_utils.unique_names(
@@ -484,6 +654,7 @@ class ValidateConfig(Validator):
 
         if config.get('node_pools'):
             self.validate_node_pool_nodes(config)
+        self.validate_dispatch_names(config)
 
         config_context = ConfigContext('config', node_names,
             config.get('command_context'), MASTER_NAMESPACE)
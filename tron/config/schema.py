@@ -39,6 +39,8 @@ TronConfig = config_object_factory(
         'time_zone',           # pytz time zone
         'nodes',               # FrozenDict of ConfigNode
         'node_pools',          # FrozenDict of ConfigNodePool
+        'dispatch',            # ConfigDispatch
+        'catch_up',            # ConfigCatchUp
         'jobs',                # FrozenDict of ConfigJob
         'services',            # FrozenDict of ConfigService
     ])
@@ -85,6 +87,26 @@ ConfigNode = config_object_factory('ConfigNode',
 ConfigNodePool = config_object_factory('ConfigNodePool', ['nodes'], ['name'])
 
 
+ConfigDispatch = config_object_factory(
+    'ConfigDispatch',
+    optional=[
+        'max_concurrent',       # int or None
+        'max_per_node',         # int or None
+        'nodes',                # FrozenDict of str to int
+        'node_pools',           # FrozenDict of str to int
+        'namespaces',           # FrozenDict of str to int
+    ])
+
+
+ConfigCatchUp = config_object_factory(
+    'ConfigCatchUp',
+    optional=[
+        'policy',               # CatchUpPolicies
+        'backfill_limit',       # int
+        'ramp_window',          # datetime.timedelta or None
+    ])
+
+
 ConfigState = config_object_factory(
     'ConfigState',
     [
@@ -92,7 +114,17 @@ ConfigState = config_object_factory(
         'store_type',
         ],[
         'connection_details',
-        'buffer_size'
+        'buffer_size',
+        'incremental',
+        'threaded_writer',
+        'writer_queue_size',
+        'max_buffer_age',
+        'min_save_interval',
+        'max_buffer_bytes',
+        'codec',
+        'restore_processes',
+        'run_archive',
+        'slow_save_threshold',
     ])
 
 
@@ -112,6 +144,9 @@ ConfigJob = config_object_factory(
         'enabled',              # bool
         'allow_overlap',        # bool
         'max_runtime',          # datetime.Timedelta
+        'priority',             # int
+        'catch_up',             # CatchUpPolicies or None
+        'backfill_limit',       # int or None
     ])
 
 
@@ -150,7 +185,11 @@ ConfigService = config_object_factory(
     ])
 
 
-StatePersistenceTypes = Enum.create('shelve', 'sql', 'mongo', 'yaml')
+StatePersistenceTypes = Enum.create(
+    'shelve', 'sql', 'mongo', 'yaml', 'sqlite', 'journal')
 
 
 ActionRunnerTypes = Enum.create('none', 'subprocess')
+
+
+CatchUpPolicies = Enum.create('run_once', 'skip', 'backfill')
@@ -1,21 +1,78 @@
 """
  tron.core.actionrun
 """
+import datetime
 import logging
 import traceback
-import itertools
+import operator
 from tron import command_context
+from tron import dispatch
 from tron.core import action
 from tron.serialize import filehandler
 from tron import node
 from tron.actioncommand import ActionCommand, NoActionRunnerFactory
 
 from tron.utils import state, timeutils, proxy, iteration
+from tron.utils.collections import update_membership
 from tron.utils.observer import Observer
 
 log = logging.getLogger(__name__)
 
 
+# Codes used for each state in the compact state format. A code must never be
+# reused for another state, so that saved state can always be restored.
+STATE_CODES = {
+    'scheduled':    0,
+    'queued':       1,
+    'starting':     2,
+    'running':      3,
+    'succeeded':    4,
+    'failed':       5,
+    'cancelled':    6,
+    'skipped':      7,
+    'unknown':      8,
+}
+
+STATE_NAMES = dict((code, name) for name, code in STATE_CODES.iteritems())
+
+
+def encode_time(time_val):
+    """Return a datetime as a unix timestamp which keeps its microseconds."""
+    if time_val is None:
+        return None
+    return timeutils.to_timestamp(time_val) + time_val.microsecond / 1e6
+
+
+def decode_time(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.datetime.fromtimestamp(timestamp)
+
+
+def is_compact_state(state_data):
+    """Return True if the state of an ActionRun is in the compact format."""
+    return 'a' in state_data
+
+
+def expand_compact_state(state_data, job_run_id, strings):
+    """Return the state of an ActionRun from the compact format, in the
+    format used before the compact format. Strings are looked up in strings,
+    the StringTable of the JobRun.
+    """
+    return {
+        'job_run_id':       job_run_id,
+        'action_name':      state_data['a'],
+        'state':            STATE_NAMES[state_data['s']],
+        'start_time':       decode_time(state_data.get('t0')),
+        'end_time':         decode_time(state_data.get('t1')),
+        'command':          strings.get(state_data.get('c')),
+        'rendered_command': strings.get(state_data.get('r')),
+        'node_name':        strings.get(state_data.get('n')),
+        'exit_status':      state_data.get('x'),
+        'dispatch_waiting': state_data.get('w', False),
+    }
+
+
 class ActionRunFactory(object):
     """Construct ActionRuns and ActionRunCollections for a JobRun and
     ActionGraph.
@@ -32,12 +89,14 @@ class ActionRunFactory(object):
 
     @classmethod
     def action_run_collection_from_state(cls, job_run, runs_state_data,
-                cleanup_action_state_data):
-        action_runs = [cls.action_run_from_state(job_run, state_data)
+                cleanup_action_state_data, strings=None):
+        action_runs = [cls.action_run_from_state(job_run, state_data,
+                            strings=strings)
                        for state_data in runs_state_data]
         if cleanup_action_state_data:
             action_runs.append(cls.action_run_from_state(
-                job_run, cleanup_action_state_data, cleanup=True))
+                job_run, cleanup_action_state_data, cleanup=True,
+                strings=strings))
 
         action_run_map = dict(
             (action_run.action_name, action_run) for action_run in action_runs)
@@ -59,14 +118,17 @@ class ActionRunFactory(object):
             action_runner=action_runner)
 
     @classmethod
-    def action_run_from_state(cls, job_run, state_data, cleanup=False):
+    def action_run_from_state(cls, job_run, state_data, cleanup=False,
+                strings=None):
         """Restore an ActionRun for this JobRun from the state data."""
         return ActionRun.from_state(
             state_data,
             job_run.context,
             job_run.output_path.clone(),
             job_run.node,
-            cleanup=cleanup)
+            cleanup=cleanup,
+            job_run_id=job_run.id,
+            strings=strings)
 
 
 class ActionRun(Observer):
@@ -119,6 +181,10 @@ class ActionRun(Observer):
          STATE_UNKNOWN)
     )
 
+    # The states and transitions of the state graph. The is_<state> properties
+    # and transition methods are added to the class from this table.
+    state_table = state.StateTable(STATE_SCHEDULED)
+
     # Failed render command is false to ensure that it will fail when run
     FAILED_RENDER = 'false'
 
@@ -139,8 +205,11 @@ class ActionRun(Observer):
         self.rendered_command   = rendered_command
         self.action_runner      = action_runner or NoActionRunnerFactory
         self.machine            = state.StateMachine(
-                    self.STATE_SCHEDULED, delegate=self, force_state=run_state)
+                    self.STATE_SCHEDULED, delegate=self, force_state=run_state,
+                    table=self.state_table)
         self.is_cleanup         = cleanup
+        # True while the command is in the Dispatcher queue, and not yet sent
+        self.dispatch_waiting   = False
         self.output_path        = output_path or filehandler.OutputPath()
         self.output_path.append(self.id)
         self.context = command_context.build_context(self, parent_context)
@@ -163,10 +232,16 @@ class ActionRun(Observer):
 
     @classmethod
     def from_state(cls, state_data, parent_context, output_path,
-                job_run_node, cleanup=False):
-        """Restore the state of this ActionRun from a serialized state."""
+                job_run_node, cleanup=False, job_run_id=None, strings=None):
+        """Restore the state of this ActionRun from a serialized state. State
+        in the compact format requires the id of the JobRun, and the
+        StringTable of its strings.
+        """
         pool_repo = node.NodePoolRepository.get_instance()
 
+        if is_compact_state(state_data):
+            state_data = expand_compact_state(state_data, job_run_id, strings)
+
         # Support state from older version
         if 'id' in state_data:
             job_run_id, action_name = state_data['id'].rsplit('.', 1)
@@ -189,16 +264,20 @@ class ActionRun(Observer):
             cleanup=cleanup,
             start_time=state_data['start_time'],
             end_time=state_data['end_time'],
-            run_state=state.named_event_by_name(
-                    cls.STATE_SCHEDULED, state_data['state']),
+            run_state=cls.state_table.get_state(state_data['state']),
             exit_status=state_data.get('exit_status')
         )
 
         # Transition running to fail unknown because exit status was missed
         if run.is_running:
             run._done('fail_unknown')
+        # A command which was waiting in the Dispatcher queue was never sent,
+        # so it is requeued by requeue(). Otherwise it may have been started.
         if run.is_starting:
-            run.fail(None)
+            if state_data.get('dispatch_waiting'):
+                run.dispatch_waiting = True
+            else:
+                run.fail(None)
         return run
 
     def start(self):
@@ -216,22 +295,53 @@ class ActionRun(Observer):
             self.fail(-1)
             return
 
+        return self._dispatch()
+
+    def requeue(self):
+        """Submit the command of a run which was restored while it was
+        waiting in the Dispatcher queue.
+        """
+        if not self.is_starting or not self.dispatch_waiting:
+            return False
+
+        log.info("Requeueing action run %s", self.id)
+        return self._dispatch()
+
+    def _dispatch(self):
         action_command = self.build_action_command()
+        self.dispatch_waiting = True
+        return dispatch.Dispatcher.get_instance().submit(self, action_command)
+
+    def submit_command(self, action_command):
+        """Send the command to the node, when the Dispatcher allows it to
+        start. Returns the deferred from the node, or None if it failed.
+        """
+        self.dispatch_waiting = False
         try:
-            self.node.submit_command(action_command)
+            return self.node.submit_command(action_command)
         except node.Error, e:
             log.warning("Failed to start %s: %r", self.id, e)
             self.fail(-2)
-            return
 
-        return True
+    def cancel_dispatch(self):
+        """Fail this run if its command is still waiting to start."""
+        if dispatch.Dispatcher.get_instance().cancel(self):
+            log.info("Removed %s from the dispatch queue", self.id)
+            self.dispatch_waiting = False
+            self.fail(None)
+            return True
+        return False
 
     def stop(self):
+        if self.cancel_dispatch():
+            return
         stop_command = self.action_runner.build_stop_action_command(
             self.id, 'terminate')
         self.node.submit_command(stop_command)
 
     def kill(self):
+        if self.cancel_dispatch():
+            return
         kill_command = self.action_runner.build_stop_action_command(
             self.id, 'kill')
         self.node.submit_command(kill_command)
@@ -299,8 +409,30 @@ class ActionRun(Observer):
             'rendered_command': self.rendered_command,
             'node_name':        self.node.get_name() if self.node else None,
             'exit_status':      self.exit_status,
+            'dispatch_waiting': self.dispatch_waiting,
         }
 
+    def compact_state_data(self, strings):
+        """Return the state of this action run in the compact format. Strings
+        are added to strings, a StringTable, and referenced by their index.
+        Values which are None are left out.
+        """
+        rendered_command = self.rendered_command
+        command = rendered_command if rendered_command else self.bare_command
+        node_name = self.node.get_name() if self.node else None
+        items = [
+            ('a',   self.action_name),
+            ('s',   STATE_CODES[self.state.name]),
+            ('t0',  encode_time(self.start_time)),
+            ('t1',  encode_time(self.end_time)),
+            ('c',   strings.add(command)),
+            ('r',   strings.add(rendered_command)),
+            ('n',   strings.add(node_name)),
+            ('x',   self.exit_status),
+            ('w',   self.dispatch_waiting or None),
+        ]
+        return dict((key, value) for key, value in items if value is not None)
+
     def render_command(self):
         """Render our configured command using the command context."""
         return self.bare_command % self.context
@@ -345,28 +477,99 @@ class ActionRun(Observer):
 
     def cleanup(self):
         self.machine.clear_observers()
+        dispatch.Dispatcher.get_instance().cancel(self)
         self.cancel()
 
-    def __getattr__(self, name):
-        """Support convenience properties for checking if this ActionRun is in
-        a specific state (Ex: self.is_running would check if self.state is
-        STATE_RUNNING) or for transitioning to a new state (ex: ready).
-        """
-        if name in self.machine.transitions:
-            return lambda: self.machine.transition(name)
+    def __str__(self):
+        return "ActionRun: %s" % self.id
+
+
+# Add properties for checking if an ActionRun is in a specific state (Ex:
+# is_running checks if state is STATE_RUNNING) and methods for transitioning
+# to a new state (Ex: ready).
+ActionRun.state_table.add_attributes(ActionRun, operator.attrgetter('machine'))
 
-        state_name = name.replace('is_', 'state_').upper()
-        try:
-            return self.state == self.__getattribute__(state_name)
-        except AttributeError:
-            raise AttributeError(name)
+
+class CompletedActionRun(object):
+    """A read only record of a finished ActionRun, which keeps only the fields
+    used by the API and to serialize its state. It has no StateMachine,
+    context or action runner.
+    """
+    __slots__ = (
+        'job_run_id',
+        'action_name',
+        'node',
+        'state',
+        'start_time',
+        'end_time',
+        'exit_status',
+        'bare_command',
+        'rendered_command',
+        'is_cleanup',
+        'output_path',
+    )
+
+    END_STATES          = ActionRun.END_STATES
+    dispatch_waiting    = False
+
+    # Serialized and checked the same way as an ActionRun
+    id                  = ActionRun.id
+    state_data          = ActionRun.state_data
+    compact_state_data  = ActionRun.compact_state_data.im_func
+    is_done             = ActionRun.is_done
+    is_complete         = ActionRun.is_complete
+    is_broken           = ActionRun.is_broken
+    is_active           = ActionRun.is_active
+
+    def __init__(self, job_run_id, action_name, node, state, start_time,
+            end_time, exit_status, bare_command, rendered_command, is_cleanup,
+            output_path):
+        self.job_run_id         = job_run_id
+        self.action_name        = action_name
+        self.node               = node
+        self.state              = state
+        self.start_time         = start_time
+        self.end_time           = end_time
+        self.exit_status        = exit_status
+        self.bare_command       = bare_command
+        self.rendered_command   = rendered_command
+        self.is_cleanup         = is_cleanup
+        self.output_path        = output_path
+
+    @classmethod
+    def from_action_run(cls, action_run):
+        return cls(
+            action_run.job_run_id,
+            action_run.action_name,
+            action_run.node,
+            action_run.state,
+            action_run.start_time,
+            action_run.end_time,
+            action_run.exit_status,
+            action_run.bare_command,
+            action_run.rendered_command,
+            action_run.is_cleanup,
+            action_run.output_path)
 
     def __str__(self):
         return "ActionRun: %s" % self.id
 
 
-class ActionRunCollection(object):
-    """A collection of ActionRuns used by a JobRun."""
+# Add properties for checking the state of a CompletedActionRun. It can not be
+# transitioned to another state.
+ActionRun.state_table.add_attributes(
+    CompletedActionRun, lambda action_run: action_run, include_transitions=False)
+
+
+class ActionRunCollection(Observer):
+    """A collection of ActionRuns used by a JobRun.
+
+    The collection watches its ActionRuns and indexes them by state. For each
+    action it also counts the required runs which are not complete, which
+    is updated when a required run changes state, so that finding startable
+    runs and checking if the collection is done does not check the
+    requirements of every run.
+    """
 
     # An ActionRunCollection is blocked when it has runs running which
     # are required for other blocked runs to start.
@@ -378,22 +581,137 @@ class ActionRunCollection(object):
         # Setup proxies
         self.proxy_action_runs_with_cleanup = proxy.CollectionProxy(
             self.get_action_runs_with_cleanup, [
-                proxy.attr_proxy('is_running',      any),
-                proxy.attr_proxy('is_starting',     any),
-                proxy.attr_proxy('is_scheduled',    any),
-                proxy.attr_proxy('is_cancelled',    any),
-                proxy.attr_proxy('is_active',       any),
-                proxy.attr_proxy('is_queued',       all),
-                proxy.attr_proxy('is_complete',     all),
                 proxy.func_proxy('queue',           iteration.list_all),
                 proxy.func_proxy('cancel',          iteration.list_all),
                 proxy.func_proxy('success',         iteration.list_all),
                 proxy.func_proxy('fail',            iteration.list_all),
                 proxy.func_proxy('ready',           iteration.list_all),
-                proxy.func_proxy('cleanup',         iteration.list_all),
                 proxy.func_proxy('stop',            iteration.list_all),
                 proxy.attr_proxy('start_time',      iteration.min_filter),
             ])
+        self._build_index()
+
+    def _build_index(self):
+        self.run_states         = {}
+        self.runs_by_state      = {}
+        self.complete_runs      = set()
+        self.startable_runs     = set()
+        self.unfinished_runs    = set()
+        self.failed_runs        = set()
+        self.dependent_runs     = {}
+        self.blocking_counts    = {}
+
+        for action_run in self.run_map.itervalues():
+            self._index_state(action_run)
+
+        for action_run in self.run_map.itervalues():
+            required_actions = self.action_graph.get_required_actions(
+                    action_run.action_name)
+            required_runs = list(self.action_runs_for_actions(required_actions))
+            for required_run in required_runs:
+                dependents = self.dependent_runs.setdefault(
+                        required_run.action_name, [])
+                dependents.append(action_run)
+            self.blocking_counts[action_run.action_name] = len(
+                [run for run in required_runs if run not in self.complete_runs])
+
+        for action_run in self.run_map.itervalues():
+            self._index_status(action_run)
+            self.watch(action_run)
+
+    def _index_state(self, action_run):
+        """Move action_run to the set of its current state. Returns True if
+        action_run became complete or is no longer complete.
+        """
+        previous_state = self.run_states.get(action_run)
+        if previous_state is not None:
+            self.runs_by_state[previous_state].discard(action_run)
+        self.runs_by_state.setdefault(action_run.state, set()).add(action_run)
+        self.run_states[action_run] = action_run.state
+
+        was_complete = action_run in self.complete_runs
+        update_membership(
+            self.complete_runs, action_run, action_run.is_complete)
+        return was_complete != action_run.is_complete
+
+    def _index_status(self, action_run):
+        """Update the startable, unfinished and failed sets for action_run."""
+        if action_run.is_cleanup:
+            return
+
+        is_blocked = (not action_run.is_done and not action_run.is_active and
+                      self.blocking_counts[action_run.action_name] > 0)
+        is_startable = bool(action_run.check_state('start')) and not is_blocked
+        update_membership(self.startable_runs, action_run, is_startable)
+        update_membership(self.unfinished_runs, action_run,
+            not action_run.is_done and not is_blocked)
+        update_membership(self.failed_runs, action_run, action_run.is_failed)
+
+    def handler(self, action_run, _):
+        """Update the index when an ActionRun changes state, and the
+        blocking counts of the runs which require it.
+        """
+        if self._index_state(action_run):
+            delta = -1 if action_run in self.complete_runs else 1
+            dependents = self.dependent_runs.get(action_run.action_name, ())
+            for dependent_run in dependents:
+                self.blocking_counts[dependent_run.action_name] += delta
+                self._index_status(dependent_run)
+        self._index_status(action_run)
+
+    def cleanup(self):
+        """Cleanup each ActionRun. ActionRuns stop notifying observers when
+        they are cleaned up, so the index is updated with their last state.
+        """
+        for action_run in self.run_map.values():
+            action_run.cleanup()
+            self.handler(action_run, None)
+
+    def _has_runs_in(self, *states):
+        return any(self.runs_by_state.get(state) for state in states)
+
+    def _has_all_runs_in(self, *states):
+        count = sum(len(self.runs_by_state.get(state, ())) for state in states)
+        return count == len(self.run_states)
+
+    @property
+    def is_running(self):
+        return self._has_runs_in(ActionRun.STATE_RUNNING)
+
+    @property
+    def is_starting(self):
+        return self._has_runs_in(ActionRun.STATE_STARTING)
+
+    @property
+    def is_scheduled(self):
+        return self._has_runs_in(ActionRun.STATE_SCHEDULED)
+
+    @property
+    def is_cancelled(self):
+        return self._has_runs_in(ActionRun.STATE_CANCELLED)
+
+    @property
+    def is_active(self):
+        return self._has_runs_in(
+            ActionRun.STATE_STARTING, ActionRun.STATE_RUNNING)
+
+    @property
+    def is_queued(self):
+        return self._has_all_runs_in(ActionRun.STATE_QUEUED)
+
+    @property
+    def is_complete(self):
+        return len(self.complete_runs) == len(self.run_states)
+
+    @property
+    def is_finished(self):
+        """Return True if the ActionRuns are done and the cleanup run, if
+        there is one, is in an end state. Runs which are blocked by a failed
+        run never start, so they are not required to be in an end state.
+        This is the condition for a JobRun to finish.
+        """
+        cleanup_run = self.cleanup_action_run
+        return self.is_done and (not cleanup_run or cleanup_run.is_done)
 
     def action_runs_for_actions(self, actions):
         return (self.run_map[a.name] for a in actions)
@@ -419,27 +737,23 @@ class ActionRunCollection(object):
         if self.cleanup_action_run:
             return self.cleanup_action_run.state_data
 
-    def _get_runs_using(self, func, include_cleanup=False):
-        """Return an iterator of all the ActionRuns which cause func to return
-        True. func should be a callable that takes a single ActionRun and
-        returns True or False.
-        """
-        if include_cleanup:
-            action_runs = self.action_runs_with_cleanup
-        else:
-            action_runs = self.action_runs
-        return itertools.ifilter(func, action_runs)
+    def compact_state_data(self, strings):
+        return [run.compact_state_data(strings) for run in self.action_runs]
+
+    def compact_cleanup_action_state_data(self, strings):
+        if self.cleanup_action_run:
+            return self.cleanup_action_run.compact_state_data(strings)
 
     def get_startable_action_runs(self):
-        """Returns any actions that are scheduled or queued that can be run."""
-        def startable(action_run):
-            return (action_run.check_state('start') and
-                    not self._is_run_blocked(action_run))
-        return self._get_runs_using(startable)
+        """Returns any actions that are scheduled or queued that can be run,
+        ordered by name.
+        """
+        return sorted(self.startable_runs,
+            key=operator.attrgetter('action_name'))
 
     @property
     def has_startable_action_runs(self):
-        return any(self.get_startable_action_runs())
+        return bool(self.startable_runs)
 
     def _is_run_blocked(self, action_run):
         """Returns True if the ActionRun is waiting on a required run to
@@ -467,19 +781,14 @@ class ActionRunCollection(object):
         """Returns True when there are no running ActionRuns and all
         non-blocked ActionRuns are done.
         """
-        if self.is_running:
-            return False
-
-        def done_or_blocked(action_run):
-            return action_run.is_done or self._is_run_blocked(action_run)
-        return all(done_or_blocked(run) for run in self.action_runs)
+        return not self.is_running and not self.unfinished_runs
 
     @property
     def is_failed(self):
         """Return True if there are failed actions and all ActionRuns are
         done or blocked.
         """
-        return self.is_done and any(run.is_failed for run in self.action_runs)
+        return self.is_done and bool(self.failed_runs)
 
     @property
     def is_complete_without_cleanup(self):
@@ -519,3 +828,63 @@ class ActionRunCollection(object):
 
     def get(self, name):
         return self.run_map.get(name)
+
+
+class CompletedActionRunCollection(object):
+    """The CompletedActionRuns of a finished JobRun, with the lookups used by
+    the API and to serialize their state.
+    """
+    __slots__ = ('action_graph', 'runs')
+
+    is_done = True
+
+    # Serialized the same way as an ActionRunCollection
+    state_data                  = ActionRunCollection.state_data
+    cleanup_action_state_data   = ActionRunCollection.cleanup_action_state_data
+    compact_state_data          = ActionRunCollection.compact_state_data.im_func
+    compact_cleanup_action_state_data = (
+        ActionRunCollection.compact_cleanup_action_state_data.im_func)
+
+    def __init__(self, action_graph, runs):
+        self.action_graph       = action_graph
+        self.runs               = runs
+
+    @classmethod
+    def from_collection(cls, action_runs):
+        """Create a CompletedActionRunCollection from an ActionRunCollection."""
+        runs = tuple(CompletedActionRun.from_action_run(action_run)
+                     for action_run in action_runs)
+        return cls(action_runs.action_graph, runs)
+
+    @property
+    def action_runs_with_cleanup(self):
+        return iter(self.runs)
+
+    @property
+    def action_runs(self):
+        return (run for run in self.runs if not run.is_cleanup)
+
+    @property
+    def cleanup_action_run(self):
+        return self.get(action.CLEANUP_ACTION_NAME)
+
+    @property
+    def names(self):
+        return [run.action_name for run in self.runs]
+
+    def __getitem__(self, name):
+        action_run = self.get(name)
+        if action_run is None:
+            raise KeyError(name)
+        return action_run
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __iter__(self):
+        return iter(self.runs)
+
+    def get(self, name):
+        for action_run in self.runs:
+            if action_run.action_name == name:
+                return action_run
@@ -1,7 +1,9 @@
+import datetime
 import logging
 import itertools
 
 from tron import command_context, event, node, eventloop
+from tron.config import schema
 from tron.core import jobrun
 from tron.core import actiongraph
 from tron.core.actionrun import ActionRun
@@ -83,11 +85,13 @@ class Job(Observable, Observer):
 
     @classmethod
     def from_config(cls,
-            job_config, scheduler, parent_context, output_path, action_runner):
+            job_config, scheduler, parent_context, output_path, action_runner,
+            run_archive=None):
         """Factory method to create a new Job instance from configuration."""
         action_graph = actiongraph.ActionGraph.from_config(
                 job_config.actions, job_config.cleanup_action)
-        runs         = jobrun.JobRunCollection.from_config(job_config)
+        runs         = jobrun.JobRunCollection.from_config(
+                job_config, run_archive)
         node_repo    = node.NodePoolRepository.get_instance()
 
         return cls(
@@ -144,6 +148,16 @@ class Job(Observable, Observer):
             'enabled':          self.enabled
         }
 
+    @property
+    def run_index_state_data(self):
+        """The state of this job with runs referenced by their run number.
+        Used when the state of each run is serialized separately.
+        """
+        return {
+            'run_nums':         self.runs.run_nums,
+            'enabled':          self.enabled
+        }
+
     def restore_state(self, state_data):
         """Apply a previous state to this Job."""
         self.enabled = state_data['enabled']
@@ -154,7 +168,8 @@ class Job(Observable, Observer):
                 self.context,
                 self.node_pool)
         for run in job_runs:
-            self.watch(run)
+            if not self.runs.freeze(run):
+                self.watch(run)
 
         self.event.ok('restored')
 
@@ -170,21 +185,36 @@ class Job(Observable, Observer):
             self.watch(run)
             yield run
 
-    def handle_job_run_state_change(self, _job_run, event):
+    def handle_job_run_state_change(self, job_run, event):
         """Handle state changes from JobRuns and propagate changes to any
         observers.
         """
         # Propagate state change for serialization
         if event == jobrun.JobRun.NOTIFY_STATE_CHANGED:
+            self.runs.mark_changed(job_run)
             self.notify(self.NOTIFY_STATE_CHANGE)
             return
 
         # Propagate DONE JobRun notifications to JobScheduler
         if event == jobrun.JobRun.NOTIFY_DONE:
             self.notify(self.NOTIFY_RUN_DONE)
+            if self.runs.freeze(job_run):
+                self.stop_watching(job_run)
             return
     handler = handle_job_run_state_change
 
+    def thaw_run(self, job_run):
+        """Return a JobRun for job_run which can be changed by commands. If
+        job_run is a CompletedJobRun it is restored from its state.
+        """
+        if not job_run.frozen:
+            return job_run
+
+        run = self.runs.thaw(job_run, self.action_graph,
+            self.output_path.clone(), self.context)
+        self.watch(run)
+        return run
+
     def __eq__(self, other):
         return all(getattr(other, attr, None) == getattr(self, attr, None)
                    for attr in self.equality_attributes)
@@ -205,17 +235,79 @@ class JobScheduler(Observer):
     def __init__(self, job):
         self.job                = job
         self.shutdown_requested = False
+        # Missed run times which may still run after a restart, or None
+        self.missed_runs_left   = None
         self.watch(job)
 
-    def restore_state(self, job_state_data):
-        """Restore the job state and schedule any JobRuns."""
+    def restore_state(self, job_state_data, catch_up=None):
+        """Restore the job state and schedule any JobRuns. If catch_up is
+        set, runs which were missed while trond was down are started or
+        skipped by its policy, instead of all starting immediately.
+        """
         self.job.restore_state(job_state_data)
         scheduled = self.job.runs.get_scheduled()
+        if catch_up and self.job.enabled:
+            scheduled = self.catch_up_missed_runs(catch_up, scheduled)
         for job_run in scheduled:
             self._set_callback(job_run)
         # Ensure we have at least 1 scheduled run
         self.schedule()
 
+    def catch_up_missed_runs(self, catch_up, scheduled):
+        """Apply the catch up policy to the first run time missed while
+        trond was down. The runs for it are either given to catch_up to
+        start, or cancelled. Later missed run times are limited by
+        get_catch_up_run_time. Returns the scheduled runs which are not
+        overdue.
+        """
+        now = timeutils.current_time()
+        missed = [run for run in scheduled if naive(run.run_time) <= now]
+        if missed:
+            run_time = min(run.run_time for run in missed)
+        else:
+            last_run = self.job.runs.get_newest(include_manual=False)
+            if scheduled or not last_run:
+                return scheduled
+            run_time = self.job.scheduler.next_run_time(last_run.run_time)
+            if naive(run_time) > now:
+                return scheduled
+
+        allowed = catch_up.get_allowed_runs(self.job)
+        missed_count = self.count_missed_runs(run_time, now)
+        catch_up.skip(self.job, missed_count - allowed)
+        if allowed:
+            self.missed_runs_left = allowed - 1
+            catch_up.delay(self, missed or self.job.build_new_runs(run_time))
+        else:
+            self.missed_runs_left = 0
+            for job_run in missed:
+                job_run.cancel()
+        return [run for run in scheduled if run not in missed]
+
+    def count_missed_runs(self, run_time, now):
+        """Return the number of run times from run_time until now."""
+        next_run_times = self.job.scheduler.next_run_times(run_time, now)
+        return 1 + sum(1 for _ in next_run_times)
+
+    def get_catch_up_run_time(self, run_time):
+        """Return the time for the next run while catching up on runs
+        missed while trond was down. Once no more missed runs are allowed,
+        skip to the next run time after now.
+        """
+        if self.missed_runs_left is None:
+            return run_time
+
+        if naive(run_time) > timeutils.current_time():
+            self.missed_runs_left = None
+            return run_time
+
+        if self.missed_runs_left:
+            self.missed_runs_left -= 1
+            return run_time
+
+        self.missed_runs_left = None
+        return self.job.scheduler.next_run_time(None)
+
     def enable(self):
         """Enable the job and start its scheduling cycle."""
         if self.job.enabled:
@@ -345,6 +437,7 @@ class JobScheduler(Observer):
             last_run = self.job.runs.get_newest(include_manual=False)
             last_run_time = last_run.run_time if last_run else None
         next_run_time = self.job.scheduler.next_run_time(last_run_time)
+        next_run_time = self.get_catch_up_run_time(next_run_time)
         return self.job.build_new_runs(next_run_time)
 
     def request_shutdown(self):
@@ -372,25 +465,155 @@ class JobScheduler(Observer):
 class JobSchedulerFactory(object):
     """Construct JobScheduler instances from configuration."""
 
-    def __init__(self, context, output_stream_dir, time_zone, action_runner):
+    def __init__(self, context, output_stream_dir, time_zone, action_runner,
+            run_archive=None):
         self.context            = context
         self.output_stream_dir  = output_stream_dir
         self.time_zone          = time_zone
         self.action_runner      = action_runner
+        self.run_archive        = run_archive
 
     def build(self, job_config):
         log.debug("Building new job %s", job_config.name)
         output_path = filehandler.OutputPath(self.output_stream_dir)
         scheduler = scheduler_from_config(job_config.schedule, self.time_zone)
-        job = Job.from_config(job_config, scheduler, self.context, output_path, self.action_runner)
+        job = Job.from_config(job_config, scheduler, self.context,
+            output_path, self.action_runner, self.run_archive)
         return JobScheduler(job)
 
 
+def naive(run_time):
+    """Return the wall clock time of a run_time, which may have a tzinfo."""
+    return run_time.replace(tzinfo=None)
+
+
+class ScheduleIndex(object):
+    """An index of the upcoming run times of enabled jobs, up to window after
+    the current time. Times are the wall clock times of runs, without jitter,
+    except for runs which are already scheduled.
+
+    The run times of a job are computed once and reused until the job is
+    enabled or disabled, its scheduler or its scheduled runs change, or a
+    lookahead goes past the last time computed for it.
+    """
+
+    def __init__(self, window):
+        self.window     = window
+        self.entries    = {}
+
+    def get_key(self, job):
+        scheduled = tuple(run.run_time for run in job.runs.get_scheduled())
+        return job.enabled, job.scheduler, scheduled
+
+    def build_run_times(self, job, start_time, end_time):
+        if not job.enabled:
+            return []
+        run_times = sorted(naive(run.run_time)
+            for run in job.runs.get_scheduled())
+        if run_times:
+            start_time = run_times[-1]
+        next_run_times = job.scheduler.next_run_times(start_time, end_time)
+        run_times.extend(naive(run_time) for run_time in next_run_times)
+        return run_times
+
+    def get_run_times(self, job, now):
+        """Return the run times of a job, up to at least now + window."""
+        end_time, key = now + self.window, self.get_key(job)
+        entry = self.entries.get(job.get_name())
+        if not entry or entry[0] != key or entry[1] < end_time:
+            run_times = self.build_run_times(job, now, end_time)
+            entry = self.entries[job.get_name()] = key, end_time, run_times
+        return entry[2]
+
+    def get_runs(self, jobs, start_time=None, end_time=None):
+        """Return a sorted list of (run_time, job) for runs of jobs between
+        start_time and end_time. end_time is limited to the window.
+        """
+        now = timeutils.current_time()
+        start_time = start_time or now
+        end_time = min(end_time or now + self.window, now + self.window)
+
+        runs = []
+        for job in jobs:
+            runs.extend((run_time, job)
+                for run_time in self.get_run_times(job, now)
+                if start_time <= run_time < end_time)
+        return sorted(runs, key=lambda run: (run[0], run[1].get_name()))
+
+    def invalidate(self, name):
+        self.entries.pop(name, None)
+
+
+class RestartCatchUp(object):
+    """Start the runs which were missed while trond was down, spread across
+    a ramp window instead of all at once, and record a summary event of the
+    runs which were delayed or skipped.
+    """
+
+    def __init__(self, config):
+        self.config     = config
+        self.delayed    = []
+        self.skipped    = {}
+
+    def get_allowed_runs(self, job):
+        """Return the number of missed run times which a job may run."""
+        policy, backfill_limit = self.config.policy, self.config.backfill_limit
+        if job.config:
+            policy = job.config.catch_up or policy
+            if job.config.backfill_limit is not None:
+                backfill_limit = job.config.backfill_limit
+
+        if policy == schema.CatchUpPolicies.skip:
+            return 0
+        if policy == schema.CatchUpPolicies.backfill:
+            return backfill_limit
+        return 1
+
+    def delay(self, job_scheduler, job_runs):
+        self.delayed.extend((job_scheduler, job_run) for job_run in job_runs)
+
+    def skip(self, job, count):
+        if count > 0:
+            self.skipped[job.get_name()] = count
+
+    def get_delays(self):
+        """Return a list of (seconds, job_scheduler, job_run) for the delayed
+        runs, oldest first, spread evenly across the ramp window.
+        """
+        ramp_window, seconds = self.config.ramp_window, 0
+        if ramp_window:
+            seconds = timeutils.delta_total_seconds(ramp_window)
+        key = lambda (_, job_run): (naive(job_run.run_time), job_run.id)
+        delayed = sorted(self.delayed, key=key)
+        return [(float(seconds) * index / len(delayed), job_scheduler, job_run)
+                for index, (job_scheduler, job_run) in enumerate(delayed)]
+
+    def start(self):
+        """Set callbacks to start the delayed runs and record a summary."""
+        delays = self.get_delays()
+        for seconds, job_scheduler, job_run in delays:
+            eventloop.call_later(seconds, job_scheduler.run_job, job_run)
+
+        if not delays and not self.skipped:
+            return
+        ramp_seconds = delays[-1][0] if delays else 0
+        log.info("Catching up on %d missed runs over %0.1fs, skipped %d.",
+            len(delays), ramp_seconds, sum(self.skipped.itervalues()))
+        event.get_recorder().notice('catch_up',
+            delayed=[job_run.id for _, _, job_run in delays],
+            skipped=self.skipped, ramp_seconds=ramp_seconds)
+
+
 class JobCollection(object):
     """A collection of jobs."""
 
+    # Upcoming runs are indexed this far into the future
+    schedule_window = datetime.timedelta(hours=24)
+
     def __init__(self):
         self.jobs = collections.MappingCollection('jobs')
+        self.schedule_index = ScheduleIndex(self.schedule_window)
+        self.catch_up_config = None
         self.proxy = proxy.CollectionProxy(self.jobs.itervalues, [
             proxy.func_proxy('request_shutdown',    iteration.list_all),
             proxy.func_proxy('enable',              iteration.list_all),
@@ -404,6 +627,8 @@ class JobCollection(object):
         jobs which were added.
         """
         self.jobs.filter_by_name(job_configs)
+        for name in set(self.schedule_index.entries) - set(job_configs):
+            self.schedule_index.invalidate(name)
 
         def map_to_job_and_schedule(job_schedulers):
             for job_scheduler in job_schedulers:
@@ -422,10 +647,24 @@ class JobCollection(object):
         job_scheduler = self.get_by_name(new_job_scheduler.get_name())
         job_scheduler.get_job().update_from_job(new_job_scheduler.get_job())
         job_scheduler.schedule_reconfigured()
+        self.schedule_index.invalidate(job_scheduler.get_name())
         return True
 
+    def update_catch_up(self, catch_up_config):
+        self.catch_up_config = catch_up_config
+
     def restore_state(self, job_state_data):
-        self.jobs.restore_state(job_state_data)
+        """Restore the state of jobs. Runs missed while trond was down are
+        caught up after every job is restored, so they can be spread out.
+        """
+        catch_up = None
+        if self.catch_up_config:
+            catch_up = RestartCatchUp(self.catch_up_config)
+        for name, state in job_state_data.iteritems():
+            self.jobs[name].restore_state(state, catch_up)
+        log.info("Loaded state for %d jobs", len(job_state_data))
+        if catch_up:
+            catch_up.start()
 
     def get_by_name(self, name):
         return self.jobs.get(name)
@@ -434,6 +673,19 @@ class JobCollection(object):
         return [job for job in self.get_jobs()
             if job.config.namespace == namespace]
 
+    def get_upcoming_runs(self, start_time=None, end_time=None,
+            namespace=None, node_pool=None):
+        """Return a sorted list of (run_time, job) for the runs of enabled
+        jobs between start_time and end_time, optionally limited to jobs in a
+        namespace or using a node pool.
+        """
+        jobs = (self.get_jobs_by_namespace(namespace) if namespace
+            else self.get_jobs())
+        if node_pool:
+            jobs = [job for job in jobs
+                if job.node_pool and job.node_pool.get_name() == node_pool]
+        return self.schedule_index.get_runs(jobs, start_time, end_time)
+
     def get_names(self):
         return self.jobs.keys()
 
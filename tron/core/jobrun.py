@@ -5,10 +5,13 @@
 from collections import deque
 import logging
 import itertools
+import operator
 from tron import node, command_context, event
+from tron.core import actionrun
 from tron.core.actionrun import ActionRun, ActionRunFactory
 from tron.serialize import filehandler
 from tron.utils import timeutils, proxy
+from tron.utils.collections import StringTable, update_membership
 from tron.utils.observer import Observable, Observer
 
 log = logging.getLogger(__name__)
@@ -17,6 +20,32 @@ class Error(Exception):
     pass
 
 
+# The version of the state format used by JobRun.state_data. State without a
+# state_format is in the original format, where each ActionRun has a dict of
+# full values.
+COMPACT_STATE_FORMAT = 2
+
+
+def expand_state_data(state_data):
+    """Return the state of a JobRun with the state of its ActionRuns in the
+    original format, for tools which read serialized state.
+    """
+    if state_data.get('state_format') != COMPACT_STATE_FORMAT:
+        return state_data
+
+    strings = StringTable(state_data['strings'])
+    job_run_id = '%s.%s' % (state_data['job_name'], state_data['run_num'])
+    def expand(action_state):
+        return actionrun.expand_compact_state(action_state, job_run_id, strings)
+
+    expanded = dict(state_data)
+    del expanded['state_format'], expanded['strings']
+    expanded['runs'] = [expand(action_state) for action_state in state_data['runs']]
+    if state_data['cleanup_run']:
+        expanded['cleanup_run'] = expand(state_data['cleanup_run'])
+    return expanded
+
+
 class JobRun(Observable, Observer):
     """A JobRun is an execution of a Job.  It has a list of ActionRuns and is
     responsible for starting ActionRuns in the correct order and managing their
@@ -28,6 +57,9 @@ class JobRun(Observable, Observer):
 
     context_class         = command_context.JobRunContext
 
+    # A JobRun is replaced by a CompletedJobRun when it is finished
+    frozen                = False
+
     # TODO: use config object
     def __init__(self, job_name, run_num, run_time, node, output_path=None,
                 base_context=None, action_runs=None, action_graph=None,
@@ -86,22 +118,36 @@ class JobRun(Observable, Observer):
             output_path=output_path,
             base_context=context
         )
+        strings = None
+        if state_data.get('state_format') == COMPACT_STATE_FORMAT:
+            strings = StringTable(state_data['strings'])
         action_runs = ActionRunFactory.action_run_collection_from_state(
-                job_run, state_data['runs'], state_data['cleanup_run'])
+                job_run, state_data['runs'], state_data['cleanup_run'],
+                strings=strings)
         job_run.action_runs = action_runs
+        # Commands which were waiting to start were never sent to their node
+        for action_run in action_runs.action_runs_with_cleanup:
+            action_run.requeue()
         return job_run
 
     @property
     def state_data(self):
-        """This data is used to serialize the state of this job run."""
+        """This data is used to serialize the state of this job run. The
+        state of its ActionRuns is in the compact format, with commands and
+        node names stored once in strings.
+        """
+        strings = StringTable()
         return {
+            'state_format':     COMPACT_STATE_FORMAT,
             'job_name':         self.job_name,
             'run_num':          self.run_num,
             'run_time':         self.run_time,
             'node_name':        self.node.get_name() if self.node else None,
-            'runs':             self.action_runs.state_data,
-            'cleanup_run':      self.action_runs.cleanup_action_state_data,
+            'runs':             self.action_runs.compact_state_data(strings),
+            'cleanup_run':
+                self.action_runs.compact_cleanup_action_state_data(strings),
             'manual':           self.manual,
+            'strings':          strings.strings,
         }
 
     def _get_action_runs(self):
@@ -272,7 +318,92 @@ class JobRun(Observable, Observer):
         return "JobRun:%s" % self.id
 
 
-class JobRunCollection(object):
+class CompletedJobRun(object):
+    """A read only record of a finished JobRun. It keeps the fields used by
+    the API and to serialize its state, and its ActionRuns as
+    CompletedActionRuns, but no context, proxies or observers. A
+    JobRunCollection replaces a JobRun with a CompletedJobRun once every
+    ActionRun is finished, and restores the JobRun from its state when a
+    command needs to change it.
+    """
+    __slots__ = (
+        'job_name',
+        'run_num',
+        'run_time',
+        'node',
+        'output_path',
+        'action_graph',
+        'action_runs',
+        'manual',
+        'state',
+        'start_time',
+        'end_time',
+    )
+
+    frozen          = True
+    is_scheduled    = False
+    is_queued       = False
+    is_starting     = False
+    is_running      = False
+
+    # Serialized the same way as a JobRun
+    id              = JobRun.id
+    state_data      = JobRun.state_data
+    get_action_run  = JobRun.get_action_run.im_func
+
+    def __init__(self, job_name, run_num, run_time, node, output_path,
+            action_graph, action_runs, manual, state, start_time, end_time):
+        self.job_name           = job_name
+        self.run_num            = run_num
+        self.run_time           = run_time
+        self.node               = node
+        self.output_path        = output_path
+        self.action_graph       = action_graph
+        self.action_runs        = action_runs
+        self.manual             = manual
+        self.state              = state
+        self.start_time         = start_time
+        self.end_time           = end_time
+
+    @classmethod
+    def from_job_run(cls, job_run):
+        action_runs = actionrun.CompletedActionRunCollection.from_collection(
+            job_run.action_runs)
+        return cls(
+            job_run.job_name,
+            job_run.run_num,
+            job_run.run_time,
+            job_run.node,
+            job_run.output_path,
+            job_run.action_graph,
+            action_runs,
+            job_run.manual,
+            job_run.state,
+            job_run.start_time,
+            job_run.end_time)
+
+    def cleanup(self):
+        """Remove the events and output of this run."""
+        event.get_recorder(self.id).notice('removed')
+        event.EventManager.get_instance().remove(str(self))
+        self.output_path.delete()
+
+    def __str__(self):
+        return "JobRun:%s" % self.id
+
+
+def get_newest_run(job_runs):
+    """Return the run with the highest run_num, or None."""
+    if not job_runs:
+        return None
+    return max(job_runs, key=operator.attrgetter('run_num'))
+
+
+def sort_newest_first(job_runs):
+    return sorted(job_runs, key=operator.attrgetter('run_num'), reverse=True)
+
+
+class JobRunCollection(Observer):
     """A JobRunCollection is a deque of JobRun objects. Responsible for
     ordering and logic related to a group of JobRuns which should all be runs
     for the same Job.
@@ -282,16 +413,38 @@ class JobRunCollection(object):
     state dict.
 
     Runs in a JobRunCollection should always remain sorted by their run_num.
+
+    The collection also tracks which runs were changed or removed since the
+    last call to pop_changes(), so that state can be persisted per run.
+
+    If the collection has a RunArchive, completed runs which are removed
+    to stay within run_limit are added to the archive.
+
+    Runs are indexed by run_num and by state, so lookups do not have to
+    compute the state of every run. The collection watches each of its runs
+    and updates the index when a run notifies that its state changed.
+
+    Finished runs are frozen into CompletedJobRuns by freeze(), which use
+    much less memory, and are restored to JobRuns by thaw().
     """
 
-    def __init__(self, run_limit):
+    def __init__(self, run_limit, archive=None):
         self.run_limit = run_limit
+        self.archive = archive
         self.runs = deque()
+        self.changed_runs = set()
+        self.removed_run_ids = set()
+        self.runs_by_num = {}
+        self.runs_by_state = {}
+        self.run_states = {}
+        self.pending_runs = set()
+        self.active_runs = set()
+        self._next_run_num = 0
 
     @classmethod
-    def from_config(cls, job_config):
+    def from_config(cls, job_config, archive=None):
         """Factory method for creating a JobRunCollection from a config."""
-        return cls(job_config.run_limit)
+        return cls(job_config.run_limit, archive)
 
     def restore_state(self, state_data, action_graph, output_path, context,
             node_pool):
@@ -305,7 +458,8 @@ class JobRunCollection(object):
                 context, node_pool.next())
             for run_state in state_data
         ]
-        self.runs.extend(restored_runs)
+        self.extend(restored_runs)
+        self.changed_runs.update(restored_runs)
         return restored_runs
 
     def build_new_run(self, job, run_time, node, manual=False):
@@ -317,10 +471,109 @@ class JobRunCollection(object):
              (run_num, job, node, run_time))
 
         run = JobRun.for_job(job, run_num, run_time, node, manual)
-        self.runs.appendleft(run)
+        self.appendleft(run)
+        self.mark_changed(run)
         self.remove_old_runs()
         return run
 
+    def appendleft(self, job_run):
+        """Add a run which is newer than the other runs."""
+        self.runs.appendleft(job_run)
+        self._add_to_index(job_run)
+
+    def extend(self, job_runs):
+        """Add runs, from newest to oldest, which are older than the other
+        runs.
+        """
+        self.runs.extend(job_runs)
+        for job_run in job_runs:
+            self._add_to_index(job_run)
+
+    def _add_to_index(self, job_run):
+        self.runs_by_num[job_run.run_num] = job_run
+        self._next_run_num = max(self._next_run_num, job_run.run_num + 1)
+        self.update_index(job_run)
+        if not job_run.frozen:
+            self.watch(job_run)
+
+    def _remove_from_index(self, job_run):
+        if not job_run.frozen:
+            self.stop_watching(job_run)
+        self.runs_by_num.pop(job_run.run_num, None)
+        state = self.run_states.pop(job_run, None)
+        self.runs_by_state.get(state, set()).discard(job_run)
+        self.pending_runs.discard(job_run)
+        self.active_runs.discard(job_run)
+
+    def update_index(self, job_run):
+        """Update the index with the current state of job_run."""
+        state = job_run.state
+        previous = self.run_states.get(job_run)
+        if job_run not in self.run_states or state != previous:
+            self.runs_by_state.get(previous, set()).discard(job_run)
+            self.runs_by_state.setdefault(state, set()).add(job_run)
+            self.run_states[job_run] = state
+
+        update_membership(self.pending_runs, job_run,
+            job_run.is_scheduled or job_run.is_queued)
+        update_membership(self.active_runs, job_run,
+            job_run.is_running or job_run.is_starting)
+
+    def handler(self, job_run, _):
+        """Handle state changes from JobRuns."""
+        self.update_index(job_run)
+
+    def freeze(self, job_run):
+        """Replace job_run with a CompletedJobRun once its ActionRuns are
+        finished, which includes runs that are blocked by a failed run.
+        Returns the CompletedJobRun, or None if job_run was not replaced.
+        """
+        if self.runs_by_num.get(job_run.run_num) is not job_run:
+            return None
+        if job_run.frozen or not job_run.action_runs.is_finished:
+            return None
+
+        completed_run = CompletedJobRun.from_job_run(job_run)
+        self._replace_run(job_run, completed_run)
+        return completed_run
+
+    def thaw(self, completed_run, action_graph, output_path, context):
+        """Replace a CompletedJobRun with a JobRun restored from its state, so
+        that it can be changed by commands. Returns the JobRun.
+        """
+        job_run = JobRun.from_state(completed_run.state_data, action_graph,
+            output_path, context, completed_run.node)
+        self._replace_run(completed_run, job_run)
+        return job_run
+
+    def _replace_run(self, old_run, new_run):
+        """Replace old_run with new_run, which has the same run_num."""
+        self.runs = deque(
+            new_run if run is old_run else run for run in self.runs)
+        self._remove_from_index(old_run)
+        self._add_to_index(new_run)
+        if old_run in self.changed_runs:
+            self.changed_runs.discard(old_run)
+            self.changed_runs.add(new_run)
+
+    def mark_changed(self, job_run):
+        """Record that the state of job_run has changed."""
+        self.changed_runs.add(job_run)
+
+    def _mark_removed(self, job_run):
+        self.changed_runs.discard(job_run)
+        self.removed_run_ids.add(job_run.id)
+
+    def pop_changes(self):
+        """Return a tuple of the runs which changed and the ids of runs which
+        were removed since the last call, and reset both.
+        """
+        changed_runs = [run for run in self.runs if run in self.changed_runs]
+        removed_run_ids = sorted(self.removed_run_ids)
+        self.changed_runs.clear()
+        self.removed_run_ids.clear()
+        return changed_runs, removed_run_ids
+
     def cancel_pending(self):
         """Find any queued or scheduled runs and cancel them."""
         for pending in self.get_pending():
@@ -328,7 +581,9 @@ class JobRunCollection(object):
 
     def remove_pending(self):
         """Remove pending runs from the run list."""
-        for pending in list(self.get_pending()):
+        for pending in self.get_pending():
+            self._remove_from_index(pending)
+            self._mark_removed(pending)
             pending.cleanup()
             self.runs.remove(pending)
 
@@ -347,16 +602,19 @@ class JobRunCollection(object):
         except StopIteration:
             return None
 
-    def _filter_by_state(self, state):
-        return lambda r: r.state == state
+    def _get_runs_by_state(self, state, node=None):
+        job_runs = self.runs_by_state.get(state, ())
+        if node:
+            return [r for r in job_runs if r.node == node]
+        return job_runs
 
     def get_run_by_state(self, state):
         """Returns the most recent run which matches the state."""
-        return self._get_run_using(self._filter_by_state(state))
+        return get_newest_run(self.runs_by_state.get(state))
 
     def get_run_by_num(self, num):
         """Return a the run with run number which matches num."""
-        return self._get_run_using(lambda r: r.run_num == num)
+        return self.runs_by_num.get(num)
 
     def get_run_by_index(self, index):
         """Return the job run at index. Jobs are indexed from oldest to newest.
@@ -368,7 +626,10 @@ class JobRunCollection(object):
 
     def get_run_by_state_short_name(self, short_name):
         """Returns the most recent run which matches the state short name."""
-        return self._get_run_using(lambda r: r.state.short_name == short_name)
+        return get_newest_run([job_run
+            for state, job_runs in self.runs_by_state.iteritems()
+            if state and state.short_name == short_name
+            for job_run in job_runs])
 
     def get_newest(self, include_manual=True):
         """Returns the most recently created JobRun."""
@@ -376,31 +637,33 @@ class JobRunCollection(object):
         return self._get_run_using(func)
 
     def get_pending(self):
-        """Return the job runs that are queued or scheduled."""
-        return self._get_runs_using(lambda r: r.is_scheduled or r.is_queued)
+        """Return the job runs that are queued or scheduled, from newest to
+        oldest.
+        """
+        return sort_newest_first(self.pending_runs)
 
     @property
     def has_pending(self):
-        return any(self.get_pending())
+        return bool(self.pending_runs)
 
     def get_active(self, node=None):
+        """Return the job runs that are running or starting, from newest to
+        oldest.
+        """
+        job_runs = self.active_runs
         if node:
-            func = lambda r: (r.is_running or r.is_starting) and r.node == node
-        else:
-            func = lambda r: r.is_running or r.is_starting
-        return self._get_runs_using(func)
+            job_runs = (r for r in job_runs if r.node == node)
+        return sort_newest_first(job_runs)
 
     def get_first_queued(self, node=None):
-        state = ActionRun.STATE_QUEUED
-        if node:
-            queued_func = lambda r: r.state == state and r.node == node
-        else:
-            queued_func = self._filter_by_state(state)
-        return self._get_run_using(queued_func, reverse=True)
+        job_runs = self._get_runs_by_state(ActionRun.STATE_QUEUED, node)
+        if not job_runs:
+            return None
+        return min(job_runs, key=operator.attrgetter('run_num'))
 
     def get_scheduled(self):
-        state = ActionRun.STATE_SCHEDULED
-        return self._get_runs_using(self._filter_by_state(state))
+        return sort_newest_first(
+            self._get_runs_by_state(ActionRun.STATE_SCHEDULED))
 
     def get_next_to_finish(self, node=None):
         """Return the most recent run which is either running or scheduled. If
@@ -414,10 +677,10 @@ class JobRunCollection(object):
         return self._get_run_using(compare)
 
     def next_run_num(self):
-        """Return the next run number to use."""
-        if not self.runs:
-            return 0
-        return max(r.run_num for r in self.runs) + 1
+        """Return the next run number to use. Run numbers are not reused,
+        even when the newest run is removed.
+        """
+        return self._next_run_num
 
     def remove_old_runs(self):
         """Remove old runs to reduce the number of completed runs
@@ -425,8 +688,19 @@ class JobRunCollection(object):
         """
         while len(self.runs) > self.run_limit:
             run = self.runs.pop()
+            self._remove_from_index(run)
+            self._mark_removed(run)
+            self._archive_run(run)
             run.cleanup()
 
+    def _archive_run(self, run):
+        if not self.archive or not run.action_runs.is_done:
+            return
+        try:
+            self.archive.add(run)
+        except Exception:
+            log.exception("Failed to archive %s", run)
+
     def get_action_runs(self, action_name):
         return [job_run.get_action_run(action_name) for job_run in self]
 
@@ -435,6 +709,11 @@ class JobRunCollection(object):
         """Return the state data to serialize."""
         return [r.state_data for r in self.runs]
 
+    @property
+    def run_nums(self):
+        """Return the run numbers of all runs, from newest to oldest."""
+        return [r.run_num for r in self.runs]
+
     @property
     def last_success(self):
         return self.get_run_by_state(ActionRun.STATE_SUCCEEDED)
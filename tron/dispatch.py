@@ -0,0 +1,270 @@
+"""
+ Limit the number of commands which run at once.
+
+ ActionRuns submit their ActionCommand to the Dispatcher instead of to their
+ Node. A command is sent to its Node when the number of running commands is
+ below each limit which applies to it: the limit of its node, of each node
+ pool which contains the node, of the namespace of its job, and the total
+ limit. Otherwise it waits until a running command finishes.
+
+ Waiting commands are started in order of the priority of their job, and then
+ in the order they were submitted.
+"""
+import bisect
+import itertools
+import logging
+
+from tron import eventloop
+
+
+log = logging.getLogger(__name__)
+
+
+# Kinds of limits, which are also the names of their dicts in ConfigDispatch
+NODES       = 'nodes'
+NODE_POOLS  = 'node_pools'
+NAMESPACES  = 'namespaces'
+
+LIMIT_KINDS = NODES, NODE_POOLS, NAMESPACES
+
+
+def get_job_name(action_run):
+    return action_run.job_run_id.rsplit('.', 1)[0]
+
+
+class DispatchRequest(object):
+    """An ActionCommand for an ActionRun which is waiting to start."""
+
+    def __init__(self, action_run, action_command, keys, priority, sequence,
+            submit_time):
+        self.action_run     = action_run
+        self.action_command = action_command
+        self.keys           = keys
+        self.priority       = priority
+        self.sequence       = sequence
+        self.submit_time    = submit_time
+        self.removed        = False
+
+    @property
+    def sort_key(self):
+        return -self.priority, self.sequence
+
+    def __str__(self):
+        return "DispatchRequest:%s" % self.action_run.id
+
+
+class Dispatcher(object):
+    """A Singleton which sends commands to their Node when they are within
+    the concurrency limits.
+    """
+
+    _instance = None
+
+    def __init__(self):
+        if self._instance is not None:
+            raise ValueError("Dispatcher is already instantiated.")
+        self.max_concurrent     = None
+        self.max_per_node       = None
+        self.limits             = dict((kind, {}) for kind in LIMIT_KINDS)
+        self.pools_by_node      = {}
+        self.jobs               = {}
+        self.running            = {}
+        self.total_running      = 0
+        self.waiting            = []
+        self.sequence           = itertools.count()
+        self.stats              = {
+            'dispatched':           0,
+            'waited':               0,
+            'total_wait_seconds':   0.0,
+            'max_wait_seconds':     0.0,
+            'max_waiting':          0,
+        }
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    def update_from_config(cls, dispatch_config, node_pool_configs,
+            job_configs):
+        """Set the limits from a ConfigDispatch, and the node pools of each
+        node and the namespace and priority of each job, which are used to
+        find the limits of a command.
+        """
+        instance = cls.get_instance()
+        instance.max_concurrent = dispatch_config.max_concurrent
+        instance.max_per_node   = dispatch_config.max_per_node
+        for kind in LIMIT_KINDS:
+            instance.limits[kind] = dict(getattr(dispatch_config, kind))
+
+        instance.pools_by_node = {}
+        for pool_config in node_pool_configs.itervalues():
+            for node_name in pool_config.nodes:
+                pools = instance.pools_by_node.setdefault(node_name, set())
+                pools.add(pool_config.name)
+
+        instance.jobs = dict(
+            (name, (config.namespace, config.priority))
+            for name, config in job_configs.iteritems())
+        instance.dispatch()
+
+    @staticmethod
+    def seconds():
+        return eventloop.timer_queue.clock.seconds()
+
+    def get_limit(self, key):
+        kind, name = key
+        default = self.max_per_node if kind == NODES else None
+        return self.limits[kind].get(name, default)
+
+    def get_keys(self, action_run):
+        """Return the keys of the limits of the command of an ActionRun."""
+        node_name = action_run.node.get_name()
+        keys = [(NODES, node_name)]
+        keys.extend((NODE_POOLS, pool_name)
+            for pool_name in sorted(self.pools_by_node.get(node_name, ())))
+        namespace, _ = self.jobs.get(get_job_name(action_run), (None, 0))
+        if namespace:
+            keys.append((NAMESPACES, namespace))
+        return keys
+
+    def is_full(self):
+        return (self.max_concurrent is not None and
+                self.total_running >= self.max_concurrent)
+
+    def can_start(self, request):
+        if self.is_full():
+            return False
+
+        for key in request.keys:
+            limit = self.get_limit(key)
+            if limit is not None and self.running.get(key, 0) >= limit:
+                return False
+        return True
+
+    def submit(self, action_run, action_command):
+        """Start the command for action_run, or queue it to be started when
+        it is within the limits. Returns False if the command could not be
+        sent to the node.
+        """
+        _, priority = self.jobs.get(get_job_name(action_run), (None, 0))
+        request = DispatchRequest(action_run, action_command,
+            self.get_keys(action_run), priority, self.sequence.next(),
+            self.seconds())
+
+        if self.can_start(request):
+            return self._start(request)
+
+        log.info("Queueing %s until it is within its concurrency limits",
+            action_run.id)
+        bisect.insort(self.waiting, (request.sort_key, request))
+        self.stats['max_waiting'] = max(
+            self.stats['max_waiting'], len(self.waiting))
+        return True
+
+    def cancel(self, action_run):
+        """Remove the command of action_run from the queue. Returns True if
+        the command was waiting.
+        """
+        for item in self.waiting:
+            request = item[1]
+            if request.action_run is action_run and not request.removed:
+                request.removed = True
+                self.waiting.remove(item)
+                return True
+        return False
+
+    def dispatch(self):
+        """Start each waiting command which is within its limits. Starting a
+        command can submit or finish other commands, so requests are marked
+        as removed, and removed from the queue after they are all checked.
+        """
+        started = False
+        for _, request in list(self.waiting):
+            if self.is_full():
+                break
+            if request.removed or not self.can_start(request):
+                continue
+            request.removed = started = True
+            self._start(request)
+
+        if started:
+            self.waiting = [item for item in self.waiting if not item[1].removed]
+
+    def _start(self, request):
+        self._record_wait(request)
+        self._acquire(request.keys)
+        deferred = request.action_run.submit_command(request.action_command)
+        if deferred is None:
+            self._finished(None, request.keys)
+            return False
+
+        deferred.addBoth(self._finished, request.keys)
+        return True
+
+    def _finished(self, result, keys):
+        self._release(keys)
+        self.dispatch()
+        return result
+
+    def _record_wait(self, request):
+        wait_seconds = max(self.seconds() - request.submit_time, 0)
+        self.stats['dispatched'] += 1
+        if wait_seconds:
+            self.stats['waited'] += 1
+        self.stats['total_wait_seconds'] += wait_seconds
+        self.stats['max_wait_seconds'] = max(
+            self.stats['max_wait_seconds'], wait_seconds)
+
+    def _acquire(self, keys):
+        self.total_running += 1
+        for key in keys:
+            self.running[key] = self.running.get(key, 0) + 1
+
+    def _release(self, keys):
+        self.total_running -= 1
+        for key in keys:
+            self.running[key] -= 1
+            if not self.running[key]:
+                del self.running[key]
+
+    def get_running(self):
+        """Return a dict of each kind of limit to a dict of names to the
+        number of running commands.
+        """
+        running = dict((kind, {}) for kind in LIMIT_KINDS)
+        for (kind, name), count in self.running.iteritems():
+            running[kind][name] = count
+        return running
+
+    def get_stats(self):
+        now = self.seconds()
+        dispatched = self.stats['dispatched']
+        return dict(self.stats,
+            running=self.total_running,
+            running_by=self.get_running(),
+            max_concurrent=self.max_concurrent,
+            max_per_node=self.max_per_node,
+            limits=self.limits,
+            mean_wait_seconds=(
+                self.stats['total_wait_seconds'] / dispatched
+                if dispatched else 0),
+            queue=[{
+                'id':               request.action_run.id,
+                'node':             request.action_run.node.get_name(),
+                'priority':         request.priority,
+                'wait_seconds':     now - request.submit_time,
+            } for _, request in self.waiting if not request.removed])
+
+    def clear(self):
+        """Remove waiting commands and reset counts."""
+        self.waiting = []
+        self.running = {}
+        self.total_running = 0
+        for key in self.stats:
+            self.stats[key] = 0
+
+    def __str__(self):
+        return "Dispatcher"
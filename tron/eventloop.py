@@ -1,8 +1,18 @@
-"""Minimal abstraction oer an event loop."""
+"""Minimal abstraction oer an event loop.
 
-from twisted.internet import reactor
+Calls made with call_later() are queued in a single TimerQueue, which keeps
+one reactor DelayedCall for the earliest timer, instead of adding a
+DelayedCall to the reactor for every scheduled run, timeout and retry.
+"""
+import heapq
+import itertools
+import logging
+
+from twisted.internet import error, reactor
 from twisted.internet.base import DelayedCall
 
+log = logging.getLogger(__name__)
+
 
 class Callback(DelayedCall):
     """
@@ -21,8 +31,208 @@ class NullCallback(object):
         return False
 
 
+class Timer(object):
+    """A call queued in a TimerQueue. Supports the same active(), cancel(),
+    reset() and getTime() methods as a DelayedCall.
+    """
+
+    def __init__(self, queue, time, func, args, kwargs):
+        self.queue          = queue
+        self.time           = time
+        self.func           = func
+        self.args           = args
+        self.kwargs         = kwargs
+        self.cancelled      = False
+        self.called         = False
+
+    def getTime(self):
+        return self.time
+
+    def active(self):
+        return not (self.cancelled or self.called)
+
+    def _check_active(self):
+        if self.cancelled:
+            raise error.AlreadyCancelled()
+        if self.called:
+            raise error.AlreadyCalled()
+
+    def cancel(self):
+        self._check_active()
+        self.cancelled = True
+        self.queue._cancelled(self)
+
+    def reset(self, delay):
+        """Reschedule the call to happen delay seconds from now."""
+        self._check_active()
+        self.queue._reset(self, delay)
+
+    def __repr__(self):
+        return "Timer(%s, %r)" % (self.time, self.func)
+
+
+class TimerQueue(object):
+    """A heap of Timers which is run by a single reactor DelayedCall, set
+    for the time of the earliest timer.
+
+    Cancelled and reset timers are not removed from the heap. Their entries
+    are skipped when they reach the top of the heap, and the heap is rebuilt
+    when more than half of its entries are stale. Timers added while the
+    queue is running are run by the next DelayedCall, so a call_later(0)
+    still waits for the next reactor iteration.
+    """
+
+    def __init__(self, clock=None):
+        self._clock         = clock
+        self.heap           = []
+        self.counter        = itertools.count()
+        self.delayed_call   = NullCallback
+        self.stale          = 0
+        self.stats          = {
+            'added':            0,
+            'fired':            0,
+            'cancelled':        0,
+            'failures':         0,
+            'last_lag':         0,
+            'max_lag':          0,
+            'total_lag':        0,
+        }
+
+    @property
+    def clock(self):
+        return self._clock or reactor
+
+    def set_clock(self, clock):
+        """Use clock instead of the reactor. Pending timers are dropped,
+        because their times are from the previous clock.
+        """
+        if self.delayed_call.active():
+            self.delayed_call.cancel()
+        self.delayed_call   = NullCallback
+        self.heap           = []
+        self.stale          = 0
+        self._clock         = clock
+
+    def call_later(self, delay, func, *args, **kwargs):
+        """Return a Timer which calls func(*args, **kwargs) in delay seconds."""
+        timer = Timer(self, self.clock.seconds() + delay, func, args, kwargs)
+        self.stats['added'] += 1
+        self._push(timer)
+        return timer
+
+    def _push(self, timer):
+        heapq.heappush(self.heap, (timer.time, next(self.counter), timer))
+        self._schedule()
+
+    def _cancelled(self, timer):
+        self.stats['cancelled'] += 1
+        self._mark_stale()
+
+    def _reset(self, timer, delay):
+        timer.time = self.clock.seconds() + delay
+        self._mark_stale()
+        self._push(timer)
+
+    def _mark_stale(self):
+        self.stale += 1
+        if self.stale > len(self.heap) / 2:
+            self._compact()
+
+    def _compact(self):
+        """Rebuild the heap without stale entries."""
+        self.heap = [entry for entry in self.heap if self._is_live(entry)]
+        heapq.heapify(self.heap)
+        self.stale = 0
+        self._schedule()
+
+    @staticmethod
+    def _is_live(entry):
+        time, _, timer = entry
+        return timer.active() and timer.time == time
+
+    def _pop_stale(self):
+        while self.heap and not self._is_live(self.heap[0]):
+            heapq.heappop(self.heap)
+            self.stale = max(self.stale - 1, 0)
+
+    def _schedule(self):
+        """Set the reactor DelayedCall for the earliest live timer."""
+        self._pop_stale()
+        if not self.heap:
+            if self.delayed_call.active():
+                self.delayed_call.cancel()
+            return
+
+        next_time = self.heap[0][0]
+        if self.delayed_call.active():
+            if self.delayed_call.getTime() <= next_time:
+                return
+            self.delayed_call.cancel()
+
+        delay = max(next_time - self.clock.seconds(), 0)
+        self.delayed_call = self.clock.callLater(delay, self._run)
+
+    def _run(self):
+        """Call every timer which is due, in order of time."""
+        # The reactor may run the call a moment before its time
+        now = max(self.clock.seconds(), self.delayed_call.getTime())
+        last_seq = next(self.counter)
+        while self.heap:
+            time, seq, timer = self.heap[0]
+            if time > now or seq > last_seq:
+                break
+            heapq.heappop(self.heap)
+            if not self._is_live((time, seq, timer)):
+                self.stale = max(self.stale - 1, 0)
+                continue
+            self._call(timer, now)
+        self._schedule()
+
+    def _call(self, timer, now):
+        timer.called = True
+        lag = now - timer.time
+        self.stats['fired']         += 1
+        self.stats['last_lag']      = lag
+        self.stats['total_lag']     += lag
+        self.stats['max_lag']       = max(self.stats['max_lag'], lag)
+        try:
+            timer.func(*timer.args, **timer.kwargs)
+        except Exception:
+            self.stats['failures'] += 1
+            log.exception("Timer %r failed.", timer)
+
+    def __len__(self):
+        return len(self.heap) - self.stale
+
+    def get_stats(self):
+        """Return a dict of statistics about the queue. Lag is the number of
+        seconds between when a timer was due and when it was called.
+        """
+        fired = self.stats['fired']
+        return dict(self.stats,
+            pending=len(self),
+            heap_size=len(self.heap),
+            mean_lag=float(self.stats['total_lag']) / fired if fired else 0)
+
+
+timer_queue = TimerQueue()
+
+
 def call_later(interval, *args, **kwargs):
-    return reactor.callLater(interval, *args, **kwargs)
+    """Call a function after interval seconds, and return a Timer."""
+    return timer_queue.call_later(interval, *args, **kwargs)
+
+
+def get_timer_stats():
+    return timer_queue.get_stats()
+
+
+def set_clock(clock):
+    """Run timers with clock, which provides the seconds() and callLater()
+    methods of a reactor, such as a twisted.internet.task.Clock. Setting it
+    to None restores the reactor.
+    """
+    timer_queue.set_clock(clock)
 
 
 class UniqueCallback(object):
@@ -37,12 +247,25 @@ class UniqueCallback(object):
         self.kwargs         = kwargs
         self.delayed_call   = NullCallback
 
-    def start(self):
-        if not self.delay or self.delayed_call.active():
+    def start(self, delay=None):
+        """Queue the call after delay seconds, or self.delay if delay is None.
+        If the call is already queued, it is only moved to fire sooner.
+        """
+        if self.delayed_call.active():
+            if delay is not None and self._seconds_until_call() > delay:
+                self.delayed_call.reset(delay)
             return
 
+        if delay is None:
+            delay = self.delay
+            if not delay:
+                return
+
         self.delayed_call = call_later(
-            self.delay, self.func, *self.args, **self.kwargs)
+            delay, self.func, *self.args, **self.kwargs)
+
+    def _seconds_until_call(self):
+        return self.delayed_call.getTime() - timer_queue.clock.seconds()
 
     def cancel(self):
         if self.delayed_call.active():
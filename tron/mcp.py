@@ -1,14 +1,17 @@
 from __future__ import with_statement
 import logging
+import os
 
 from tron import command_context, actioncommand
 from tron import event
 from tron import crash_reporter
+from tron import dispatch
 from tron import node
 from tron.config import manager
 from tron.core import service, job
+from tron.serialize import runarchive
 from tron.serialize.runstate import statemanager
-from tron.utils import emailer
+from tron.utils import emailer, timeutils
 
 
 log = logging.getLogger(__name__)
@@ -37,9 +40,13 @@ class MasterControlProgram(object):
         self.event_recorder     = event.get_recorder()
         self.event_recorder.ok('started')
         self.state_watcher      = statemanager.StateChangeWatcher()
+        self.startup_timer      = timeutils.StepTimer()
+        self.run_archive        = None
 
     def shutdown(self):
         self.state_watcher.shutdown()
+        if self.run_archive:
+            self.run_archive.cleanup()
 
     def graceful_shutdown(self):
         """Inform JobCollection that a shutdown has been requested."""
@@ -58,30 +65,39 @@ class MasterControlProgram(object):
     def _load_config(self, reconfigure=False):
         """Read config data and apply it."""
         with self.state_watcher.disabled():
-            self.apply_config(self.config.load(), reconfigure=reconfigure)
+            with self.startup_timer.time('config_load'):
+                config_container = self.config.load()
+            self.apply_config(config_container, reconfigure=reconfigure)
 
     def initial_setup(self):
         """When the MCP is initialized the config is applied before the state.
         In this case jobs shouldn't be scheduled until the state is applied.
         """
+        self.startup_timer = timer = timeutils.StepTimer()
         self._load_config()
         self.restore_state()
         # Any job with existing state would have been scheduled already. Jobs
         # without any state will be scheduled here.
-        self.jobs.schedule()
+        with timer.time('first_schedule'):
+            self.jobs.schedule()
+        log.info("Startup timings: %s", timer)
 
     def apply_config(self, config_container, reconfigure=False):
         """Apply a configuration."""
         master_config_directives = [
             (self.update_state_watcher_config,           'state_persistence'),
+            (self.update_run_archive,                    'state_persistence'),
             (self.set_context_base,                      'command_context'),
-            (node.NodePoolRepository.update_from_config, 'nodes',
+            (self.update_nodes,                          'nodes',
                                                          'node_pools',
                                                          'ssh_options'),
             (self.apply_notification_options,            'notification_options'),
+            (self.jobs.update_catch_up,                  'catch_up'),
         ]
         master_config = config_container.get_master()
         apply_master_configuration(master_config_directives, master_config)
+        self.update_dispatcher(master_config.dispatch,
+            master_config.node_pools, config_container.get_jobs())
 
         # TODO: unify NOTIFY_STATE_CHANGE and simplify this
         factory = self.build_job_scheduler_factory(master_config)
@@ -103,7 +119,8 @@ class MasterControlProgram(object):
             self.context,
             output_stream_dir,
             master_config.time_zone,
-            action_runner)
+            action_runner,
+            self.run_archive)
 
     def update_state_watcher_config(self, state_config):
         """Update the StateChangeWatcher, and save all state if the state config
@@ -111,10 +128,36 @@ class MasterControlProgram(object):
         """
         if self.state_watcher.update_from_config(state_config):
             for job_scheduler in self.jobs:
-                self.state_watcher.save_job(job_scheduler.get_job())
+                self.state_watcher.save_job(
+                    job_scheduler.get_job(), all_runs=True)
             for service in self.services:
                 self.state_watcher.save_service(service)
 
+    def update_run_archive(self, state_config):
+        """Open the RunArchive, or replace it if its filename changed."""
+        filename = state_config.run_archive
+        if filename:
+            filename = os.path.join(self.working_dir, filename)
+
+        current = self.run_archive.filename if self.run_archive else None
+        if filename == current:
+            return
+
+        if self.run_archive:
+            self.run_archive.cleanup()
+        self.run_archive = runarchive.RunArchive(filename) if filename else None
+        for job_runs in self.jobs.get_job_run_collections():
+            job_runs.archive = self.run_archive
+
+    def update_nodes(self, nodes, node_pools, ssh_options):
+        with self.startup_timer.time('node_setup'):
+            node.NodePoolRepository.update_from_config(
+                nodes, node_pools, ssh_options)
+
+    def update_dispatcher(self, dispatch_config, node_pools, job_configs):
+        dispatch.Dispatcher.update_from_config(
+            dispatch_config, node_pools, job_configs)
+
     def apply_notification_options(self, conf):
         if not conf:
             return
@@ -138,16 +181,24 @@ class MasterControlProgram(object):
     def get_config_manager(self):
         return self.config
 
+    def get_state_watcher(self):
+        return self.state_watcher
+
+    def get_dispatcher(self):
+        return dispatch.Dispatcher.get_instance()
+
     def restore_state(self):
         """Use the state manager to retrieve to persisted state and apply it
         to the configured Jobs and Services.
         """
         self.event_recorder.notice('restoring')
         job_states, service_states = self.state_watcher.restore(
-                self.jobs.get_names(), self.services.get_names())
+                self.jobs.get_names(), self.services.get_names(),
+                timer=self.startup_timer)
 
-        self.jobs.restore_state(job_states)
-        self.services.restore_state(service_states)
+        with self.startup_timer.time('apply'):
+            self.jobs.restore_state(job_states)
+            self.services.restore_state(service_states)
         self.state_watcher.save_metadata()
 
     def __str__(self):
@@ -62,6 +62,8 @@ class NodePoolRepository(object):
         super(NodePoolRepository, self).__init__()
         self.nodes = collections.MappingCollection('nodes')
         self.pools = collections.MappingCollection('pools')
+        # Creates a Node from its config, replaced in a simulation
+        self.node_factory = Node.from_config
 
     @classmethod
     def get_instance(cls):
@@ -85,7 +87,7 @@ class NodePoolRepository(object):
     def _update_nodes(self, node_configs, ssh_options, known_hosts, ssh_config):
         for config in node_configs.itervalues():
             pub_key = known_hosts.get_public_key(config.hostname)
-            node = Node.from_config(config, ssh_options, pub_key, ssh_config)
+            node = self.node_factory(config, ssh_options, pub_key, ssh_config)
             self.add_node(node)
 
     def _update_node_pools(self, node_pool_configs):
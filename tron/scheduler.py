@@ -10,10 +10,17 @@ Tron schedulers
     def next_run_time(self, last_run_time):
         <returns datetime>
 
+    def next_run_times(self, start_time, end_time):
+        <returns a sequence of datetimes>
+
 
  next_run_time() should return a datetime which is the time the next job run
  will be run.
 
+ next_run_times() should return the times (without jitter) that runs would be
+ scheduled after start_time and before end_time, if they can be known ahead
+ of time.
+
  schedule_on_complete is a bool that identifies if this scheduler should have
  jobs scheduled with the start_time of the previous run (False), or the
  end time of the previous run (False).
@@ -83,6 +90,12 @@ class ConstantScheduler(object):
     def next_run_time(self, _):
         return timeutils.current_time()
 
+    def next_run_times(self, start_time, end_time):
+        """Runs are scheduled when the previous run completes, so there is
+        no way to know when they will run.
+        """
+        return []
+
     def __str__(self):
         return self.get_name()
 
@@ -117,8 +130,14 @@ def get_jitter_str(time_delta):
 
 class GeneralScheduler(object):
     """Scheduler which uses a TimeSpecification.
+
+    The next cache_size matches after a start time are computed together and
+    cached, because the next run of a job is scheduled from the run_time of
+    the previous run, which is the previous match. A new scheduler (and cache)
+    is created for a job when it is reconfigured.
     """
     schedule_on_complete = False
+    cache_size           = 5
 
     def __init__(self,
             ordinals=None,
@@ -150,7 +169,8 @@ class GeneralScheduler(object):
         self.jitter         = jitter
         self.name           = name or 'daily'
         self.original       = original or ''
-        self.time_spec      = trontimespec.TimeSpecification(
+        self.next_matches   = {}
+        self.time_spec      = trontimespec.CompiledTimeSpecification(
             ordinals=ordinals,
             weekdays=weekdays,
             months=months,
@@ -161,23 +181,61 @@ class GeneralScheduler(object):
             seconds=seconds,
             timezone=time_zone.zone if time_zone else None)
 
+    def localize(self, start_time):
+        """Return start_time in the time zone of this scheduler."""
+        if not self.time_zone or start_time.tzinfo:
+            return start_time
+        try:
+            return self.time_zone.localize(start_time, is_dst=None)
+        except AmbiguousTimeError:
+            # We are in the infamous 1 AM block which happens twice on
+            # fall-back. Pretend like it's the first time, every time.
+            return self.time_zone.localize(start_time, is_dst=True)
+        except NonExistentTimeError:
+            # We are in the infamous 2:xx AM block which does not
+            # exist. Pretend like it's the later time, every time.
+            return self.time_zone.localize(start_time, is_dst=True)
+
     def next_run_time(self, start_time):
         """Find the next time to run."""
         if not start_time:
             start_time = timeutils.current_time()
-        elif self.time_zone:
-            try:
-                start_time = self.time_zone.localize(start_time, is_dst=None)
-            except AmbiguousTimeError:
-                # We are in the infamous 1 AM block which happens twice on
-                # fall-back. Pretend like it's the first time, every time.
-                start_time = self.time_zone.localize(start_time, is_dst=True)
-            except NonExistentTimeError:
-                # We are in the infamous 2:xx AM block which does not
-                # exist. Pretend like it's the later time, every time.
-                start_time = self.time_zone.localize(start_time, is_dst=True)
-
-        return self.time_spec.get_match(start_time) + get_jitter(self.jitter)
+        else:
+            start_time = self.localize(start_time)
+
+        return self.get_match(start_time) + get_jitter(self.jitter)
+
+    def next_run_times(self, start_time, end_time):
+        """Yield the matches after start_time and before end_time. These
+        do not use the cache of next matches, so that a lookahead does not
+        replace the matches cached for scheduling.
+        """
+        match_time = self.localize(start_time)
+        end_time = self.localize(end_time)
+        while True:
+            match_time = self.time_spec.get_match(match_time)
+            if match_time is None or match_time >= end_time:
+                return
+            yield match_time
+
+    def get_match(self, start_time):
+        """Return the next match of the time specification after start_time.
+        On a cache miss, the following matches are cached as well.
+        """
+        # Naive and aware datetimes can not be compared
+        cache_key = lambda dt: (dt.tzinfo, dt)
+        if cache_key(start_time) in self.next_matches:
+            return self.next_matches[cache_key(start_time)]
+
+        self.next_matches = {}
+        match_time = start_time
+        for _ in xrange(self.cache_size):
+            next_time = self.time_spec.get_match(match_time)
+            self.next_matches[cache_key(match_time)] = next_time
+            if next_time is None:
+                break
+            match_time = next_time
+        return self.next_matches[cache_key(start_time)]
 
     def __str__(self):
         return '%s %s%s' % (
@@ -213,6 +271,12 @@ class IntervalScheduler(object):
         last_run_time = last_run_time or timeutils.current_time()
         return last_run_time + self.interval + get_jitter(self.jitter)
 
+    def next_run_times(self, start_time, end_time):
+        run_time = start_time + self.interval
+        while self.interval and run_time < end_time:
+            yield run_time
+            run_time += self.interval
+
     def __str__(self):
         return "%s %s%s" % (
             self.get_name(), self.interval, get_jitter_str(self.jitter))
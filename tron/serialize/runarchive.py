@@ -0,0 +1,197 @@
+"""
+ Archive the state of completed job runs which were removed from their
+ JobRunCollection, so that run history can be kept beyond a job's run_limit.
+
+ Runs are stored in a local sqlite database, indexed by job name, run number
+ and run time. Runs are written in batches by a ThreadedStateWriter, so
+ archiving a run never blocks the reactor on sqlite.
+"""
+import cPickle as pickle
+import datetime
+import sqlite3
+
+from tron.core import jobrun
+from tron.serialize.runstate import codec
+from tron.serialize.runstate import threadedwriter
+from tron.utils import timeutils
+
+
+class ArchivedActionRun(object):
+    """A read only view of the state of an archived ActionRun."""
+
+    def __init__(self, state_data):
+        self.job_run_id         = state_data['job_run_id']
+        self.action_name        = state_data['action_name']
+        self.id                 = '%s.%s' % (self.job_run_id, self.action_name)
+        self.state              = state_data['state']
+        self.start_time         = state_data.get('start_time')
+        self.end_time           = state_data.get('end_time')
+        self.command            = state_data.get('command')
+        self.node_name          = state_data.get('node_name')
+        self.exit_status        = state_data.get('exit_status')
+
+
+class ArchivedJobRun(object):
+    """A read only view of the state of an archived JobRun."""
+
+    def __init__(self, state, state_data, start_time, end_time):
+        state_data              = jobrun.expand_state_data(state_data)
+        self.job_name           = state_data['job_name']
+        self.run_num            = state_data['run_num']
+        self.id                 = '%s.%s' % (self.job_name, self.run_num)
+        self.run_time           = state_data['run_time']
+        self.node_name          = state_data.get('node_name')
+        self.manual             = state_data.get('manual', False)
+        self.state              = state
+        self.start_time         = start_time
+        self.end_time           = end_time
+        action_states = list(state_data['runs'])
+        if state_data.get('cleanup_run'):
+            action_states.append(state_data['cleanup_run'])
+        self.action_runs = [ArchivedActionRun(action_state)
+                            for action_state in action_states]
+
+    def get_action_run(self, action_name):
+        for action_run in self.action_runs:
+            if action_run.action_name == action_name:
+                return action_run
+
+
+def to_timestamp(dt):
+    return timeutils.to_timestamp(dt) if dt else None
+
+
+def from_timestamp(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.datetime.fromtimestamp(timestamp)
+
+
+def create_tables(connection):
+    with connection:
+        connection.execute(
+            """CREATE TABLE IF NOT EXISTS job_runs (
+                job_name    TEXT NOT NULL,
+                run_num     INTEGER NOT NULL,
+                run_time    REAL,
+                start_time  REAL,
+                end_time    REAL,
+                state       TEXT NOT NULL,
+                state_data  BLOB NOT NULL,
+                PRIMARY KEY (job_name, run_num)
+            )""")
+        connection.execute(
+            """CREATE INDEX IF NOT EXISTS job_runs_run_time
+                ON job_runs (job_name, run_time)""")
+
+
+class RunArchiveStore(object):
+    """A store for ThreadedStateWriter which inserts a batch of encoded
+    job_runs rows in a single transaction. It has its own connection, which
+    is only used from the writer thread once it is created.
+    """
+
+    def __init__(self, filename):
+        self.filename           = filename
+        self.connection         = sqlite3.connect(
+                                    filename, check_same_thread=False)
+
+    def build_key(self, job_name, run_num):
+        return job_name, run_num
+
+    def save(self, key_value_pairs):
+        rows = [row for _, row in key_value_pairs]
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO job_runs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows)
+
+    def cleanup(self):
+        self.connection.close()
+
+    def __str__(self):
+        return "RunArchiveStore(%s)" % self.filename
+
+
+class RunArchive(object):
+    """Store and page through the state of job runs. Runs passed to add()
+    are written by a worker thread, and are not returned by get_runs()
+    until flush() returns or the worker has written them.
+    """
+
+    # Number of queued runs before the writer reports it is falling behind
+    queue_size              = 1000
+
+    def __init__(self, filename):
+        self.filename           = filename
+        self.codec              = codec.StateCodec(
+                                    codec.PickleCodec(), pickle.loads)
+        self.connection         = sqlite3.connect(filename)
+        create_tables(self.connection)
+        self.writer             = threadedwriter.ThreadedStateWriter(
+                                    RunArchiveStore(filename), self.queue_size)
+
+    def add(self, job_run):
+        """Queue the state of a JobRun to be archived. The row is encoded
+        here, because the JobRun is cleaned up once it is archived.
+        """
+        key = self.writer.build_key(job_run.job_name, job_run.run_num)
+        row = (
+            job_run.job_name,
+            job_run.run_num,
+            to_timestamp(job_run.run_time),
+            to_timestamp(job_run.start_time),
+            to_timestamp(job_run.end_time),
+            str(job_run.state),
+            sqlite3.Binary(self.codec.encode(job_run.state_data)),
+        )
+        self.writer.save([(key, row)])
+
+    def flush(self):
+        """Block until all queued runs are written."""
+        self.writer.flush()
+
+    def get_runs(self, job_name, limit, before_run_num=None, before_time=None):
+        """Return up to limit ArchivedJobRuns for a job, newest first. To
+        page through runs, pass the run_num of the last run in a page as
+        before_run_num. before_time is a unix timestamp which limits the
+        results to runs with an earlier run_time.
+        """
+        query = ["SELECT state, state_data, start_time, end_time "
+                 "FROM job_runs WHERE job_name = ?"]
+        params = [job_name]
+        if before_run_num is not None:
+            query.append("AND run_num < ?")
+            params.append(before_run_num)
+        if before_time is not None:
+            query.append("AND run_time < ?")
+            params.append(before_time)
+        query.append("ORDER BY run_num DESC LIMIT ?")
+        params.append(limit)
+
+        cursor = self.connection.execute(" ".join(query), params)
+        return [ArchivedJobRun(state, self.codec.decode(str(state_data)),
+                    from_timestamp(start_time), from_timestamp(end_time))
+                for state, state_data, start_time, end_time in cursor]
+
+    def get_action_runs(self, job_name, action_name, limit,
+                        before_run_num=None, before_time=None):
+        """Return the ArchivedActionRuns for action_name from a page of
+        archived runs.
+        """
+        runs = self.get_runs(job_name, limit, before_run_num, before_time)
+        action_runs = (run.get_action_run(action_name) for run in runs)
+        return [action_run for action_run in action_runs if action_run]
+
+    def count(self, job_name):
+        cursor = self.connection.execute(
+            "SELECT COUNT(*) FROM job_runs WHERE job_name = ?", (job_name,))
+        return cursor.fetchone()[0]
+
+    def cleanup(self):
+        """Write all queued runs and close the database."""
+        self.writer.cleanup()
+        self.connection.close()
+
+    def __str__(self):
+        return "RunArchive(%s)" % self.filename
@@ -2,5 +2,6 @@
 
 # State types
 JOB_STATE               = 'job_state'
+JOB_RUN_STATE           = 'job_run_state'
 SERVICE_STATE           = 'service_state'
 MCP_STATE               = 'mcp_state'
\ No newline at end of file
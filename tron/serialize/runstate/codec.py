@@ -0,0 +1,256 @@
+"""
+ Codecs which encode state_data for StateStores which store bytes.
+
+ Encoded data is prefixed with a header which names the codec, so data can
+ always be decoded regardless of the codec which is currently configured.
+ Data without a header was written before codecs were added, and is decoded
+ by the legacy decoder of the store.
+
+ Codec names may be prefixed with wrappers, separated by '+'. For example
+ 'zlib+json' is JSON compressed with zlib, and 'base64+zlib+json' is the
+ same data encoded to be stored in a text column.
+"""
+import base64
+import cPickle as pickle
+import datetime
+import json
+import time
+import zlib
+
+import yaml
+
+
+HEADER_PREFIX           = '#tron-codec:'
+DATETIME_TAG            = '__datetime__'
+TUPLE_TAG               = '__tuple__'
+ITEMS_TAG               = '__items__'
+DATETIME_FORMAT         = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class UnknownCodecError(ValueError):
+    """Raised when a codec name is not known."""
+
+
+def decode_string(value):
+    """JSON strings are decoded as unicode. Return ascii strings as str, so
+    state encoded with str round trips.
+    """
+    try:
+        return value.encode('ascii')
+    except UnicodeEncodeError:
+        return value
+
+
+class JSONCodec(object):
+    """Encode state as JSON. datetimes, tuples, and dicts with keys which
+    are not strings are encoded as tagged objects, so they are decoded to
+    the same types. Other types which JSON can not represent are rejected
+    with a TypeError.
+    """
+    name                = 'json'
+    binary              = False
+
+    def _tag(self, obj):
+        if isinstance(obj, dict):
+            if all(isinstance(key, basestring) for key in obj):
+                return dict((key, self._tag(value))
+                            for key, value in obj.iteritems())
+            return {ITEMS_TAG: [[self._tag(key), self._tag(value)]
+                                for key, value in obj.iteritems()]}
+        if isinstance(obj, list):
+            return [self._tag(value) for value in obj]
+        if isinstance(obj, tuple):
+            return {TUPLE_TAG: [self._tag(value) for value in obj]}
+        if isinstance(obj, datetime.datetime):
+            return {DATETIME_TAG: obj.strftime(DATETIME_FORMAT)}
+        return obj
+
+    @staticmethod
+    def _default(obj):
+        raise TypeError("%r is not JSON serializable" % obj)
+
+    def _untag(self, obj):
+        if isinstance(obj, unicode):
+            return decode_string(obj)
+        if isinstance(obj, list):
+            return [self._untag(value) for value in obj]
+        if not isinstance(obj, dict):
+            return obj
+
+        if len(obj) == 1:
+            if DATETIME_TAG in obj:
+                return datetime.datetime.strptime(
+                    obj[DATETIME_TAG], DATETIME_FORMAT)
+            if TUPLE_TAG in obj:
+                return tuple(self._untag(obj[TUPLE_TAG]))
+            if ITEMS_TAG in obj:
+                return dict((self._untag(key), self._untag(value))
+                            for key, value in obj[ITEMS_TAG])
+        return dict((decode_string(key), self._untag(value))
+                    for key, value in obj.iteritems())
+
+    def encode(self, state_data):
+        return json.dumps(self._tag(state_data), default=self._default,
+            separators=(',', ':'))
+
+    def decode(self, data):
+        return self._untag(json.loads(data))
+
+
+class PickleCodec(object):
+    """Encode state using pickle protocol 2."""
+    name                = 'pickle'
+    binary              = True
+    protocol            = 2
+
+    def encode(self, state_data):
+        return pickle.dumps(state_data, self.protocol)
+
+    def decode(self, data):
+        return pickle.loads(data)
+
+
+class StateLoader(getattr(yaml, 'CSafeLoader', yaml.SafeLoader)):
+    """A safe loader which also accepts the python/str, python/unicode and
+    python/tuple tags, which were written by the full Dumper in state saved
+    by earlier versions of tron. No other python tags are constructed.
+    """
+
+StateLoader.add_constructor(u'tag:yaml.org,2002:python/str',
+    lambda loader, node: loader.construct_scalar(node).encode('utf-8'))
+StateLoader.add_constructor(u'tag:yaml.org,2002:python/unicode',
+    lambda loader, node: loader.construct_scalar(node))
+StateLoader.add_constructor(u'tag:yaml.org,2002:python/tuple',
+    lambda loader, node: tuple(loader.construct_sequence(node)))
+
+
+class StateDumper(getattr(yaml, 'CSafeDumper', yaml.SafeDumper)):
+    """A safe dumper which writes tuples with the python/tuple tag, so they
+    are loaded by StateLoader as tuples.
+    """
+
+StateDumper.add_representer(tuple, lambda dumper, data:
+    dumper.represent_sequence(u'tag:yaml.org,2002:python/tuple', data))
+
+
+class YamlCodec(object):
+    """Encode state as YAML, using libyaml when it is available. Only
+    plain data is loaded, see StateLoader.
+    """
+    name                = 'yaml'
+    binary              = False
+    dumper              = StateDumper
+    loader              = StateLoader
+
+    def encode(self, state_data):
+        return yaml.dump(state_data, Dumper=self.dumper)
+
+    def decode(self, data):
+        return yaml.load(data, Loader=self.loader)
+
+
+class ZlibCodec(object):
+    """Compress the output of another codec with zlib."""
+    prefix              = 'zlib'
+    binary              = True
+    level               = 6
+
+    def __init__(self, codec):
+        self.codec      = codec
+        self.name       = '%s+%s' % (self.prefix, codec.name)
+
+    def encode(self, state_data):
+        return zlib.compress(self.codec.encode(state_data), self.level)
+
+    def decode(self, data):
+        return self.codec.decode(zlib.decompress(data))
+
+
+class Base64Codec(object):
+    """Encode the output of a binary codec so it can be stored as text."""
+    prefix              = 'base64'
+    binary              = False
+
+    def __init__(self, codec):
+        self.codec      = codec
+        self.name       = '%s+%s' % (self.prefix, codec.name)
+
+    def encode(self, state_data):
+        return base64.b64encode(self.codec.encode(state_data))
+
+    def decode(self, data):
+        return self.codec.decode(base64.b64decode(data))
+
+
+CODECS = dict((codec.name, codec) for codec in
+              [JSONCodec, PickleCodec, YamlCodec])
+
+WRAPPERS = dict((wrapper.prefix, wrapper) for wrapper in
+                [ZlibCodec, Base64Codec])
+
+
+def get_codec(name):
+    """Return the codec for a name, like 'json' or 'zlib+json'."""
+    parts = name.split('+')
+    if parts[-1] not in CODECS or not set(parts[:-1]) <= set(WRAPPERS):
+        raise UnknownCodecError("Unknown codec: %s" % name)
+
+    codec = CODECS[parts[-1]]()
+    for prefix in reversed(parts[:-1]):
+        codec = WRAPPERS[prefix](codec)
+    return codec
+
+
+def text_codec(codec):
+    """Return a codec which can be stored as text."""
+    return Base64Codec(codec) if codec.binary else codec
+
+
+class StateCodec(object):
+    """Encode state with a codec, and decode state encoded by any codec.
+    Data which was encoded without a header is decoded with legacy_decoder.
+
+    If metrics is set, the time spent encoding and decoding, and the size of
+    the encoded data, is recorded by it.
+    """
+
+    def __init__(self, codec, legacy_decoder):
+        self.codec              = codec
+        self.legacy_decoder     = legacy_decoder
+        self.header             = '%s%s\n' % (HEADER_PREFIX, codec.name)
+        self.metrics            = None
+
+    def __getstate__(self):
+        # Metrics are not sent to the processes of a ParallelDecoder
+        return dict(self.__dict__, metrics=None)
+
+    @property
+    def name(self):
+        return self.codec.name
+
+    def encode(self, state_data):
+        if not self.metrics:
+            return self.header + self.codec.encode(state_data)
+
+        start_time = time.time()
+        data = self.header + self.codec.encode(state_data)
+        self.metrics.record_encode(time.time() - start_time, len(data))
+        return data
+
+    def decode(self, data):
+        if not self.metrics:
+            return self._decode(data)
+
+        start_time = time.time()
+        state_data = self._decode(data)
+        self.metrics.record_decode(time.time() - start_time)
+        return state_data
+
+    def _decode(self, data):
+        if not data.startswith(HEADER_PREFIX):
+            return self.legacy_decoder(data)
+
+        header, data = data.split('\n', 1)
+        name = header[len(HEADER_PREFIX):]
+        codec = self.codec if name == self.codec.name else get_codec(name)
+        return codec.decode(data)
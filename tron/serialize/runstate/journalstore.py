@@ -0,0 +1,314 @@
+"""
+ State storage using an append-only journal and periodic snapshots.
+
+ Each call to save() appends a single checksummed record to the current
+ journal segment. When a segment reaches segment_size bytes a new segment is
+ started, and after compact_segments segments have been filled a compacted
+ snapshot of all state is written in the background, after which the
+ segments it includes are removed.
+
+ The directory contains:
+
+    snapshot                the most recent compacted snapshot
+    journal.<number>        journal segments, replayed in order after the
+                            snapshot
+
+ Records are framed as a 4 byte length, a 4 byte crc32 checksum, and a
+ payload encoded by the configured codec (pickle by default). Replay stops at
+ the first incomplete or corrupt record of a segment, so state is always
+ restored to the last completely written save. The store does not write
+ anything until the first save, so a running tron's state can be read by
+ tools which restore from a store.
+
+ The sync policy, set with connection_details (ex: "sync=segment"), controls
+ when records are forced to disk with fsync:
+
+    always                  after every save, the default. A save is
+                            durable once save() returns.
+    segment                 when a segment is closed, and on cleanup. A
+                            power loss can lose the saves of the current
+                            segment.
+    none                    never. Durability is left to the OS.
+
+ Snapshots are always synced before the segments they include are removed.
+"""
+from collections import namedtuple
+import copy
+import cPickle as pickle
+import errno
+import logging
+import os
+import re
+import struct
+import threading
+import urlparse
+import zlib
+
+from tron.serialize.runstate import codec
+
+log = logging.getLogger(__name__)
+
+JournalKey = namedtuple('JournalKey', ['type', 'iden'])
+
+RECORD_HEADER = struct.Struct('>II')
+
+SNAPSHOT_FILENAME = 'snapshot'
+SEGMENT_FORMAT = 'journal.%08d'
+SEGMENT_RE = re.compile(r'^journal\.(\d+)$')
+
+SYNC_ALWAYS, SYNC_SEGMENT, SYNC_NONE = SYNC_POLICIES = (
+    'always', 'segment', 'none')
+
+
+class CorruptRecordError(ValueError):
+    """Raised when a record is incomplete or its checksum does not match."""
+
+
+def checksum(data):
+    return zlib.crc32(data) & 0xffffffff
+
+
+def encode_record(data):
+    return RECORD_HEADER.pack(len(data), checksum(data)) + data
+
+
+def parse_connection_details(connection_details):
+    """Return the sync policy from a connection_details query string.
+    Raises ValueError for unknown options.
+    """
+    params = dict(urlparse.parse_qsl(connection_details or ''))
+    unknown = sorted(set(params) - set(['sync']))
+    if unknown:
+        raise ValueError("Unknown journal options: %s" % ', '.join(unknown))
+
+    sync = params.get('sync', SYNC_ALWAYS)
+    if sync not in SYNC_POLICIES:
+        raise ValueError("Unknown journal sync policy: %s" % sync)
+    return sync
+
+
+def fsync_directory(path):
+    """Force the entries of a directory, like a new or renamed file, to
+    disk.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_records(fh):
+    """Yield the data of records from a file. Raises CorruptRecordError
+    if a record is incomplete or fails its checksum.
+    """
+    while True:
+        header = fh.read(RECORD_HEADER.size)
+        if not header:
+            return
+        if len(header) < RECORD_HEADER.size:
+            raise CorruptRecordError("Incomplete record header")
+
+        length, expected = RECORD_HEADER.unpack(header)
+        data = fh.read(length)
+        if len(data) < length:
+            raise CorruptRecordError("Incomplete record")
+        if checksum(data) != expected:
+            raise CorruptRecordError("Checksum mismatch")
+        yield data
+
+
+class JournalStateStore(object):
+
+    # Bytes written to a segment before a new segment is started
+    segment_size        = 16 * 1024 * 1024
+
+    # Number of filled segments which trigger writing a snapshot
+    compact_segments    = 4
+
+    def __init__(self, path, state_codec=None, connection_details=None):
+        self.path               = path
+        self.sync               = parse_connection_details(connection_details)
+        self.codec              = codec.StateCodec(
+                                    state_codec or codec.PickleCodec(),
+                                    pickle.loads)
+        self.state              = {}
+        self.lock               = threading.Lock()
+        self.segment            = None
+        self.segment_number     = 0
+        self.compact_thread     = None
+        self._load()
+
+    def _filename(self, name):
+        return os.path.join(self.path, name)
+
+    def _segment_numbers(self):
+        if not os.path.isdir(self.path):
+            return []
+        matches = (SEGMENT_RE.match(name) for name in os.listdir(self.path))
+        return sorted(int(match.group(1)) for match in matches if match)
+
+    def _load(self):
+        """Restore state from the snapshot, and replay all segments written
+        after it. If a segment is removed by a compaction in another process
+        while loading, the load is restarted from the new snapshot.
+        """
+        while True:
+            try:
+                return self._load_state()
+            except IOError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+                log.info("%s was compacted while loading, reloading.", self)
+
+    def _load_state(self):
+        self.state = {}
+        first_segment = self._load_snapshot()
+        for number in self._segment_numbers():
+            self.segment_number = max(self.segment_number, number)
+            if number >= first_segment:
+                self._replay_segment(number)
+
+    def _load_snapshot(self):
+        filename = self._filename(SNAPSHOT_FILENAME)
+        if not os.path.exists(filename):
+            return 0
+
+        with open(filename, 'rb') as fh:
+            for data in read_records(fh):
+                snapshot = self.codec.decode(data)
+                self._apply(snapshot['state'])
+                return snapshot['next_segment']
+        return 0
+
+    def _replay_segment(self, number):
+        filename = self._filename(SEGMENT_FORMAT % number)
+        with open(filename, 'rb') as fh:
+            try:
+                for data in read_records(fh):
+                    self._apply(self.codec.decode(data))
+            except CorruptRecordError, e:
+                log.warn("Stopped replay of %s: %s", filename, e)
+
+    def _apply(self, items):
+        """Apply a sequence of (type, iden, state_data) to the state."""
+        for type, iden, state_data in items:
+            key = JournalKey(type, iden)
+            if state_data is None:
+                self.state.pop(key, None)
+                continue
+            self.state[key] = state_data
+
+    def build_key(self, type, iden):
+        return JournalKey(type, iden)
+
+    def save(self, key_value_pairs):
+        items = [(key.type, key.iden, state_data)
+                 for key, state_data in key_value_pairs]
+        record = encode_record(self.codec.encode(items))
+
+        with self.lock:
+            segment = self._get_segment()
+            segment.write(record)
+            segment.flush()
+            if self.sync == SYNC_ALWAYS:
+                os.fsync(segment.fileno())
+            self._apply(items)
+            if segment.tell() >= self.segment_size:
+                self._start_segment()
+
+    def _get_segment(self):
+        if not self.segment:
+            self._start_segment()
+        return self.segment
+
+    def _start_segment(self):
+        """Close the current segment, and start writing to a new one. Starts
+        a compaction when enough segments have been filled.
+        """
+        if self.segment:
+            self._close_segment()
+        elif not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        self.segment_number += 1
+        filename = self._filename(SEGMENT_FORMAT % self.segment_number)
+        self.segment = open(filename, 'ab')
+        if self.sync == SYNC_ALWAYS:
+            fsync_directory(self.path)
+
+        if len(self._segment_numbers()) > self.compact_segments:
+            self._start_compaction()
+
+    def _close_segment(self):
+        if self.sync != SYNC_NONE:
+            self.segment.flush()
+            os.fsync(self.segment.fileno())
+        self.segment.close()
+        self.segment = None
+
+    def _start_compaction(self):
+        if self.compact_thread and self.compact_thread.is_alive():
+            return
+
+        snapshot = {
+            'state':            [(key.type, key.iden, state_data)
+                                 for key, state_data in self.state.iteritems()],
+            'next_segment':     self.segment_number,
+        }
+        self.compact_thread = threading.Thread(
+            target=self._write_snapshot, args=(snapshot,),
+            name="%s compaction" % self)
+        self.compact_thread.daemon = True
+        self.compact_thread.start()
+
+    def compact(self):
+        """Write a snapshot of all state, and remove the segments it
+        includes. Blocks until the snapshot is written.
+        """
+        if self.compact_thread:
+            self.compact_thread.join()
+
+        with self.lock:
+            if not self.segment:
+                return
+            self._start_segment()
+            self._start_compaction()
+        self.compact_thread.join()
+
+    def _write_snapshot(self, snapshot):
+        filename = self._filename(SNAPSHOT_FILENAME)
+        tmp_filename = filename + '.tmp'
+        try:
+            with open(tmp_filename, 'wb') as fh:
+                fh.write(encode_record(self.codec.encode(snapshot)))
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.rename(tmp_filename, filename)
+            fsync_directory(self.path)
+        except Exception:
+            log.exception("%s failed to write snapshot.", self)
+            return
+
+        for number in self._segment_numbers():
+            if number < snapshot['next_segment']:
+                os.unlink(self._filename(SEGMENT_FORMAT % number))
+        log.info("%s wrote snapshot of %d keys.", self, len(snapshot['state']))
+
+    def restore(self, keys):
+        """Return copies of the state for keys, because restored state is
+        changed by the caller, and self.state is written to snapshots.
+        """
+        with self.lock:
+            return dict((key, copy.deepcopy(self.state[key]))
+                        for key in keys if key in self.state)
+
+    def cleanup(self):
+        if self.compact_thread:
+            self.compact_thread.join()
+        with self.lock:
+            if self.segment:
+                self._close_segment()
+
+    def __str__(self):
+        return "JournalStateStore(%s)" % self.path
@@ -0,0 +1,118 @@
+"""
+ Metrics about the persistence of state: the latency of saves, how much is
+ written by each flush, how long restores take, and how much of that time is
+ spent encoding and decoding state compared to store I/O.
+"""
+import bisect
+import time
+
+from tron.utils import timeutils
+
+
+# Upper bounds, in seconds, of the buckets of the save latency histogram
+SAVE_LATENCY_BUCKETS    = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+# Upper bounds of the buckets of the keys per flush histogram
+FLUSH_KEYS_BUCKETS      = (1, 10, 100, 1000, 10000)
+
+
+class Histogram(object):
+    """Count values in buckets with fixed upper bounds. Values larger than
+    the last bound are counted in an overflow bucket.
+    """
+
+    def __init__(self, bounds):
+        self.bounds             = tuple(bounds)
+        self.counts             = [0] * (len(self.bounds) + 1)
+        self.count              = 0
+        self.total              = 0
+        self.max                = 0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count              += 1
+        self.total              += value
+        self.max                = max(self.max, value)
+
+    def get_stats(self):
+        """Return a dict of the bucket counts and summary of the values. The
+        overflow bucket has an upper bound of None.
+        """
+        bounds = self.bounds + (None,)
+        return {
+            'buckets':  [{'le': bound, 'count': count}
+                         for bound, count in zip(bounds, self.counts)],
+            'count':    self.count,
+            'total':    self.total,
+            'max':      self.max,
+            'mean':     float(self.total) / self.count if self.count else 0,
+        }
+
+
+class PersistenceMetrics(object):
+    """Record metrics for a PersistentStateManager and the codec of its
+    store. Codec time may be recorded from a writer thread.
+    """
+
+    def __init__(self):
+        self.save_latency       = Histogram(SAVE_LATENCY_BUCKETS)
+        self.flush_keys         = Histogram(FLUSH_KEYS_BUCKETS)
+        self.codec_timer        = timeutils.StepTimer()
+        self.restore_timer      = timeutils.StepTimer()
+        self.restore_keys       = {}
+        self.encoded_bytes      = 0
+        self.slow_saves         = 0
+        self.last_flush         = None
+
+    def record_flush(self, reason, keys, duration):
+        """Record a flush of keys from the buffer which was saved to the store
+        in duration seconds.
+        """
+        self.save_latency.add(duration)
+        self.flush_keys.add(keys)
+        self.last_flush         = {
+            'reason':               reason,
+            'keys':                 keys,
+            'duration':             duration,
+            'time':                 time.time(),
+        }
+
+    def record_encode(self, duration, size):
+        self.codec_timer.add('encode', duration)
+        self.encoded_bytes += size
+
+    def record_decode(self, duration):
+        self.codec_timer.add('decode', duration)
+
+    def record_restore(self, item_type, keys, duration):
+        """Record the restore of keys of item_type."""
+        self.restore_timer.add(item_type, duration)
+        self.restore_keys[item_type] = self.restore_keys.get(item_type, 0) + keys
+
+    def get_stats(self, write_time=None):
+        """Return a dict of the metrics. write_time is the number of seconds
+        spent writing to the store, including encoding, when the store is not
+        written by the reactor thread.
+        """
+        codec_durations = dict(self.codec_timer.durations)
+        encode_time = codec_durations.get('encode', 0)
+        if write_time is None:
+            write_time = self.save_latency.total
+        flushes = self.flush_keys.count
+
+        return {
+            'save_latency':         self.save_latency.get_stats(),
+            'flush_keys':           self.flush_keys.get_stats(),
+            'last_flush':           self.last_flush,
+            'slow_saves':           self.slow_saves,
+            'encoded_bytes':        self.encoded_bytes,
+            'bytes_per_flush':      (
+                float(self.encoded_bytes) / flushes if flushes else 0),
+            'encode_time':          encode_time,
+            'decode_time':          codec_durations.get('decode', 0),
+            'store_io_time':        max(write_time - encode_time, 0),
+            'restore':              dict(
+                (item_type, {
+                    'duration':         duration,
+                    'keys':             self.restore_keys.get(item_type, 0)})
+                for item_type, duration in self.restore_timer.durations.items()),
+        }
@@ -1,6 +1,9 @@
 """
  State storage using mongoDB.
- Tested with pymongo 2.2
+ Requires pymongo 3.5 or later.
+
+ Keys are restored with one find() per collection, and each save is written
+ with one unordered bulk write per collection.
 """
 
 from collections import namedtuple
@@ -14,18 +17,37 @@ pymongo = None # pyflakes
 MongoStateKey = namedtuple('MongoStateKey', ['collection', 'key'])
 
 
+def group_by_collection(keys):
+    """Return an iterator of (collection name, keys) for keys."""
+    get_collection = operator.attrgetter('collection')
+    keys = sorted(keys, key=get_collection)
+    return itertools.groupby(keys, get_collection)
+
+
+def parse_write_concern(value):
+    """Return the write concern w option, which is either the number of
+    servers to acknowledge a write, or the name of a mode (majority).
+    """
+    return int(value) if value.isdigit() else value
+
+
 class MongoStateStore(object):
 
     JOB_COLLECTION              = 'job_state_collection'
+    JOB_RUN_COLLECTION          = 'job_run_state_collection'
     SERVICE_COLLECTION          = 'service_state_collection'
     METADATA_COLLECTION         = 'metadata_collection'
 
     TYPE_TO_COLLECTION_MAP = {
         runstate.JOB_STATE:     JOB_COLLECTION,
+        runstate.JOB_RUN_STATE: JOB_RUN_COLLECTION,
         runstate.SERVICE_STATE: SERVICE_COLLECTION,
         runstate.MCP_STATE:     METADATA_COLLECTION
     }
 
+    # Maximum number of keys in the $in clause of a single find()
+    chunk_size                  = 1000
+
     def __init__(self, db_name, connection_details):
         import pymongo
         global pymongo
@@ -36,15 +58,27 @@ class MongoStateStore(object):
         self._connect(db_name, connection_params)
 
     def _connect(self, db_name, params):
-        """Connect to MongoDB."""
-        hostname            = params.get('hostname')
+        """Create a MongoClient, which keeps a pool of connections to
+        MongoDB.
+        """
+        options = {}
+        if params.get('w'):
+            options['w'] = parse_write_concern(params['w'])
+        if params.get('journal'):
+            options['journal'] = params['journal'].lower() == 'true'
+        if params.get('max_pool_size'):
+            options['maxPoolSize'] = int(params['max_pool_size'])
+        if params.get('username') and params.get('password'):
+            options['username'] = params['username']
+            options['password'] = params['password']
+            options['authSource'] = db_name
+
         port                = params.get('port')
-        username            = params.get('username')
-        password            = params.get('password')
-        self.connection     = pymongo.Connection(hostname, port)
+        self.connection     = pymongo.MongoClient(
+                                params.get('hostname'),
+                                int(port) if port else None,
+                                **options)
         self.db             = self.connection[db_name]
-        if username and password:
-            self.db.authenticate(username, password)
 
     def _parse_connection_details(self, connection_details):
         if not connection_details:
@@ -55,18 +89,36 @@ class MongoStateStore(object):
         return MongoStateKey(self.TYPE_TO_COLLECTION_MAP[type], iden)
 
     def save(self, key_value_pairs):
-        for key, state_data in key_value_pairs:
-            state_data['_id'] = key.key
-            collection = self.db[key.collection]
-            collection.save(state_data)
+        # Only the last value for each key is saved
+        items = dict(key_value_pairs)
+        for collection, keys in group_by_collection(items):
+            requests = [self._build_request(key, items[key]) for key in keys]
+            self.db[collection].bulk_write(requests, ordered=False)
+
+    def _build_request(self, key, state_data):
+        if state_data is None:
+            return pymongo.DeleteOne({'_id': key.key})
+        doc = dict(state_data, _id=key.key)
+        return pymongo.ReplaceOne({'_id': key.key}, doc, upsert=True)
 
     def restore(self, keys):
-        items = [
-            (key, self.db[key.collection].find_one(key.key)) for key in keys]
-        return dict(itertools.ifilter(operator.itemgetter(1), items))
+        items = {}
+        for collection, keys in group_by_collection(keys):
+            keys = list(keys)
+            for i in xrange(0, len(keys), self.chunk_size):
+                chunk = keys[i:i + self.chunk_size]
+                items.update(self._find(collection, chunk))
+        return items
+
+    def _find(self, collection, keys):
+        """Return a dict of key to state_data for the keys which are found."""
+        keys_by_id = dict((key.key, key) for key in keys)
+        query = {'_id': {'$in': keys_by_id.keys()}}
+        for doc in self.db[collection].find(query):
+            yield keys_by_id[doc.pop('_id')], doc
 
     def cleanup(self):
-        self.connection.disconnect()
+        self.connection.close()
 
     def __str__(self):
         return "MongoStateStore(%s)" % self.db_name
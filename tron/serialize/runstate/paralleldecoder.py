@@ -0,0 +1,53 @@
+"""
+ Decode state restored from a StateStore in a pool of processes.
+
+ StateStores which support this provide restore_raw(keys), which returns the
+ encoded data for each key, and a picklable codec with a decode(data)
+ method. Keys are never sent to the pool, only the encoded data.
+"""
+import itertools
+import logging
+import multiprocessing
+
+log = logging.getLogger(__name__)
+
+
+def decode_chunk(args):
+    codec, data_seq = args
+    return [codec.decode(data) for data in data_seq]
+
+
+class ParallelDecoder(object):
+    """Decode state data in chunks using a pool of processes."""
+
+    # Number of values sent to a process at a time
+    chunk_size          = 100
+
+    def __init__(self, processes):
+        self.processes          = processes
+
+    def decode(self, codec, raw_items):
+        """Return a dict of key to decoded state_data for a dict of key to
+        encoded data.
+        """
+        keys, data_seq = raw_items.keys(), raw_items.values()
+        if self.processes < 2 or len(data_seq) <= self.chunk_size:
+            return dict(itertools.izip(keys, decode_chunk((codec, data_seq))))
+
+        chunks = [(codec, data_seq[i:i + self.chunk_size])
+                  for i in xrange(0, len(data_seq), self.chunk_size)]
+        log.info("Decoding %d keys in %d chunks with %d processes.",
+            len(data_seq), len(chunks), self.processes)
+
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            results = pool.map(decode_chunk, chunks)
+            pool.close()
+        except Exception:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        state_data = itertools.chain.from_iterable(results)
+        return dict(itertools.izip(keys, state_data))
@@ -37,6 +37,9 @@ class ShelveStateStore(object):
 
     def save(self, key_value_pairs):
         for key, state_data in key_value_pairs:
+            if state_data is None:
+                self.shelve.pop(key.key, None)
+                continue
             self.shelve[key.key] = state_data
         self.shelve.sync()
 
@@ -1,36 +1,55 @@
 from collections import namedtuple
 from contextlib import contextmanager
-import itertools
-import operator
+import logging
 
-import yaml
 sqlalchemy = None # pyflakes
 
 from tron.serialize import runstate
+from tron.serialize.runstate import codec
 from tron.config.config_utils import MAX_IDENTIFIER_LENGTH
 
 
+log = logging.getLogger(__name__)
+
 SQLStateKey = namedtuple('SQLStateKey', ['table', 'id'])
 
 
+def legacy_decode(data):
+    """Decode state saved before codecs were added, which was YAML."""
+    return codec.YamlCodec().decode(data)
+
+
 class SQLAlchemyStateStore(object):
 
-    def __init__(self, name, connection_details):
+    # Maximum number of ids in a single IN (...) clause
+    chunk_size          = 500
+
+    # Seconds before a pooled connection is replaced, to avoid using
+    # connections which were closed by the server (ex: mysql wait_timeout)
+    pool_recycle        = 3600
+
+    def __init__(self, name, connection_details, state_codec=None):
         import sqlalchemy
+        import sqlalchemy.exc
         global sqlalchemy
         assert sqlalchemy # pyflakes
 
         self.name               = name
         self._connection        = None
-        self.encoder            = yaml.dump
-        self.decoder            = yaml.load
+        state_codec             = codec.text_codec(
+                                    state_codec or codec.YamlCodec())
+        self.codec              = codec.StateCodec(
+                                    state_codec, legacy_decode)
+        self.encoder            = self.codec.encode
+        self.decoder            = self.codec.decode
         self._create_engine(connection_details)
         self._build_tables()
         self.create_tables()
 
     def _create_engine(self, connection_details):
         """Connect to the configured database."""
-        self.engine = sqlalchemy.create_engine(connection_details)
+        self.engine = sqlalchemy.create_engine(
+            connection_details, pool_recycle=self.pool_recycle)
 
     def _build_tables(self):
         """Build table objects."""
@@ -41,6 +60,11 @@ class SQLAlchemyStateStore(object):
             Column('state_data', Text)
         )
 
+        self.job_run_table = Table('job_run_state_data', self._metadata,
+            Column('id', String(MAX_IDENTIFIER_LENGTH), primary_key=True),
+            Column('state_data', Text)
+        )
+
         self.service_table = Table('service_state_data', self._metadata,
             Column('id', String(MAX_IDENTIFIER_LENGTH), primary_key=True),
             Column('state_data', Text)
@@ -58,52 +82,99 @@ class SQLAlchemyStateStore(object):
     @contextmanager
     def connect(self):
         """Yield a connection."""
-        # TODO: handle 'mysql has gone away' and similar exceptions
         if not self._connection or self._connection.closed:
             self._connection = self.engine.connect()
         yield self._connection
 
+    def _execute(self, func):
+        """Call func with a connection. If the connection to the database was
+        lost (ex: 'mysql has gone away'), reconnect and call func once more.
+        """
+        try:
+            with self.connect() as conn:
+                return func(conn)
+        except sqlalchemy.exc.DBAPIError, e:
+            if not e.connection_invalidated:
+                raise
+            log.warn("Lost connection to %s, reconnecting: %s", self, e)
+            self._connection = None
+
+        with self.connect() as conn:
+            return func(conn)
+
     def build_key(self, type, iden):
         table = None
         if type == runstate.JOB_STATE:
             table = self.job_table
+        if type == runstate.JOB_RUN_STATE:
+            table = self.job_run_table
         if type == runstate.SERVICE_STATE:
             table = self.service_table
         if type == runstate.MCP_STATE:
             table = self.metadata_table
         return SQLStateKey(table, iden)
 
-    def save(self, key_value_pairs):
-        with self.connect() as conn:
-            for key, state_data in key_value_pairs:
-                state_data = self.encoder(state_data)
-
-                # The first state update requires an insert
-                if not self._update(conn, key, state_data):
-                    self._insert(conn, key, state_data)
+    def _group_by_table(self, keys, get_key=lambda k: k):
+        """Return a list of (table, items) for a sequence of items, where
+        get_key(item) returns the SQLStateKey of the item.
+        """
+        groups = {}
+        for item in keys:
+            groups.setdefault(get_key(item).table, []).append(item)
+        return groups.items()
 
-    def _update(self, conn, key, data):
-        """Attempt to update the state_data."""
-        update  = key.table.update()
-        where   = key.table.c.id==key.id
-        results = conn.execute(update.where(where).values(state_data=data))
-        return results.rowcount
+    def _chunks(self, seq):
+        return (seq[i:i + self.chunk_size]
+                for i in xrange(0, len(seq), self.chunk_size))
 
-    def _insert(self, conn, key, state_data):
-        """Attempt to insert the state_data."""
-        insert = key.table.insert()
-        conn.execute(insert.values(id=key.id, state_data=state_data))
+    def save(self, key_value_pairs):
+        """Write all items in a single transaction. Existing rows are deleted
+        and new rows are inserted with executemany, which is supported by
+        all databases.
+        """
+        items_by_table = self._group_by_table(
+            key_value_pairs, lambda item: item[0])
+
+        def save(conn):
+            with conn.begin():
+                for table, items in items_by_table:
+                    self._upsert(conn, table, items)
+        self._execute(save)
+
+    def _upsert(self, conn, table, items):
+        ids = [key.id for key, _ in items]
+        for chunk in self._chunks(ids):
+            conn.execute(table.delete().where(table.c.id.in_(chunk)))
+
+        rows = [{'id': key.id, 'state_data': self.encoder(state_data)}
+                for key, state_data in items if state_data is not None]
+        if rows:
+            conn.execute(table.insert(), rows)
 
     def restore(self, keys):
-        with self.connect() as conn:
-            items = [(key, self._select(conn, key)) for key in keys]
-            return dict(itertools.ifilter(operator.itemgetter(1), items))
-
-    def _select(self, conn, key):
-        cols = [key.table.c.state_data]
-        select = sqlalchemy.sql.select(cols, key.table.c.id==key.id)
-        result = conn.execute(select).fetchone()
-        return self.decoder(result[0]) if result else None
+        return dict((key, self.decoder(data))
+                    for key, data in self.restore_raw(keys).iteritems())
+
+    def restore_raw(self, keys):
+        """Return a dict of key to the encoded state_data."""
+        keys_by_table = self._group_by_table(keys)
+
+        def restore(conn):
+            return dict(
+                (SQLStateKey(table, id), state_data)
+                for table, table_keys in keys_by_table
+                for id, state_data in self._select(conn, table, table_keys))
+        return self._execute(restore)
+
+    def _select(self, conn, table, keys):
+        """Return (id, state_data) rows for keys, using one query for every
+        chunk_size keys.
+        """
+        cols = [table.c.id, table.c.state_data]
+        for chunk in self._chunks([key.id for key in keys]):
+            select = sqlalchemy.sql.select(cols, table.c.id.in_(chunk))
+            for row in conn.execute(select):
+                yield row
 
     def cleanup(self):
         if self._connection:
@@ -0,0 +1,95 @@
+"""
+ State storage using an embedded sqlite database.
+
+ The database uses write-ahead logging, and each call to save() is written as
+ a single transaction, so a crash never leaves a partially written flush.
+"""
+from collections import namedtuple
+import cPickle as pickle
+import itertools
+import sqlite3
+
+from tron.serialize.runstate import codec
+
+
+SQLiteStateKey = namedtuple('SQLiteStateKey', ['type', 'iden'])
+
+
+class SQLiteStateStore(object):
+
+    # Maximum number of keys in a single IN (...) clause. sqlite limits the
+    # number of parameters in a statement to 999.
+    restore_chunk_size  = 500
+
+    def __init__(self, filename, state_codec=None):
+        self.filename       = filename
+        self.codec          = codec.StateCodec(
+                                state_codec or codec.PickleCodec(), pickle.loads)
+        self.connection     = self._connect(filename)
+        self.create_tables()
+
+    def _connect(self, filename):
+        # The connection may be used by a ThreadedStateWriter, which never
+        # uses it concurrently with the reactor thread.
+        connection = sqlite3.connect(filename, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def create_tables(self):
+        with self.connection:
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS state (
+                    type        TEXT NOT NULL,
+                    key         TEXT NOT NULL,
+                    state_data  BLOB NOT NULL,
+                    PRIMARY KEY (type, key)
+                )""")
+
+    def build_key(self, type, iden):
+        return SQLiteStateKey(type, iden)
+
+    def encode(self, state_data):
+        return sqlite3.Binary(self.codec.encode(state_data))
+
+    def save(self, key_value_pairs):
+        upserts, deletes = [], []
+        for key, state_data in key_value_pairs:
+            if state_data is None:
+                deletes.append((key.type, key.iden))
+                continue
+            upserts.append((key.type, key.iden, self.encode(state_data)))
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO state (type, key, state_data) "
+                "VALUES (?, ?, ?)", upserts)
+            self.connection.executemany(
+                "DELETE FROM state WHERE type = ? AND key = ?", deletes)
+
+    def restore(self, keys):
+        return dict((key, self.codec.decode(data))
+                    for key, data in self.restore_raw(keys).iteritems())
+
+    def restore_raw(self, keys):
+        """Return a dict of key to the encoded state_data."""
+        keys = sorted(keys)
+        state = {}
+        for type, type_keys in itertools.groupby(keys, lambda k: k.type):
+            idens = [key.iden for key in type_keys]
+            for i in xrange(0, len(idens), self.restore_chunk_size):
+                chunk = idens[i:i + self.restore_chunk_size]
+                state.update(self._select(type, chunk))
+        return state
+
+    def _select(self, type, idens):
+        query = "SELECT key, state_data FROM state WHERE type = ? AND key IN (%s)"
+        query %= ','.join('?' * len(idens))
+        cursor = self.connection.execute(query, [type] + idens)
+        return ((self.build_key(type, iden), str(data)) for iden, data in cursor)
+
+    def cleanup(self):
+        self.connection.close()
+
+    def __str__(self):
+        return "SQLiteStateStore(%s)" % self.filename
@@ -3,14 +3,22 @@ import logging
 import time
 import itertools
 import tron
+from tron import event
+from tron import eventloop
 from tron.config import schema
 from tron.core import job, service
 from tron.serialize import runstate
+from tron.serialize.runstate import codec
+from tron.serialize.runstate.journalstore import JournalStateStore
+from tron.serialize.runstate.metrics import PersistenceMetrics
 from tron.serialize.runstate.mongostore import MongoStateStore
+from tron.serialize.runstate.paralleldecoder import ParallelDecoder
 from tron.serialize.runstate.shelvestore import ShelveStateStore
 from tron.serialize.runstate.sqlalchemystore import SQLAlchemyStateStore
+from tron.serialize.runstate.sqlitestore import SQLiteStateStore
+from tron.serialize.runstate.threadedwriter import ThreadedStateWriter
 from tron.serialize.runstate.yamlstore import YamlStateStore
-from tron.utils import observer
+from tron.utils import observer, timeutils
 
 log = logging.getLogger(__name__)
 
@@ -27,20 +35,44 @@ class PersistenceManagerFactory(object):
 
     @classmethod
     def from_config(cls, persistence_config):
+        store = cls.store_from_config(persistence_config)
+
+        if persistence_config.threaded_writer:
+            store = ThreadedStateWriter(
+                store, persistence_config.writer_queue_size)
+
+        buffer = StateSaveBuffer(
+            persistence_config.buffer_size,
+            max_age=persistence_config.max_buffer_age,
+            min_interval=persistence_config.min_save_interval,
+            max_bytes=persistence_config.max_buffer_bytes)
+
+        decoder = None
+        if persistence_config.restore_processes:
+            decoder = ParallelDecoder(persistence_config.restore_processes)
+        return PersistentStateManager(store, buffer, decoder,
+            slow_save_threshold=persistence_config.slow_save_threshold)
+
+    @classmethod
+    def store_from_config(cls, persistence_config):
+        """Create the StateStore for a state_persistence config."""
         store_type              = persistence_config.store_type
         name                    = persistence_config.name
         connection_details      = persistence_config.connection_details
-        buffer_size             = persistence_config.buffer_size
         store                   = None
 
         if store_type not in schema.StatePersistenceTypes:
             raise PersistenceStoreError("Unknown store type: %s" % store_type)
 
+        state_codec = None
+        if persistence_config.codec:
+            state_codec = codec.get_codec(persistence_config.codec)
+
         if store_type == schema.StatePersistenceTypes.shelve:
             store = ShelveStateStore(name)
 
         if store_type == schema.StatePersistenceTypes.sql:
-            store = SQLAlchemyStateStore(name, connection_details)
+            store = SQLAlchemyStateStore(name, connection_details, state_codec)
 
         if store_type == schema.StatePersistenceTypes.mongo:
             store = MongoStateStore(name, connection_details)
@@ -48,8 +80,14 @@ class PersistenceManagerFactory(object):
         if store_type == schema.StatePersistenceTypes.yaml:
             store = YamlStateStore(name)
 
-        buffer = StateSaveBuffer(buffer_size)
-        return PersistentStateManager(store, buffer)
+        if store_type == schema.StatePersistenceTypes.sqlite:
+            store = SQLiteStateStore(name, state_codec)
+
+        if store_type == schema.StatePersistenceTypes.journal:
+            store = JournalStateStore(
+                name, state_codec, connection_details)
+
+        return store
 
 
 class StateMetadata(object):
@@ -59,21 +97,29 @@ class StateMetadata(object):
     name                        = 'StateMetadata'
     version                     = tron.__version_info__
 
-    def __init__(self):
+    def __init__(self, codec_name=None):
         self.state_data         = {
             'version':              self.version,
             'create_time':          time.time(),
+            'codec':                codec_name,
         }
 
     @classmethod
     def validate_metadata(cls, metadata):
         """Raises an exception if the metadata version is newer then
-        tron.__version__.
+        tron.__version__, or the state was saved with an unknown codec.
         """
         if not metadata:
             return
 
-        version = metadata['version']
+        if metadata.get('codec'):
+            try:
+                codec.get_codec(metadata['codec'])
+            except codec.UnknownCodecError, e:
+                raise PersistenceStoreError(e)
+
+        # Some codecs restore tuples as lists
+        version = tuple(metadata['version'])
         # Names (and state keys) changed in 0.5.2, requires migration
         # see tools/migration/migrate_state_to_namespace
         if version > cls.version or version < (0, 5, 2):
@@ -82,28 +128,152 @@ class StateMetadata(object):
                 msg % (metadata['version'] , cls.version))
 
 
+def estimate_size(state_data):
+    """Return a rough estimate of the number of bytes needed to store
+    state_data. This is much cheaper than actually encoding it.
+    """
+    if isinstance(state_data, basestring):
+        return len(state_data)
+    if isinstance(state_data, dict):
+        return sum(estimate_size(key) + estimate_size(value)
+                   for key, value in state_data.iteritems())
+    if isinstance(state_data, (list, tuple)):
+        return sum(estimate_size(item) for item in state_data)
+    return 8
+
+
 class StateSaveBuffer(object):
-    """Buffer calls to save, and perform the saves when buffer reaches
-    buffer size. This buffer will only store one state_data for each key.
+    """Buffer calls to save, and perform the saves when the buffer is full.
+    This buffer will only store one state_data for each key.
+
+    The buffer is full when it has received buffer_size calls to save, when
+    the buffered state is estimated to be at least max_bytes, or when the
+    oldest buffered state is max_age seconds old. A full buffer is not
+    flushed until min_interval seconds have passed since the previous
+    flush. flush_delay() returns the number of seconds until the buffer has
+    to be flushed, so that state is saved even if no more saves are made.
     """
 
-    def __init__(self, buffer_size):
+    def __init__(self, buffer_size, max_age=None, min_interval=None,
+                max_bytes=None):
         self.buffer_size        = buffer_size
+        self.max_age            = max_age
+        self.min_interval       = min_interval
+        self.max_bytes          = max_bytes
         self.buffer             = {}
-        self.counter            = itertools.cycle(xrange(buffer_size))
+        self.sizes              = {}
+        self.save_count         = 0
+        self.first_save_time    = None
+        self.last_flush_time    = 0
+        self.flush_pending      = False
+        self.stats              = {
+            'saves':                0,
+            'flushes':              0,
+            'keys_written':         0,
+            'bytes_written':        0,
+            'last_staleness':       0,
+            'max_staleness':        0,
+            'flush_reasons':        {},
+        }
 
     def save(self, key, state_data):
-        """Save the state_data indexed by key and return True if the buffer
-        is full.
+        """Save the state_data indexed by key and return the reason the buffer
+        should be flushed, or None if it should not be flushed yet.
+        """
+        return self.save_all([(key, state_data)])
+
+    def save_all(self, key_state_pairs):
+        """Save many state_data items as a single call to save. Returns the
+        same as save().
+        """
+        now = time.time()
+        if not self.buffer:
+            self.first_save_time = now
+
+        for key, state_data in key_state_pairs:
+            self.buffer[key] = state_data
+            if self.max_bytes:
+                self.sizes[key] = estimate_size(state_data)
+
+        self.save_count += 1
+        self.stats['saves'] += 1
+        return self._get_flush_reason(now)
+
+    @property
+    def buffered_bytes(self):
+        return sum(self.sizes.itervalues())
+
+    def _get_flush_reason(self, now):
+        if self.save_count >= self.buffer_size:
+            reason = 'count'
+        elif self.max_bytes and self.buffered_bytes >= self.max_bytes:
+            reason = 'bytes'
+        elif self.max_age and now - self.first_save_time >= self.max_age:
+            reason = 'age'
+        else:
+            return None
+
+        if self.min_interval and now - self.last_flush_time < self.min_interval:
+            self.flush_pending = True
+            return None
+        return reason
+
+    def flush_delay(self):
+        """Return the number of seconds until the buffer must be flushed, or
+        None if there is no time limit.
         """
-        self.buffer[key] = state_data
-        return not self.counter.next()
+        if not self.buffer:
+            return None
+
+        flush_times = []
+        if self.max_age:
+            flush_times.append(self.first_save_time + self.max_age)
+        if self.flush_pending:
+            flush_times.append(self.last_flush_time + self.min_interval)
+        if not flush_times:
+            return None
+        return max(min(flush_times) - time.time(), 0)
+
+    def flush(self, reason):
+        """Return all buffered (key, state_data) pairs, clear the buffer, and
+        record statistics about the flush.
+        """
+        now = time.time()
+        items = self.buffer.items()
+        if items:
+            staleness = now - self.first_save_time
+            reasons = self.stats['flush_reasons']
+            reasons[reason] = reasons.get(reason, 0) + 1
+            self.stats['flushes']        += 1
+            self.stats['keys_written']   += len(items)
+            self.stats['bytes_written']  += self.buffered_bytes
+            self.stats['last_staleness'] = staleness
+            self.stats['max_staleness']  = max(
+                self.stats['max_staleness'], staleness)
+
+        self.buffer.clear()
+        self.sizes.clear()
+        self.save_count         = 0
+        self.first_save_time    = None
+        self.last_flush_time    = now
+        self.flush_pending      = False
+        return items
 
     def __iter__(self):
         """Return all buffered data and clear the buffer."""
-        for key, item in self.buffer.iteritems():
-            yield key, item
-        self.buffer.clear()
+        return iter(self.flush('manual'))
+
+    def get_stats(self):
+        """Return a dict of statistics about the buffer. write_amplification
+        is the number of keys written for each call to save.
+        """
+        saves = self.stats['saves']
+        return dict(self.stats,
+            flush_reasons=dict(self.stats['flush_reasons']),
+            buffered_keys=len(self.buffer),
+            buffered_bytes=self.buffered_bytes,
+            write_amplification=(
+                float(self.stats['keys_written']) / saves if saves else 0))
 
 
 class PersistentStateManager(object):
@@ -120,7 +290,12 @@ class PersistentStateManager(object):
         def restore(self, keys):
             return <dict of key to states>
 
-        def save(self, key, state_data):
+        # Optional, allows state to be decoded by a ParallelDecoder
+        def restore_raw(self, keys):
+            return <dict of key to encoded states, decoded by self.codec>
+
+        def save(self, key_value_pairs):
+            # A state_data of None removes the key from the store
             pass
 
         def cleanup(self):
@@ -128,21 +303,43 @@ class PersistentStateManager(object):
 
     """
 
-    def __init__(self, persistence_impl, buffer):
+    def __init__(self, persistence_impl, buffer, decoder=None,
+                slow_save_threshold=None):
         self.enabled            = True
         self._buffer            = buffer
         self._impl              = persistence_impl
+        self._decoder           = decoder
+        self.slow_save_threshold = slow_save_threshold
+        self.metrics            = PersistenceMetrics()
+        self._flush_callback    = eventloop.UniqueCallback(
+                                    None, self._save_from_timer)
         self.metadata_key       = self._impl.build_key(
                                     runstate.MCP_STATE, StateMetadata.name)
+        self._attach_codec_metrics()
 
-    def restore(self, job_names, service_names, skip_validation=False):
-        """Return the most recent serialized state."""
+    def _attach_codec_metrics(self):
+        """Record encode and decode time for stores which use a StateCodec,
+        including a store wrapped by a ThreadedStateWriter.
+        """
+        store = getattr(self._impl, 'store', self._impl)
+        state_codec = getattr(store, 'codec', None)
+        if isinstance(state_codec, codec.StateCodec):
+            state_codec.metrics = self.metrics
+
+    def restore(self, job_names, service_names, skip_validation=False,
+                timer=None):
+        """Return the most recent serialized state. If a timer is given, the
+        time spent fetching and decoding state is added to it.
+        """
         log.debug("Restoring state.")
+        timer = timer or timeutils.StepTimer()
         if not skip_validation:
             self._restore_metadata()
 
-        return (self._restore_dicts(runstate.JOB_STATE, job_names),
-                self._restore_dicts(runstate.SERVICE_STATE, service_names))
+        job_states = self._restore_dicts(runstate.JOB_STATE, job_names, timer)
+        return (self._restore_job_runs(job_states, timer),
+                self._restore_dicts(
+                    runstate.SERVICE_STATE, service_names, timer))
 
     def _restore_metadata(self):
         metadata = self._impl.restore([self.metadata_key])
@@ -153,29 +350,102 @@ class PersistentStateManager(object):
         keys = (self._impl.build_key(item_type, name) for name in names)
         return dict(itertools.izip(keys, names))
 
-    def _restore_dicts(self, item_type, items):
+    def _restore_dicts(self, item_type, items, timer=None):
         """Return a dict mapping of the items name to its state data."""
         key_to_item_map  = self._keys_for_items(item_type, items)
-        key_to_state_map = self._impl.restore(key_to_item_map.keys())
+        start_time       = time.time()
+        key_to_state_map = self._restore_keys(
+            key_to_item_map.keys(), timer or timeutils.StepTimer())
+        self.metrics.record_restore(
+            item_type, len(key_to_item_map), time.time() - start_time)
         return dict((key_to_item_map[key], state_data)
                     for key, state_data in key_to_state_map.iteritems())
 
+    def _restore_keys(self, keys, timer):
+        """Restore keys from the store. When a decoder is configured and the
+        store supports it, state is fetched and then decoded by the decoder.
+        Otherwise decoding is part of the state_fetch time.
+        """
+        if not self._decoder or not hasattr(self._impl, 'restore_raw'):
+            with timer.time('state_fetch'):
+                return self._impl.restore(keys)
+
+        with timer.time('state_fetch'):
+            raw_items = self._impl.restore_raw(keys)
+        with timer.time('decode'):
+            return self._decoder.decode(self._impl.codec, raw_items)
+
+    def _restore_job_runs(self, job_states, timer=None):
+        """Jobs which were saved with a run index have the state of each run
+        stored under its own key. Restore those runs, and replace the index
+        with the list of run states expected by Job.restore_state().
+        """
+        def run_names(name, job_state):
+            return ['%s.%s' % (name, num) for num in job_state['run_nums']]
+
+        indexed_jobs = dict((name, job_state)
+            for name, job_state in job_states.iteritems()
+            if 'run_nums' in job_state)
+        names = [run_name
+            for name, job_state in indexed_jobs.iteritems()
+            for run_name in run_names(name, job_state)]
+        if not names:
+            return job_states
+
+        run_states = self._restore_dicts(runstate.JOB_RUN_STATE, names, timer)
+        for name, job_state in indexed_jobs.iteritems():
+            job_state['runs'] = [run_states[run_name]
+                for run_name in run_names(name, job_state)
+                if run_name in run_states]
+            del job_state['run_nums']
+        return job_states
+
     def save(self, type_enum, name, state_data):
         """Persist an items state."""
         key = self._impl.build_key(type_enum, name)
         log.info("Buffering state save for: %s", key)
-        if self._buffer.save(key, state_data) and self.enabled:
-            self._save_from_buffer()
+        self._flush_or_schedule(self._buffer.save(key, state_data))
+
+    def save_all(self, items):
+        """Persist the state of several items together, so they are written
+        in the same flush. items is a sequence of (type_enum, name, state_data)
+        tuples. A state_data of None removes the item from the store.
+        """
+        key_state_pairs = [(self._impl.build_key(type_enum, name), state_data)
+                           for type_enum, name, state_data in items]
+        log.info("Buffering state save for: %s",
+            ','.join(str(key) for key, _ in key_state_pairs))
+        self._flush_or_schedule(self._buffer.save_all(key_state_pairs))
+
+    def _flush_or_schedule(self, flush_reason):
+        """Flush the buffer if there is a flush_reason, otherwise schedule the
+        buffer to be flushed when it reaches its time limit.
+        """
+        if not self.enabled:
+            return
 
-    def _save_from_buffer(self):
-        key_state_pairs = list(self._buffer)
+        if flush_reason:
+            self._save_from_buffer(flush_reason)
+            return
+
+        delay = self._buffer.flush_delay()
+        if delay is not None:
+            self._flush_callback.start(delay)
+
+    def _save_from_timer(self):
+        if self.enabled:
+            self._save_from_buffer('timer')
+
+    def _save_from_buffer(self, reason):
+        self._flush_callback.cancel()
+        key_state_pairs = self._buffer.flush(reason)
         if not key_state_pairs:
             return
 
         keys = ','.join(str(key) for key, _ in key_state_pairs)
         log.info("Saving state for %s" % keys)
 
-        with self._timeit():
+        with self._timeit(reason, len(key_state_pairs)):
             try:
                 self._impl.save(key_state_pairs)
             except Exception, e:
@@ -184,16 +454,40 @@ class PersistentStateManager(object):
                 raise PersistenceStoreError(msg)
 
     def cleanup(self):
-        self._save_from_buffer()
+        self._save_from_buffer('cleanup')
         self._impl.cleanup()
 
     @contextmanager
-    def _timeit(self):
-        """Log the time spent saving the state."""
+    def _timeit(self, reason, keys):
+        """Log and record the time spent saving the state, and record an
+        event if the save was slow.
+        """
         start_time = time.time()
         yield
         duration = time.time() - start_time
         log.info("State saved using %s in %0.3fs." % (self._impl, duration))
+        self.metrics.record_flush(reason, keys, duration)
+
+        if self.slow_save_threshold and duration >= self.slow_save_threshold:
+            self.metrics.slow_saves += 1
+            log.warn("Slow state save of %d keys took %0.3fs.", keys, duration)
+            event.get_recorder().notice('slow_state_save',
+                reason=reason, keys=keys, duration=duration)
+
+    def get_stats(self):
+        """Return a dict of persistence metrics, including statistics from
+        the buffer and, if the store has them, from the store.
+        """
+        store_stats, write_time = None, None
+        if hasattr(self._impl, 'get_stats'):
+            store_stats = self._impl.get_stats()
+            write_time  = store_stats.get('total_save_duration')
+
+        return dict(self.metrics.get_stats(write_time),
+            store=str(self._impl),
+            store_stats=store_stats,
+            buffer=self._buffer.get_stats(),
+            slow_save_threshold=self.slow_save_threshold)
 
     @contextmanager
     def disabled(self):
@@ -212,6 +506,10 @@ class NullStateManager(object):
     def cleanup():
         pass
 
+    @staticmethod
+    def get_stats():
+        return {}
+
     @classmethod
     def disabled(cls):
         return cls()
@@ -224,11 +522,31 @@ class NullStateManager(object):
 
 
 class StateChangeWatcher(observer.Observer):
-    """Observer of stateful objects."""
+    """Observer of stateful objects.
+
+    A state change only marks the object as dirty. The state of dirty objects
+    is saved once, at the end of the current reactor tick, so an object which
+    changes many times in the same tick (for example when a job starts, or is
+    disabled) is only serialized once.
+    """
 
     def __init__(self):
-        self.state_manager = NullStateManager
-        self.config        = None
+        self.state_manager      = NullStateManager
+        self.config             = None
+        self.dirty_jobs         = {}
+        self.dirty_services     = {}
+        self._save_callback     = eventloop.UniqueCallback(
+                                    None, self.save_dirty)
+
+    @property
+    def incremental(self):
+        """Return True if job runs are saved individually."""
+        return bool(self.config and self.config.incremental)
+
+    @property
+    def codec_name(self):
+        """Return the name of the configured codec, or None."""
+        return self.config.codec if self.config else None
 
     def update_from_config(self, state_config):
         if self.config == state_config:
@@ -240,30 +558,70 @@ class StateChangeWatcher(observer.Observer):
         return True
 
     def handler(self, observable, _event):
-        """Handle a state change in an observable by saving its state."""
+        """Handle a state change in an observable by marking it dirty, and
+        schedule the dirty state to be saved.
+        """
         if isinstance(observable, job.Job):
-            self.save_job(observable)
-        if isinstance(observable, service.Service):
-            self.save_service(observable)
+            self.dirty_jobs[observable.name] = observable
+        elif isinstance(observable, service.Service):
+            self.dirty_services[observable.name] = observable
+        else:
+            return
+        self._save_callback.start(0)
+
+    def save_dirty(self):
+        """Save the state of all jobs and services marked dirty."""
+        self._save_callback.cancel()
+        for job in self.dirty_jobs.values():
+            self.save_job(job)
+        for service in self.dirty_services.values():
+            self.save_service(service)
+
+    def save_job(self, job, all_runs=False):
+        """Save the state of a job. When saving incrementally only the runs
+        which changed are saved, unless all_runs is True.
+        """
+        self.dirty_jobs.pop(job.name, None)
+        changed_runs, removed_run_ids = job.runs.pop_changes()
+        if not self.incremental:
+            self._save_object(runstate.JOB_STATE, job)
+            return
 
-    def save_job(self, job):
-        self._save_object(runstate.JOB_STATE, job)
+        if all_runs:
+            changed_runs = list(job.runs)
+
+        items = [(runstate.JOB_RUN_STATE, run.id, run.state_data)
+                 for run in changed_runs]
+        items.extend((runstate.JOB_RUN_STATE, run_id, None)
+                     for run_id in removed_run_ids)
+        items.append((runstate.JOB_STATE, job.name, job.run_index_state_data))
+        self.state_manager.save_all(items)
 
     def save_service(self, service):
+        self.dirty_services.pop(service.name, None)
         self._save_object(runstate.SERVICE_STATE, service)
 
     def save_metadata(self):
-        self._save_object(runstate.MCP_STATE, StateMetadata())
+        self._save_object(runstate.MCP_STATE, StateMetadata(self.codec_name))
 
     def _save_object(self, state_type, obj):
         self.state_manager.save(state_type, obj.name, obj.state_data)
 
     def shutdown(self):
+        self.save_dirty()
         self.state_manager.enabled = False
         self.state_manager.cleanup()
 
     def disabled(self):
         return self.state_manager.disabled()
 
-    def restore(self, jobs, services):
-        return self.state_manager.restore(jobs, services)
+    def restore(self, jobs, services, timer=None):
+        return self.state_manager.restore(jobs, services, timer=timer)
+
+    def get_stats(self):
+        """Return persistence metrics, with the number of dirty jobs and
+        services waiting to be saved.
+        """
+        return dict(self.state_manager.get_stats(),
+            dirty_jobs=len(self.dirty_jobs),
+            dirty_services=len(self.dirty_services))
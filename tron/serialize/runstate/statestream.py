@@ -0,0 +1,101 @@
+"""
+ Stream the state in a StateStore in chunks of keys, so that it can be copied
+ to another store, or inspected, without restoring all of it into memory.
+
+ Streams read keys directly from a store (see
+ PersistenceManagerFactory.store_from_config), so the state is not modified
+ and the state metadata is not validated.
+"""
+from collections import namedtuple
+import logging
+
+from tron.serialize import runstate
+
+log = logging.getLogger(__name__)
+
+
+StateItem = namedtuple('StateItem', ['type', 'name', 'state_data'])
+
+
+def chunks(seq, size):
+    """Yield lists of up to size items from seq."""
+    seq = list(seq)
+    for i in xrange(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+class StateStream(object):
+    """Iterate over the state of jobs, job runs and services in a store, as
+    StateItems. Keys are restored chunk_size at a time. The runs of a job
+    which was saved with a run index are streamed after the job.
+    """
+
+    chunk_size          = 500
+
+    def __init__(self, store, job_names, service_names, chunk_size=None):
+        self.store              = store
+        self.job_names          = job_names
+        self.service_names      = service_names
+        self.chunk_size         = chunk_size or self.chunk_size
+
+    def __iter__(self):
+        for job_item in self._stream(runstate.JOB_STATE, self.job_names):
+            yield job_item
+            for run_item in self._stream_runs(job_item):
+                yield run_item
+
+        for item in self._stream(runstate.SERVICE_STATE, self.service_names):
+            yield item
+
+    def _stream_runs(self, job_item):
+        run_nums = job_item.state_data.get('run_nums')
+        if not run_nums:
+            return []
+        names = ['%s.%s' % (job_item.name, run_num) for run_num in run_nums]
+        return self._stream(runstate.JOB_RUN_STATE, names)
+
+    def _stream(self, state_type, names):
+        for chunk in chunks(names, self.chunk_size):
+            keys = [self.store.build_key(state_type, name) for name in chunk]
+            state = self.store.restore(keys)
+            for key, name in zip(keys, chunk):
+                if key in state:
+                    yield StateItem(state_type, name, state[key])
+
+
+class StateCopier(object):
+    """Save StateItems to a store in batches, each with a single call to
+    store.save(). progress, if set, is called with the number of items saved
+    so far after each batch.
+    """
+
+    batch_size          = 500
+
+    def __init__(self, store, batch_size=None, progress=None):
+        self.store              = store
+        self.batch_size         = batch_size or self.batch_size
+        self.progress           = progress
+        self.count              = 0
+        self._batch             = []
+
+    def add(self, item):
+        key = self.store.build_key(item.type, item.name)
+        self._batch.append((key, item.state_data))
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._batch:
+            return
+        self.store.save(self._batch)
+        self.count += len(self._batch)
+        self._batch = []
+        if self.progress:
+            self.progress(self.count)
+
+    def copy(self, items):
+        """Save all items and return the number saved."""
+        for item in items:
+            self.add(item)
+        self.flush()
+        return self.count
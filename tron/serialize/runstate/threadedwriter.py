@@ -0,0 +1,209 @@
+"""
+ Write state to a StateStore from a dedicated thread, so that the reactor
+ thread never blocks on storage I/O.
+"""
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class ThreadedStateWriter(object):
+    """Wraps a StateStore and performs saves on a worker thread.
+
+    Saves are queued by key, so a newer state_data for a key replaces one
+    which has not been written yet, and the queue never holds more than one
+    state_data for each key. save() never blocks. When the number of queued
+    keys reaches queue_size a warning is logged and counted, but the save is
+    still queued. A failed write is retried, with the delay doubling after
+    each consecutive failure up to max_retry_delay. restore() and cleanup()
+    wait for all queued saves to be written first.
+
+    The state_data handed to save() must not be modified by the caller
+    afterwards. state_data properties build a new dict on every call, so
+    this holds for the values passed in by PersistentStateManager.
+    """
+
+    # Seconds to wait before retrying a failed save, doubled after each
+    # consecutive failure up to max_retry_delay
+    retry_delay             = 1
+    max_retry_delay         = 60
+    # Seconds between checks for shutdown while waiting
+    wait_interval           = 0.5
+
+    def __init__(self, store, queue_size):
+        self.store              = store
+        self.queue_size         = queue_size
+        self.pending            = {}
+        self.writing            = False
+        self.stopped            = False
+        self.over_capacity      = False
+        self.condition          = threading.Condition()
+        self.stats              = {
+            'saves':                0,
+            'failures':             0,
+            'keys_written':         0,
+            'coalesced':            0,
+            'over_capacity':        0,
+            'max_queue_depth':      0,
+            'retries':              0,
+            'consecutive_failures': 0,
+            'retry_delay':          0,
+            'last_save_duration':   0,
+            'max_save_duration':    0,
+            'total_save_duration':  0,
+        }
+        # Stores which support restore_raw() can be decoded in parallel
+        if hasattr(store, 'restore_raw'):
+            self.restore_raw    = self._restore_raw
+            self.codec          = store.codec
+        self.thread             = threading.Thread(
+            target=self._run, name=str(self))
+        self.thread.daemon      = True
+        self.thread.start()
+
+    def build_key(self, type, iden):
+        return self.store.build_key(type, iden)
+
+    def save(self, key_value_pairs):
+        """Queue state_data to be saved by the worker thread. This is called
+        from the reactor thread, so it must never wait for the worker.
+        """
+        with self.condition:
+            for key, state_data in key_value_pairs:
+                if key in self.pending:
+                    self.stats['coalesced'] += 1
+                self.pending[key] = state_data
+
+            self._check_queue_depth()
+            self.condition.notify_all()
+
+    def _check_queue_depth(self):
+        depth = len(self.pending)
+        self.stats['max_queue_depth'] = max(
+            self.stats['max_queue_depth'], depth)
+        if depth < self.queue_size or self.over_capacity:
+            return
+
+        self.over_capacity = True
+        self.stats['over_capacity'] += 1
+        log.warn("%s has %d keys queued, saves are falling behind.",
+            self, depth)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait(self.wait_interval)
+
+                if not self.pending:
+                    return
+
+                items, self.pending = self.pending.items(), {}
+                self.writing = True
+                self.over_capacity = False
+                self.condition.notify_all()
+
+            succeeded = self._write(items)
+
+            with self.condition:
+                self.writing = False
+                if not succeeded:
+                    self._requeue(items)
+                self.condition.notify_all()
+
+            if not succeeded:
+                self._wait_to_retry()
+
+    def _write(self, items):
+        """Save items to the store. Stats are updated while holding the
+        condition, because get_stats() reads them from the reactor thread.
+        """
+        start_time = time.time()
+        try:
+            self.store.save(items)
+        except Exception:
+            log.exception("%s failed to save state for %d keys.",
+                self, len(items))
+            with self.condition:
+                self._record_failure()
+            return False
+
+        duration = time.time() - start_time
+        with self.condition:
+            self.stats['saves']                 += 1
+            self.stats['keys_written']          += len(items)
+            self.stats['last_save_duration']    = duration
+            self.stats['total_save_duration']   += duration
+            self.stats['max_save_duration']     = max(
+                self.stats['max_save_duration'], duration)
+            self.stats['consecutive_failures']  = 0
+            self.stats['retry_delay']           = 0
+        return True
+
+    def _record_failure(self):
+        failures = self.stats['consecutive_failures']
+        self.stats['failures']              += 1
+        self.stats['consecutive_failures']  = failures + 1
+        self.stats['retry_delay']           = min(
+            self.retry_delay * 2 ** failures, self.max_retry_delay)
+
+    def _wait_to_retry(self):
+        """Wait before retrying a failed save. Returns early if the writer
+        is stopped, because the failed items are dropped by then.
+        """
+        with self.condition:
+            end_time = time.time() + self.stats['retry_delay']
+            while not self.stopped and time.time() < end_time:
+                self.condition.wait(min(
+                    self.wait_interval, end_time - time.time()))
+            if not self.stopped:
+                self.stats['retries'] += 1
+
+    def _requeue(self, items):
+        """Queue items from a failed save, unless they were replaced by a
+        newer save. Items are dropped once the writer is stopped.
+        """
+        if self.stopped:
+            log.error("%s dropped state for %d keys on shutdown.",
+                self, len(items))
+            return
+
+        for key, state_data in items:
+            self.pending.setdefault(key, state_data)
+
+    def flush(self):
+        """Block until all queued saves are written, or a save fails."""
+        with self.condition:
+            failures = self.stats['failures']
+            while ((self.pending or self.writing) and self.thread.is_alive()
+                    and failures == self.stats['failures']):
+                self.condition.wait(self.wait_interval)
+
+    def restore(self, keys):
+        self.flush()
+        return self.store.restore(keys)
+
+    def _restore_raw(self, keys):
+        self.flush()
+        return self.store.restore_raw(keys)
+
+    def get_stats(self):
+        """Return a dict of statistics about this writer."""
+        with self.condition:
+            stats = dict(self.stats, queue_depth=len(self.pending))
+        return stats
+
+    def cleanup(self):
+        """Write all queued saves, stop the worker thread and cleanup the
+        store.
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.store.cleanup()
+
+    def __str__(self):
+        return "ThreadedStateWriter(%s)" % self.store
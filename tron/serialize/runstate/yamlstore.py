@@ -1,60 +1,171 @@
-"""Store state in a local YAML file.
+"""Store state in local YAML files.
 
-WARNING: Using this store is NOT recommended.  It will be far too slow for
-anything but the most trivial setups.  It should only be used with a high
-buffer size (10+), and a low run_limit (< 10).
+The state of each key is stored in its own file, in a directory for each
+type of state:
+
+    <path>/<type>/<iden>.yaml
+
+Only the files for saved keys are written, and only the files for requested
+keys are read. Each file is written to a temporary file which is then renamed,
+so a crash never leaves a partially written file.
+
+State files created before state was sharded (a single YAML file at <path>)
+can still be restored. The first save converts the file to the directory
+layout. Shards are written to <path>.converting, then the file is moved to
+<path>.old, and then the new directory is moved to <path>. If trond stops
+before the file is moved, the conversion starts over on the next save. If it
+stops after, the move of the directory is finished by the next restore or
+save.
 """
 from collections import namedtuple
-import itertools
-import operator
+import logging
 import os
+import shutil
+import tempfile
+import urllib
 from tron.serialize import runstate
+from tron.serialize.runstate import codec
 
-yaml = None # For pyflakes
+log = logging.getLogger(__name__)
 
 YamlKey = namedtuple('YamlKey', ['type', 'iden'])
 
 TYPE_MAPPING = {
     runstate.JOB_STATE:     'jobs',
+    runstate.JOB_RUN_STATE: 'job_runs',
     runstate.SERVICE_STATE: 'services',
     runstate.MCP_STATE:     runstate.MCP_STATE
 }
 
+SHARD_EXTENSION = '.yaml'
+CONVERTING_SUFFIX = '.converting'
+LEGACY_SUFFIX = '.old'
+
+
 class YamlStateStore(object):
 
-    def __init__(self, filename):
-        # Differ import of yaml until class is instantiated
-        import yaml
-        global yaml
-        assert yaml
-        self.filename           = filename
-        self.buffer             = {}
+    def __init__(self, path):
+        self.path               = path
+        self.codec              = codec.YamlCodec()
 
     def build_key(self, type, iden):
         return YamlKey(TYPE_MAPPING[type], iden)
 
+    def _shard_filename(self, key, path=None):
+        iden = urllib.quote(key.iden, safe='')
+        filename = iden + SHARD_EXTENSION
+        return os.path.join(path or self.path, key.type, filename)
+
+    @property
+    def is_legacy_file(self):
+        return os.path.isfile(self.path)
+
+    def _finish_conversion(self):
+        """Move the converted directory to path, if a conversion stopped
+        after the legacy file was moved out of the way.
+        """
+        converting_path = self.path + CONVERTING_SUFFIX
+        if os.path.exists(self.path) or not os.path.isdir(converting_path):
+            return
+
+        log.warn("Finishing conversion of %s to a state directory.", self.path)
+        os.rename(converting_path, self.path)
+
     def restore(self, keys):
-        if not os.path.exists(self.filename):
-            return {}
+        self._finish_conversion()
+        if self.is_legacy_file:
+            return self._restore_legacy_file(keys)
+
+        return dict((key, self.codec.decode(data))
+                    for key, data in self.restore_raw(keys).iteritems())
 
-        with open(self.filename, 'r') as fh:
-            self.buffer = yaml.load(fh)
+    def restore_raw(self, keys):
+        """Return a dict of key to the contents of its shard."""
+        self._finish_conversion()
+        if self.is_legacy_file:
+            state = self._restore_legacy_file(keys)
+            return dict((key, self.codec.encode(state_data))
+                        for key, state_data in state.iteritems())
 
-        items = (self.buffer.get(key.type, {}).get(key.iden) for key in keys)
-        key_item_pairs = itertools.izip(keys, items)
-        return dict(itertools.ifilter(operator.itemgetter(1), key_item_pairs))
+        items = ((key, self._read_shard(key)) for key in keys)
+        return dict((key, data) for key, data in items if data is not None)
+
+    def _read_shard(self, key):
+        filename = self._shard_filename(key)
+        if not os.path.exists(filename):
+            return None
+
+        with open(filename, 'r') as fh:
+            return fh.read()
+
+    def _load_legacy_file(self):
+        with open(self.path, 'r') as fh:
+            return self.codec.decode(fh) or {}
+
+    def _restore_legacy_file(self, keys):
+        state = self._load_legacy_file()
+        items = ((key, state.get(key.type, {}).get(key.iden)) for key in keys)
+        return dict((key, state_data) for key, state_data in items if state_data)
 
     def save(self, key_value_pairs):
+        self._finish_conversion()
+        if self.is_legacy_file:
+            self._convert_legacy_file()
+
         for key, state_data in key_value_pairs:
-            self.buffer.setdefault(key.type, {})[key.iden] = state_data
-        self._write_buffer()
+            if state_data is None:
+                self._remove_shard(key)
+                continue
+            self._write_shard(key, state_data)
+
+    def _write_shard(self, key, state_data, path=None):
+        filename = self._shard_filename(key, path)
+        dirname = os.path.dirname(filename)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        fd, tmp_filename = tempfile.mkstemp(dir=dirname, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                fh.write(self.codec.encode(state_data))
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.rename(tmp_filename, filename)
+        except Exception:
+            os.unlink(tmp_filename)
+            raise
+
+    def _remove_shard(self, key):
+        filename = self._shard_filename(key)
+        if os.path.exists(filename):
+            os.unlink(filename)
+
+    def _convert_legacy_file(self):
+        """Write the contents of a state file with the old single file layout
+        as shards in a new directory, then move the file out of the way and
+        replace it with the directory. The file is only moved once every
+        shard has been written.
+        """
+        state = self._load_legacy_file()
+        old_filename = self.path + LEGACY_SUFFIX
+        converting_path = self.path + CONVERTING_SUFFIX
+        log.warn("Converting %s to a state directory, moving it to %s",
+            self.path, old_filename)
+
+        # Remove the shards of a conversion which did not finish
+        if os.path.exists(converting_path):
+            shutil.rmtree(converting_path)
+        os.makedirs(converting_path)
+        for type, items in state.iteritems():
+            for iden, state_data in (items or {}).iteritems():
+                self._write_shard(
+                    YamlKey(type, iden), state_data, converting_path)
 
-    def _write_buffer(self):
-        with open(self.filename, 'w') as fh:
-            yaml.dump(self.buffer, fh)
+        os.rename(self.path, old_filename)
+        os.rename(converting_path, self.path)
 
     def cleanup(self):
         pass
 
     def __repr__(self):
-        return "YamlStateStore('%s')" % self.filename
+        return "YamlStateStore('%s')" % self.path
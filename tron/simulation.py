@@ -0,0 +1,371 @@
+"""
+ Run the MasterControlProgram against a simulated clock.
+
+ Timers from eventloop.call_later() and timeutils.current_time() use a
+ twisted Clock, which is advanced from one timer to the next, so a day of
+ scheduling runs in seconds. Nodes are replaced by SimulatedNodes which do
+ not connect to a host. Their commands exit after a duration chosen by a
+ CommandModel.
+
+ The simulation runs in a temporary working directory, so state and output
+ are not written to the working directory of a real trond. sql and mongo
+ state stores are replaced by a sqlite store in that directory.
+"""
+import fnmatch
+import functools
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from twisted.internet import task
+
+from tron import dispatch
+from tron import eventloop
+from tron import mcp
+from tron import node
+from tron.config import config_parse, schema
+from tron.core import actionrun
+from tron.utils import timeutils
+
+
+log = logging.getLogger(__name__)
+
+
+class Error(Exception):
+    pass
+
+
+# Functions which return a random duration from a random.Random and the
+# parameters of a distribution
+DISTRIBUTIONS = {
+    'constant':     lambda rand, seconds: seconds,
+    'uniform':      lambda rand, low, high: rand.uniform(low, high),
+    'exponential':  lambda rand, mean: rand.expovariate(1.0 / mean),
+    'normal':       lambda rand, mu, sigma: rand.normalvariate(mu, sigma),
+    'lognormal':    lambda rand, mu, sigma: rand.lognormvariate(mu, sigma),
+}
+
+
+class Distribution(object):
+    """A distribution of command durations in seconds."""
+
+    def __init__(self, name, params):
+        if name not in DISTRIBUTIONS:
+            raise Error("Unknown distribution: %s" % name)
+        self.name       = name
+        self.params     = params
+
+    @classmethod
+    def from_string(cls, spec):
+        """Create a Distribution from a string like 'uniform:10,300'. A
+        number is a constant duration.
+        """
+        name, _, params = str(spec).partition(':')
+        if not params:
+            name, params = 'constant', name
+        try:
+            params = [float(param) for param in params.split(',')]
+        except ValueError:
+            raise Error("Invalid distribution: %s" % spec)
+        return cls(name, params)
+
+    def sample(self, rand):
+        try:
+            return max(DISTRIBUTIONS[self.name](rand, *self.params), 0)
+        except TypeError:
+            raise Error("Wrong number of parameters for %s" % self)
+
+    def __str__(self):
+        return "%s:%s" % (self.name, ','.join(map(str, self.params)))
+
+
+def get_action_name(command_id):
+    """Return the job and action name of an ActionCommand id, which is the
+    id of its action run, without the run number.
+    """
+    parts = command_id.split('.')
+    return '.'.join(parts[:-2] + parts[-1:])
+
+
+class CommandModel(object):
+    """Choose how long each simulated command runs and whether it fails, and
+    count the commands which were run.
+
+    actions is a dict of patterns, which are matched against the job and
+    action name (for example MASTER.job_name.action_name), to a
+    Distribution. The longest matching pattern is used, or default if none
+    match.
+    """
+
+    def __init__(self, default, failure_rate=0, actions=None, seed=None):
+        self.default        = default
+        self.failure_rate   = failure_rate
+        self.actions        = sorted((actions or {}).items(),
+                                key=lambda item: (-len(item[0]), item[0]))
+        self.random         = random.Random(seed)
+        self.running        = 0
+        self.stats          = {
+            'started':          0,
+            'succeeded':        0,
+            'failed':           0,
+            'stopped':          0,
+            'max_running':      0,
+        }
+
+    @classmethod
+    def from_config(cls, config, seed=None):
+        """Create a CommandModel from a dict like:
+
+            default: uniform:10,300
+            failure_rate: 0.01
+            actions:
+                MASTER.nightly_*.load: lognormal:6,0.5
+        """
+        actions = dict(
+            (pattern, Distribution.from_string(spec))
+            for pattern, spec in (config.get('actions') or {}).iteritems())
+        return cls(
+            Distribution.from_string(config.get('default', 60)),
+            failure_rate=float(config.get('failure_rate', 0)),
+            actions=actions,
+            seed=seed)
+
+    def get_distribution(self, command_id):
+        action_name = get_action_name(command_id)
+        for pattern, distribution in self.actions:
+            if fnmatch.fnmatchcase(action_name, pattern):
+                return distribution
+        return self.default
+
+    def start(self, command):
+        """Return the duration and exit status of a command which starts."""
+        self.running += 1
+        self.stats['started'] += 1
+        self.stats['max_running'] = max(self.stats['max_running'], self.running)
+        duration = self.get_distribution(command.id).sample(self.random)
+        failed = self.random.random() < self.failure_rate
+        return duration, 1 if failed else 0
+
+    def exited(self, exit_status):
+        self.running -= 1
+        if exit_status is None:
+            self.stats['stopped'] += 1
+        elif exit_status:
+            self.stats['failed'] += 1
+        else:
+            self.stats['succeeded'] += 1
+
+    def get_stats(self):
+        return dict(self.stats, running=self.running)
+
+
+class SimulatedNode(node.Node):
+    """A Node which runs commands without connecting to its host. A command
+    starts after the same jitter as on a Node, and exits after a duration
+    chosen by the CommandModel.
+    """
+
+    def __init__(self, command_model, *args, **kwargs):
+        super(SimulatedNode, self).__init__(*args, **kwargs)
+        self.command_model  = command_model
+        self.exit_timers    = {}
+
+    def run(self, run):
+        if run.id in self.run_states:
+            raise node.Error("Run %s already running !?!" % run.id)
+
+        self.run_states[run.id] = node.RunState(run)
+        delay = node.determine_jitter(len(self.run_states), self.node_settings)
+        if delay:
+            eventloop.call_later(delay, self._do_run, run)
+        else:
+            self._do_run(run)
+        return self.run_states[run.id].deferred
+
+    def _do_run(self, run):
+        if run.id not in self.run_states:
+            return
+
+        duration, exit_status = self.command_model.start(run)
+        self.run_states[run.id].state = node.RUN_STATE_RUNNING
+        self.exit_timers[run.id] = eventloop.call_later(
+            duration, self._run_exited, run, exit_status)
+        run.started()
+
+    def _run_exited(self, run, exit_status):
+        del self.exit_timers[run.id]
+        deferred = self.run_states[run.id].deferred
+        self._cleanup(run)
+        self.command_model.exited(exit_status)
+        run.exited(exit_status)
+        run.done()
+        deferred.callback(exit_status)
+
+    def stop(self, command):
+        exit_timer = self.exit_timers.pop(command.id, None)
+        if exit_timer:
+            exit_timer.cancel()
+            self.command_model.exited(None)
+        super(SimulatedNode, self).stop(command)
+
+    def _cleanup(self, run):
+        del self.run_states[run.id]
+
+
+# State stores which are replaced by a sqlite store in a simulation
+REMOTE_STORE_TYPES = [
+    schema.StatePersistenceTypes.sql,
+    schema.StatePersistenceTypes.mongo,
+]
+
+
+class SimulatedMasterControlProgram(mcp.MasterControlProgram):
+    """A MasterControlProgram which does not write state to a remote store
+    or send email.
+    """
+
+    def update_state_watcher_config(self, state_config):
+        if state_config.store_type in REMOTE_STORE_TYPES:
+            log.warning("Simulating %s state store with sqlite.",
+                state_config.store_type)
+            state_config = state_config._replace(
+                store_type=schema.StatePersistenceTypes.sqlite,
+                connection_details=None)
+        super(SimulatedMasterControlProgram,
+            self).update_state_watcher_config(state_config)
+
+    def apply_notification_options(self, conf):
+        pass
+
+
+class Simulation(object):
+    """Run a configuration against a simulated clock, and record the number
+    of commands run, the depth of the queue of job runs, and the state
+    which was written.
+    """
+
+    def __init__(self, config_path, command_model, start_time=None,
+            sample_interval=300, seed=None):
+        self.config_path        = os.path.abspath(config_path)
+        self.command_model      = command_model
+        self.start_time         = start_time or timeutils.current_time()
+        self.sample_interval    = sample_interval
+        self.seed               = seed
+        self.clock              = task.Clock()
+        self.working_dir        = None
+        self.prev_dir           = None
+        self.mcp                = None
+        self.queue_depths       = []
+        self.wall_time          = 0
+
+    def setup(self):
+        """Start the MasterControlProgram at start_time."""
+        # Schedule jitter and node selection use the random module
+        if self.seed is not None:
+            random.seed(self.seed)
+        self.clock.advance(timeutils.to_timestamp(self.start_time))
+        eventloop.set_clock(self.clock)
+        timeutils.set_clock(self.clock)
+        dispatch.Dispatcher.get_instance().clear()
+        node.NodePoolRepository.get_instance().node_factory = (
+            functools.partial(SimulatedNode, self.command_model))
+        config_parse.valid_ssh_options.require_agent = False
+
+        self.working_dir = tempfile.mkdtemp(prefix='tron_simulation_')
+        self.prev_dir = os.getcwd()
+        os.chdir(self.working_dir)
+        self.mcp = SimulatedMasterControlProgram(
+            self.working_dir, self.config_path)
+        self.mcp.initial_setup()
+
+    def cleanup(self):
+        """Shutdown the MasterControlProgram and restore the real clock."""
+        if self.mcp:
+            self.mcp.shutdown()
+        node.NodePoolRepository.get_instance().node_factory = (
+            node.Node.from_config)
+        config_parse.valid_ssh_options.require_agent = True
+        dispatch.Dispatcher.get_instance().clear()
+        eventloop.set_clock(None)
+        timeutils.set_clock(None)
+        if self.prev_dir:
+            os.chdir(self.prev_dir)
+        if self.working_dir:
+            shutil.rmtree(self.working_dir, ignore_errors=True)
+
+    def advance_to(self, end_time):
+        """Advance the clock to each DelayedCall until end_time, so timers
+        are called at their own time.
+        """
+        while True:
+            calls = self.clock.getDelayedCalls()
+            next_time = min(call.getTime() for call in calls) if calls else None
+            if next_time is None or next_time > end_time:
+                self.clock.advance(max(end_time - self.clock.seconds(), 0))
+                return
+            self.clock.advance(max(next_time - self.clock.seconds(), 0))
+
+    def get_queue_depth(self):
+        """Return the number of queued job runs. The state of action runs is
+        compared directly, because JobRun.is_queued checks the state of every
+        action run through a proxy.
+        """
+        def is_queued(job_run):
+            return all(action_run.state == actionrun.ActionRun.STATE_QUEUED
+                for action_run in job_run.action_runs)
+
+        return sum(
+            sum(1 for job_run in job_runs if is_queued(job_run))
+            for job_runs in self.mcp.jobs.get_job_run_collections())
+
+    def run(self, seconds):
+        """Run the simulation for seconds of simulated time."""
+        start_time = time.time()
+        end_time = self.clock.seconds() + seconds
+        while self.clock.seconds() < end_time:
+            self.advance_to(
+                min(self.clock.seconds() + self.sample_interval, end_time))
+            self.queue_depths.append(self.get_queue_depth())
+        self.wall_time += time.time() - start_time
+
+    def get_dispatch_stats(self):
+        stats = dispatch.Dispatcher.get_instance().get_stats()
+        del stats['queue']
+        return stats
+
+    def get_report(self):
+        simulated_seconds = (self.clock.seconds() -
+            timeutils.to_timestamp(self.start_time))
+        hours = simulated_seconds / 3600.0
+        depths = self.queue_depths or [0]
+        commands = self.command_model.get_stats()
+        return {
+            'start_time':           self.start_time,
+            'end_time':             timeutils.current_time(),
+            'simulated_seconds':    simulated_seconds,
+            'wall_seconds':         self.wall_time,
+            'commands':             commands,
+            'commands_per_hour':    commands['started'] / hours if hours else 0,
+            'queue_depth':          {
+                'max':                  max(depths),
+                'mean':                 float(sum(depths)) / len(depths),
+            },
+            'timers':               eventloop.get_timer_stats(),
+            'dispatch':             self.get_dispatch_stats(),
+            'persistence':          self.mcp.get_state_watcher().get_stats(),
+        }
+
+
+def run_simulation(config_path, hours, command_model, start_time=None,
+        seed=None):
+    """Run a simulation for a number of hours, and return its report."""
+    simulation = Simulation(config_path, command_model, start_time, seed=seed)
+    try:
+        simulation.setup()
+        simulation.run(hours * 3600)
+        return simulation.get_report()
+    finally:
+        simulation.cleanup()
@@ -62,6 +62,41 @@ class MappingCollection(dict):
         return self.remove(item.get_name())
 
 
+def update_membership(items, item, is_member):
+    """Add item to the set items if is_member is True, otherwise remove it."""
+    if is_member:
+        items.add(item)
+    else:
+        items.discard(item)
+
+
+class StringTable(object):
+    """Intern strings into a list, so that each string can be referenced by
+    its index. None is never added to the table.
+    """
+
+    def __init__(self, strings=None):
+        self.strings = list(strings or [])
+        self._indexes = dict(
+            (string, index) for index, string in enumerate(self.strings))
+
+    def add(self, string):
+        """Return the index of string, adding it to the table if needed."""
+        if string is None:
+            return None
+
+        if string not in self._indexes:
+            self._indexes[string] = len(self.strings)
+            self.strings.append(string)
+        return self._indexes[string]
+
+    def get(self, index):
+        return None if index is None else self.strings[index]
+
+    def __len__(self):
+        return len(self.strings)
+
+
 class Enum(object):
     """Enumeration of values."""
 
@@ -88,6 +88,63 @@ def get_transitions(starting_state):
     return [trans for trans, _ in traverse(starting_state, transition_match)]
 
 
+class StateTable(object):
+    """The states and transitions of a state graph, found once by traversing
+    the graph from its initial state. A StateTable is built once for each
+    class which uses a state graph, after the graph is complete, so that
+    looking up transitions and states by name does not traverse the graph.
+    """
+
+    def __init__(self, initial_state):
+        self.initial_state = initial_state
+        self.transitions = frozenset(get_transitions(initial_state))
+        self.states = []
+        self.state_by_name = {}
+        for _, state in traverse(initial_state, lambda t, s: True):
+            if state.name not in self.state_by_name:
+                self.states.append(state)
+                self.state_by_name[state.name] = state
+
+    def get_state(self, name):
+        """Return the state with the name, or raise a ValueError."""
+        try:
+            return self.state_by_name[name]
+        except KeyError:
+            raise ValueError("State %s not found." % name)
+
+    def build_attributes(self, get_machine, include_transitions=True):
+        """Return a dict of attributes for a class with a StateMachine using
+        this table. get_machine is a function which returns the machine of
+        an instance, or any object with a state. The attributes are an
+        is_<name> property for each state, and a method for each transition
+        unless include_transitions is False.
+        """
+        def build_state_property(state):
+            return property(lambda self: get_machine(self).state is state)
+
+        def build_transition_method(name):
+            def transition(self):
+                return get_machine(self).transition(name)
+            transition.__name__ = name
+            return transition
+
+        attributes = dict(('is_%s' % state.name, build_state_property(state))
+                          for state in self.states)
+        if include_transitions:
+            attributes.update((name, build_transition_method(name))
+                              for name in self.transitions)
+        return attributes
+
+    def add_attributes(self, cls, get_machine, include_transitions=True):
+        """Add the attributes from build_attributes() to cls, except those cls
+        already defines.
+        """
+        attributes = self.build_attributes(get_machine, include_transitions)
+        for name, attribute in attributes.iteritems():
+            if not hasattr(cls, name):
+                setattr(cls, name, attribute)
+
+
 class StateMachine(Observable):
     """StateMachine is a class that can be used for managing state machines.
 
@@ -99,12 +156,13 @@ class StateMachine(Observable):
     transitioning to other states based on the target.
     """
 
-    def __init__(self, initial_state, delegate=None, force_state=None):
+    def __init__(self, initial_state, delegate=None, force_state=None,
+            table=None):
         super(StateMachine, self).__init__()
         self.initial_state = initial_state
         self.state = force_state or self.initial_state
-        self._state_by_name = None
         self.delegate = delegate
+        self.table = table
 
     def check(self, target):
         """Check if the state can be transitioned to target. Returns the
@@ -116,6 +174,8 @@ class StateMachine(Observable):
 
     @property
     def transitions(self):
+        if self.table:
+            return self.table.transitions
         return get_transitions(self.initial_state)
 
     def transition(self, target, stop_item=None):
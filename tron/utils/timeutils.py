@@ -1,12 +1,30 @@
 """Functions for working with dates and timestamps."""
 from __future__ import division
+from contextlib import contextmanager
 import datetime
 import re
 import time
 
+from tron.utils.dicts import OrderedDict
+
+
+# Set by set_clock() to read the current time from a simulated clock
+clock = None
+
+
+def set_clock(new_clock):
+    """Read the current time from new_clock, which has a seconds() method
+    like a reactor, instead of the system clock. None restores the system
+    clock.
+    """
+    global clock
+    clock = new_clock
+
 
 def current_time():
     """Return the current datetime."""
+    if clock:
+        return datetime.datetime.fromtimestamp(clock.seconds())
     return datetime.datetime.now()
 
 
@@ -96,4 +114,27 @@ class DateArithmetic(object):
             return int(to_timestamp(dt)) + delta
 
         if attr == 'daynumber':
-            return dt.toordinal() + delta
\ No newline at end of file
+            return dt.toordinal() + delta
+
+
+class StepTimer(object):
+    """Record the number of seconds spent in named steps. Time spent in a
+    step more than once is added together.
+    """
+
+    def __init__(self):
+        self.durations = OrderedDict()
+
+    @contextmanager
+    def time(self, name):
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - start_time)
+
+    def add(self, name, duration):
+        self.durations[name] = self.durations.get(name, 0) + duration
+
+    def __str__(self):
+        return ", ".join("%s=%.3fs" % item for item in self.durations.items())
@@ -271,3 +271,108 @@ class TimeSpecification(object):
 
     def __ne__(self, other):
         return not self == other
+
+
+def to_mask(values):
+    """Return an int with a bit set for each value."""
+    mask = 0
+    for value in values:
+        mask |= 1 << value
+    return mask
+
+
+def lowest_bit(mask):
+    """Return the index of the lowest bit set in mask."""
+    return (mask & -mask).bit_length() - 1
+
+
+def next_bit(mask, value):
+    """Return the lowest bit set in mask which is >= value, or None."""
+    mask >>= value
+    if not mask:
+        return None
+    return value + lowest_bit(mask)
+
+
+class CompiledTimeSpecification(TimeSpecification):
+    """A TimeSpecification which matches using bitsets of the valid months,
+    hours, minutes and seconds, and a cached bitset of the matching days for
+    each (year, month). get_match() returns the same times as
+    TimeSpecification.get_match().
+    """
+
+    # Stop looking for a matching day after this many months
+    max_months              = 400 * 12
+
+    def __init__(self, *args, **kwargs):
+        super(CompiledTimeSpecification, self).__init__(*args, **kwargs)
+        self.month_mask     = to_mask(self.months)
+        self.hour_mask      = to_mask(self.hours)
+        self.minute_mask    = to_mask(self.minutes)
+        self.second_mask    = to_mask(self.seconds)
+        self.first_time     = datetime.time(
+            self.hours[0], self.minutes[0], self.seconds[0])
+        self.day_masks      = {}
+
+    def day_mask(self, year, month):
+        """Return a bitset of the days which match in a month."""
+        key = year, month
+        if key not in self.day_masks:
+            days = self.next_day(1, year, month)
+            self.day_masks[key] = to_mask(days)
+        return self.day_masks[key]
+
+    def next_time(self, start_date, is_start_day):
+        """Return the first valid time, or the first time after the time of
+        start_date when is_start_day is True.
+        """
+        if not is_start_day:
+            return self.first_time
+
+        start = start_date.time()
+        hour = next_bit(self.hour_mask, start.hour)
+        if hour == start.hour:
+            minute = next_bit(self.minute_mask, start.minute)
+            if minute == start.minute:
+                second = next_bit(self.second_mask, start.second + 1)
+                if second is not None:
+                    return datetime.time(hour, minute, second)
+                minute = next_bit(self.minute_mask, start.minute + 1)
+            if minute is not None:
+                return datetime.time(hour, minute, self.seconds[0])
+            hour = next_bit(self.hour_mask, start.hour + 1)
+
+        if hour is None:
+            return None
+        return datetime.time(hour, self.minutes[0], self.seconds[0])
+
+    def get_match(self, start):
+        """Returns the next datetime match after start."""
+        start_date  = to_timezone(start, self.timezone).replace(tzinfo=None)
+        year, month = start_date.year, start_date.month
+        first_day   = start_date.day
+
+        for _ in xrange(self.max_months):
+            if self.month_mask & (1 << month):
+                # Clear the bits for days before first_day
+                days = self.day_mask(year, month) >> first_day << first_day
+                while days:
+                    day = lowest_bit(days)
+                    days &= days - 1
+                    is_start_day = start_date.timetuple()[:3] == (
+                        year, month, day)
+
+                    time = self.next_time(start_date, is_start_day)
+                    if time is None:
+                        continue
+
+                    candidate = datetime.datetime(year, month, day, time.hour,
+                        time.minute, time.second)
+                    candidate = self.handle_timezone(candidate, start.tzinfo)
+                    if candidate:
+                        return candidate
+
+            first_day = 1
+            month += 1
+            if month > 12:
+                month, year = 1, year + 1
@@ -1,6 +1,8 @@
-from twisted.internet import defer, reactor
+from twisted.internet import defer
 from twisted.python import failure
 
+from tron import eventloop
+
 
 class Error(Exception):
     pass
@@ -17,7 +19,18 @@ def _cancel(deferred):
 
 
 def defer_timeout(deferred, timeout):
+    """Cancel deferred if it has not fired after timeout seconds. The timer
+    is cancelled when the deferred fires, and is returned.
+    """
     try:
-        reactor.callLater(timeout, deferred.cancel)
+        timer = eventloop.call_later(timeout, deferred.cancel)
     except AttributeError:
-        reactor.callLater(timeout, lambda: _cancel(deferred))
+        timer = eventloop.call_later(timeout, lambda: _cancel(deferred))
+
+    def cancel_timer(result):
+        if timer.active():
+            timer.cancel()
+        return result
+
+    deferred.addBoth(cancel_timer)
+    return timer